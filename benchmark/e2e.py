@@ -0,0 +1,208 @@
+"""
+End to end benchmark of the wrapper: runs theli.py with a stub THELI
+installation on synthetic data folders of increasing size and reports the
+time spent in the wrapper (everything but the THELI scripts) per job.
+
+    python3 -m benchmark.e2e --files 1000 10000 100000
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from time import time
+
+from .stub_theli import (FRAME_LEVELS, create_exposures, create_home,
+                         create_installation)
+
+
+THELI = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "theli.py")
+INSTRUMENT = "STUB@BENCHMARK"
+DEFAULT_JOBS = "FsCbCfCsBmWgWcArAsAcSsCa"
+
+
+parser = argparse.ArgumentParser(
+    description="Runs the TheliWrapper end to end with a stub THELI "
+                "installation, which emulates the scripts, on synthetic "
+                "data and reports the wrapper overhead per job.")
+parser.add_argument(
+    '--files', metavar='N', type=int, nargs='+',
+    default=[1000, 10000, 100000],
+    help='number of chip images in the science folder, one run per value '
+         '(default: 1000 10000 100000)')
+parser.add_argument(
+    '--nchips', type=int, default=4,
+    help='number of chips of the stub instrument (default: 4)')
+parser.add_argument(
+    '--calib', metavar='NEXP', type=int, default=10,
+    help='number of bias and flat exposures (default: 10)')
+parser.add_argument(
+    '--jobs', '-j', metavar='JOBLIST', default=DEFAULT_JOBS,
+    help='jobs to run (default: %s)' % DEFAULT_JOBS)
+parser.add_argument(
+    '--shape', metavar=('NY', 'NX'), type=int, nargs=2, default=[16, 16],
+    help='size of the synthetic images (default: 16 16)')
+parser.add_argument(
+    '--delay', metavar='SEC', type=float, default=0.0,
+    help='time the stub scripts spend per image (default: 0)')
+parser.add_argument(
+    '--loglines', metavar='N', type=int, default=5,
+    help='log lines the stub scripts write per image (default: 5)')
+parser.add_argument(
+    '--backend', metavar='STAGE=IMPL', action='append', default=[],
+    help='passed on to theli.py, can be used repeatedly')
+parser.add_argument(
+    '--threads', metavar='N', type=int,
+    help='passed on to theli.py')
+parser.add_argument(
+    '--profile', action='store_true',
+    help='profile the wrapper with theli.py --profile')
+parser.add_argument(
+    '--workdir', metavar='DIR',
+    help='folder for the installation, data and logs (default: temporary '
+         'folder, which is deleted afterwards)')
+parser.add_argument(
+    '--output', metavar='FILE',
+    help='write the results as JSON to FILE')
+
+
+def run_theli(workdir, project, args):
+    """Run theli.py on the stub data in 'project' and return the events
+    and the wall time of the process."""
+    eventfile = os.path.join(workdir, "events.jsonl")
+    if os.path.exists(eventfile):
+        os.remove(eventfile)
+    command = [
+        sys.executable, THELI, INSTRUMENT, "--main", project,
+        "--bias", "BIAS", "--flat", "FLAT", "--science", "SCIENCE",
+        "--jobs", args.jobs, "--events", eventfile, "--log-display", "none"]
+    if args.threads is not None:
+        command.extend(["--threads", str(args.threads)])
+    for backend in args.backend:
+        command.extend(["--backend", backend])
+    if args.profile:
+        command.extend(["--profile", os.path.join(workdir, "profile")])
+    env = os.environ.copy()
+    env["HOME"] = os.path.join(workdir, "home")
+    logpath = os.path.join(workdir, "theli.log")
+    with open(logpath, "w") as log:
+        start = time()
+        code = subprocess.call(
+            command, stdout=log, stderr=subprocess.STDOUT, env=env,
+            cwd=project)
+        wall = time() - start
+    if code != 0:
+        with open(logpath) as log:
+            sys.stdout.write("".join(log.readlines()[-20:]))
+        raise RuntimeError("theli.py failed, see log: %s" % logpath)
+    with open(eventfile) as f:
+        events = [json.loads(line) for line in f]
+    return start, wall, events
+
+
+def analyse(start, wall, events):
+    """Split the run into the setup, the jobs and the remaining time (between
+    jobs and at exit) and sum up the time spent in the THELI scripts.
+
+    Returns:
+        rows [list]:
+            dictionaries with job name, wall time, script time, number of
+            script calls and wrapper overhead in seconds
+    """
+    def segment(name):
+        return dict(job=name, wall=0.0, scripts=0.0, calls=0)
+
+    rows = [segment("setup")]
+    other = segment("other")
+    current, mark = rows[0], start
+    for event in events:
+        if event["event"] in ("job_start", "job_finish"):
+            current["wall"] += event["time"] - mark
+            mark = event["time"]
+            if event["event"] == "job_start":
+                current = segment(event["job"])
+                rows.append(current)
+            else:
+                current = other
+        elif event["event"] == "script_finish":
+            current["scripts"] += event["seconds"]
+            current["calls"] += 1
+    current["wall"] += start + wall - mark
+    rows.append(other)
+    for row in rows:
+        row["overhead"] = row["wall"] - row["scripts"]
+    return rows
+
+
+def report(nfiles, nexposures, rows):
+    """Format the results of one run as table."""
+    lines = ["%d files (%d exposures)" % (nfiles, nexposures)]
+    lines.append("  %-28s %9s %9s %6s %9s %10s" % (
+        "JOB", "WALL", "SCRIPTS", "CALLS", "OVERHEAD", "MS/FILE"))
+    total = dict(wall=0.0, scripts=0.0, calls=0, overhead=0.0)
+    for row in rows:
+        lines.append("  %-28s %9.2f %9.2f %6d %9.2f %10.3f" % (
+            row["job"][:28], row["wall"], row["scripts"], row["calls"],
+            row["overhead"], 1000.0 * row["overhead"] / nfiles))
+        for key in total:
+            total[key] += row[key]
+    lines.append("  %-28s %9.2f %9.2f %6d %9.2f %10.3f" % (
+        "TOTAL", total["wall"], total["scripts"], total["calls"],
+        total["overhead"], 1000.0 * total["overhead"] / nfiles))
+    return "\n".join(lines)
+
+
+def main():
+    args = parser.parse_args()
+    cleanup = args.workdir is None
+    root = tempfile.mkdtemp() if cleanup else os.path.abspath(args.workdir)
+    results = []
+    try:
+        # the python backends require the chips to match the chip size of
+        # the instrument definition
+        size = (4096, 2048)
+        if any(backend.endswith(("=python", "=shadow"))
+               for backend in args.backend):
+            size = tuple(args.shape)
+        pipesoft = create_installation(
+            root, INSTRUMENT, args.nchips, tuple(args.shape), size=size,
+            delay=args.delay, loglines=args.loglines)
+        for nfiles in args.files:
+            workdir = os.path.join(root, "files_%d" % nfiles)
+            if os.path.exists(workdir):
+                shutil.rmtree(workdir)
+            project = os.path.join(workdir, "project")
+            # a new THELI home for each run, the history must not leak
+            create_home(os.path.join(workdir, "home"), pipesoft)
+            nexposures = max(nfiles // args.nchips, 3)
+            for seed, (folder, prefix, count, frametype) in enumerate((
+                    ("BIAS", "bias", args.calib, "bias"),
+                    ("FLAT", "flat", args.calib, "flat"),
+                    ("SCIENCE", "sci", nexposures, "science"))):
+                create_exposures(
+                    os.path.join(project, folder), prefix, count,
+                    args.nchips, tuple(args.shape),
+                    level=FRAME_LEVELS[frametype], seed=seed)
+            start, wall, events = run_theli(workdir, project, args)
+            rows = analyse(start, wall, events)
+            print(report(nfiles, nexposures, rows))
+            sys.stdout.flush()
+            results.append(dict(
+                files=nfiles, exposures=nexposures, nchips=args.nchips,
+                jobs=args.jobs, delay=args.delay, rows=rows))
+            if cleanup:
+                shutil.rmtree(workdir)
+    finally:
+        if cleanup:
+            shutil.rmtree(root)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Defines a minimal FITS writer and header reader, which create synthetic raw
+data for the benchmarks without requiring astropy or numpy
+"""
+
+import os
+import struct
+import random
+
+
+BLOCK = 2880  # FITS files are organised in blocks of 2880 bytes
+CARD = 80  # length of a header card
+# default header of the synthetic exposures
+DEFAULT_KEYS = (
+    ("OBJECT", "BENCHMARK"), ("FILTER", "r_G0326"), ("EXPTIME", 60.0),
+    ("CRVAL1", 150.1), ("CRVAL2", 2.2), ("AIRMASS", 1.2),
+    ("GAIN", 1.5), ("DATE-OBS", "2017-01-01T00:00:00.000"))
+
+
+def format_card(key, value=None, comment=""):
+    """Format a header card with fixed format values.
+
+    Arguments:
+        key [string]:
+            header keyword, at most 8 characters
+        value [bool, int, float, string]:
+            card value, None for commentary keywords like 'END'
+        comment [string]:
+            optional card comment
+    Returns:
+        card [string]:
+            80 character header card
+    """
+    if value is None:
+        card = "%-8s%s" % (key, comment)
+    else:
+        if isinstance(value, bool):
+            value = "%20s" % ("T" if value else "F")
+        elif isinstance(value, int):
+            value = "%20d" % value
+        elif isinstance(value, float):
+            value = "%20s" % repr(value).upper()
+        else:
+            value = "'%-8s'" % value.replace("'", "''")
+        card = "%-8s= %s" % (key, value)
+        if comment != "":
+            card += " / " + comment
+    return card[:CARD].ljust(CARD)
+
+
+def _pad(data, fill):
+    """Pad 'data' to the next multiple of the FITS block size."""
+    return data + fill * (-len(data) % BLOCK)
+
+
+def header_block(cards):
+    """Convert a list of (key, value) tuples or formatted cards to a padded
+    header ending with 'END'."""
+    lines = [
+        c if isinstance(c, str) else format_card(*c) for c in cards]
+    lines.append(format_card("END"))
+    return _pad("".join(lines).encode("ascii"), b" ")
+
+
+def data_block(shape, level=1000.0, noise=10.0, seed=None):
+    """Create a padded 16 bit integer image of given shape (ny, nx) with a
+    constant background level and uniform noise.
+
+    Arguments:
+        shape [tuple]:
+            image size (ny, nx)
+        level [float]:
+            background level
+        noise [float]:
+            amplitude of the pixel noise
+        seed [int]:
+            seed of the random numbers
+    Returns:
+        data [bytes]:
+            big endian pixel data, padded to full FITS blocks
+    """
+    rng = random.Random(seed)
+    npix = shape[0] * shape[1]
+    # repeat a short noise pattern, generating each pixel would be slow
+    pattern = [
+        max(-32768, min(32767, int(level + noise * (rng.random() - 0.5))))
+        for i in range(min(npix, 1024))]
+    pixels = (pattern * (npix // len(pattern) + 1))[:npix]
+    return _pad(struct.pack(">%dh" % npix, *pixels), b"\0")
+
+
+def image_cards(shape, extension=False):
+    """Mandatory keywords of a 16 bit image HDU."""
+    cards = [("XTENSION", "IMAGE")] if extension else [("SIMPLE", True)]
+    cards.extend([
+        ("BITPIX", 16), ("NAXIS", 2), ("NAXIS1", shape[1]),
+        ("NAXIS2", shape[0])])
+    if extension:
+        cards.extend([("PCOUNT", 0), ("GCOUNT", 1)])
+    return cards
+
+
+def write_image(path, shape, keys=DEFAULT_KEYS, seed=None, data=None):
+    """Write a single extension FITS image.
+
+    Arguments:
+        path [string]:
+            output file path
+        shape [tuple]:
+            image size (ny, nx)
+        keys [list]:
+            additional (key, value) header cards
+        seed [int]:
+            seed of the pixel noise
+        data [bytes]:
+            padded pixel data from 'data_block', generated if not given
+    """
+    cards = image_cards(shape)
+    cards.extend(keys)
+    if data is None:
+        data = data_block(shape, seed=seed)
+    with open(path, "wb") as f:
+        f.write(header_block(cards))
+        f.write(data)
+
+
+def write_mef(path, shape, nchips, keys=DEFAULT_KEYS, seed=None, data=None):
+    """Write a raw multi-extension FITS exposure with one image extension
+    per chip and the exposure keywords in the primary header.
+
+    Arguments:
+        path [string]:
+            output file path
+        shape [tuple]:
+            chip size (ny, nx)
+        nchips [int]:
+            number of chips
+        keys [list]:
+            additional (key, value) cards of the primary header
+        seed [int]:
+            seed of the pixel noise
+        data [bytes]:
+            padded pixel data of each chip from 'data_block', generated if
+            not given
+    """
+    primary = [("SIMPLE", True), ("BITPIX", 16), ("NAXIS", 0),
+               ("EXTEND", True), ("NEXTEND", nchips)]
+    primary.extend(keys)
+    # all chips share the same pixel data
+    if data is None:
+        data = data_block(shape, seed=seed)
+    with open(path, "wb") as f:
+        f.write(header_block(primary))
+        for chip in range(1, nchips + 1):
+            cards = image_cards(shape, extension=True)
+            cards.extend([("EXTNAME", "CHIP%d" % chip), ("CHIPID", chip)])
+            f.write(header_block(cards))
+            f.write(data)
+
+
+def card_values(cards):
+    """Convert header cards to a dictionary of keywords and value strings
+    (without quotes and comments)."""
+    header = {}
+    for card in cards:
+        if card[8:10] == "= ":
+            value = card[10:].split(" / ")[0].strip()
+            header[card[:8].strip()] = value.strip("'").strip()
+    return header
+
+
+def read_cards(path):
+    """Read the header cards of all extensions of a FITS file.
+
+    Arguments:
+        path [string]:
+            FITS file path
+    Returns:
+        headers [list]:
+            list of the header cards (without 'END') of each extension
+    """
+    headers = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while f.tell() < size:
+            cards = []
+            done = False
+            while not done:
+                block = f.read(BLOCK).decode("ascii", errors="replace")
+                if len(block) < BLOCK:
+                    return headers
+                for i in range(0, BLOCK, CARD):
+                    card = block[i:i + CARD]
+                    if card[:8].strip() == "END":
+                        done = True
+                        break
+                    cards.append(card)
+            headers.append(cards)
+            # skip the data unit
+            header = card_values(cards)
+            bitpix = abs(int(header.get("BITPIX", 8)))
+            npix = 0
+            if int(header.get("NAXIS", 0)) > 0:
+                npix = 1
+                for n in range(1, int(header["NAXIS"]) + 1):
+                    npix *= int(header["NAXIS%d" % n])
+            nbytes = npix * bitpix // 8
+            f.seek(nbytes + (-nbytes % BLOCK), os.SEEK_CUR)
+    return headers
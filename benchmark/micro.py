@@ -0,0 +1,444 @@
+"""
+Microbenchmarks of the hot paths of the wrapper: folder index, tag
+extraction, header reading, parameter files and log scanning. The results
+are appended per git commit to a JSON lines file and can be compared with a
+previous commit to catch performance regressions.
+
+    python3 -m benchmark.micro [-k PATTERN] [--compare [REV]]
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+from time import time
+from timeit import Timer
+from fnmatch import fnmatch
+from statistics import median
+
+from .fitsgen import DEFAULT_KEYS, write_image
+from .stub_theli import create_home, create_installation
+
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(REPOSITORY, "benchmark", "results.jsonl")
+NCHIPS = 4
+# a benchmark is slower, if its time increased by more than this fraction
+THRESHOLD = 0.1
+# lines of the synthetic log, without any error keyword
+LOG_TEMPLATE = (
+    "  Processing chip %(chip)d of exposure %(exp)d ...\n"
+    "  working on sci%(exp)05d_%(chip)dOFCB.fits ...\n"
+    "    mode = 1000.%(mode)02d, sigma = 10.00, pixels = 8388608\n"
+    "WW-Version 1.3.0\n")
+
+
+parser = argparse.ArgumentParser(
+    description="Runs the microbenchmarks of the TheliWrapper hot paths, "
+                "stores the results of the current git commit and "
+                "optionally compares them with a previous commit.")
+parser.add_argument(
+    '-k', metavar='PATTERN', default="*",
+    help='only run benchmarks matching the shell style PATTERN')
+parser.add_argument(
+    '--list', action='store_true',
+    help='list the benchmarks and exit')
+parser.add_argument(
+    '--files', metavar='N', type=int, default=10000,
+    help='number of files in the benchmark data folder (default: 10000)')
+parser.add_argument(
+    '--log', metavar='FILE',
+    help='recorded script log to scan (default: synthetic log)')
+parser.add_argument(
+    '--log-size', metavar='MB', type=float, default=50.0,
+    help='size of the synthetic log in MB (default: 50)')
+parser.add_argument(
+    '--repeat', metavar='N', type=int, default=5,
+    help='number of repetitions of each benchmark (default: 5)')
+parser.add_argument(
+    '--theli-home', action='store_true',
+    help='use the THELI installation of the current user instead of a stub '
+         'installation')
+parser.add_argument(
+    '--results', metavar='FILE', default=RESULTS,
+    help='JSON lines file with the results of all commits (default: '
+         'benchmark/results.jsonl)')
+parser.add_argument(
+    '--no-save', action='store_true',
+    help='do not append the results to the results file')
+parser.add_argument(
+    '--compare', metavar='REV', nargs='?', const="",
+    help='compare with the results of commit REV (default: the last '
+         'results of a different commit), exit with status 1 on '
+         'regressions')
+parser.add_argument(
+    '--threshold', metavar='FRAC', type=float, default=THRESHOLD,
+    help='report a regression, if a benchmark is slower by more than this '
+         'fraction (default: %.2f)' % THRESHOLD)
+
+
+class Context(object):
+    """Creates and caches the data shared by the benchmarks.
+
+    Arguments:
+        workdir [string]:
+            folder for the benchmark data
+        args [argparse.Namespace]:
+            command line arguments
+        scriptdir [string]:
+            stub script folder to add scripts to, None for a real THELI
+            installation
+    """
+
+    def __init__(self, workdir, args, scriptdir=None):
+        super(Context, self).__init__()
+        self.workdir = workdir
+        self.args = args
+        self.scriptdir = scriptdir
+        self._cache = {}
+
+    def _cached(self, key, create):
+        if key not in self._cache:
+            self._cache[key] = create()
+        return self._cache[key]
+
+    def names(self):
+        """File names of a folder with 'files' chip images of all tags."""
+        def create():
+            tags = ("OFCB", "OFCB", "OFCB.sub", "OFC")
+            names = []
+            for n in range(self.args.files):
+                names.append("sci%05d_%d%s.fits" % (
+                    n // NCHIPS + 1, n % NCHIPS + 1, tags[n % 7 % 4]))
+            return names
+        return self._cached("names", create)
+
+    def folder(self):
+        """Folder with empty files, sufficient for the file index."""
+        def create():
+            path = os.path.join(self.workdir, "SCIENCE")
+            os.makedirs(path)
+            for name in self.names():
+                open(os.path.join(path, name), "w").close()
+            return path
+        return self._cached("folder", create)
+
+    def fits_folder(self):
+        """Folder with a few hundred FITS images with headers."""
+        def create():
+            path = os.path.join(self.workdir, "HEADERS")
+            os.makedirs(path)
+            for n in range(200):
+                write_image(
+                    os.path.join(path, "sci%05d_1OFCB.fits" % n), (16, 16),
+                    DEFAULT_KEYS, seed=0)
+            return path
+        return self._cached("fits_folder", create)
+
+    def logfile(self):
+        """Path of the recorded or synthetic script log."""
+        def create():
+            if self.args.log is not None:
+                return os.path.abspath(self.args.log)
+            path = os.path.join(self.workdir, "script.log")
+            size = int(self.args.log_size * 1024**2)
+            with open(path, "w") as log:
+                n = 0
+                while log.tell() < size:
+                    log.write(LOG_TEMPLATE % dict(
+                        exp=n // NCHIPS % 100000, chip=n % NCHIPS + 1,
+                        mode=n % 100))
+                    n += 1
+            return path
+        return self._cached("logfile", create)
+
+    def loglines(self):
+        """Lines of the script log as captured by 'checked_call'."""
+        def create():
+            with open(self.logfile(), "rb") as log:
+                return [
+                    line.decode("utf-8", errors="replace").rstrip("\r\n")
+                    for line in log] + [""]
+        return self._cached("loglines", create)
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, number=None):
+    """Register a benchmark. The decorated function takes the context and
+    returns the statement to time or None, if the benchmark is not
+    available.
+
+    Arguments:
+        name [string]:
+            name of the benchmark
+        number [int]:
+            executions of the statement per repetition, determined
+            automatically by default
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup, number))
+        return setup
+    return register
+
+
+@benchmark("folder.update_index")
+def bench_update_index(ctx):
+    from system.folder import Folder
+    folder = Folder(ctx.folder(), NCHIPS)
+
+    def stmt():
+        folder._update_time = 0  # force rescanning
+        folder._update_index()
+    return stmt
+
+
+@benchmark("folder.update_index_cold")
+def bench_update_index_cold(ctx):
+    from system.folder import Folder
+    folder = Folder(ctx.folder(), NCHIPS)
+
+    def stmt():
+        folder._update_time = 0
+        folder._fits_index = {}  # all tags must be extracted again
+        folder._update_index()
+    return stmt
+
+
+@benchmark("folder.fits")
+def bench_fits(ctx):
+    from system.folder import Folder
+    folder = Folder(ctx.folder(), NCHIPS)
+    return lambda: folder.fits("OFCB")
+
+
+@benchmark("folder.fits_count")
+def bench_fits_count(ctx):
+    from system.folder import Folder
+    folder = Folder(ctx.folder(), NCHIPS)
+    return lambda: folder.fits_count()
+
+
+@benchmark("folder.tags")
+def bench_tags(ctx):
+    from system.folder import Folder
+    folder = Folder(ctx.folder(), NCHIPS)
+    return lambda: folder.tags(ignore_sub=True)
+
+
+@benchmark("folder.filters")
+def bench_filters(ctx):
+    from system.folder import Folder
+    folder = Folder(ctx.fits_folder(), NCHIPS)
+    return lambda: folder.filters()
+
+
+@benchmark("base.extract_tag")
+def bench_extract_tag(ctx):
+    from system.base import extract_tag
+    names = ctx.names()
+    return lambda: [extract_tag(name, NCHIPS) for name in names]
+
+
+@benchmark("base.natural_sort")
+def bench_natural_sort(ctx):
+    from system.base import natural_sort
+    names = list(ctx.names())
+    random.Random(0).shuffle(names)
+    return lambda: natural_sort(names)
+
+
+def header_statement(ctx, function):
+    path = os.path.join(ctx.fits_folder(), "sci00000_1OFCB.fits")
+    return lambda: function(path, ["FILTER", "CRVAL1", "CRVAL2"])
+
+
+@benchmark("base.get_FITS_header_values.pyfits")
+def bench_header_pyfits(ctx):
+    from system import base
+    if not base._import_pyfits():
+        return None
+    return header_statement(ctx, base._get_FITS_header_values_pyfits)
+
+
+@benchmark("base.get_FITS_header_values.dfits")
+def bench_header_dfits(ctx):
+    from system import base
+    return header_statement(ctx, base._get_FITS_header_values_dfits)
+
+
+@benchmark("parameters.get")
+def bench_parameters_get(ctx):
+    from system.parameters import Parameters
+    params = Parameters()
+    return lambda: params.get("V_CSKYMETHOD")  # last parameter
+
+
+@benchmark("parameters.set")
+def bench_parameters_set(ctx):
+    from system.parameters import Parameters
+    params = Parameters()
+    return lambda: params.set({"V_COADD_IDENT": "r_G0326"})
+
+
+@benchmark("scripts.scan_log", number=1)
+def bench_scan_log(ctx):
+    from system.scripts import scan_log
+    lines = ctx.loglines()
+    return lambda: scan_log(lines)
+
+
+@benchmark("scripts.checked_call", number=1)
+def bench_checked_call(ctx):
+    if ctx.scriptdir is None:
+        return None
+    from system.scripts import checked_call
+    script = os.path.join(ctx.scriptdir, "replay_log.sh")
+    with open(script, "w") as f:
+        f.write("#!/bin/sh\ncat \"$1\"\n")
+    os.chmod(script, 0o755)
+    logfile = ctx.logfile()
+
+    def replay_log():
+        return checked_call("replay_log.sh", [logfile], verb=0)
+    return replay_log
+
+
+def measure(stmt, number, repeat):
+    """Time the statement and return the minimum and median time per
+    execution in seconds and the number of executions per repetition."""
+    timer = Timer(stmt)
+    if number is None:
+        number = timer.autorange()[0]
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return min(times), median(times), number
+
+
+def git_revision():
+    """Return the current commit hash and whether the work tree has
+    uncommitted changes."""
+    def git(*args):
+        return subprocess.check_output(
+            ("git", "-C", REPOSITORY) + args,
+            stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    try:
+        commit = git("rev-parse", "HEAD")
+        dirty = git("status", "--porcelain", "--untracked-files=no") != ""
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = "unknown", True
+    return commit, dirty
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(history, current, revision):
+    """Select the results to compare with: the last results of commit
+    'revision' or, if empty, of the last commit different from the current
+    one. Only results with the same configuration are considered."""
+    for entry in reversed(history):
+        if entry["config"] != current["config"]:
+            continue
+        if revision != "":
+            if entry["commit"].startswith(revision):
+                return entry
+        elif entry["commit"] != current["commit"]:
+            return entry
+    return None
+
+
+def compare(baseline, current, threshold):
+    """Print the time ratios of all benchmarks and return the names of the
+    regressions."""
+    print("\ncompared with %s%s" % (
+        baseline["commit"][:10], " (dirty)" if baseline["dirty"] else ""))
+    print("%-40s %12s %12s %7s" % ("BENCHMARK", "BASE", "CURRENT", "RATIO"))
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]["min"]
+        ratio = result["min"] / base
+        flag = ""
+        if ratio > 1.0 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("%-40s %12s %12s %7.2f%s" % (
+            name, format_time(base), format_time(result["min"]), ratio,
+            flag))
+    return regressions
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "%.3f %s" % (seconds / scale, unit)
+    return "%.1f ns" % (seconds * 1e9)
+
+
+def main():
+    args = parser.parse_args()
+    selected = [b for b in BENCHMARKS if fnmatch(b[0], args.k)]
+    if args.list:
+        for name, setup, number in selected:
+            print(name)
+        return
+    workdir = tempfile.mkdtemp()
+    scriptdir = None
+    if not args.theli_home:
+        # the wrapper must be imported after setting up the stub home
+        pipesoft = create_installation(os.path.join(workdir, "stub"))
+        home = os.path.join(workdir, "home")
+        create_home(home, pipesoft)
+        os.environ["HOME"] = home
+        scriptdir = os.path.join(pipesoft, "gui", "scripts")
+    ctx = Context(workdir, args, scriptdir)
+    commit, dirty = git_revision()
+    current = dict(
+        commit=commit, dirty=dirty, time=time(),
+        host=socket.gethostname(), python=platform.python_version(),
+        config=dict(files=args.files, log=args.log, log_size=args.log_size,
+                    stub=not args.theli_home),
+        results={})
+    try:
+        # set up the wrapper before printing the table
+        import system.base  # noqa: F401
+        print("%-40s %12s %12s %9s" % ("BENCHMARK", "MIN", "MEDIAN", "NUMBER"))
+        for name, setup, number in selected:
+            stmt = setup(ctx)
+            if stmt is None:
+                print("%-40s %12s" % (name, "skipped"))
+                continue
+            best, med, number = measure(stmt, number, args.repeat)
+            current["results"][name] = dict(
+                min=best, median=med, number=number)
+            print("%-40s %12s %12s %9d" % (
+                name, format_time(best), format_time(med), number))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(workdir)
+    history = load_results(args.results)
+    if not args.no_save:
+        with open(args.results, "a") as f:
+            f.write(json.dumps(current) + "\n")
+    if args.compare is not None:
+        baseline = find_baseline(history, current, args.compare)
+        if baseline is None:
+            print("\nno results to compare with")
+        elif len(compare(baseline, current, args.threshold)) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""
+Emulates the THELI GUI scripts in the stub installation created by
+'stub_theli'. Each script writes a log similar to the original script and
+creates the output files the wrapper expects, such that the whole job list
+can be run without THELI. Called as
+
+    stub_script.py CONFIG SCRIPT [ARGUMENTS]
+
+where CONFIG is the JSON configuration of the stub installation.
+"""
+
+import os
+import re
+import sys
+import json
+from time import sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark.fitsgen import (card_values, data_block, format_card,
+                               read_cards, write_image)
+
+
+# matches chip images: [base]_[chip][tag].fits
+CHIP_IMAGE = re.compile(r"^(.+)_(\d+)((?:OFC[A-Z]*)?(?:\.sub)?)\.fits$")
+# structural keywords that are not copied from the raw headers
+STRUCTURE_KEYS = (
+    "SIMPLE", "XTENSION", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "EXTEND",
+    "NEXTEND", "PCOUNT", "GCOUNT")
+
+
+class Stub(object):
+    """Common functions of the stub scripts.
+
+    Arguments:
+        config [dict]:
+            configuration of the stub installation
+    """
+
+    def __init__(self, config):
+        super(Stub, self).__init__()
+        self.config = config
+        self.nchips = config["nchips"]
+        self.shape = tuple(config["shape"])
+        self._data = None
+
+    @property
+    def data(self):
+        # all output images share the same pixel data
+        if self._data is None:
+            self._data = data_block(self.shape, seed=1)
+        return self._data
+
+    def log(self, line):
+        sys.stdout.write(line + "\n")
+
+    def work(self, name):
+        """Emulate processing the image 'name': write the log lines and wait
+        for the configured time."""
+        self.log("  working on %s ..." % name)
+        for i in range(self.config["loglines"]):
+            self.log("    mode = %.2f, sigma = %.2f, pixels = %d" % (
+                1000.0 + i, 10.0, self.shape[0] * self.shape[1]))
+        if self.config["delay"] > 0:
+            sys.stdout.flush()
+            sleep(self.config["delay"])
+
+    def images(self, folder, tag=None):
+        """List the chip images in 'folder' as tuples of file name, base name,
+        chip and tag, optionally only those with tag 'tag'."""
+        images = []
+        for entry in sorted(os.listdir(folder)):
+            match = CHIP_IMAGE.match(entry)
+            if match is None:
+                continue
+            base, chip, imtag = match.groups()
+            if tag is None or imtag == tag:
+                images.append((entry, base, int(chip), imtag))
+        return images
+
+    def link(self, source, destination):
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.link(source, destination)
+
+    def move(self, folder, name, subfolder):
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+        os.rename(
+            os.path.join(folder, name), os.path.join(folder, subfolder, name))
+
+    def header_keys(self, path):
+        """Header cards of a chip image, without the structural keywords."""
+        return [
+            c for c in read_cards(path)[0]
+            if c[:8].strip() not in STRUCTURE_KEYS]
+
+
+def split(stub, maindir, imdir, *args):
+    folder = os.path.join(maindir, imdir)
+    raws = [
+        f for f in sorted(os.listdir(folder))
+        if f.endswith(".fits") and CHIP_IMAGE.match(f) is None]
+    for raw in raws:
+        stub.log("Splitting %s ..." % raw)
+        headers = read_cards(os.path.join(folder, raw))
+        primary = [
+            c for c in headers[0] if c[:8].strip() not in STRUCTURE_KEYS]
+        base = os.path.splitext(raw)[0]
+        for chip, cards in enumerate(headers[1:], 1):
+            values = card_values(cards)
+            shape = (int(values["NAXIS2"]), int(values["NAXIS1"]))
+            name = "%s_%d.fits" % (base, chip)
+            write_image(
+                os.path.join(folder, name), shape,
+                primary + [format_card("CHIPID", chip)], data=stub.data)
+            stub.work(name)
+        stub.move(folder, raw, "ORIGINALS")
+
+
+def master(stub, maindir, *folders):
+    # bias, dark: [maindir, folder], flat: [maindir, biasdir, flatdir]
+    imdir = folders[-1]
+    folder = os.path.join(maindir, imdir)
+    images = [
+        i for i in stub.images(folder, "")
+        if not i[0].startswith(imdir + "_")]
+    keys = []
+    if len(images) > 0:
+        keys = stub.header_keys(os.path.join(folder, images[0][0]))
+    for chip in range(1, stub.nchips + 1):
+        chipimages = [i[0] for i in images if i[2] == chip]
+        stub.log("Combining %d images of chip %d" % (len(chipimages), chip))
+        for name in chipimages:
+            stub.work(name)
+        write_image(
+            os.path.join(folder, "%s_%d.fits" % (imdir, chip)), stub.shape,
+            keys, data=stub.data)
+        stub.log("  created %s_%d.fits" % (imdir, chip))
+
+
+def normalise(stub, maindir, flatdir, *args):
+    normdir = os.path.join(maindir, flatdir + "_norm")
+    os.makedirs(normdir, exist_ok=True)
+    for chip in range(1, stub.nchips + 1):
+        name = "%s_norm_%d.fits" % (flatdir, chip)
+        stub.link(
+            os.path.join(maindir, flatdir, "%s_%d.fits" % (flatdir, chip)),
+            os.path.join(normdir, name))
+        stub.work(name)
+
+
+def science(stub, maindir, biasdarkdir, flatdir, imdir, *args):
+    folder = os.path.join(maindir, imdir)
+    for name, base, chip, tag in stub.images(folder, ""):
+        output = "%s_%dOFC.fits" % (base, chip)
+        stub.link(os.path.join(folder, name), os.path.join(folder, output))
+        stub.work(output)
+        stub.move(folder, name, "SPLIT_IMAGES")
+
+
+def background(stub, maindir, imdir, *args):
+    folder = os.path.join(maindir, imdir)
+    for name, base, chip, tag in stub.images(folder):
+        if tag.endswith(".sub"):
+            continue
+        output = "%s_%d%sB.fits" % (base, chip, tag)
+        stub.link(os.path.join(folder, name), os.path.join(folder, output))
+        stub.work(output)
+        stub.move(folder, name, tag + "_IMAGES")
+
+
+def global_weights(stub, maindir, normdir, imdir, *args):
+    weightdir = os.path.join(maindir, "WEIGHTS")
+    os.makedirs(weightdir, exist_ok=True)
+    for chip in range(1, stub.nchips + 1):
+        source = os.path.join(
+            maindir, normdir, "%s_%d.fits" % (normdir, chip))
+        for kind in ("globalweight", "globalflag"):
+            name = "%s_%d.fits" % (kind, chip)
+            if os.path.exists(source):
+                stub.link(source, os.path.join(weightdir, name))
+            else:
+                write_image(
+                    os.path.join(weightdir, name), stub.shape, [],
+                    data=stub.data)
+            stub.work(name)
+
+
+def weights(stub, maindir, imdir, tag, *args):
+    folder = os.path.join(maindir, imdir)
+    weightdir = os.path.join(maindir, "WEIGHTS")
+    os.makedirs(weightdir, exist_ok=True)
+    for name, base, chip, imtag in stub.images(folder, tag):
+        for kind in (".weight", ".flag"):
+            output = kind.join(os.path.splitext(name))
+            stub.link(
+                os.path.join(folder, name), os.path.join(weightdir, output))
+        stub.work(name)
+
+
+def write_catalogs(folder, name, nsources):
+    """Write a ds9 region file and a skycat file with 'nsources' sources."""
+    ds9dir = os.path.join(folder, "cat", "ds9cat")
+    skydir = os.path.join(folder, "cat", "skycat")
+    os.makedirs(ds9dir, exist_ok=True)
+    os.makedirs(skydir, exist_ok=True)
+    with open(os.path.join(ds9dir, name + ".reg"), "w") as reg:
+        reg.write("# Region file format: DS9 version 4.1\n")
+        for i in range(nsources):
+            reg.write("circle(%.6f,%.6f,1.0\")\n" % (
+                150.0 + i * 1e-4, 2.0 + i * 1e-4))
+    with open(os.path.join(skydir, name + ".skycat"), "w") as sky:
+        sky.write("ID\tRa\tDec\tMag\n------------------\n")
+        for i in range(nsources):
+            sky.write("%d\t%.6f\t%.6f\t%.2f\n" % (
+                i, 150.0 + i * 1e-4, 2.0 + i * 1e-4, 20.0))
+
+
+def refcat(stub, maindir, imdir, *args):
+    stub.log("Retrieving reference catalogue ...")
+    write_catalogs(
+        os.path.join(maindir, imdir), "theli_mystd",
+        stub.config["sources"])
+    stub.log("%d sources retrieved" % stub.config["sources"])
+
+
+def source_cats(stub, maindir, imdir, tag, *args):
+    folder = os.path.join(maindir, imdir)
+    for name, base, chip, imtag in stub.images(folder, tag):
+        write_catalogs(
+            folder, os.path.splitext(name)[0], stub.config["sources"])
+        stub.work(name)
+
+
+def scamp(stub, maindir, imdir, tag, *args):
+    folder = os.path.join(maindir, imdir)
+    exposures = {}
+    for name, base, chip, imtag in stub.images(folder, tag):
+        exposures.setdefault(base, []).append(chip)
+    for kind in ("headers", "headers_scamp"):
+        os.makedirs(os.path.join(folder, kind), exist_ok=True)
+    for base, chips in sorted(exposures.items()):
+        cards = "".join(
+            format_card(key, value) + "\n" for key, value in (
+                ("CRVAL1", 150.1), ("CRVAL2", 2.2), ("CRPIX1", 1.0),
+                ("CRPIX2", 1.0)))
+        with open(os.path.join(folder, "headers_scamp", base + ".head"),
+                  "w") as head:
+            head.write(cards * len(chips))
+        for chip in chips:
+            with open(os.path.join(
+                    folder, "headers", "%s_%d.head" % (base, chip)),
+                    "w") as head:
+                head.write(cards)
+        stub.work(base)
+
+
+def skysub(stub, maindir, imdir, tag, *args):
+    folder = os.path.join(maindir, imdir)
+    for name, base, chip, imtag in stub.images(folder, tag):
+        output = ".sub".join(os.path.splitext(name))
+        stub.link(os.path.join(folder, name), os.path.join(folder, output))
+        stub.work(output)
+
+
+def coadd(stub, maindir, imdir, *args):
+    folder = os.path.join(maindir, imdir)
+    images = stub.images(folder)
+    filterkey = "stub"
+    if len(images) > 0:
+        header = card_values(read_cards(
+            os.path.join(folder, images[0][0]))[0])
+        filterkey = header.get("FILTER", filterkey)
+    coadddir = os.path.join(folder, "coadd_" + filterkey)
+    os.makedirs(coadddir, exist_ok=True)
+    for image in images:
+        stub.log("  adding %s" % image[0])
+    write_image(
+        os.path.join(coadddir, "coadd.fits"), stub.shape, [],
+        data=stub.data)
+    stub.log("coaddition done")
+
+
+def default(stub, *args):
+    """Scripts without relevant output only log the processed images."""
+    if len(args) > 2 and os.path.isdir(os.path.join(args[0], args[1])):
+        for image in stub.images(os.path.join(args[0], args[1]), args[2]):
+            stub.work(image[0])
+
+
+ACTIONS = {
+    "process_bias_para.sh": master,
+    "process_dark_para.sh": master,
+    "process_flat_para.sh": master,
+    "create_norm_para.sh": normalise,
+    "process_science_para.sh": science,
+    "process_background_para.sh": background,
+    "create_global_weights_para.sh": global_weights,
+    "create_weights_para.sh": weights,
+    "create_astrorefcat_fromWEB.sh": refcat,
+    "create_astromcats_para.sh": source_cats,
+    "create_scamp.sh": scamp,
+    "create_skysub_para.sh": skysub,
+    "perform_coadd_swarp.sh": coadd,
+}
+
+
+def main():
+    with open(sys.argv[1]) as f:
+        config = json.load(f)
+    script, args = sys.argv[2], sys.argv[3:]
+    # the parallel manager calls the script given as first argument
+    if script == "parallel_manager.sh":
+        script, args = args[0], args[1:]
+    stub = Stub(config)
+    stub.log("%s %s" % (script, " ".join(args)))
+    if script.startswith("process_split_"):
+        action = split
+    else:
+        action = ACTIONS.get(script, default)
+    action(stub, *args)
+    stub.log("%s: done" % script)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Defines a stub THELI installation and synthetic raw data, which allow running
+the wrapper end to end without THELI and real observations
+"""
+
+import os
+import sys
+import json
+import stat
+
+from .fitsgen import data_block, write_mef
+
+
+STUB_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "stub_script.py")
+# scripts called by the benchmark job list, all other scripts are created as
+# well, but only log the processed images
+SCRIPTS = (
+    "parallel_manager.sh", "check_files_para.sh", "process_bias_para.sh",
+    "process_dark_para.sh", "process_flat_para.sh", "create_flat_ratio.sh",
+    "create_norm_para.sh", "process_science_para.sh",
+    "process_background_para.sh", "id_bright_objects.sh",
+    "create_global_weights_para.sh", "transform_ds9_reg.sh",
+    "create_weights_para.sh", "create_astrorefcat_fromWEB.sh",
+    "create_astromcats_para.sh", "create_scampcats.sh", "create_scamp.sh",
+    "create_stats_table.sh", "create_absphotom_coadd.sh",
+    "create_skysub_para.sh", "create_smoothedge_para.sh",
+    "prepare_coadd_swarp.sh", "resample_coadd_swarp_para.sh",
+    "resample_filtercosmics.sh", "perform_coadd_swarp.sh",
+    "update_coadd_header.sh", "make_album.sh", "create_tiff.sh")
+# background level of the synthetic raw frames by type: the calibrated
+# science frames keep the sky level of 1000 above the bias
+BIAS_LEVEL = 300.0
+FRAME_LEVELS = {
+    "bias": BIAS_LEVEL, "dark": BIAS_LEVEL, "flat": 10000.0,
+    "science": BIAS_LEVEL + 1000.0}
+# prints the first header block card by card, like THELI's 'dfits'
+DFITS = """#!/bin/sh
+for file in "$@"; do :; done
+head -c 2880 "$file" | fold -w 80
+echo
+"""
+PROGS_INI = """export PIPESOFT=%s
+export BIN=${PIPESOFT}/bin
+export SCRIPTS=${PIPESOFT}/gui/scripts
+export TEMPDIR=~/.theli/tmp
+export P_DFITS=${BIN}/dfits
+"""
+INSTRUMENT_INI = """# Instrument config file of the THELI stub installation
+INSTRUMENT=%(name)s
+NCHIPS=%(nchips)d
+export INSTRUMENT
+export NCHIPS
+. progs.ini
+PIXSCX=-5.55556e-05
+PIXSCY=5.55556e-05
+PIXSCALE=0.200
+GAIN=1.0
+SIZEX=(%(sizex)s)
+SIZEY=(%(sizey)s)
+TYPE=OPT
+"""
+
+
+def _write_executable(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP)
+
+
+def create_installation(root, instrument="STUB@BENCHMARK", nchips=4,
+                        shape=(16, 16), size=(4096, 2048), delay=0.0,
+                        loglines=5, sources=100):
+    """Create a stub THELI installation in folder 'root' with an optical
+    instrument and stub scripts (see 'stub_script').
+
+    Arguments:
+        root [string]:
+            folder to create the installation in
+        instrument [string]:
+            name of the stub instrument
+        nchips [int]:
+            number of chips of the instrument
+        shape [tuple]:
+            size (ny, nx) of the images created by the stub scripts
+        size [tuple]:
+            chip size (ny, nx) in the instrument file, used by the wrapper to
+            estimate the memory usage
+        delay [float]:
+            time in seconds the stub scripts spend per processed image
+        loglines [int]:
+            number of log lines the stub scripts write per processed image
+        sources [int]:
+            number of sources in the stub catalogues
+    Returns:
+        pipesoft [string]:
+            path of the THELI installation ('theli' folder)
+    """
+    pipesoft = os.path.join(os.path.abspath(root), "theli")
+    scriptdir = os.path.join(pipesoft, "gui", "scripts")
+    bindir = os.path.join(pipesoft, "bin")
+    instdir = os.path.join(scriptdir, "instruments_professional")
+    for folder in (scriptdir, bindir, instdir):
+        os.makedirs(folder, exist_ok=True)
+    # files read by the wrapper
+    with open(os.path.join(pipesoft, "README"), "w") as f:
+        f.write("THELI stub installation, version 0.0.0\n")
+    with open(os.path.join(pipesoft, "gui", "CHANGELOG"), "w") as f:
+        f.write("v0.0.0 stub installation for benchmarks\n")
+    with open(os.path.join(scriptdir, "progs.ini"), "w") as f:
+        f.write(PROGS_INI % pipesoft)
+    for include in ("bash.include", "bash_functions.include"):
+        open(os.path.join(scriptdir, include), "w").close()
+    with open(os.path.join(instdir, instrument + ".ini"), "w") as f:
+        f.write(INSTRUMENT_INI % dict(
+            name=instrument, nchips=nchips,
+            sizex=" ".join(
+                "[%d]=%d" % (i, size[1]) for i in range(1, nchips + 1)),
+            sizey=" ".join(
+                "[%d]=%d" % (i, size[0]) for i in range(1, nchips + 1))))
+    _write_executable(os.path.join(bindir, "dfits"), DFITS)
+    # configuration of the stub scripts
+    config = os.path.join(scriptdir, "stub.json")
+    with open(config, "w") as f:
+        json.dump(dict(
+            nchips=nchips, shape=list(shape), delay=delay,
+            loglines=loglines, sources=sources), f)
+    for script in SCRIPTS + ("process_split_%s.sh" % instrument,):
+        _write_executable(
+            os.path.join(scriptdir, script),
+            "#!/bin/sh\nexec %s %s %s %s \"$@\"\n" % (
+                sys.executable, STUB_SCRIPT, config, script))
+    return pipesoft
+
+
+def create_home(home, pipesoft):
+    """Prepare the THELI home folder in 'home', such that the wrapper finds
+    the stub installation 'pipesoft' without asking."""
+    linkdir = os.path.join(home, ".theli", "scripts")
+    os.makedirs(linkdir, exist_ok=True)
+    for name in ("progs.ini", "bash.include", "bash_functions.include"):
+        link = os.path.join(linkdir, name)
+        if not os.path.lexists(link):
+            os.symlink(
+                os.path.join(pipesoft, "gui", "scripts", name), link)
+
+
+def create_exposures(folder, prefix, nexposures, nchips, shape=(16, 16),
+                     filterkey="r_G0326", level=1000.0, seed=0):
+    """Write 'nexposures' synthetic raw multi-extension FITS files into
+    'folder'.
+
+    Arguments:
+        folder [string]:
+            output folder, created if necessary
+        prefix [string]:
+            file name prefix, must not start with a master frame pattern
+            like 'BIAS_'
+        nexposures [int]:
+            number of exposures
+        nchips [int]:
+            number of chips per exposure
+        shape [tuple]:
+            chip size (ny, nx)
+        filterkey [string]:
+            value of the FILTER keyword
+        level [float]:
+            background level of the pixels, see FRAME_LEVELS
+        seed [int]:
+            seed of the pixel noise
+    """
+    os.makedirs(folder, exist_ok=True)
+    data = data_block(shape, level=level, seed=seed)
+    for n in range(1, nexposures + 1):
+        keys = (
+            ("OBJECT", prefix.upper()), ("FILTER", filterkey),
+            ("EXPTIME", 60.0), ("CRVAL1", 150.1 + n * 1e-3),
+            ("CRVAL2", 2.2), ("AIRMASS", 1.2), ("MJD-OBS", 57754.0 + n))
+        write_mef(
+            os.path.join(folder, "%s%05d.fits" % (prefix, n)), shape,
+            nchips, keys=keys, data=data)
@@ -0,0 +1,179 @@
+"""
+Validates the python splitter against the splitting script of an instrument:
+splits copies of the raw files in RAWDIR with both backends and compares the
+chip images, the THELI header keywords and the pixel values. The result is
+appended to a JSON lines file, such that the validated instruments and
+wrapper versions are on record.
+
+    python3 -m benchmark.validate_split INSTRUMENT RAWDIR
+"""
+
+import os
+import sys
+import json
+import shutil
+import socket
+import argparse
+import tempfile
+from time import time
+
+from system.base import FITS_EXTENSIONS
+from system.instruments import Instrument
+from system.reduction import Reduction
+from system.native import fitsio
+from system.native.split import check_split
+
+from .micro import REPOSITORY, git_revision
+
+
+# THELI keywords and their tolerance (None: exact match)
+COMPARED_KEYS = {
+    "NAXIS1": None, "NAXIS2": None, "CTYPE1": None, "CTYPE2": None,
+    "CRVAL1": 1e-4, "CRVAL2": 1e-4, "CRPIX1": 1e-3, "CRPIX2": 1e-3,
+    "CD1_1": 1e-9, "CD1_2": 1e-9, "CD2_1": 1e-9, "CD2_2": 1e-9,
+    "EQUINOX": 1e-6, "OBJECT": None, "EXPTIME": 1e-3, "AIRMASS": 1e-3,
+    "FILTER": None, "DATE-OBS": None, "MJD-OBS": 1e-5, "GABODSID": None,
+    "IMAGEID": None}
+RESULTS = os.path.join(REPOSITORY, "benchmark", "split_validation.jsonl")
+
+
+parser = argparse.ArgumentParser(
+    description="Splits the raw files in RAWDIR with the splitting script "
+                "of INSTRUMENT and with the python splitter and reports all "
+                "differences of the chip images.")
+parser.add_argument(
+    'instrument', metavar='INSTRUMENT',
+    help='THELI instrument of the raw data')
+parser.add_argument(
+    'rawdir', metavar='RAWDIR',
+    help='folder with raw files')
+parser.add_argument(
+    '--files', metavar='N', type=int, default=3,
+    help='number of raw files to compare (default: 3)')
+parser.add_argument(
+    '--workdir', metavar='DIR',
+    help='folder for the split images (default: temporary folder, which '
+         'is deleted afterwards)')
+parser.add_argument(
+    '--results', metavar='FILE', default=RESULTS,
+    help='JSON lines file with the validation results (default: '
+         'benchmark/split_validation.jsonl)')
+parser.add_argument(
+    '--no-save', action='store_true',
+    help='do not append the result to the results file')
+
+
+def split(instrument, maindir, rawfiles, backend):
+    """Copy the raw files to the data folder 'backend' in 'maindir' and
+    split them with the given backend.
+
+    Returns:
+        folder [string]:
+            path of the data folder
+    """
+    folder = os.path.join(maindir, backend)
+    os.mkdir(folder)
+    for rawfile in rawfiles:
+        shutil.copy(rawfile, folder)
+    reduction = Reduction(
+        instrument, maindir, title="validate_split", sciencedir=backend,
+        verbosity="quiet", logdisplay="none", check_filters=False,
+        backends={"split": backend})
+    reduction.split_FITS_correct_header()
+    return folder
+
+
+def physical(hdu):
+    """Pixel values of a chip with BZERO and BSCALE applied."""
+    return hdu.data().astype("f8") * hdu.header.get("BSCALE", 1.0) + \
+        hdu.header.get("BZERO", 0.0)
+
+
+def compare_values(key, reference, value):
+    tolerance = COMPARED_KEYS[key]
+    if tolerance is None or not isinstance(reference, (int, float)):
+        return reference == value
+    try:
+        return abs(float(value) - reference) <= tolerance
+    except (TypeError, ValueError):
+        return False
+
+
+def compare(reference_folder, test_folder):
+    """Compare the chip images in the two folders.
+
+    Returns:
+        differences [list of strings]:
+            description of all differences
+    """
+    def chips(folder):
+        return sorted(
+            f for f in os.listdir(folder) if f.endswith(FITS_EXTENSIONS))
+
+    differences = []
+    reference_files = chips(reference_folder)
+    test_files = chips(test_folder)
+    for fname in sorted(set(reference_files) ^ set(test_files)):
+        differences.append("%s: only created by the %s backend" % (
+            fname, "shell" if fname in reference_files else "python"))
+    for fname in sorted(set(reference_files) & set(test_files)):
+        reference = fitsio.read_hdus(
+            os.path.join(reference_folder, fname))[0]
+        test = fitsio.read_hdus(os.path.join(test_folder, fname))[0]
+        for key in COMPARED_KEYS:
+            if key not in reference.header:
+                continue
+            if not compare_values(
+                    key, reference.header[key], test.header.get(key)):
+                differences.append("%s: %s = %r, expected %r" % (
+                    fname, key, test.header.get(key), reference.header[key]))
+        if fitsio.__numpy_success__ and reference.shape == test.shape:
+            deviation = abs(physical(reference) - physical(test)).max()
+            if deviation > 0.0:
+                differences.append(
+                    "%s: pixel values differ by up to %g" % (
+                        fname, deviation))
+    return differences
+
+
+def main():
+    args = parser.parse_args()
+    rawfiles = sorted(
+        os.path.join(args.rawdir, f) for f in os.listdir(args.rawdir)
+        if f.endswith(FITS_EXTENSIONS))[:args.files]
+    if len(rawfiles) == 0:
+        sys.exit("no raw files found in %s" % args.rawdir)
+    # otherwise both backends run the splitting script
+    reason = check_split(Instrument(args.instrument), rawfiles)
+    if reason is not None:
+        sys.exit("python splitter not applicable: %s" % reason)
+    cleanup = args.workdir is None
+    maindir = tempfile.mkdtemp() if cleanup else os.path.abspath(
+        args.workdir)
+    try:
+        reference = split(args.instrument, maindir, rawfiles, "shell")
+        test = split(args.instrument, maindir, rawfiles, "python")
+        differences = compare(reference, test)
+    finally:
+        if cleanup:
+            shutil.rmtree(maindir)
+    if not fitsio.__numpy_success__:
+        print("numpy not found, pixel values are not compared")
+    for difference in differences:
+        print(difference)
+    print("%d raw file(s) compared, %d difference(s)" % (
+        len(rawfiles), len(differences)))
+    if not args.no_save:
+        commit, dirty = git_revision()
+        with open(args.results, "a") as f:
+            f.write(json.dumps(dict(
+                commit=commit, dirty=dirty, time=time(),
+                host=socket.gethostname(), instrument=args.instrument,
+                files=[os.path.basename(f) for f in rawfiles],
+                pixels=fitsio.__numpy_success__,
+                differences=differences)) + "\n")
+    sys.exit(1 if len(differences) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
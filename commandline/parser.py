@@ -13,7 +13,7 @@ from math import ceil
 
 from system.base import INSTRUMENTS, ascii_styled
 from system.instruments import Instrument
-from system.version import __version_theli__, __version_gui__, __version__
+from system import version
 from .commandlist import *  # command line parameter data base
 
 
@@ -444,12 +444,13 @@ class ActionVersion(argparse.Action):
         pad = 17
         versionstr = ""
         versionstr += "{:{pad}}{:}\n".format(
-            "THELI", __version_theli__, pad=pad)
+            "THELI", version.__version_theli__, pad=pad)
         versionstr += "{:{pad}}{:}\n".format(
-            "GUI scripts", __version_gui__, pad=pad)
+            "GUI scripts", version.__version_gui__, pad=pad)
         versionstr += ascii_styled("#" * 30 + "\n", "bb-")
         versionstr += ascii_styled(
-            "{:{pad}}{:}".format("TheliWrapper", __version__, pad=pad), "b--")
+            "{:{pad}}{:}".format(
+                "TheliWrapper", version.__version__, pad=pad), "b--")
         print("\n" + versionstr + "\n")
         sys.exit(0)
 
@@ -489,6 +490,46 @@ def TypePath(path):
     return os.path.expanduser(path)
 
 
+def TypeBackend(value):
+    """Parse the backend selection 'stage=implementation' of a reduction
+    stage.
+
+    Arguments:
+        value [string]:
+            parsed backend selection
+    Returns:
+        selection [tuple]:
+            stage and implementation
+    """
+    stage, _, backend = value.partition("=")
+    # the stages and implementations are verified by the Reduction class,
+    # which registers the implementations
+    if stage == "" or backend == "":
+        raise argparse.ArgumentTypeError(
+            "invalid backend '%s', expected STAGE=shell|python|shadow" %
+            value)
+    return stage, backend
+
+
+def TypeChips(value):
+    """Parse a comma separated list of chip numbers.
+
+    Arguments:
+        value [string]:
+            parsed chip list
+    Returns:
+        chips [tuple]:
+            chip numbers
+    """
+    try:
+        chips = tuple(int(chip) for chip in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid chip list: '%s'" % value)
+    if any(chip < 1 for chip in chips):
+        raise argparse.ArgumentTypeError("invalid chip list: '%s'" % value)
+    return chips
+
+
 class TheliParser(argparse.ArgumentParser):
     """Argument parser with custom parsing method that handles the argument
     conversion. Maps choices to internal values, creates the list of jobs to
@@ -632,6 +673,79 @@ optargs.add_argument(
 optargs.add_argument(
     "--verbosity", "-v", type=str, default="normal",
     choices=("quiet", "normal", "full"))
+optargs.add_argument(
+    "--memory-limit", metavar="GB", type=float,
+    help="limit the memory used by the THELI scripts to GB gigabytes "
+         "(default: 90%% of the available memory)")
+optargs.add_argument(
+    "--backend", metavar="STAGE=IMPL", type=TypeBackend, action="append",
+    default=[],
+    help="implementation of a reduction stage: 'shell' (THELI scripts, "
+         "default), 'python' or 'shadow' (runs the scripts and the python "
+         "implementation on a copy of the chips selected with "
+         "--shadow-chips, compares their outputs and run times), can be "
+         "used repeatedly, stages: split (copies the chip data without "
+         "decoding unless crosstalk is corrected, overscan correction and "
+         "cutting are left to the calibration), check (brightness "
+         "level check on a subsample of rows, requires numpy), stack "
+         "(master bias and dark in bounded memory, requires numpy), "
+         "calibrate (science calibration in a single pass per chip, "
+         "requires numpy), background (static background models in "
+         "bounded memory, uses the script for dynamic models and "
+         "defringing, requires numpy), preview (binned TIFF and PNG "
+         "previews without full resolution mosaics, requires numpy), "
+         "weights (global and image weights with thresholds and DS9 "
+         "masks, requires numpy), outliers (outlier rejection of the "
+         "resampled images in tiles of the coaddition grid, requires "
+         "numpy)")
+optargs.add_argument(
+    "--shadow-chips", metavar="N[,N]", type=TypeChips, default=(1,),
+    help="chips processed by the python implementation of stages in "
+         "shadow mode, stages that combine the chips use all chips "
+         "(default: 1)")
+optargs.add_argument(
+    "--shadow-tolerance", metavar=("RTOL", "ATOL"), type=float, nargs=2,
+    default=(1e-4, 1e-3),
+    help="pixel values of the shadow mode differ, if |python - script| > "
+         "ATOL + RTOL * |script| (default: 1e-4 1e-3)")
+optargs.add_argument(
+    "--check-fraction", metavar="F", type=float, default=0.05,
+    help="fraction of the image rows read by the python brightness level "
+         "check, images close to the mode limits are read completely "
+         "(default: 0.05)")
+optargs.add_argument(
+    "--events", metavar="FILE", type=TypePath,
+    help="append machine readable events of each reduction step to FILE "
+         "(JSON lines)")
+optargs.add_argument(
+    "--profile", metavar="DIR", nargs="?", const="",
+    help="profile the CPU time of the wrapper for each job, excluding the "
+         "THELI scripts, write the profiles to DIR (default: "
+         "ROOTDIR/profile) and summarise the hotspots")
+optargs.add_argument(
+    "--plan", metavar="FILE", nargs="?", const="",
+    help="do not run any script, but report which steps of JOBLIST will be "
+         "executed or skipped and their estimated runtime, optionally export "
+         "the plan to FILE (JSON)")
+optargs.add_argument(
+    "--tune-npara", metavar="NEXP", type=int, nargs="?", const=4,
+    help="run JOBLIST on copies of the first NEXP (default: 4) exposures of "
+         "each data folder with different numbers of parallel processes and "
+         "store the fastest setting per script for this host, which is used "
+         "in all following reductions")
+optargs.add_argument(
+    "--single", metavar="FILE", type=TypePath,
+    help="fast reduction of a single science exposure using existing master "
+         "frames, global weights and cached astrometry, before running "
+         "JOBLIST")
+optargs.add_argument(
+    "--watch", metavar="RAWDIR", type=TypePath,
+    help="watch RAWDIR for new raw frames and split and calibrate them as "
+         "they arrive, before running JOBLIST")
+optargs.add_argument(
+    "--watch-timeout", metavar="SEC", type=float,
+    help="stop watching after SEC seconds without new frames "
+         "(default: until interrupted)")
 
 # add the THELI parameters
 theli_group = Parser.add_argument_group(
@@ -0,0 +1,127 @@
+"""
+Defines a cache of astrometric solutions for the fast single exposure
+reduction
+"""
+
+import os
+import json
+import shutil
+from math import cos, radians, sqrt
+
+from .base import DIRS
+
+
+class AstrometryCache(object):
+    """Stores the scamp header files of reduced exposures per instrument and
+    filter, such that new exposures of the same pointing can reuse the
+    solution. Offsets between the pointings are applied to the reference
+    coordinates (CRVAL1/2) of the cached headers.
+
+    Arguments:
+        instrument [string]:
+            valid THELI instrument string (e.g. ACAM@WHT)
+        radius [float]:
+            maximum distance in arcmin between cached and new pointing
+    """
+
+    def __init__(self, instrument, radius=2.0):
+        super(AstrometryCache, self).__init__()
+        self.root = os.path.join(
+            DIRS["PIPEHOME"], "astrometry_cache", instrument)
+        self.radius = radius
+        self._indexfile = os.path.join(self.root, "index.json")
+        try:
+            with open(self._indexfile) as f:
+                self._index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._index = []
+
+    def save(self):
+        """Write the cache index to disk."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._indexfile, "w") as f:
+            json.dump(self._index, f, indent=1)
+
+    @staticmethod
+    def _separation(ra1, dec1, ra2, dec2):
+        """Approximate angular distance in arcmin for small separations."""
+        dra = ((ra1 - ra2 + 180.0) % 360.0 - 180.0) * cos(
+            radians(0.5 * (dec1 + dec2)))
+        return 60.0 * sqrt(dra ** 2 + (dec1 - dec2) ** 2)
+
+    def lookup(self, ra, dec, filterkey):
+        """Find the closest cached solution within the matching radius.
+
+        Arguments:
+            ra, dec [float]:
+                pointing of the exposure (CRVAL1/2 of the first chip)
+            filterkey [string]:
+                filter of the exposure
+        Returns:
+            entry [dict]:
+                cache entry or None, if no solution is found
+        """
+        best, best_sep = None, self.radius
+        for entry in self._index:
+            if entry["filter"] != filterkey:
+                continue
+            sep = self._separation(ra, dec, entry["ra"], entry["dec"])
+            if sep <= best_sep:
+                best, best_sep = entry, sep
+        return best
+
+    def store(self, ra, dec, filterkey, headers):
+        """Add the header files of an exposure to the cache, replacing any
+        entry with the same pointing. Changes are written to disk with
+        'save'.
+
+        Arguments:
+            ra, dec [float]:
+                pointing of the exposure (CRVAL1/2 of the first chip)
+            filterkey [string]:
+                filter of the exposure
+            headers [dict]:
+                maps chip number to the path of its scamp header file
+        """
+        entry_id = "%09.5f_%+09.5f_%s" % (ra, dec, filterkey)
+        entry_id = entry_id.replace(" ", "_").replace(os.sep, "_")
+        self._index = [e for e in self._index if e["id"] != entry_id]
+        shutil.rmtree(os.path.join(self.root, entry_id), ignore_errors=True)
+        os.makedirs(os.path.join(self.root, entry_id), exist_ok=True)
+        for chip, headerfile in headers.items():
+            shutil.copy(headerfile, os.path.join(
+                self.root, entry_id, "%d.head" % int(chip)))
+        self._index.append({
+            "id": entry_id, "ra": ra, "dec": dec, "filter": filterkey,
+            "chips": sorted(int(c) for c in headers)})
+
+    def restore(self, entry, ra, dec, base, destfolder):
+        """Write the cached header files for the exposure 'base' to
+        'destfolder', shifted to the new pointing.
+
+        Arguments:
+            entry [dict]:
+                cache entry returned by 'lookup'
+            ra, dec [float]:
+                pointing of the new exposure
+            base [string]:
+                file name base of the new exposure (without chip and tag)
+            destfolder [string]:
+                folder to write header files '[base]_[chip].head' to
+        """
+        os.makedirs(destfolder, exist_ok=True)
+        shift = {"CRVAL1": ra - entry["ra"], "CRVAL2": dec - entry["dec"]}
+        for chip in entry["chips"]:
+            source = os.path.join(self.root, entry["id"], "%d.head" % chip)
+            lines = []
+            with open(source) as head:
+                for line in head:
+                    key = line[:8].strip()
+                    if key in shift:
+                        value = float(line[9:].split("/")[0].strip("= '"))
+                        line = "%-8s= %20.10f / shifted by cache\n" % (
+                            key, value + shift[key])
+                    lines.append(line)
+            with open(os.path.join(
+                    destfolder, "%s_%d.head" % (base, chip)), "w") as head:
+                head.writelines(lines)
@@ -4,17 +4,21 @@ Defines low level functions for the Reduction class
 
 import os
 import sys
+import json
 import subprocess
 from re import split
+from collections.abc import MutableMapping, Sequence
 from itertools import combinations
 
-try:
-    # import user specific paths
-    _theli_home = os.path.join(os.environ["HOME"], ".theli")
-    sys.path.append(_theli_home)
-    from theli_paths import DIRS, CMDTOOLS, CMDSCRIPTS, LOCKFILE, LOGFILE
-except ImportError:
-    print("\nSetting up system for first usage...")
+
+def _setup_paths():
+    """Set up the THELI home folder, if necessary, and read the paths to the
+    THELI installation from THELI's 'progs.ini'.
+
+    Returns:
+        paths [tuple]:
+            DIRS, CMDTOOLS, CMDSCRIPTS, LOCKFILE, LOGFILE
+    """
     # set up main data folders
     DIRS = {}
     DIRS["HOME"] = os.environ["HOME"]
@@ -34,6 +38,7 @@ except ImportError:
     if any(
             not os.path.exists(os.path.join(script_link_folder, f))
             for f in ("progs.ini", "bash.include", "bash_functions.include")):
+        print("\nSetting up system for first usage...")
         print("enter path to folder containing THELI installation 'theli'")
         theli_folder = ""
         while not os.path.exists(theli_folder):
@@ -50,11 +55,12 @@ except ImportError:
         if not os.path.exists(gui_folder):
             print("THELI GUI installation not found")
             sys.exit(1)
-        # link to files in theli folder
+        # link to files in theli folder, replace links to a moved installation
         for dest in ("progs.ini", "bash.include", "bash_functions.include"):
-            os.symlink(
-                os.path.join(gui_folder, "scripts", dest),
-                os.path.join(script_link_folder, dest))
+            link = os.path.join(script_link_folder, dest)
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.join(gui_folder, "scripts", dest), link)
     # paths read from "progs.ini": folders, binaries, scripts and configuration
     CMDTOOLS = {}  # binaries
     CMDSCRIPTS = {}  # scripts
@@ -85,36 +91,222 @@ except ImportError:
             CMDTOOLS[key] = DIRS.pop(key)
         if key.startswith("S_"):
             CMDSCRIPTS[key] = DIRS.pop(key)
+    # create log folder
+    if not os.path.exists(DIRS["LOGFOLDER"]):
+        os.mkdir(DIRS["LOGFOLDER"])
+    return DIRS, CMDTOOLS, CMDSCRIPTS, LOCKFILE, LOGFILE
+
+
+# format version of the environment snapshot, increment if its content changes
+ENVIRONMENT_VERSION = 1
 
-    # create source files containing DIRS, CMDTOOLS, CMDSCRIPTS, ...
+
+def _environment_file():
+    return os.path.join(os.environ["HOME"], ".theli", "theli_environment.json")
+
+
+def _environment_stamps(dirs):
+    """Modification times of the files and folders the environment snapshot
+    is derived from. Links are resolved, such that changing the link to
+    'progs.ini' invalidates the snapshot as well.
+
+    Arguments:
+        dirs [dict]:
+            THELI folders (DIRS)
+    Returns:
+        stamps [dict]:
+            modification time (or None, if missing) by resolved path
+    """
+    stamps = {}
+    for path in (
+            os.path.join(dirs["PIPEHOME"], "scripts", "progs.ini"),
+            dirs["SCRIPTS"],
+            os.path.join(dirs["PIPESOFT"], "README"),
+            os.path.join(dirs["PIPESOFT"], "gui", "CHANGELOG")):
+        path = os.path.realpath(path)
+        try:
+            stamps[path] = os.stat(path).st_mtime
+        except OSError:
+            stamps[path] = None
+    return stamps
+
+
+def _build_environment():
+    """Collect the paths, instruments and versions of the THELI installation.
+
+    Returns:
+        environment [dict]:
+            snapshot of the THELI environment, serialisable as JSON
+    """
+    from .version import _read_gui_version, _read_theli_version
+    dirs, cmdtools, cmdscripts, lockfile, logfile = _setup_paths()
+    versions = {}
+    for key, reader in (
+            ("__version_theli__", _read_theli_version),
+            ("__version_gui__", _read_gui_version)):
+        try:
+            versions[key] = reader(dirs["PIPESOFT"])
+        except OSError:
+            versions[key] = "N/A"
+    return {
+        "version": ENVIRONMENT_VERSION,
+        "stamps": _environment_stamps(dirs),
+        "DIRS": dirs, "CMDTOOLS": cmdtools, "CMDSCRIPTS": cmdscripts,
+        "LOCKFILE": lockfile, "LOGFILE": logfile,
+        "INSTRUMENTS": _find_instruments(dirs["SCRIPTS"]),
+        "versions": versions}
+
+
+def _load_environment():
+    """Load the environment snapshot from the THELI home folder. If it is
+    missing, outdated or the THELI installation changed since it was created,
+    rebuild it from the installation and store it.
+
+    Returns:
+        environment [dict]:
+            snapshot of the THELI environment
+    """
+    envfile = _environment_file()
     try:
-        with open(os.path.join(_theli_home, "theli_paths.py"), 'w') as f:
-            f.write("\"\"\"\nThis file is generated automatically.\n")
-            f.write("It contains the folders and paths to the THELI ")
-            f.write("installation and package.\n\"\"\"\n\n")
-            f.write("DIRS = {\n")
-            for key, val in DIRS.items():
-                f.write("    '%s': '%s',\n" % (key, val))
-            f.write("}\n\n")
-            f.write("CMDTOOLS = {\n")
-            for key, val in CMDTOOLS.items():
-                f.write("    '%s': '%s',\n" % (key, val))
-            f.write("}\n\n")
-            f.write("CMDSCRIPTS = {\n")
-            for key, val in CMDSCRIPTS.items():
-                f.write("    '%s': '%s',\n" % (key, val))
-            f.write("}\n\n")
-            f.write("LOCKFILE = '%s'\n\n" % LOCKFILE)
-            f.write("LOGFILE = '%s'\n\n" % LOGFILE)
-    except Exception:
-        print("WARNING: database file could not be created: " + _paths_file)
+        with open(envfile) as f:
+            environment = json.load(f)
+        if environment["version"] == ENVIRONMENT_VERSION and \
+                environment["stamps"] == _environment_stamps(
+                    environment["DIRS"]):
+            return environment
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    environment = _build_environment()
+    try:
+        # write to a temporary file first, concurrent runs may read it
+        with open(envfile + ".tmp", "w") as f:
+            json.dump(environment, f, indent=1)
+        os.replace(envfile + ".tmp", envfile)
+    except OSError:
+        print("WARNING: environment file could not be created: " + envfile)
         print("continuing...\n")
-    finally:
-        # create log folder
-        if not os.path.exists(os.path.join(DIRS["PIPEHOME"], "script_logs")):
-            os.mkdir(os.path.join(DIRS["PIPEHOME"], "script_logs"))
+    return environment
+
+
+_environment = None  # cached result of _load_environment
+
+
+def _get_environment():
+    global _environment
+    if _environment is None:
+        _environment = _load_environment()
+    return _environment
+
+
+class LazyDict(MutableMapping):
+    """Dictionary that is created on first access, such that importing this
+    module does not require a THELI installation.
+
+    Arguments:
+        loader [callable]:
+            function that returns the dictionary
+    """
+
+    def __init__(self, loader):
+        super(LazyDict, self).__init__()
+        self._loader = loader
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return repr(self.data)
+
+
+class LazyList(Sequence):
+    """List that is created on first access (see LazyDict).
+
+    Arguments:
+        loader [callable]:
+            function that returns the list
+    """
+
+    def __init__(self, loader):
+        super(LazyList, self).__init__()
+        self._loader = loader
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, item):
+        return item in self.data
 
-from .version import __version_gui__
+    def __repr__(self):
+        return repr(self.data)
+
+
+class LazyPath(os.PathLike):
+    """File path that is determined on first access (see LazyDict). Can be
+    used like a string in file system functions and string formatting.
+
+    Arguments:
+        loader [callable]:
+            function that returns the path
+    """
+
+    def __init__(self, loader):
+        super(LazyPath, self).__init__()
+        self._loader = loader
+        self._path = None
+
+    def __fspath__(self):
+        if self._path is None:
+            self._path = self._loader()
+        return self._path
+
+    def __str__(self):
+        return self.__fspath__()
+
+    def __repr__(self):
+        return repr(self.__fspath__())
+
+    def __eq__(self, other):
+        return self.__fspath__() == os.fspath(other)
+
+    def __hash__(self):
+        return hash(self.__fspath__())
+
+
+# paths to the THELI installation, home folder and log, set up on first use
+DIRS = LazyDict(lambda: _get_environment()["DIRS"])  # folders
+CMDTOOLS = LazyDict(lambda: _get_environment()["CMDTOOLS"])  # binaries
+CMDSCRIPTS = LazyDict(lambda: _get_environment()["CMDSCRIPTS"])  # scripts
+LOCKFILE = LazyPath(lambda: _get_environment()["LOCKFILE"])
+LOGFILE = LazyPath(lambda: _get_environment()["LOGFILE"])
 
 
 # common fits file extensions and file names of calibration master frames
@@ -140,143 +332,172 @@ for n in range(6):
     THELI_TAGS["OFC" + THELI_FLAGS[n]] = tuple(reversed(tags))
 
 
-INSTRUMENTS = []  # all instruments available in THELI
-# splitting script: "process_split_[instrument@telescope]"
-splitting_scripts = [
-    os.path.join(DIRS["SCRIPTS"], s)
-    for s in os.listdir(DIRS["SCRIPTS"])
-    if os.path.isfile(os.path.join(DIRS["SCRIPTS"], s)) and
-    s.startswith("process_split_") and
-    s != "process_split_tiff.sh"]
-# collect names of all available instruments
-for fpath in splitting_scripts:
-    # remove path, "process_split_" and extension -> instrument name
-    instrument = os.path.basename(fpath).split("_", 2)[-1]
-    INSTRUMENTS.append(os.path.splitext(instrument)[0])
+def _find_instruments(scriptdir):
+    """List the names of all instruments available in THELI by scanning the
+    THELI script folder 'scriptdir'."""
+    instruments = []
+    # splitting script: "process_split_[instrument@telescope]"
+    splitting_scripts = [
+        os.path.join(scriptdir, s)
+        for s in os.listdir(scriptdir)
+        if os.path.isfile(os.path.join(scriptdir, s)) and
+        s.startswith("process_split_") and
+        s != "process_split_tiff.sh"]
+    # collect names of all available instruments
+    for fpath in splitting_scripts:
+        # remove path, "process_split_" and extension -> instrument name
+        instrument = os.path.basename(fpath).split("_", 2)[-1]
+        instruments.append(os.path.splitext(instrument)[0])
+    return instruments
 
 
-# find method to read fits file headers:
-# try importing astropy.io.fits or pyfits
-try:
-    from astropy.io import fits as pyfits
-    __pyfits_success__ = True
-except ImportError:
-    try:
-        import pyfits
-        __pyfits_success__ = True
-    except ImportError:
-        __pyfits_success__ = False
-# define function to read header values: if pyfits import failed, use custom
-# function based on command line tool 'defits' (from THELI package)
-if __pyfits_success__:
-    def get_FITS_header_values(file, keys, extension=-1, exists=False):
-        """Opens FITS image 'file' and checks, if a list of key words ('keys')
-        is found in a specified 'extension' of the FITS image. By default all
-        extensions are checked, if they contain the key words.
-        WARNING: if keys occur in multiple extensions, only the last occurence
-        is returned.
+# all instruments available in THELI
+INSTRUMENTS = LazyList(lambda: _get_environment()["INSTRUMENTS"])
 
-        Arguments:
-            file [string]:
-                valid FITS file path
-            keys [string, list of strings]:
-                keyword(s) to read from FITS file
-            extension [int]:
-                FITS extension index (starting from 0) to check, by default -1
-                which checks all available extension
-            exists [bool]:
-                check key existence only
 
-        Returns:
-            values [list]:
-                value belonging to FITS key word in 'keys'
-        """
-        # list to hold results in order as keys are specified
-        values = [None] * len(keys)
-        with pyfits.open(file) as fits:
-            # if no extension is defined, iterate through all and search
-            iter_ext = range(len(fits)) if extension == -1 else [extension]
-            for i in iter_ext:
-                # check if table contains any of the key words
-                for k, key in enumerate(keys):
-                    if exists:
-                        if key not in fits[i].header:
-                            raise KeyError()
-                    else:
-                        try:
-                            values[k] = (fits[i].header[key])
-                        except KeyError:
-                            continue
-        if exists:
-            return True
-        else:
-            # if any key word did not appear in extension(s), its value is None
-            for i, val in enumerate(values):
-                if val is None:
-                    raise KeyError("Keyword '%s' not found." % keys[i])
-            return values
-else:
-    def get_FITS_header_values(file, keys, extension=-1):
-        """Opens FITS image 'file' and checks, if a list of key words ('keys')
-        is found in a specified 'extension' of the FITS image. By default all
-        extensions are checked, if they contain the key words.
-        WARNING: if keys occur in multiple extensions, only the last occurence
-        is returned.
+_pyfits = None  # cached result of _import_pyfits
 
-        Arguments:
-            file [string]:
-                valid FITS file path
-            keys [string, list of strings]:
-                keyword(s) to read from FITS file
-            extension [int]:
-                FITS extension index (starting from 0) to check, by default -1
-                which checks all available extension
-            exists [bool]:
-                check key existence only
 
-        Returns:
-            values [list]:
-                value belonging to FITS key word in 'keys'
-        """
-        # read the header from the stdout of 'dfits -x [extension]'
-        cmdstr = "%s -x %d %s" % (CMDTOOLS["P_DFITS"], extension + 1, file)
-        call = subprocess.Popen(cmdstr, shell=True, stdout=subprocess.PIPE)
-        stdout = call.communicate()[0].decode("utf-8").splitlines()
-        # make list of values from requested keywords
-        values = []
-        for key in keys:
-            # some keywords may be repeated over many lines, join these lines
-            subvals = []
-            for line in stdout:
-                if line.startswith(key):
-                    subvals.append(line)
-            # if no matching key word is found
-            if subvals == []:
-                raise KeyError("Keyword '%s' not found." % key)
-            values.append("\n".join(subvals))
-        if exists:
-            return True
-        else:
-            # deduce the value type from the string pattern and convert it
-            for i in range(len(values)):
-                # special keywords like 'HISTORY' need no further processing
-                splited = values[i].split("=", 1)
-                if len(splited) == 1:
-                    continue
-                # data keywords
+def _import_pyfits():
+    """Find method to read fits file headers: try importing astropy.io.fits
+    or pyfits on first use (importing astropy is slow).
+
+    Returns:
+        pyfits [module]:
+            the FITS module or False, if neither is installed
+    """
+    global _pyfits
+    if _pyfits is None:
+        try:
+            from astropy.io import fits as pyfits
+        except ImportError:
+            try:
+                import pyfits
+            except ImportError:
+                pyfits = False
+        _pyfits = pyfits
+    return _pyfits
+
+
+# functions to read header values: with pyfits or with the command line tool
+# 'dfits' (from THELI package), which is used if pyfits import failed
+def _get_FITS_header_values_pyfits(file, keys, extension=-1, exists=False):
+    """Opens FITS image 'file' and checks, if a list of key words ('keys')
+    is found in a specified 'extension' of the FITS image. By default all
+    extensions are checked, if they contain the key words.
+    WARNING: if keys occur in multiple extensions, only the last occurence
+    is returned.
+
+    Arguments:
+        file [string]:
+            valid FITS file path
+        keys [string, list of strings]:
+            keyword(s) to read from FITS file
+        extension [int]:
+            FITS extension index (starting from 0) to check, by default -1
+            which checks all available extension
+        exists [bool]:
+            check key existence only
+
+    Returns:
+        values [list]:
+            value belonging to FITS key word in 'keys'
+    """
+    # list to hold results in order as keys are specified
+    values = [None] * len(keys)
+    with _import_pyfits().open(file) as fits:
+        # if no extension is defined, iterate through all and search
+        iter_ext = range(len(fits)) if extension == -1 else [extension]
+        for i in iter_ext:
+            # check if table contains any of the key words
+            for k, key in enumerate(keys):
+                if exists:
+                    if key not in fits[i].header:
+                        raise KeyError()
+                else:
+                    try:
+                        values[k] = (fits[i].header[key])
+                    except KeyError:
+                        continue
+    if exists:
+        return True
+    else:
+        # if any key word did not appear in extension(s), its value is None
+        for i, val in enumerate(values):
+            if val is None:
+                raise KeyError("Keyword '%s' not found." % keys[i])
+        return values
+
+
+def _get_FITS_header_values_dfits(file, keys, extension=-1, exists=False):
+    """Opens FITS image 'file' and checks, if a list of key words ('keys')
+    is found in a specified 'extension' of the FITS image. By default all
+    extensions are checked, if they contain the key words.
+    WARNING: if keys occur in multiple extensions, only the last occurence
+    is returned.
+
+    Arguments:
+        file [string]:
+            valid FITS file path
+        keys [string, list of strings]:
+            keyword(s) to read from FITS file
+        extension [int]:
+            FITS extension index (starting from 0) to check, by default -1
+            which checks all available extension
+        exists [bool]:
+            check key existence only
+
+    Returns:
+        values [list]:
+            value belonging to FITS key word in 'keys'
+    """
+    # read the header from the stdout of 'dfits -x [extension]'
+    cmdstr = "%s -x %d %s" % (CMDTOOLS["P_DFITS"], extension + 1, file)
+    call = subprocess.Popen(cmdstr, shell=True, stdout=subprocess.PIPE)
+    stdout = call.communicate()[0].decode("utf-8").splitlines()
+    # make list of values from requested keywords
+    values = []
+    for key in keys:
+        # some keywords may be repeated over many lines, join these lines
+        subvals = []
+        for line in stdout:
+            if line.startswith(key):
+                subvals.append(line)
+        # if no matching key word is found
+        if subvals == []:
+            raise KeyError("Keyword '%s' not found." % key)
+        values.append("\n".join(subvals))
+    if exists:
+        return True
+    else:
+        # deduce the value type from the string pattern and convert it
+        for i in range(len(values)):
+            # special keywords like 'HISTORY' need no further processing
+            splited = values[i].split("=", 1)
+            if len(splited) == 1:
+                continue
+            # data keywords
+            else:
+                # some lines defining the image data type contain a comment
+                # which follows the value after a slash -> remove comment
+                splited = splited[1].split(" / ")[0].strip()
+                # strings are enclosed with with white spaces ('string   ')
+                if splited.startswith("'") and splited.endswith("'"):
+                    values[i] = splited.strip("'").strip()
+                # remaining types are either float or int -> convert type
+                elif "." in splited:
+                    values[i] = float(splited)
                 else:
-                    # some lines defining the image data type contain a comment
-                    # which follows the value after a slash -> remove comment
-                    splited = splited[1].split(" / ")[0].strip()
-                    # strings are enclosed with with white spaces ('string   ')
-                    if splited.startswith("'") and splited.endswith("'"):
-                        values[i] = splited.strip("'").strip()
-                    # remaining types are either float or int -> convert type
-                    elif "." in splited:
-                        values[i] = float(splited)
-                    else:
-                        values[i] = int(splited)
-            return values
+                    values[i] = int(splited)
+        return values
+
+
+def get_FITS_header_values(file, keys, extension=-1, exists=False):
+    """Read header values with pyfits, if it is installed, otherwise with
+    'dfits' (see _get_FITS_header_values_pyfits for the arguments)."""
+    if _import_pyfits():
+        return _get_FITS_header_values_pyfits(file, keys, extension, exists)
+    return _get_FITS_header_values_dfits(file, keys, extension, exists)
 
 
 # This is supposed to test if the terminal supports ANSI escape sequences.
@@ -380,6 +601,21 @@ def get_crossid_radius(pixscale):
         return 10.0 * pixscale
 
 
+def format_duration(seconds):
+    """Format a duration as HH:MM:SS.
+
+    Arguments:
+        seconds [float]:
+            duration in seconds
+    Returns:
+        duration [string]:
+            formatted duration
+    """
+    seconds = int(seconds)
+    return "%02d:%02d:%02d" % (
+        seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
 '''
 def extract_tag(filename):
     """Extract the THELI progess tag from the filename of an image. Tag does
@@ -0,0 +1,111 @@
+"""
+Defines the machine readable event stream of the reduction
+"""
+
+import os
+import json
+from time import time
+
+from .base import LOGFILE
+from .governor import count_exposures
+from .scripts import CallMonitor
+
+
+class EventStream(object):
+    """Distributes reduction events to JSON lines files and callback
+    functions. Each event is a dictionary with the event type ('event'), the
+    UNIX time ('time'), the emitting reduction ('source') and event specific
+    data. Events are discarded immediately if there is no receiver.
+
+    Arguments:
+        source [string]:
+            identifier of the reduction (e.g. its main folder)
+    """
+
+    def __init__(self, source=None):
+        super(EventStream, self).__init__()
+        self.source = source
+        self._files = []  # file descriptors
+        self._callbacks = []
+
+    @property
+    def enabled(self):
+        return len(self._files) > 0 or len(self._callbacks) > 0
+
+    def add_file(self, path):
+        """Append events as JSON lines to file 'path'. Each event is written
+        with a single system call, such that several reductions can share
+        the same file."""
+        self._files.append(os.open(
+            path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644))
+
+    def add_callback(self, callback):
+        """Call 'callback' with the dictionary of each event."""
+        self._callbacks.append(callback)
+
+    def emit(self, event, **data):
+        """Send an event of type 'event' with additional data to all
+        receivers."""
+        if not self.enabled:
+            return
+        data["event"] = event
+        data["time"] = time()
+        data["source"] = self.source
+        if len(self._files) > 0:
+            line = (json.dumps(data) + "\n").encode("utf-8")
+            for fd in self._files:
+                os.write(fd, line)
+        for callback in self._callbacks:
+            callback(data)
+
+    def close(self):
+        """Close all event files."""
+        for fd in self._files:
+            os.close(fd)
+        self._files = []
+
+
+class EventMonitor(CallMonitor):
+    """Emits an event before and after each script call with the processed
+    data folder, exposure and chip counts, duration and the result of the
+    log file scan.
+
+    Arguments:
+        stream [EventStream]:
+            event stream of the reduction
+        nchips [int]:
+            number of chips of the instrument
+    """
+
+    def __init__(self, stream, nchips):
+        super(EventMonitor, self).__init__()
+        self.stream = stream
+        self.nchips = nchips
+        self._start = None
+
+    def call_prepare(self, script, arglist):
+        if not self.stream.enabled:
+            return
+        exposures = count_exposures(arglist)
+        try:
+            folder = arglist[1]
+        except (IndexError, TypeError):
+            folder = None
+        self.stream.emit(
+            "script_start", script=script, folder=folder,
+            exposures=exposures, chips=exposures * self.nchips)
+
+    def call_started(self, script, arglist, process):
+        self._start = time()
+
+    def call_finished(self, script, arglist, process, return_code):
+        if not self.stream.enabled or self._start is None:
+            return
+        self.stream.emit(
+            "script_finish", script=script,
+            seconds=time() - self._start,
+            success=return_code == (0, ""),
+            interrupted=return_code is None,
+            log=os.path.realpath(LOGFILE),
+            log_line=None if return_code is None else return_code[0])
+        self._start = None
@@ -8,14 +8,258 @@ from time import time
 from fnmatch import fnmatch
 from inspect import stack
 
-from .base import (FITS_EXTENSIONS,
+from .base import (FITS_EXTENSIONS, THELI_TAGS,
                    extract_tag, check_system_lock, get_FITS_header_values)
 
 
 MASTER_PATTERN = ("BIAS_", "FLAT_", "DARK_")
 
 
-class Folder(object):
+def _merge_tree(source, target):
+    """Move the content of folder 'source' to folder 'target', merging
+    subfolders that exist in both, and remove 'source'."""
+    for entry in os.listdir(source):
+        src, dst = os.path.join(source, entry), os.path.join(target, entry)
+        if os.path.isdir(src) and os.path.isdir(dst):
+            _merge_tree(src, dst)
+        else:
+            shutil.move(src, dst)
+    os.rmdir(source)
+
+
+def check_requirements(folders, requirements):
+    """Check if the data folders a job requires are specified and, if
+    needed, contain a master frame.
+
+    Arguments:
+        folders [dict]:
+            data folders (Folder or snapshot) by attribute name (e.g.
+            'biasdir'), None or missing if not specified
+        requirements [list of tuples]:
+            attribute name and whether a master frame is required
+    Returns:
+        reason [string]:
+            why a requirement is not met, None if all are met
+    """
+    for key, master in requirements:
+        name = key[:-3]
+        if folders.get(key) is None:
+            return "%s folder not specified" % name
+        if master and not folders[key].contains_master():
+            return "master %s not found" % name
+    return None
+
+
+class ProgressChecks(object):
+    """Predicates on the reduction progress of a data folder and the
+    verification of the Reduction jobs, shared with the dry-run planner.
+    They only rely on 'tags', 'contains', 'contains_tag', 'fits_count',
+    'check_weight' and the 'contains_*' and 'search_flatnorm' methods, such
+    that they apply to 'Folder' and the snapshots of the planner alike.
+
+    The 'verify_*' methods return the outcome of the verification of a job
+    as tuple (action, reason), where the action is one of
+        'run':   the job processes the folder, a reason is shown as warning
+        'skip':  the output exists
+        'warn':  the folder is skipped with a warning
+        'error': the folder is skipped with a non-critical error
+        'fail':  the reduction cannot continue
+    """
+
+    def multiple_stages(self):
+        """Test if folder contains images of more than one progress stage."""
+        return len(self.tags(ignore_sub=True)) > 1
+
+    def found_split(self):
+        """Test if folder contains original images and split images (or
+        their archive folder).
+
+        Returns:
+            found_original [bool]:
+                original images found
+            found_split [bool]:
+                split images or SPLIT_IMAGES found
+        """
+        found_split = self.contains_tag('') or self.contains("SPLIT_IMAGES")
+        return self.contains_tag('none'), found_split
+
+    def found_calibrated(self):
+        """Test if folder contains split images and calibrated images (or
+        their archive folder).
+
+        Returns:
+            found_split [bool]:
+                split images found
+            found_calibrated [bool]:
+                OFC images or OFC_IMAGES found
+        """
+        found_calibrated = \
+            self.contains_tag('OFC') or self.contains("OFC_IMAGES")
+        return self.contains_tag(''), found_calibrated
+
+    def found_step(self, flag, archive=True):
+        """Test if folder contains the input and output images of a
+        reduction step that appends 'flag' to the file tags listed in
+        THELI_TAGS['OFC' + flag].
+
+        Arguments:
+            flag [string]:
+                file tag appended by the reduction step, e.g. 'B'
+            archive [bool]:
+                whether the step moves its input to [tag]_IMAGES, which
+                counts as output
+        Returns:
+            found_input [bool]:
+                input images found
+            found_output [bool]:
+                output images (or their archive folder) found
+        """
+        tags = THELI_TAGS["OFC" + flag]
+        found_input = any(self.contains_tag(t) for t in tags)
+        found_output = any(self.contains_tag(t + flag) for t in tags)
+        if archive:
+            found_output |= any(
+                self.contains(t + flag + "_IMAGES") for t in tags)
+        return found_input, found_output
+
+    def found_coadd_input(self):
+        """Test if folder contains the input of the coaddition.
+
+        Returns:
+            found_input [bool]:
+                sky subtracted images (or their input) found
+            found_weights [bool]:
+                weight maps found
+            timestamps_fine [bool]:
+                weight maps are newer than the images
+            found_headers [bool]:
+                astrometric header files found
+        """
+        found_input, found_output = self.found_step(".sub", archive=False)
+        found_weights, timestamps_fine = self.check_weight()
+        return (found_input, found_weights, timestamps_fine,
+                self.contains("headers"))
+
+    def verify_split(self):
+        """Verification of the splitting of raw images."""
+        found_original, found_split = self.found_split()
+        if self.multiple_stages():
+            return "fail", "found multiple progress stages"
+        if self.contains_master():
+            return "skip", "master frame found"
+        if found_split:
+            return "skip", "split images found"
+        if not found_original:
+            return "fail", "no original images found"
+        return "run", ""
+
+    def verify_master(self, name, redo, normflat=False):
+        """Verification of the master frame 'name' (e.g. 'bias'), which is
+        only complete with the normalised flat, if 'normflat' is set."""
+        found_master = self.contains_master()
+        if normflat:
+            found_master &= self.search_flatnorm()
+        if self.multiple_stages():
+            return "fail", "found multiple progress stages"
+        if not redo and found_master:
+            return "skip", "master %s found" % name
+        if not self.contains_tag(''):
+            return "fail", "no split images found"
+        if self.fits_count() < 3:
+            return "fail", "need at least 3 exposures"
+        return "run", ""
+
+    def verify_calibration(self):
+        """Verification of the calibration of the split images."""
+        found_split, found_calibrated = self.found_calibrated()
+        if self.multiple_stages():
+            return "fail", "found multiple progress stages"
+        if found_calibrated:
+            return "skip", "OFC images found"
+        if not found_split:
+            return "fail", "no split images found"
+        return "run", ""
+
+    def verify_step(self, flag, inputs, redo, archive=True, min_count=0):
+        """Verification of a reduction step that appends 'flag' to the file
+        tags (see found_step), 'inputs' names the input images in the
+        messages (e.g. 'OFC(BHC)'). The step needs at least 'min_count'
+        exposures."""
+        found_input, found_output = self.found_step(flag, archive)
+        if self.multiple_stages():
+            return "fail", "found multiple progress stages"
+        if not redo and found_output:
+            return "skip", "%s%s images found" % (inputs, flag)
+        if redo and found_output and not found_input:
+            return "warn", "no %s images found - skipping redo" % inputs
+        if not found_input:
+            return "fail", "no %s images found" % inputs
+        if self.fits_count() < min_count:
+            return "error", "need at least %d exposures" % min_count
+        return "run", ""
+
+    def verify_preview(self, redo):
+        """Verification of the binned previews."""
+        if len(self.tags(ignore_sub=True)) < 1:
+            return "fail", "no images found"
+        if not redo and self.contains_preview():
+            return "skip", "preview images found"
+        return "run", ""
+
+    def verify_weights(self, redo):
+        """Verification of the weight maps."""
+        found_weights, timestamps_fine = self.check_weight()
+        if not redo and found_weights and timestamps_fine:
+            return "skip", "weight maps found"
+        return "run", ""
+
+    def _verify_output(self, found_output, reason, redo):
+        if self.multiple_stages():
+            return "fail", "found multiple progress stages"
+        if not redo and found_output:
+            return "skip", reason
+        return "run", ""
+
+    def verify_refcat(self, redo):
+        """Verification of the astrometric reference catalogue."""
+        return self._verify_output(
+            self.contains_refcatfiles(), "reference catalogue found", redo)
+
+    def verify_catalogs(self, redo):
+        """Verification of the source catalogues."""
+        return self._verify_output(
+            self.contains_catfiles(), "image catalogues found", redo)
+
+    def verify_astrometry(self, redo):
+        """Verification of the astrometric solution."""
+        return self._verify_output(
+            self.contains_astrometry(), "astrometric headers found", redo)
+
+    def verify_coadd(self, redo):
+        """Verification of the coaddition."""
+        found_input, found_weights, timestamps_fine, found_headers = \
+            self.found_coadd_input()
+        found_output = self.contains_coadds()
+        missing = [
+            reason for found, reason in (
+                (found_input, "no OFC(BHCP) images found"),
+                (found_weights, "no weight maps found"),
+                (found_headers, "no astrometric header files found"))
+            if not found]
+        if self.multiple_stages():
+            return "fail", "found multiple progress stages"
+        if not redo and found_output:
+            return "skip", "coadd images found"
+        if redo and found_output and len(missing) > 0:
+            return "warn", missing[0] + " - skipping redo"
+        if len(missing) > 0:
+            return "fail", missing[0]
+        if not timestamps_fine:
+            return "run", "weight maps possibly outdated"
+        return "run", ""
+
+
+class Folder(ProgressChecks):
     """Class with convenice functions to monitor the content and reduction
     progress of the THELI data folders. Uses file index to reduce redundant
     storage access. The index is only updated, if a minimum time interval has
@@ -41,7 +285,7 @@ class Folder(object):
         self.nchips = nchips
         self._update_index()  # generate initial FITS index
 
-    def _update_index(self, force=True):
+    def _update_index(self, force=False):
         """Update the internal index if a minimum time interval has passed or
         the calling external function changed.
 
@@ -59,7 +303,8 @@ class Folder(object):
                 break
         # test if folder was scanned recently
         timediff = time() - self._update_time
-        if timediff > self._update_delay or caller != self._last_call:
+        if force or timediff > self._update_delay or \
+                caller != self._last_call:
             # get all FITS files that are not master frames (BIAS, DARK, FLAT)
             files = [os.path.join(self.abs, f) for f in os.listdir(self.abs)
                      if os.path.isfile(os.path.join(self.abs, f)) and
@@ -79,6 +324,10 @@ class Folder(object):
             self._last_call = caller
             self._update_time = time()
 
+    def refresh(self):
+        """Rescan the folder, e.g. after a script created or moved files."""
+        self._update_index(force=True)
+
     def __str__(self):
         return self.abs
 
@@ -425,6 +674,14 @@ class Folder(object):
                     os.path.join(self.abs, entry))
             shutil.rmtree(subfolder)  # remove subfolder
 
+    def merge_content(self, subfolder):
+        """Move the content of 'subfolder' to its parent (folder) like
+        lift_content, but merge it with existing folders of the same name
+        (e.g. 'SPLIT_IMAGES'), if no instance of THELI is running."""
+        check_system_lock()  # exit to prevent data loss
+        if self.contains(subfolder):
+            _merge_tree(os.path.join(self.abs, subfolder), self.abs)
+
     def move_tag(self, tag, dest, ignore_sub=False):
         """Move any FITS file that matches 'tag' to sufolder 'dest' if no
         instance of THELI is running.
@@ -0,0 +1,214 @@
+"""
+Defines the memory governor that adapts the THELI parameters NPARA and NFRAMES
+to the measured memory usage of the parallel scripts
+"""
+
+import os
+import re
+import json
+import threading
+
+from .base import DIRS
+from .resources import free_memory, process_tree_rss
+from .scripts import CallMonitor
+
+
+# scripts that keep up to NFRAMES images per parallel process in memory
+NFRAMES_SCRIPTS = (
+    "process_bias_para.sh", "process_dark_para.sh", "process_flat_para.sh",
+    "process_background_para.sh")
+# initial guess of the memory per frame in units of the frame size (float32),
+# the scripts use float64 intermediates and keep input and output images
+DEFAULT_FACTOR = 3.0
+# minimum number of frames the stacking scripts should keep in memory
+MIN_FRAMES = 3
+# matches the first chip of an exposure: [base]_1[tag].fits
+FIRST_CHIP = re.compile(r"_1(OFC[A-Z]*(\.sub)?)?\.fits$")
+
+
+def count_exposures(arglist):
+    """Count the exposures in the data folder of a parallel script call by
+    their first chip.
+
+    Arguments:
+        arglist [list of strings]:
+            script arguments, the main and the data folder
+    Returns:
+        nexposures [int]:
+            number of exposures, 0 if the folder cannot be read
+    """
+    try:
+        folder = os.path.join(arglist[0], arglist[1])
+        return sum(1 for f in os.listdir(folder) if FIRST_CHIP.search(f))
+    except (OSError, IndexError, TypeError):
+        return 0
+
+
+def _positive_int(value):
+    """Parse a positive integer parameter value, None if it is not set."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+class MemoryGovernor(CallMonitor):
+    """Lowers NPARA and NFRAMES before each parallel script such that the
+    expected memory usage stays below a ceiling, values set by the user are
+    never raised. The resident memory of the script's process tree is
+    sampled while it runs, and the peak usage is used to learn the memory
+    consumption per frame of each script, which is stored in the THELI home
+    folder.
+
+    Arguments:
+        params [Parameters]:
+            parameter manager of the reduction
+        ncpus [int]:
+            maximum number of parallel processes
+        nchips [int]:
+            number of chips of the instrument
+        framesize [int]:
+            size of the largest chip in bytes (float32)
+        limit [int]:
+            memory ceiling in bytes, by default 90% of the memory currently
+            available on the system
+        sampling [float]:
+            memory sampling interval in seconds
+    """
+
+    def __init__(self, params, ncpus, nchips, framesize, limit=None,
+                 sampling=0.5):
+        super(MemoryGovernor, self).__init__()
+        self.params = params
+        self.ncpus = ncpus
+        self.nchips = nchips
+        self.framesize = framesize
+        self.limit = limit
+        self.sampling = sampling
+        self._profile_file = os.path.join(
+            DIRS["PIPEHOME"], "memory_profile.json")
+        try:
+            with open(self._profile_file) as f:
+                self.factors = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.factors = {}
+        # NPARA and NFRAMES as set by the user (or the reduction), restored
+        # after each script
+        self._requested = None
+        self._stage = None  # script and frames in memory of current call
+        self._peak = 0
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def ceiling(self):
+        """Return the memory in bytes the next script may use."""
+        available = 0.9 * free_memory()
+        if self.limit is not None:
+            return min(self.limit, available)
+        return available
+
+    def max_processes(self, script, nexposures):
+        """Number of processes a parallel script can use: the stacking
+        scripts combine all exposures of a chip in one process, the other
+        scripts are distributed over the chips by parallel_manager.sh or,
+        for single chip cameras, over the exposures."""
+        if script in NFRAMES_SCRIPTS or self.nchips > 1:
+            return self.nchips
+        return max(1, nexposures)
+
+    def plan(self, script, nexposures, max_npara=None, max_nframes=None):
+        """Compute NPARA and NFRAMES for a script from the learned memory
+        consumption per frame.
+
+        Arguments:
+            script [string]:
+                name of the script
+            nexposures [int]:
+                number of exposures the script processes
+            max_npara [int]:
+                requested number of parallel processes, which is never
+                exceeded, by default the number of CPUs
+            max_nframes [int]:
+                requested number of frames per process, which is never
+                exceeded
+        Returns:
+            npara [int]:
+                number of parallel processes
+            nframes [int]:
+                number of frames per process
+        """
+        factor = self.factors.get(script, DEFAULT_FACTOR)
+        # number of frames that fit into memory at the same time
+        max_units = max(1, int(self.ceiling() / (factor * self.framesize)))
+        npara = max(1, min(
+            self.ncpus if max_npara is None else max_npara,
+            self.max_processes(script, nexposures)))
+        if script in NFRAMES_SCRIPTS:
+            wanted = max(1, nexposures)
+            nframes = min(wanted, max_units // npara)
+            # reduce parallelism rather than number of frames in memory
+            while npara > 1 and nframes < min(wanted, MIN_FRAMES):
+                npara -= 1
+                nframes = min(wanted, max_units // npara)
+            nframes = max(1, nframes)
+        else:
+            npara = min(npara, max_units)
+            nframes = max(1, max_units // npara)
+        if max_nframes is not None:
+            nframes = min(nframes, max_nframes)
+        return npara, nframes
+
+    def _sample(self, pid):
+        while not self._stop.wait(self.sampling):
+            self._peak = max(self._peak, process_tree_rss(pid))
+
+    def call_prepare(self, script, arglist):
+        self._stage = None
+        if not script.endswith("_para.sh"):
+            return
+        nexposures = count_exposures(arglist)
+        self._requested = {
+            key: self.params.get(key) for key in ("NPARA", "NFRAMES")}
+        npara, nframes = self.plan(
+            script, nexposures, _positive_int(self._requested["NPARA"]),
+            _positive_int(self._requested["NFRAMES"]))
+        self.params.set({"NPARA": str(npara), "NFRAMES": str(nframes)})
+        frames = min(nframes, max(1, nexposures)) \
+            if script in NFRAMES_SCRIPTS else 1
+        self._stage = (script, npara * frames)
+
+    def call_started(self, script, arglist, process):
+        if self._stage is None:
+            return
+        self._peak = 0
+        self._stop.clear()
+        self._sampler = threading.Thread(
+            target=self._sample, args=(process.pid,), daemon=True)
+        self._sampler.start()
+
+    def call_finished(self, script, arglist, process, return_code):
+        if self._requested is not None:
+            self.params.set(self._requested)
+            self._requested = None
+        if self._sampler is None:
+            return
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        if return_code is None or self._peak == 0 or self._stage is None:
+            return
+        script, units = self._stage
+        observed = self._peak / (units * self.framesize)
+        factor = self.factors.get(script, DEFAULT_FACTOR)
+        # adapt quickly to higher usage to avoid swapping, slowly otherwise
+        if observed > factor:
+            factor = 1.1 * observed
+        else:
+            factor = 0.8 * factor + 0.2 * observed
+        self.factors[script] = factor
+        try:
+            with open(self._profile_file, "w") as f:
+                json.dump(self.factors, f, indent=1)
+        except OSError:
+            pass
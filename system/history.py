@@ -0,0 +1,291 @@
+"""
+Defines the run history database that records the duration of each script
+call and reduction step and predicts the duration of future steps
+"""
+
+import os
+import socket
+import sqlite3
+from time import time
+
+from .base import DIRS
+from .governor import count_exposures
+from .scripts import CallMonitor
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL, host TEXT, instrument TEXT, title TEXT, maindir TEXT,
+    ncpus INTEGER);
+CREATE TABLE IF NOT EXISTS stages (
+    run INTEGER REFERENCES runs(id), script TEXT, folder TEXT,
+    exposures INTEGER, chips INTEGER, npara INTEGER, started REAL,
+    seconds REAL, success INTEGER);
+CREATE INDEX IF NOT EXISTS stages_script ON stages(script);
+CREATE TABLE IF NOT EXISTS steps (
+    run INTEGER REFERENCES runs(id), stage TEXT, exposures INTEGER,
+    chips INTEGER, started REAL, seconds REAL, success INTEGER);
+CREATE INDEX IF NOT EXISTS steps_stage ON steps(stage);
+"""
+# exposure counts are similar, if they differ less than this factor
+SIMILARITY = 2.0
+
+
+def history_path():
+    """Return the path of the run history database in the THELI home
+    folder."""
+    return os.path.join(DIRS["PIPEHOME"], "run_history.sqlite")
+
+
+class RunHistory(object):
+    """SQLite database of the durations of the script calls of all
+    reductions on this machine, stored in the THELI home folder.
+
+    Arguments:
+        path [string]:
+            path to the database, by default 'run_history.sqlite' in the
+            THELI home folder
+    """
+
+    def __init__(self, path=None):
+        super(RunHistory, self).__init__()
+        self.path = history_path() if path is None else path
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def start_run(self, instrument, title, maindir, ncpus):
+        """Register a new reduction run and return its ID."""
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (started, host, instrument, title, "
+                "maindir, ncpus) VALUES (?, ?, ?, ?, ?, ?)",
+                (time(), socket.gethostname(), instrument, title, maindir,
+                 ncpus))
+        return cursor.lastrowid
+
+    def add_stage(self, run, script, folder, exposures, chips, npara,
+                  started, seconds, success):
+        """Record a finished script call of run 'run'."""
+        with self.db:
+            self.db.execute(
+                "INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run, script, folder, exposures, chips, npara, started,
+                 seconds, int(success)))
+
+    def add_step(self, run, stage, exposures, chips, started, seconds,
+                 success):
+        """Record a reduction step (see Reduction.display_header) of run
+        'run' and return its ID."""
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run, stage, exposures, chips, started, seconds,
+                 int(success)))
+        return cursor.lastrowid
+
+    def update_step(self, step, seconds, success):
+        """Update the duration and success of a recorded reduction step."""
+        with self.db:
+            self.db.execute(
+                "UPDATE steps SET seconds = ?, success = ? WHERE rowid = ?",
+                (seconds, int(success), step))
+
+    def predict(self, script, instrument, exposures):
+        """Predict the duration of a script call from the successful calls of
+        previous runs with the same instrument. If possible, only calls with
+        a similar number of exposures are used.
+
+        Arguments:
+            script [string]:
+                name of the script
+            instrument [string]:
+                THELI instrument string
+            exposures [int]:
+                number of exposures the script processes
+        Returns:
+            seconds [float]:
+                median duration scaled to the number of exposures, None if
+                there are no previous calls
+        """
+        return self._predict("stages", "script", script, instrument, exposures)
+
+    def predict_step(self, stage, instrument, exposures):
+        """Predict the duration of a reduction step, like 'predict', from
+        the steps with the same header message 'stage'."""
+        return self._predict("steps", "stage", stage, instrument, exposures)
+
+    def _predict(self, table, column, name, instrument, exposures):
+        rows = self.db.execute(
+            "SELECT {0}.exposures, {0}.seconds FROM {0} "
+            "JOIN runs ON {0}.run = runs.id WHERE {0}.{1} = ? AND "
+            "runs.instrument = ? AND {0}.success = 1".format(table, column),
+            (name, instrument)).fetchall()
+        if len(rows) == 0:
+            return None
+        if exposures > 0:
+            similar = [
+                r for r in rows if r[0] > 0 and
+                1.0 / SIMILARITY <= exposures / r[0] <= SIMILARITY]
+            if len(similar) > 0:
+                rows = similar
+        # scale with the exposure count, if it is known
+        values = sorted(
+            r[1] * exposures / r[0] if r[0] > 0 and exposures > 0
+            else r[1] for r in rows)
+        return values[len(values) // 2]
+
+    @staticmethod
+    def _filter(instrument, host, since):
+        """Build the SQL conditions and their values to select runs."""
+        conditions, values = ["1"], []
+        for column, value in (("runs.instrument", instrument),
+                              ("runs.host", host)):
+            if value is not None:
+                conditions.append("%s = ?" % column)
+                values.append(value)
+        if since is not None:
+            conditions.append("runs.started >= ?")
+            values.append(since)
+        return conditions, values
+
+    def summary(self, instrument=None, host=None, since=None):
+        """Summarise the recorded script calls for capacity planning.
+
+        Arguments:
+            instrument [string]:
+                only use runs of this instrument
+            host [string]:
+                only use runs on this host
+            since [float]:
+                only use runs started after this UNIX time
+        Returns:
+            rows [list]:
+                tuples of instrument, script, number of calls, total number
+                of chips, total hours and seconds per chip
+        """
+        conditions, values = self._filter(instrument, host, since)
+        conditions.append("stages.success = 1")
+        return self.db.execute(
+            "SELECT runs.instrument, stages.script, COUNT(*), "
+            "SUM(stages.chips), SUM(stages.seconds) / 3600.0, "
+            "SUM(stages.seconds) / MAX(SUM(stages.chips), 1) FROM stages "
+            "JOIN runs ON stages.run = runs.id WHERE %s "
+            "GROUP BY runs.instrument, stages.script "
+            "ORDER BY runs.instrument, SUM(stages.seconds) DESC" %
+            " AND ".join(conditions), values).fetchall()
+
+    def runs(self, instrument=None, host=None, since=None):
+        """List the recorded runs with their total duration, filtered like
+        'summary'."""
+        conditions, values = self._filter(instrument, host, since)
+        return self.db.execute(
+            "SELECT runs.id, runs.started, runs.host, runs.instrument, "
+            "runs.title, runs.ncpus, COUNT(stages.run), "
+            "COALESCE(SUM(stages.seconds), 0) FROM runs LEFT JOIN stages "
+            "ON stages.run = runs.id WHERE %s GROUP BY runs.id "
+            "ORDER BY runs.started" % " AND ".join(conditions),
+            values).fetchall()
+
+
+class HistoryRecorder(CallMonitor):
+    """Records every script call of a reduction and the reduction steps
+    (see Reduction.display_header) they belong to in the run history. The
+    predicted duration of a step is reported before its first script
+    starts. Must be registered after monitors that modify NPARA.
+
+    Arguments:
+        reduction [Reduction]:
+            reduction project to record
+        history [RunHistory]:
+            run history database
+        callback [callable]:
+            called with the header message of the step and its predicted
+            duration in seconds (or None), before its first script starts
+    """
+
+    def __init__(self, reduction, history, callback=None):
+        super(HistoryRecorder, self).__init__()
+        self.history = history
+        self.reduction = reduction
+        self.callback = callback
+        self.run = None  # registered with the first script call
+        self._call = None
+        # current step: header message, start time, row ID, exposures and
+        # success of the scripts so far
+        self._step = None
+
+    def predict(self, script, exposures):
+        return self.history.predict(
+            script, self.reduction.instrument.NAME, exposures)
+
+    def predict_step(self, stage, exposures):
+        return self.history.predict_step(
+            stage, self.reduction.instrument.NAME, exposures)
+
+    def _begin_step(self, exposures):
+        """Start recording a new step, if the reduction displayed a new
+        header since the last script call."""
+        stage = self.reduction._stage
+        started = self.reduction._stage_start
+        if stage is None or (
+                self._step is not None and
+                self._step[:2] == [stage, started]):
+            return
+        self._step = [stage, started, None, exposures, True]
+        if self.callback is not None:
+            self.callback(stage, self.predict_step(stage, exposures))
+
+    def _record_step(self, success):
+        """Record the duration of the current step up to now."""
+        if self._step is None:
+            return
+        stage, started, rowid, exposures, step_success = self._step
+        step_success &= success
+        seconds = time() - started
+        if rowid is None:
+            rowid = self.history.add_step(
+                self.run, stage, exposures,
+                exposures * self.reduction.nchips, started, seconds,
+                step_success)
+        else:
+            self.history.update_step(rowid, seconds, step_success)
+        self._step[2:] = [rowid, exposures, step_success]
+
+    def call_prepare(self, script, arglist):
+        exposures = count_exposures(arglist)
+        try:
+            folder = arglist[1]
+        except (IndexError, TypeError):
+            folder = ""
+        try:
+            npara = int(self.reduction.params.get("NPARA"))
+        except (TypeError, ValueError):
+            npara = 1
+        if not script.endswith("_para.sh"):
+            npara = 1
+        self._call = [folder, exposures, npara, None]
+        self._begin_step(exposures)
+
+    def call_started(self, script, arglist, process):
+        if self._call is not None:
+            self._call[3] = time()
+
+    def call_finished(self, script, arglist, process, return_code):
+        if self._call is None or self._call[3] is None:
+            return
+        folder, exposures, npara, started = self._call
+        self._call = None
+        if self.run is None:
+            self.run = self.history.start_run(
+                self.reduction.instrument.NAME, self.reduction.title,
+                self.reduction.maindir, self.reduction.ncpus)
+        success = return_code == (0, "")
+        self.history.add_stage(
+            self.run, script, folder, exposures,
+            exposures * self.reduction.nchips,
+            npara, started, time() - started, success)
+        self._record_step(success)
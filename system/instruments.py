@@ -3,10 +3,185 @@ Defines the instrument manager for the Reduction class
 """
 
 import os
+import re
+import json
 
 from .base import DIRS, INSTRUMENTS
 
 
+# format version of the instrument database, increment if its content changes
+DATABASE_VERSION = 3
+# scalar and per-chip shell variables read from the instrument .ini-files
+SCALAR_KEYS = {
+    "NCHIPS": int, "TYPE": str, "PIXSCALE": float, "GAIN": float,
+    "PIXSCX": float, "PIXSCY": float}
+CHIP_KEYS = (
+    "SIZEX", "SIZEY", "OVSCANX1", "OVSCANX2", "CUTX", "CUTY", "REFPIXX",
+    "REFPIXY", "STATSXMIN", "STATSXMAX", "STATSYMIN", "STATSYMAX")
+# variables that are not required by the wrapper, invalid values are ignored
+OPTIONAL_KEYS = (
+    "GAIN", "PIXSCX", "PIXSCY", "OVSCANX1", "OVSCANX2", "CUTX", "CUTY",
+    "REFPIXX", "REFPIXY", "STATSXMIN", "STATSXMAX", "STATSYMIN",
+    "STATSYMAX")
+# shell variable assignment: NAME=value
+ASSIGNMENT = re.compile(r"^\s*(?:export\s+)?([A-Z0-9_]+)=(.*)$")
+# array element in a shell array: [chip]=value
+ARRAY_ELEMENT = re.compile(r"\[(\d+)\]=([^\s)]+)")
+
+
+def instrument_folders():
+    """Folders with instrument .ini-files in order of increasing precedence:
+    user defined, commercial and professional instruments."""
+    return (
+        os.path.join(DIRS["PIPEHOME"], "instruments_user"),
+        os.path.join(DIRS["SCRIPTS"], "instruments_commercial"),
+        os.path.join(DIRS["SCRIPTS"], "instruments_professional"))
+
+
+def parse_instrument_file(inifile):
+    """Read the shell variables of interest from an instrument .ini-file:
+    number of chips, type (optical, NIR, MIR), pixel scale, gain and the chip
+    geometry (size, overscan and cut regions, reference pixel, statistics
+    region) of each chip.
+
+    Arguments:
+        inifile [string]:
+            path of the shell style instrument .ini-file
+    Returns:
+        data [dict]:
+            instrument data, the chip geometry is given as lists with one
+            entry per chip
+    """
+    variables = {}
+    with open(inifile) as ini:
+        for line in ini:
+            match = ASSIGNMENT.match(line.split("#")[0])
+            if match is not None:
+                variables[match.group(1)] = match.group(2).strip()
+    data = {
+        "NCHIPS": 0, "TYPE": "OPT", "PIXSCALE": 0.0, "GAIN": 1.0,
+        "PIXSCX": 0.0, "PIXSCY": 0.0}
+    for key, cast in SCALAR_KEYS.items():
+        try:
+            if variables.get(key, "") != "":
+                data[key] = cast(variables[key])
+        except ValueError:
+            if key not in OPTIONAL_KEYS:
+                raise
+    for key in CHIP_KEYS:
+        try:
+            data[key] = _parse_chip_values(
+                variables.get(key, ""), data["NCHIPS"])
+        except ValueError:
+            if key not in OPTIONAL_KEYS:
+                raise
+            data[key] = [0] * data["NCHIPS"]
+    return data
+
+
+def _parse_chip_values(value, nchips):
+    """Convert the value of a shell array with one number per chip to a list,
+    scalar values apply to all chips."""
+    values = [0] * nchips
+    # example format for single chip:
+    # SIZEX/Y=([1]=2044) or SIZEX/Y=2044
+    # example format for mosaic:
+    # SIZEX/Y=([1]=2038 [2]=2038 [3]=2038 [4]=2038 [5]=2038 ...)
+    elements = ARRAY_ELEMENT.findall(value)
+    if len(elements) > 0:
+        for chip, chipvalue in elements:
+            if 0 < int(chip) <= nchips:
+                values[int(chip) - 1] = _number(chipvalue)
+    elif value.strip("()") != "":
+        values = [_number(value.strip("()"))] * nchips
+    return values
+
+
+def _number(string):
+    try:
+        return int(string)
+    except ValueError:
+        return float(string)
+
+
+def _folder_stamps(folders):
+    """Latest modification time of each folder and the .ini-files therein,
+    None for missing folders."""
+    stamps = {}
+    for folder in folders:
+        try:
+            stamp = os.stat(folder).st_mtime
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".ini"):
+                        stamp = max(stamp, entry.stat().st_mtime)
+        except OSError:
+            stamp = None
+        stamps[folder] = stamp
+    return stamps
+
+
+def _build_database(folders):
+    """Parse all instrument .ini-files in 'folders', later folders take
+    precedence. Instruments with invalid files are stored as None."""
+    instruments = {}
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for fname in os.listdir(folder):
+            name, ext = os.path.splitext(fname)
+            if ext != ".ini":
+                continue
+            try:
+                instruments[name] = parse_instrument_file(
+                    os.path.join(folder, fname))
+            except (OSError, ValueError):
+                instruments[name] = None
+    return instruments
+
+
+_database = None  # cached result of instrument_database
+
+
+def instrument_database():
+    """Load the parsed data of all instruments from 'instruments.json' in the
+    THELI home folder. The file is rebuilt, if it is outdated or any
+    instrument file changed since it was created.
+
+    Returns:
+        instruments [dict]:
+            instrument data (see parse_instrument_file) by instrument name
+    """
+    global _database
+    if _database is not None:
+        return _database
+    dbfile = os.path.join(DIRS["PIPEHOME"], "instruments.json")
+    folders = instrument_folders()
+    stamps = _folder_stamps(folders)
+    try:
+        with open(dbfile) as f:
+            database = json.load(f)
+        if database["version"] == DATABASE_VERSION and \
+                database["stamps"] == stamps:
+            _database = database["instruments"]
+            return _database
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    _database = _build_database(folders)
+    try:
+        # write to a temporary file first, concurrent runs may read it
+        with open(dbfile + ".tmp", "w") as f:
+            json.dump(
+                {"version": DATABASE_VERSION, "stamps": stamps,
+                 "instruments": _database},
+                f, separators=(",", ":"))
+        os.replace(dbfile + ".tmp", dbfile)
+    except OSError:
+        print("WARNING: instrument database could not be created: " + dbfile)
+        print("continuing...\n")
+    return _database
+
+
 class Instrument(object):
     """Manages instruments in THELI by checking, if it is properly implemented
     and loading instrument data.
@@ -24,12 +199,14 @@ class Instrument(object):
     def __str__(self):
         string = "instrument: %s (type: %s)\n" % (self.NAME, self.TYPE)
         string += "%d chip(s) of size" % self.NCHIPS
-        string += " size %d x %d" % (self.SIZEX, self.SIZEY)
+        sizes = sorted(set(zip(self.CHIPSIZEX, self.CHIPSIZEY)))
+        string += ", ".join(" %d x %d" % size for size in sizes)
         string += " with pixel scale %.3f" % self.PIXSCALE
         return string
 
     def set(self, new_instrument):
-        """Changes instrument to 'new_instrument' and loads data file."""
+        """Changes instrument to 'new_instrument' and loads its data from the
+        instrument database."""
         # delete data from previous instrument
         self.NAME = ""
         self.SIZEX = 0
@@ -37,56 +214,70 @@ class Instrument(object):
         self.NCHIPS = 0
         self.TYPE = "NONE"
         self.PIXSCALE = 0.0
+        self.GAIN = 1.0
+        self.PIXSCX = 0.0
+        self.PIXSCY = 0.0
+        # chip geometry, one entry per chip
+        self.CHIPSIZEX = []
+        self.CHIPSIZEY = []
+        self.OVSCANX1 = []
+        self.OVSCANX2 = []
+        self.CUTX = []
+        self.CUTY = []
+        self.REFPIXX = []
+        self.REFPIXY = []
+        self.STATSXMIN = []
+        self.STATSXMAX = []
+        self.STATSYMIN = []
+        self.STATSYMAX = []
         # check if new instrument is implemented
         if new_instrument not in INSTRUMENTS:
             raise ValueError(
                 "Not in list of implemented instruments: " + new_instrument)
         self.NAME = new_instrument
-        # figure out path to the shell style instrument .ini-file
-        if_prof = os.path.join(  # professional instruments
-            DIRS["SCRIPTS"], "instruments_professional", "%s.ini" % self.NAME)
-        if_comm = os.path.join(  # commercial instruments
-            DIRS["SCRIPTS"], "instruments_commercial", "%s.ini" % self.NAME)
-        if_user = os.path.join(  # user defined instruments
-            DIRS["PIPEHOME"], "instruments_user", "%s.ini" % self.NAME)
-        if os.path.exists(if_prof):
-            inifile = if_prof
-        elif os.path.exists(if_comm):
-            inifile = if_comm
-        elif os.path.exists(if_user):
-            inifile = if_user
-        else:  # data incomplete
+        database = instrument_database()
+        if new_instrument not in database:  # data incomplete
             raise ValueError(
                 "Instrument definition file not found: %s.ini" % self.NAME)
-        # Read the shell variables of interest from the instrument file:
-        # number of chips, x- and y-dimension of first chip (assuming first one
-        # is representative for mosaic), type (optical, NIR, MIR), pixel scale
-        with open(inifile) as ini:
-            for line in ini.readlines():
-                # example format for single chip:
-                # SIZEX/Y=([1]=2044)
-                # example format for mosaic:
-                # SIZEX/Y=([1]=2038 [2]=2038 [3]=2038 [4]=2038 [5]=2038 ...)
-                if "SIZEX=" in line:
-                    n = line.strip().split("=")
-                    if len(n) == 3:
-                        self.SIZEX = int(n[2].strip("()[]"))
-                    else:
-                        self.SIZEX = int(n[2].split()[0])  # get first chip
-                if "SIZEY=" in line:
-                    n = line.strip().split("=")
-                    if len(n) == 3:
-                        self.SIZEY = int(n[2].strip("()[]"))
-                    else:
-                        self.SIZEY = int(n[2].split()[0])  # get first chip
-                # format: NCHIPS/TYPE/PIXSCALE=X
-                if "NCHIPS=" in line:
-                    n = line.strip().split("=")
-                    self.NCHIPS = int(n[1])
-                if "TYPE=" in line:
-                    self.TYPE = line.strip().split("=")[1]
-                if "PIXSCALE=" in line:
-                    self.PIXSCALE = float(line.strip().split("=")[1])
-        # type may not be defined: assume optical
-        if self.TYPE is None:
-            self.TYPE = "OPT"
+        data = database[new_instrument]
+        if data is None:
+            raise ValueError(
+                "Instrument definition file invalid: %s.ini" % self.NAME)
+        self.NCHIPS = data["NCHIPS"]
+        self.TYPE = data["TYPE"]
+        self.PIXSCALE = data["PIXSCALE"]
+        self.GAIN = data["GAIN"]
+        self.PIXSCX = data["PIXSCX"]
+        self.PIXSCY = data["PIXSCY"]
+        self.CHIPSIZEX = data["SIZEX"]
+        self.CHIPSIZEY = data["SIZEY"]
+        self.OVSCANX1 = data["OVSCANX1"]
+        self.OVSCANX2 = data["OVSCANX2"]
+        self.CUTX = data["CUTX"]
+        self.CUTY = data["CUTY"]
+        self.REFPIXX = data["REFPIXX"]
+        self.REFPIXY = data["REFPIXY"]
+        self.STATSXMIN = data["STATSXMIN"]
+        self.STATSXMAX = data["STATSXMAX"]
+        self.STATSYMIN = data["STATSYMIN"]
+        self.STATSYMAX = data["STATSYMAX"]
+        # size of the first chip, representative for most mosaics
+        if self.NCHIPS > 0:
+            self.SIZEX = self.CHIPSIZEX[0]
+            self.SIZEY = self.CHIPSIZEY[0]
+
+    def chip_bytes(self, chip=None):
+        """Size of a chip image in memory (float32).
+
+        Arguments:
+            chip [int]:
+                chip number (starting from 1), by default the largest chip
+        Returns:
+            size [int]:
+                size in bytes
+        """
+        if chip is not None:
+            return self.CHIPSIZEX[chip - 1] * self.CHIPSIZEY[chip - 1] * 4
+        return max(
+            [x * y * 4 for x, y in zip(self.CHIPSIZEX, self.CHIPSIZEY)],
+            default=0)
@@ -0,0 +1,352 @@
+"""
+Defines the native background model engine, which combines the mode
+normalised images of each chip out of core in row chunks, optionally with
+object masks from a first pass, and applies the model to the images
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .fitsio import np, create_image, format_card, read_hdus
+from .chips import CHIP_IMAGE, chunk_rows, group_chips, physical
+from .check import estimate_mode
+
+
+# every n-th row of an image is used to estimate its mode and noise
+SAMPLE_STEP = 8
+# methods to apply the model (V_BACK_APPLYMODE)
+SUBTRACT, DIVIDE = 0, 1
+
+
+def _read_rows(hdu, start, stop):
+    return physical(hdu.data()[start:stop], hdu.header)
+
+
+def image_mode(path):
+    """Estimate the mode of an image from every SAMPLE_STEP-th row."""
+    hdu = read_hdus(path)[0]
+    return estimate_mode(
+        physical(hdu.data()[::SAMPLE_STEP], hdu.header).ravel())
+
+
+def masked_combine(stack, nlow=0, nhigh=0, median=True):
+    """Combine a stack of images pixel by pixel ignoring masked (NaN)
+    values: reject the 'nlow' lowest and 'nhigh' highest valid values and
+    compute the median or mean of the remaining ones. If no value remains,
+    all valid values are used, pixels without valid value are NaN.
+
+    Arguments:
+        stack [numpy.ndarray]:
+            image stack with shape (nimages, ny, nx), masked values are NaN
+        nlow [int]:
+            number of low values rejected per pixel
+        nhigh [int]:
+            number of high values rejected per pixel
+        median [bool]:
+            compute the median instead of the mean
+    Returns:
+        combined [numpy.ndarray]:
+            combined image (float32)
+    """
+    stack.sort(axis=0)  # NaN values are sorted to the end
+    nvalid = np.isfinite(stack).sum(axis=0)
+    low = np.full(nvalid.shape, nlow)
+    high = nvalid - nhigh
+    rejected_all = high - low < 1
+    low[rejected_all] = 0
+    high[rejected_all] = nvalid[rejected_all]
+    if median:
+        lower = (low + high - 1) // 2
+        upper = (low + high) // 2
+        lower = np.clip(lower, 0, len(stack) - 1)[np.newaxis]
+        upper = np.clip(upper, 0, len(stack) - 1)[np.newaxis]
+        combined = 0.5 * (
+            np.take_along_axis(stack, lower, axis=0)[0] +
+            np.take_along_axis(stack, upper, axis=0)[0])
+    else:
+        cumulative = np.zeros(
+            (len(stack) + 1,) + stack.shape[1:], dtype=np.float64)
+        np.cumsum(np.nan_to_num(stack), axis=0, out=cumulative[1:])
+        total = np.take_along_axis(cumulative, high[np.newaxis], axis=0) - \
+            np.take_along_axis(cumulative, low[np.newaxis], axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            combined = total[0] / (high - low)
+    combined = combined.astype(np.float32)
+    combined[nvalid == 0] = np.nan
+    return combined
+
+
+def combine_chip(files, modes, nlow=0, nhigh=0, median=True, masks=None,
+                 max_bytes=256 * 1024**2):
+    """Combine the mode normalised images of a chip to a background model
+    (see masked_combine), reading at most 'max_bytes' of pixel data at a
+    time. Pixels without any valid value are set to 1.
+
+    Arguments:
+        files [list of strings]:
+            paths of the chip images
+        modes [list of float]:
+            mode of each image
+        nlow, nhigh [int]:
+            number of low and high values rejected per pixel
+        median [bool]:
+            compute the median instead of the mean
+        masks [list of strings]:
+            paths of the object masks of each image (see object_mask)
+        max_bytes [int]:
+            memory limit of the image stack
+    Returns:
+        model [numpy.ndarray]:
+            normalised background model
+    """
+    hdus = [read_hdus(path)[0] for path in files]
+    maskhdus = None if masks is None else [
+        read_hdus(path)[0] for path in masks]
+    shape = hdus[0].shape
+    for hdu in hdus[1:]:
+        if hdu.shape != shape:
+            raise ValueError("image size differs: " + hdu.path)
+    model = np.empty(shape, dtype=np.float32)
+    # leave room for the temporary arrays of masked_combine
+    step = chunk_rows(shape, 3 * len(hdus), max_bytes)
+    stack = np.empty((len(hdus), step, shape[1]), dtype=np.float32)
+    for start in range(0, shape[0], step):
+        stop = min(start + step, shape[0])
+        chunk = stack[:, :stop - start]
+        for i, hdu in enumerate(hdus):
+            chunk[i] = _read_rows(hdu, start, stop)
+            chunk[i] /= modes[i]
+            if maskhdus is not None:
+                chunk[i][maskhdus[i].data()[start:stop] > 0] = np.nan
+        model[start:stop] = masked_combine(chunk, nlow, nhigh, median)
+    model[~np.isfinite(model)] = 1.0
+    return model
+
+
+def _neighbours(mask):
+    """Number of set pixels in the 3x3 neighbourhood of each pixel."""
+    padded = np.pad(mask.astype(np.uint8), 1)
+    ny, nx = mask.shape
+    count = np.zeros(mask.shape, dtype=np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            count += padded[dy:dy + ny, dx:dx + nx]
+    return count
+
+
+def object_mask(path, maskfile, mode, model=None, threshold=1.3,
+                minarea=5, expand=2, smooth=True):
+    """Detect objects in an image and write a mask (8 bit, 1 for object
+    pixels). Object pixels exceed the background (the model or the mode) by
+    'threshold' times the noise and have at least min(minarea, 9) detected
+    pixels in their 3x3 neighbourhood, the detections are expanded by
+    'expand' pixels.
+
+    Arguments:
+        path [string]:
+            path of the image
+        maskfile [string]:
+            path of the mask
+        mode [float]:
+            mode of the image
+        model [numpy.ndarray]:
+            normalised background model of the first pass or None
+        threshold [float]:
+            detection threshold in units of the noise
+        minarea [int]:
+            minimum number of detected neighbours
+        expand [int]:
+            number of pixels the detections are expanded by
+        smooth [bool]:
+            smooth the image with a 3x3 box filter before the detection
+    """
+    hdu = read_hdus(path)[0]
+    residual = physical(hdu.data(), hdu.header) / mode
+    residual -= 1.0 if model is None else model
+    sample = residual[::SAMPLE_STEP].ravel()
+    sample = sample[np.isfinite(sample)]
+    sigma = 1.4826 * np.median(abs(sample - np.median(sample)))
+    if smooth:
+        padded = np.pad(np.nan_to_num(residual), 1, mode="edge")
+        ny, nx = residual.shape
+        residual = sum(
+            padded[dy:dy + ny, dx:dx + nx]
+            for dy in range(3) for dx in range(3)) / 9.0
+        sigma /= 3.0  # noise of the mean of 9 pixels
+    detected = residual > threshold * sigma
+    detected &= _neighbours(detected) >= min(max(1, minarea), 9)
+    for i in range(expand):
+        detected = _neighbours(detected) > 0
+    mask = create_image(maskfile + ".tmp", [], detected.shape, bitpix=8)
+    mask.data(mode="r+")[:] = detected
+    os.replace(maskfile + ".tmp", maskfile)
+
+
+def apply_model(path, outfile, mode, model, applymode=SUBTRACT,
+                max_bytes=64 * 1024**2):
+    """Apply a normalised background model to an image: subtract the model
+    scaled to the mode of the image (the sky level is preserved) or divide
+    by the model.
+
+    Arguments:
+        path [string]:
+            path of the image
+        outfile [string]:
+            path of the corrected image
+        mode [float]:
+            mode of the image
+        model [numpy.ndarray]:
+            normalised background model
+        applymode [int]:
+            SUBTRACT or DIVIDE
+        max_bytes [int]:
+            memory limit of a row chunk
+    """
+    hdu = read_hdus(path)[0]
+    if hdu.shape != model.shape:
+        raise ValueError("model size differs")
+    cards = [
+        card for card in hdu.cards
+        if card[:8].strip() not in ("BZERO", "BSCALE", "BLANK")]
+    cards.append(format_card(
+        "HISTORY", comment=" theli.py: background model %s" % (
+            "subtracted" if applymode == SUBTRACT else "divided")))
+    output = create_image(outfile + ".tmp", cards, hdu.shape)
+    data = output.data(mode="r+")
+    step = chunk_rows(hdu.shape, 2, max_bytes)
+    for start in range(0, hdu.shape[0], step):
+        stop = min(start + step, hdu.shape[0])
+        rows = _read_rows(hdu, start, stop)
+        if applymode == SUBTRACT:
+            rows -= mode * (model[start:stop] - 1.0)
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rows /= model[start:stop]
+            rows[~np.isfinite(rows)] = 0.0
+        data[start:stop] = rows
+    data.flush()
+    del data
+    os.replace(outfile + ".tmp", outfile)
+
+
+def background_folder(files, modelfiles=None, nlow1=0, nhigh1=0, nlow2=0,
+                      nhigh2=1, median=True, twopass=True, threshold=1.3,
+                      minarea=5, expand=2, smooth=True, applymode=SUBTRACT,
+                      nthreads=1, max_bytes=256 * 1024**2):
+    """Create the background model of each chip and apply it to the images
+    [base]_[chip][tag].fits, which are moved to the subfolder [tag]_IMAGES
+    after writing [base]_[chip][tag]B.fits. The models are written to the
+    subfolder 'BACKGROUND', the object masks to 'MASK_IMAGES'.
+
+    With 'twopass', a first model (rejecting 'nlow1' and 'nhigh1' values)
+    is used to detect and mask objects (see object_mask), before the final
+    model is combined (rejecting 'nlow2' and 'nhigh2' values).
+
+    Arguments:
+        files [list of strings]:
+            paths of the images to correct
+        modelfiles [list of strings]:
+            paths of the images the model is created from (e.g. of a sky
+            folder), by default 'files'
+        nlow1, nhigh1, nlow2, nhigh2 [int]:
+            number of low and high values rejected in the first and second
+            pass
+        median [bool]:
+            combine with the median instead of the mean
+        twopass [bool]:
+            mask objects with the model of a first pass
+        threshold, minarea, expand, smooth:
+            object detection parameters (see object_mask)
+        applymode [int]:
+            SUBTRACT or DIVIDE
+        nthreads [int]:
+            number of images or chips processed in parallel
+        max_bytes [int]:
+            memory limit of all image stacks
+    Returns:
+        errors [list of strings]:
+            error messages
+    """
+    if modelfiles is None:
+        modelfiles = files
+    inputs = group_chips(modelfiles)
+    nthreads = max(1, nthreads)
+    allfiles = sorted(set(files) | set(modelfiles))
+    folder = os.path.dirname(files[0])
+    name = os.path.basename(folder)
+    for subfolder in ("BACKGROUND", "MASK_IMAGES"):
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+
+    def maskfile(path):
+        return os.path.join(
+            os.path.dirname(path), "MASK_IMAGES",
+            os.path.splitext(os.path.basename(path))[0] + "_mask.fits")
+
+    def run(function, items):
+        def wrapper(item):
+            try:
+                function(item)
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                label = "chip %d" % item if isinstance(item, int) \
+                    else os.path.basename(item)
+                return "%s: %s" % (label, e)
+            return None
+
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            return [e for e in pool.map(wrapper, items) if e is not None]
+
+    modes = {}
+    models = {}
+
+    def measure(path):
+        modes[path] = image_mode(path)
+        if not modes[path] > 0.0:
+            raise ValueError("mode is not positive")
+
+    def combine(chip, nlow, nhigh, masked):
+        chipfiles = sorted(inputs[chip])
+        models[chip] = combine_chip(
+            chipfiles, [modes[path] for path in chipfiles], nlow, nhigh,
+            median, [maskfile(p) for p in chipfiles] if masked else None,
+            max_bytes // min(nthreads, len(inputs)))
+
+    def detect(path):
+        chip = int(CHIP_IMAGE.match(os.path.basename(path)).group(2))
+        object_mask(
+            path, maskfile(path), modes[path], models[chip], threshold,
+            minarea, expand, smooth)
+
+    def write_model(chip):
+        output = create_image(
+            os.path.join(folder, "BACKGROUND", "%s_%d.fits" % (name, chip)),
+            [], models[chip].shape)
+        output.data(mode="r+")[:] = models[chip]
+
+    def apply(path):
+        match = CHIP_IMAGE.match(os.path.basename(path))
+        chip, tag = int(match.group(2)), match.group(3)
+        if chip not in models:
+            raise ValueError("no model for chip %d" % chip)
+        apply_model(
+            path, os.path.join(folder, "%s_%d%sB.fits" % (
+                match.group(1), chip, tag)),
+            modes[path], models[chip], applymode,
+            max_bytes // nthreads)
+        imagedir = os.path.join(folder, tag + "_IMAGES")
+        os.makedirs(imagedir, exist_ok=True)
+        os.rename(path, os.path.join(imagedir, os.path.basename(path)))
+
+    errors = run(measure, allfiles)
+    if twopass and len(errors) == 0:
+        errors = run(lambda chip: combine(chip, nlow1, nhigh1, False),
+                     sorted(inputs))
+        if len(errors) == 0:
+            errors = run(detect, sorted(modelfiles))
+    if len(errors) == 0:
+        errors = run(lambda chip: combine(chip, nlow2, nhigh2, twopass),
+                     sorted(inputs))
+    if len(errors) == 0:
+        errors = run(write_model, sorted(models))
+    if len(errors) == 0:
+        errors = run(apply, sorted(files))
+    return errors
@@ -0,0 +1,239 @@
+"""
+Defines the native science calibration, which applies the overscan
+correction, cutting, bias (or dark) subtraction and flat division to each
+chip image in a single pass, with the master frames shared by all worker
+processes
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .fitsio import np, card_key, create_image, format_card, read_hdus
+from .chips import (CHIP_IMAGE, chip_geometry, chunk_rows, group_chips,
+                    output_shape, physical, read_rows)
+from .check import estimate_mode, stats_region
+
+
+# master frames of a worker process by chip number and type (see _attach),
+# flats are stored inverted (see inverse_flat)
+_masters = {}
+# shared memory blocks of the worker process, must stay open
+_blocks = []
+
+
+def read_master(path):
+    """Read a master frame as float32 array in native byte order."""
+    hdu = read_hdus(path)[0]
+    return physical(hdu.data(), hdu.header)
+
+
+def inverse_flat(flat, scale=1.0):
+    """Inverse of a flat divided by 'scale', pixels without valid flat value
+    are set to zero."""
+    inverse = np.zeros_like(flat)
+    np.divide(scale, flat, out=inverse, where=flat > 0.0)
+    return inverse
+
+
+def flat_scale(instrument, flatdir):
+    """Normalisation shared by the master flats [flatdir]_[chip].fits of
+    all chips: the median of the modes of the chip flats in their
+    statistics regions. Dividing every chip by the same value keeps the
+    gain ratios between the chips. Chips without master flat are ignored.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the flats
+        flatdir [string]:
+            path of the flat folder
+    Returns:
+        scale [float]:
+            common normalisation of the flats
+    """
+    name = os.path.basename(os.path.normpath(flatdir))
+    modes = []
+    for chip in range(1, instrument.NCHIPS + 1):
+        path = os.path.join(flatdir, "%s_%d.fits" % (name, chip))
+        if not os.path.exists(path):
+            continue
+        flat = read_master(path)
+        y0, y1, x0, x1 = stats_region(instrument, chip, flat.shape)
+        modes.append(estimate_mode(flat[y0:y1, x0:x1].ravel()))
+    if len(modes) == 0:
+        raise ValueError("no master flat found")
+    scale = float(np.median(modes))
+    if not scale > 0.0:
+        raise ValueError("invalid flat normalisation %g" % scale)
+    return scale
+
+
+def _share(array, blocks):
+    """Copy an array to a new shared memory block, which is appended to
+    'blocks'.
+
+    Returns:
+        reference [tuple]:
+            name of the memory block and shape of the array
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=np.float32, buffer=block.buf)[:] = array
+    return block.name, array.shape
+
+
+def _attach(references):
+    """Initialise a worker process with the shared master frames."""
+    for key, (name, shape) in references.items():
+        block = shared_memory.SharedMemory(name=name)
+        _blocks.append(block)
+        _masters[key] = np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+
+
+def calibrated_header(hdu, geometry, steps):
+    """Header cards of a calibrated chip image: the reference pixel is moved
+    by the cut offset and the scaling keywords are removed."""
+    cut = output_shape(hdu, geometry) != hdu.shape
+    x0, y0 = geometry["cut"] if cut else (0, 0)
+    cards = []
+    offsets = {"CRPIX1": x0, "CRPIX2": y0}
+    for card in hdu.cards:
+        key = card_key(card)
+        if key in ("BZERO", "BSCALE", "BLANK"):
+            continue
+        value = hdu.header.get(key)
+        if key in offsets and isinstance(value, (int, float)):
+            card = format_card(key, float(value - offsets[key]))
+        cards.append(card)
+    cards.append(format_card(
+        "HISTORY", comment=" theli.py: " + ", ".join(steps)))
+    return cards
+
+
+def calibrate_chip(path, chip, geometry, max_bytes=64 * 1024**2):
+    """Calibrate a chip image [base]_[chip].fits with the master frames of
+    the worker process and write [base]_[chip]OFC.fits. The chip image is
+    moved to the subfolder 'SPLIT_IMAGES' afterwards, like the THELI
+    calibration script.
+
+    Arguments:
+        path [string]:
+            path of the split chip image
+        chip [int]:
+            chip number, starting from 1
+        geometry [dict]:
+            chip geometry (see chips.chip_geometry)
+        max_bytes [int]:
+            memory limit of a row chunk
+    Returns:
+        error [string]:
+            error message, None on success
+    """
+    folder, fname = os.path.split(path)
+    try:
+        hdu = read_hdus(path)[0]
+        shape = output_shape(hdu, geometry)
+        bias = _masters.get((chip, "bias"))
+        flat = _masters.get((chip, "flat"))
+        steps = ["overscan corrected" if geometry["overscan"] else
+                 "no overscan"]
+        if bias is not None:
+            steps.append("bias subtracted")
+        if flat is not None:
+            steps.append("flat divided")
+        for master in (bias, flat):
+            if master is not None and master.shape != shape:
+                raise ValueError("master frame size differs")
+        outfile = os.path.join(folder, "%s_%dOFC.fits" % (
+            CHIP_IMAGE.match(fname).group(1), chip))
+        tmpfile = outfile + ".tmp"
+        output = create_image(
+            tmpfile, calibrated_header(hdu, geometry, steps), shape)
+        data = output.data(mode="r+")
+        step = chunk_rows(shape, 1, max_bytes)
+        for start in range(0, shape[0], step):
+            stop = min(start + step, shape[0])
+            rows = read_rows(hdu, geometry, start, stop)
+            if bias is not None:
+                rows -= bias[start:stop]
+            if flat is not None:
+                rows *= flat[start:stop]
+            data[start:stop] = rows
+        data.flush()
+        del data
+        os.replace(tmpfile, outfile)
+        splitdir = os.path.join(folder, "SPLIT_IMAGES")
+        os.makedirs(splitdir, exist_ok=True)
+        os.rename(path, os.path.join(splitdir, fname))
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        return "%s: %s" % (fname, e)
+    return None
+
+
+def calibrate_folder(instrument, files, biasdir=None, flatdir=None,
+                     nprocs=1, max_bytes=256 * 1024**2):
+    """Calibrate split chip images in parallel worker processes. The master
+    frames [biasdir]_[chip].fits and [flatdir]_[chip].fits are read once and
+    shared by all workers, the flats are normalised by the same value for
+    all chips (see flat_scale).
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        files [list of strings]:
+            paths of the split chip images
+        biasdir [string]:
+            path of the bias or dark folder, None to skip the subtraction
+        flatdir [string]:
+            path of the flat folder, None to skip the flat division
+        nprocs [int]:
+            number of worker processes
+        max_bytes [int]:
+            memory limit of the row chunks of all workers
+    Returns:
+        errors [list of strings]:
+            error messages of images that could not be calibrated
+    """
+    chips = group_chips(files)
+    nprocs = max(1, min(nprocs, len(files)))
+    errors = []
+    blocks = []
+    references = {}
+    try:
+        if flatdir is not None:
+            try:
+                scale = flat_scale(instrument, flatdir)
+            except (OSError, ValueError, KeyError) as e:
+                return ["master flat: %s" % e]
+        for chip in sorted(chips):
+            masters = {}
+            for kind, folder in (("bias", biasdir), ("flat", flatdir)):
+                if folder is not None:
+                    name = os.path.basename(os.path.normpath(folder))
+                    masters[kind] = os.path.join(
+                        folder, "%s_%d.fits" % (name, chip))
+            for kind, path in masters.items():
+                try:
+                    master = read_master(path)
+                except (OSError, ValueError, KeyError) as e:
+                    errors.append("chip %d: master %s: %s" % (chip, kind, e))
+                    continue
+                if kind == "flat":
+                    master = inverse_flat(master, scale)
+                references[chip, kind] = _share(master, blocks)
+        if len(errors) > 0:
+            return errors
+        with ProcessPoolExecutor(
+                max_workers=nprocs, initializer=_attach,
+                initargs=(references,)) as pool:
+            futures = [
+                pool.submit(
+                    calibrate_chip, path, chip,
+                    chip_geometry(instrument, chip), max_bytes // nprocs)
+                for chip in sorted(chips) for path in sorted(chips[chip])]
+            results = [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return [error for error in results if error is not None]
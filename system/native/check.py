@@ -0,0 +1,156 @@
+"""
+Defines the native brightness level check, which estimates the mode of each
+chip image from a subsample of its rows and moves exposures with a mode
+outside the accepted range to the subfolder 'BADMODE'
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .fitsio import np, read_hdus
+from .chips import CHIP_IMAGE, physical
+
+
+# subsamples with fewer pixels are not used, the full region is read instead
+MIN_SAMPLE = 2000
+
+
+def estimate_mode(values, niter=3, nsigma=3.0):
+    """Estimate the mode of pixel values with the relation
+    mode = 2.5 * median - 1.5 * mean after iterative sigma clipping. The
+    median is used for skewed distributions, like SExtractor does.
+
+    Arguments:
+        values [numpy.ndarray]:
+            pixel values
+        niter [int]:
+            number of clipping iterations
+        nsigma [float]:
+            clipping threshold in standard deviations
+    Returns:
+        mode [float]:
+            mode estimate
+    """
+    values = values[np.isfinite(values)].astype(np.float64)
+    if len(values) == 0:
+        raise ValueError("no valid pixels")
+    for i in range(niter):
+        median = np.median(values)
+        sigma = values.std()
+        clipped = values[abs(values - median) <= nsigma * sigma]
+        if len(clipped) == 0 or len(clipped) == len(values):
+            break
+        values = clipped
+    median = np.median(values)
+    mean = values.mean()
+    sigma = values.std()
+    if sigma > 0.0 and abs(mean - median) / sigma >= 0.3:
+        return float(median)
+    return float(2.5 * median - 1.5 * mean)
+
+
+def stats_region(instrument, chip, shape):
+    """Statistics region (y0, y1, x0, x1) of a chip as defined by the
+    instrument (STATSXMIN/MAX, STATSYMIN/MAX), clipped to the image. The
+    full image is used if the instrument does not define a region."""
+    i = chip - 1
+    ny, nx = shape
+    x0, x1 = instrument.STATSXMIN[i], instrument.STATSXMAX[i]
+    y0, y1 = instrument.STATSYMIN[i], instrument.STATSYMAX[i]
+    if x1 <= x0 or y1 <= y0:
+        return 0, ny, 0, nx
+    x0, y0 = min(max(0, x0 - 1), nx - 1), min(max(0, y0 - 1), ny - 1)
+    return y0, min(ny, y1), x0, min(nx, x1)
+
+
+def chip_mode(path, region, fraction=0.05):
+    """Estimate the mode of a chip image from every n-th row of the
+    statistics region, such that about 'fraction' of the region is read. The
+    subsample is split into two interleaved halves, the difference of their
+    mode estimates serves as error bound.
+
+    Arguments:
+        path [string]:
+            path of the chip image
+        region [tuple]:
+            statistics region (y0, y1, x0, x1)
+        fraction [float]:
+            fraction of rows read, 1 reads the full region
+    Returns:
+        mode [float]:
+            mode estimate
+        error [float]:
+            error bound of the estimate, 0 if the full region was read
+    """
+    hdu = read_hdus(path)[0]
+    y0, y1, x0, x1 = region
+    step = max(1, int(round(1.0 / fraction))) if fraction > 0.0 else 1
+    nrows = len(range(y0, y1, step))
+    if step == 1 or nrows < 2 or nrows * (x1 - x0) < MIN_SAMPLE:
+        data = hdu.data()[y0:y1, x0:x1]
+        return estimate_mode(physical(data, hdu.header).ravel()), 0.0
+    sample = physical(hdu.data()[y0:y1:step, x0:x1], hdu.header)
+    mode = estimate_mode(sample.ravel())
+    error = abs(estimate_mode(sample[0::2].ravel()) -
+                estimate_mode(sample[1::2].ravel()))
+    return mode, error
+
+
+def check_folder(instrument, files, minmode, maxmode, fraction=0.05,
+                 nthreads=1):
+    """Check the brightness level of split chip images and move all chips
+    of exposures that have a chip with a mode outside [minmode, maxmode] to
+    the subfolder 'BADMODE' of their folder. If the error bound of the
+    subsampled estimate (see chip_mode) does not allow a decision, the full
+    statistics region is read.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        files [list of strings]:
+            paths of the split chip images
+        minmode [float]:
+            lower limit of the mode
+        maxmode [float]:
+            upper limit of the mode
+        fraction [float]:
+            fraction of rows read for the subsampled estimate
+        nthreads [int]:
+            number of images processed in parallel
+    Returns:
+        rejected [list of strings]:
+            base names of the rejected exposures
+        errors [list of strings]:
+            error messages of images that could not be checked
+    """
+    def check(path):
+        fname = os.path.basename(path)
+        match = CHIP_IMAGE.match(fname)
+        chip = int(match.group(2))
+        try:
+            shape = read_hdus(path)[0].shape
+            region = stats_region(instrument, chip, shape)
+            mode, error = chip_mode(path, region, fraction)
+            if abs(mode - minmode) < error or abs(mode - maxmode) < error:
+                # too close to a limit for a decision
+                mode, error = chip_mode(path, region, 1.0)
+            rejected = not minmode <= mode <= maxmode
+        except (OSError, ValueError, KeyError) as e:
+            return match.group(1), "%s: %s" % (fname, e)
+        return match.group(1) if rejected else None, None
+
+    files = [f for f in files if CHIP_IMAGE.match(os.path.basename(f))]
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as pool:
+        results = list(pool.map(check, files))
+    errors = [error for base, error in results if error is not None]
+    if len(errors) > 0:
+        return [], errors
+    rejected = sorted(set(base for base, error in results if base))
+    # move all chips of a rejected exposure
+    for path in files:
+        match = CHIP_IMAGE.match(os.path.basename(path))
+        if match.group(1) in rejected:
+            badmode = os.path.join(os.path.dirname(path), "BADMODE")
+            os.makedirs(badmode, exist_ok=True)
+            os.rename(path, os.path.join(badmode, os.path.basename(path)))
+    return rejected, []
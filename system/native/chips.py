@@ -0,0 +1,119 @@
+"""
+Defines the chip preprocessing of the native backends: reading row chunks
+of split chip images with overscan correction and cutting as defined by the
+instrument
+"""
+
+import os
+import re
+
+from .fitsio import np
+
+
+# split chip images: [base]_[chip][tag].fits
+CHIP_IMAGE = re.compile(r"^(.+)_(\d+)([A-Z]*(?:\.sub)?)\.fits$")
+
+
+def chip_geometry(instrument, chip):
+    """Collect the overscan and cut region of a chip from the instrument
+    definition.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        chip [int]:
+            chip number, starting from 1
+    Returns:
+        geometry [dict]:
+            'overscan': first and last overscan column (starting from 1) or
+            None, 'cut': first column and row (starting from 0), 'size':
+            number of columns and rows after cutting
+    """
+    i = chip - 1
+    overscan = None
+    if instrument.OVSCANX2[i] > 0:
+        overscan = (max(1, instrument.OVSCANX1[i]), instrument.OVSCANX2[i])
+    return {
+        "overscan": overscan,
+        "cut": (
+            max(1, instrument.CUTX[i]) - 1, max(1, instrument.CUTY[i]) - 1),
+        "size": (instrument.CHIPSIZEX[i], instrument.CHIPSIZEY[i])}
+
+
+def output_shape(hdu, geometry):
+    """Image shape (ny, nx) of a chip after cutting. Chips that already have
+    the size of the cut region are not cut."""
+    ny, nx = hdu.shape
+    sizex, sizey = geometry["size"]
+    if (ny, nx) == (sizey, sizex) or sizex <= 0 or sizey <= 0:
+        return ny, nx
+    x0, y0 = geometry["cut"]
+    if x0 + sizex > nx or y0 + sizey > ny:
+        raise ValueError("cut region exceeds image: " + hdu.path)
+    return sizey, sizex
+
+
+def read_rows(hdu, geometry, start, stop):
+    """Read rows of a chip image, subtract the median of the overscan region
+    of each row and cut the image as defined by the instrument.
+
+    Arguments:
+        hdu [HDU]:
+            header and data unit of the split chip image
+        geometry [dict]:
+            chip geometry (see chip_geometry)
+        start [int]:
+            first row of the cut image
+        stop [int]:
+            last row (exclusive) of the cut image
+    Returns:
+        rows [numpy.ndarray]:
+            pixel values (float32) of the cut rows
+    """
+    ny, nx = output_shape(hdu, geometry)
+    if (ny, nx) == hdu.shape:
+        x0, y0 = 0, 0
+    else:
+        x0, y0 = geometry["cut"]
+    data = hdu.data()[y0 + start:y0 + stop]
+    rows = physical(data[:, x0:x0 + nx], hdu.header)
+    if geometry["overscan"] is not None and (ny, nx) != hdu.shape:
+        x1, x2 = geometry["overscan"]
+        overscan = physical(data[:, x1 - 1:x2], hdu.header)
+        rows -= np.median(overscan, axis=1)[:, np.newaxis]
+    return rows
+
+
+def physical(data, header):
+    """Convert stored pixel values to float32 and apply BSCALE and BZERO."""
+    values = data.astype(np.float32)
+    if "BSCALE" in header:
+        values *= np.float32(header["BSCALE"])
+    if "BZERO" in header:
+        values += np.float32(header["BZERO"])
+    return values
+
+
+def chunk_rows(shape, nimages, max_bytes):
+    """Number of rows per chunk, such that the rows of 'nimages' images of
+    'shape' (float32) do not exceed 'max_bytes'."""
+    rowsize = 4 * shape[1] * max(1, nimages)
+    return max(1, min(shape[0], max_bytes // rowsize))
+
+
+def group_chips(files):
+    """Group split chip images by chip number.
+
+    Arguments:
+        files [list of strings]:
+            paths of split chip images
+    Returns:
+        chips [dict]:
+            list of paths by chip number
+    """
+    chips = {}
+    for path in files:
+        match = CHIP_IMAGE.match(os.path.basename(path))
+        if match is not None:
+            chips.setdefault(int(match.group(2)), []).append(path)
+    return chips
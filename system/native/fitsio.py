@@ -0,0 +1,281 @@
+"""
+Defines a minimal FITS reader and writer for the native backends, which
+locates the header and data units of a file and copies data units without
+decoding the pixels
+"""
+
+import os
+
+# numpy is only required to access the pixel values
+try:
+    import numpy as np
+    __numpy_success__ = True
+except ImportError:
+    np = None
+    __numpy_success__ = False
+
+
+BLOCK = 2880  # FITS files are organised in blocks of 2880 bytes
+CARD = 80  # length of a header card
+# keywords that describe the structure of a header and data unit
+STRUCTURE_KEYS = (
+    "SIMPLE", "XTENSION", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "NAXIS3",
+    "EXTEND", "NEXTEND", "PCOUNT", "GCOUNT", "END")
+# keywords without value
+COMMENTARY_KEYS = ("COMMENT", "HISTORY", "")
+# big endian data types by BITPIX
+BITPIX_TYPES = {8: "u1", 16: ">i2", 32: ">i4", 64: ">i8", -32: ">f4",
+                -64: ">f8"}
+
+
+def parse_value(string):
+    """Convert the value of a header card to bool, int, float or string.
+
+    Arguments:
+        string [string]:
+            card content following '= ', may include a comment
+    Returns:
+        value [bool, int, float, string]:
+            card value
+    """
+    string = string.strip()
+    if string.startswith("'"):
+        # string values may contain quotes ('') and slashes
+        end = 1
+        while True:
+            end = string.index("'", end)
+            if string[end + 1:end + 2] != "'":
+                break
+            end += 2
+        return string[1:end].replace("''", "'").rstrip()
+    value = string.split("/", 1)[0].strip()
+    if value == "T":
+        return True
+    if value == "F":
+        return False
+    try:
+        return int(value)
+    except ValueError:
+        return float(value.replace("D", "E"))
+
+
+def card_key(card):
+    return card[:8].strip()
+
+
+def format_card(key, value=None, comment=""):
+    """Format a header card with fixed format values.
+
+    Arguments:
+        key [string]:
+            header keyword, at most 8 characters
+        value [bool, int, float, string]:
+            card value, None for commentary keywords like 'HISTORY'
+        comment [string]:
+            card comment or text of commentary keywords
+    Returns:
+        card [string]:
+            80 character header card
+    """
+    if value is None:
+        card = "%-8s%s" % (key, comment)
+    else:
+        if isinstance(value, bool):
+            value = "%20s" % ("T" if value else "F")
+        elif isinstance(value, int):
+            value = "%20d" % value
+        elif isinstance(value, float):
+            value = "%20s" % repr(value).upper()
+        else:
+            value = "'%-8s'" % value.replace("'", "''")
+        card = "%-8s= %s" % (key, value)
+        if comment != "":
+            card += " / " + comment
+    return card[:CARD].ljust(CARD)
+
+
+def header_bytes(cards):
+    """Convert a list of header cards to a header ending with 'END', padded
+    to full FITS blocks."""
+    header = "".join(cards) + format_card("END")
+    header += " " * (-len(header) % BLOCK)
+    return header.encode("ascii")
+
+
+class HDU(object):
+    """Location and header of a header and data unit in a FITS file.
+
+    Arguments:
+        path [string]:
+            path of the FITS file
+        cards [list of strings]:
+            header cards without 'END'
+        header_offset [int]:
+            byte offset of the header in the file
+        data_offset [int]:
+            byte offset of the data unit in the file
+    """
+
+    def __init__(self, path, cards, header_offset, data_offset):
+        super(HDU, self).__init__()
+        self.path = path
+        self.cards = cards
+        self.header_offset = header_offset
+        self.data_offset = data_offset
+        self.header = {}
+        for card in cards:
+            key = card_key(card)
+            if key not in COMMENTARY_KEYS and card[8:10] == "= ":
+                try:
+                    self.header[key] = parse_value(card[10:])
+                except ValueError:
+                    self.header[key] = card[10:].strip()
+
+    @property
+    def shape(self):
+        """Data shape in numpy order (NAXISn, ..., NAXIS1)."""
+        naxis = self.header.get("NAXIS", 0)
+        return tuple(
+            self.header["NAXIS%d" % n] for n in range(naxis, 0, -1))
+
+    @property
+    def data_size(self):
+        """Size of the data unit in bytes without padding."""
+        if len(self.shape) == 0:
+            return 0
+        size = 1
+        for n in self.shape:
+            size *= n
+        size = abs(self.header["BITPIX"]) // 8 * self.header.get(
+            "GCOUNT", 1) * (size + self.header.get("PCOUNT", 0))
+        return size
+
+    @property
+    def padded_size(self):
+        """Size of the data unit in bytes including padding."""
+        return self.data_size + (-self.data_size % BLOCK)
+
+    @property
+    def is_image(self):
+        return self.header.get("XTENSION", "IMAGE") == "IMAGE" and \
+            len(self.shape) > 0
+
+    def data(self, mode="r"):
+        """Memory map the data unit as numpy array with the pixel values
+        as stored in the file (BZERO and BSCALE are not applied).
+
+        Arguments:
+            mode [string]:
+                numpy.memmap access mode
+        Returns:
+            data [numpy.memmap]:
+                pixel data
+        """
+        return np.memmap(
+            self.path, dtype=BITPIX_TYPES[self.header["BITPIX"]],
+            mode=mode, offset=self.data_offset, shape=self.shape)
+
+
+def read_hdus(path):
+    """Parse the headers of all header and data units of a FITS file.
+
+    Arguments:
+        path [string]:
+            path of the FITS file
+    Returns:
+        hdus [list of HDU]:
+            header and data units in order of appearance
+    """
+    hdus = []
+    filesize = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = 0
+        while offset < filesize:
+            f.seek(offset)
+            cards = []
+            header_offset = offset
+            while True:
+                block = f.read(BLOCK)
+                offset += BLOCK
+                if len(block) < BLOCK:
+                    raise ValueError("truncated FITS header: " + path)
+                block = block.decode("ascii", "replace")
+                for i in range(0, BLOCK, CARD):
+                    card = block[i:i + CARD]
+                    if card_key(card) == "END":
+                        break
+                    cards.append(card)
+                else:
+                    continue
+                break
+            hdu = HDU(path, cards, header_offset, offset)
+            if not hdu.header.get("SIMPLE", hdu.header.get("XTENSION")):
+                raise ValueError("not a FITS file: " + path)
+            offset += hdu.padded_size
+            hdus.append(hdu)
+    return hdus
+
+
+def copy_data(src, dst, offset, count):
+    """Copy 'count' bytes starting at 'offset' from the file descriptor
+    'src' to the current position of 'dst' without passing the data through
+    Python, if the operating system supports it.
+
+    Arguments:
+        src [int]:
+            file descriptor of the source file
+        dst [int]:
+            file descriptor of the destination file
+        offset [int]:
+            byte offset in the source file
+        count [int]:
+            number of bytes to copy
+    """
+    end = offset + count
+    while offset < end:
+        try:
+            if hasattr(os, "copy_file_range"):
+                copied = os.copy_file_range(src, dst, end - offset, offset)
+            else:
+                copied = os.sendfile(dst, src, offset, end - offset)
+        except OSError:
+            # e.g. copies across file systems on older kernels
+            copied = os.write(dst, os.pread(
+                src, min(end - offset, 1 << 24), offset))
+        if copied == 0:
+            raise OSError("unexpected end of file")
+        offset += copied
+
+
+def create_image(path, cards, shape, bitpix=-32):
+    """Create a single extension FITS image with the given header cards,
+    whose data unit can be filled through a memory map (see HDU.data).
+
+    Arguments:
+        path [string]:
+            output file path
+        cards [list of strings]:
+            additional header cards, structural keywords are ignored
+        shape [tuple]:
+            image shape in numpy order (ny, nx)
+        bitpix [int]:
+            FITS data type, by default 32 bit float
+    Returns:
+        hdu [HDU]:
+            header and data unit of the new image
+    """
+    header = [
+        format_card("SIMPLE", True),
+        format_card("BITPIX", bitpix),
+        format_card("NAXIS", len(shape))]
+    for n, size in enumerate(reversed(shape), 1):
+        header.append(format_card("NAXIS%d" % n, size))
+    header.extend(
+        card for card in cards if card_key(card) not in STRUCTURE_KEYS)
+    hdu = HDU(path, header, 0, 0)
+    with open(path, "wb") as f:
+        f.write(header_bytes(header))
+        hdu.data_offset = f.tell()
+        # allocate the padded data unit, the file system fills it with zeros
+        f.truncate(hdu.data_offset + hdu.padded_size)
+    return hdu
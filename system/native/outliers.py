@@ -0,0 +1,340 @@
+"""
+Defines the native outlier rejection of resampled images, which walks the
+common coaddition grid in tiles, clips the stack of overlapping pixels and
+sets the weight of outliers to zero
+"""
+
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from .fitsio import np, read_hdus
+from .chips import physical
+
+
+# size of the tiles of the coaddition grid in pixels, smaller tiles are
+# used if the memory limit requires it, but not less than MIN_TILE_SIZE
+TILE_SIZE = 512
+MIN_TILE_SIZE = 64
+# number of arrays of the size of the pixel stack (float32) a tile holds in
+# memory while it is clipped
+STACK_COPIES = 8
+# stacks with fewer valid pixels are not clipped
+MIN_STACK = 3
+RESAMPLED_SUFFIX = ".resamp.fits"
+WEIGHT_SUFFIX = ".resamp.weight.fits"
+
+
+def grid_offsets(hdus):
+    """Position of the resampled images on the coaddition grid: the lower
+    left pixel COMIN1/2 written by SWarp or, if missing, the offset of the
+    reference pixel.
+
+    Arguments:
+        hdus [list of HDU]:
+            header and data units of the resampled images
+    Returns:
+        offsets [list of tuples]:
+            offset (y, x) of each image, starting from 0
+        shape [tuple]:
+            shape of the grid covered by the images
+    """
+    corners = []
+    for hdu in hdus:
+        if "COMIN1" in hdu.header and "COMIN2" in hdu.header:
+            corners.append((hdu.header["COMIN2"], hdu.header["COMIN1"]))
+        else:
+            corners.append((
+                int(round(-hdu.header["CRPIX2"])),
+                int(round(-hdu.header["CRPIX1"]))))
+    y0 = min(y for y, x in corners)
+    x0 = min(x for y, x in corners)
+    offsets = [(y - y0, x - x0) for y, x in corners]
+    shape = (
+        max(y + hdu.shape[0] for (y, x), hdu in zip(offsets, hdus)),
+        max(x + hdu.shape[1] for (y, x), hdu in zip(offsets, hdus)))
+    return offsets, shape
+
+
+def overlapping(tile, margin, images):
+    """Indices of the images that overlap a tile of the coaddition grid.
+
+    Arguments:
+        tile [tuple]:
+            grid region (y0, y1, x0, x1)
+        margin [int]:
+            margin around the tile in pixels
+        images [list of tuples]:
+            image HDU, weight HDU and grid offset (y, x) of each resampled
+            image
+    Returns:
+        indices [list of int]:
+            indices of the overlapping images in 'images'
+    """
+    y0, y1, x0, x1 = tile
+    ry0, rx0 = y0 - margin, x0 - margin
+    ry1, rx1 = y1 + margin, x1 + margin
+    indices = []
+    for n, (image, weight, (oy, ox)) in enumerate(images):
+        ny, nx = image.shape
+        if oy < ry1 and oy + ny > ry0 and ox < rx1 and ox + nx > rx0:
+            indices.append(n)
+    return indices
+
+
+def tile_layout(nimages, nprocs, max_bytes, margin, tilesize=TILE_SIZE):
+    """Size of the tiles and number of worker processes, such that the
+    pixel stacks of 'nimages' images in all workers fit into 'max_bytes'.
+    The tiles are shrunk first, then the number of workers is reduced. The
+    scatter estimate of clip_stack depends on the size of the tiles.
+
+    Arguments:
+        nimages [int]:
+            maximum number of images in a pixel stack
+        nprocs [int]:
+            requested number of worker processes
+        max_bytes [int]:
+            memory limit of all workers, no limit if None
+        margin [int]:
+            margin around each tile in pixels
+        tilesize [int]:
+            maximum size of the tiles in pixels
+    Returns:
+        tilesize [int]:
+            size of the tiles in pixels
+        nprocs [int]:
+            number of worker processes
+    """
+    nprocs = max(1, nprocs)
+    if max_bytes is None:
+        return tilesize, nprocs
+
+    def tile_bytes(size):
+        return STACK_COPIES * 4 * max(1, nimages) * (size + 2 * margin)**2
+
+    budget = max_bytes // nprocs
+    while tilesize // 2 >= MIN_TILE_SIZE and tile_bytes(tilesize) > budget:
+        tilesize //= 2
+    nprocs = max(1, min(nprocs, max_bytes // tile_bytes(tilesize)))
+    return tilesize, nprocs
+
+
+def _neighbours(mask):
+    """Number of set pixels in the 3x3 neighbourhood of each pixel of a
+    stack of masks with shape (nimages, ny, nx)."""
+    padded = np.pad(mask.astype(np.uint8), ((0, 0), (1, 1), (1, 1)))
+    ny, nx = mask.shape[1:]
+    count = np.zeros(mask.shape, dtype=np.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            count += padded[:, dy:dy + ny, dx:dx + nx]
+    return count
+
+
+def clip_stack(stack, threshold, niter=3):
+    """Detect outliers in a stack of pixels by iterative clipping around
+    the median of each pixel stack. Few images are not sufficient to
+    estimate the scatter of a single pixel stack, instead the scatter of
+    each image is estimated from the median absolute deviation of all its
+    residuals.
+
+    Arguments:
+        stack [numpy.ndarray]:
+            pixel stack with shape (nimages, ny, nx), NaN for pixels without
+            data
+        threshold [float]:
+            rejection threshold in units of the scatter
+        niter [int]:
+            number of clipping iterations
+    Returns:
+        outliers [numpy.ndarray]:
+            True for rejected pixels
+    """
+    outliers = np.zeros(stack.shape, dtype=bool)
+    values = stack.copy()
+    with warnings.catch_warnings():
+        # pixels without data in all images
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for i in range(niter):
+            clipped = np.isfinite(values).sum(axis=0) >= MIN_STACK
+            if not clipped.any():
+                break
+            residuals = abs(values - np.nanmedian(values, axis=0))
+            residuals[:, ~clipped] = np.nan
+            # the median of odd stacks has no residual and would bias the
+            # scatter low
+            sample = np.where(residuals > 0.0, residuals, np.nan)
+            sigma = 1.4826 * np.nanmedian(
+                sample.reshape(len(values), -1), axis=1)
+            with np.errstate(invalid="ignore"):
+                rejected = residuals > threshold * sigma[:, None, None]
+            rejected[~np.isfinite(sigma) | (sigma <= 0.0)] = False
+            if not rejected.any():
+                break
+            outliers |= rejected
+            values[rejected] = np.nan
+    return outliers
+
+
+def filter_tile(tile, images, threshold, clustersize=1, borderwidth=0):
+    """Detect outliers in a tile of the coaddition grid. Only groups of at
+    least min(clustersize, 9) rejected pixels are kept, which are expanded
+    by 'borderwidth' pixels. The weights are not modified, such that the
+    result does not depend on the processing order of the tiles.
+
+    Arguments:
+        tile [tuple]:
+            grid region (y0, y1, x0, x1)
+        images [list of tuples]:
+            image HDU, weight HDU and grid offset (y, x) of each resampled
+            image, ideally only those overlapping the tile (see overlapping)
+        threshold [float]:
+            rejection threshold in units of the scatter
+        clustersize [int]:
+            minimum number of rejected neighbours
+        borderwidth [int]:
+            width of the border masked around rejected pixels
+    Returns:
+        outliers [dict]:
+            flat pixel indices of the rejected pixels by index in 'images'
+        error [string]:
+            error message, None on success
+    """
+    # read a margin around the tile for the neighbourhood operations
+    margin = 1 + borderwidth
+    y0, y1, x0, x1 = tile
+    ry0, rx0 = y0 - margin, x0 - margin
+    ry1, rx1 = y1 + margin, x1 + margin
+    members = []
+    for n in overlapping(tile, margin, images):
+        image, weight, (oy, ox) = images[n]
+        members.append((n, image, weight, oy, ox))
+    if len(members) < MIN_STACK:
+        return {}, None
+    try:
+        stack = np.full(
+            (len(members), ry1 - ry0, rx1 - rx0), np.nan, dtype=np.float32)
+        regions = []
+        for i, (n, image, weight, oy, ox) in enumerate(members):
+            # overlap in image and stack coordinates
+            iy0, iy1 = max(0, ry0 - oy), min(image.shape[0], ry1 - oy)
+            ix0, ix1 = max(0, rx0 - ox), min(image.shape[1], rx1 - ox)
+            sy, sx = oy + iy0 - ry0, ox + ix0 - rx0
+            region = (slice(iy0, iy1), slice(ix0, ix1))
+            target = (i, slice(sy, sy + iy1 - iy0), slice(sx, sx + ix1 - ix0))
+            values = physical(image.data()[region], image.header)
+            values[physical(weight.data()[region], weight.header) <= 0.0] = \
+                np.nan
+            stack[target] = values
+            regions.append((region, target))
+        outliers = clip_stack(stack, threshold)
+        if clustersize > 1:
+            outliers &= _neighbours(outliers) >= min(clustersize, 9)
+        for i in range(borderwidth):
+            outliers = _neighbours(outliers) > 0
+        # keep the rejections in the tile itself, the margin belongs to the
+        # neighbouring tiles
+        core = np.zeros(outliers.shape[1:], dtype=bool)
+        core[margin:margin + y1 - y0, margin:margin + x1 - x0] = True
+        outliers &= core
+        outliers &= np.isfinite(stack)
+        rejected = {}
+        for (n, image, weight, oy, ox), (region, target) in zip(
+                members, regions):
+            y, x = np.nonzero(outliers[target])
+            if len(y) > 0:
+                rejected[n] = np.ravel_multi_index(
+                    (y + region[0].start, x + region[1].start), image.shape)
+    except (OSError, ValueError, KeyError) as e:
+        return {}, "tile %d:%d,%d:%d: %s" % (y0, y1, x0, x1, e)
+    return rejected, None
+
+
+def filter_outliers(coadddir, threshold, clustersize=1, borderwidth=0,
+                    nprocs=1, tilesize=TILE_SIZE, max_bytes=None):
+    """Reject outliers of the resampled images [name].resamp.fits in the
+    coaddition folder (see filter_tile) by setting their weight in
+    [name].resamp.weight.fits to zero. The tiles are distributed across
+    worker processes, which receive only the images overlapping their tile.
+
+    Arguments:
+        coadddir [string]:
+            coaddition folder with the resampled images
+        threshold [float]:
+            rejection threshold in units of the scatter
+        clustersize [int]:
+            minimum number of rejected neighbours
+        borderwidth [int]:
+            width of the border masked around rejected pixels
+        nprocs [int]:
+            number of worker processes
+        tilesize [int]:
+            maximum size of the tiles in pixels
+        max_bytes [int]:
+            memory limit of the pixel stacks of all workers (see
+            tile_layout)
+    Returns:
+        nrejected [int]:
+            number of rejected pixels
+        errors [list of strings]:
+            error messages of tiles or weights that could not be processed
+    """
+    names = sorted(
+        f[:-len(RESAMPLED_SUFFIX)] for f in os.listdir(coadddir)
+        if f.endswith(RESAMPLED_SUFFIX) and not f.endswith(WEIGHT_SUFFIX))
+    if len(names) == 0:
+        return 0, ["no resampled images found"]
+    try:
+        images = [read_hdus(os.path.join(coadddir, n + RESAMPLED_SUFFIX))[0]
+                  for n in names]
+        weights = [read_hdus(os.path.join(coadddir, n + WEIGHT_SUFFIX))[0]
+                   for n in names]
+        offsets, shape = grid_offsets(images)
+    except (OSError, ValueError, KeyError) as e:
+        return 0, [str(e)]
+    stack = list(zip(images, weights, offsets))
+    margin = 1 + borderwidth
+    tilesize, nprocs = tile_layout(
+        len(stack), nprocs, max_bytes, margin, tilesize)
+    tiles = [
+        (y, min(y + tilesize, shape[0]), x, min(x + tilesize, shape[1]))
+        for y in range(0, shape[0], tilesize)
+        for x in range(0, shape[1], tilesize)]
+    # images of each tile, tiles with too few images are not clipped
+    members = [overlapping(tile, margin, stack) for tile in tiles]
+    tiles = [
+        (tile, indices) for tile, indices in zip(tiles, members)
+        if len(indices) >= MIN_STACK]
+    with ProcessPoolExecutor(max_workers=nprocs) as pool:
+        futures = [
+            pool.submit(
+                filter_tile, tile, [stack[n] for n in indices], threshold,
+                clustersize, borderwidth)
+            for tile, indices in tiles]
+        results = []
+        for (tile, indices), future in zip(tiles, futures):
+            outliers, error = future.result()
+            # map the indices of the tile's images to all images
+            results.append((
+                {indices[i]: pixels for i, pixels in outliers.items()},
+                error))
+    errors = [error for outliers, error in results if error is not None]
+    if len(errors) > 0:
+        return 0, errors
+    # set the weight of all rejected pixels to zero
+    nrejected = 0
+    for n, weight in enumerate(weights):
+        indices = [
+            outliers[n] for outliers, error in results if n in outliers]
+        if len(indices) == 0:
+            continue
+        indices = np.concatenate(indices)
+        try:
+            data = weight.data(mode="r+")
+            data.reshape(-1)[indices] = 0.0
+            data.flush()
+            del data
+        except (OSError, ValueError) as e:
+            errors.append("%s%s: %s" % (names[n], WEIGHT_SUFFIX, e))
+        nrejected += len(indices)
+    return nrejected, errors
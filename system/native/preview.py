@@ -0,0 +1,248 @@
+"""
+Defines the native preview generator, which bins the chips of each exposure
+directly from the memory mapped images, assembles them to a mosaic using the
+reference pixels of the instrument and writes 8 bit TIFF and PNG previews
+"""
+
+import os
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from .fitsio import np, create_image, read_hdus
+from .chips import CHIP_IMAGE, physical
+from .check import estimate_mode
+
+
+# number of binned rows processed at a time
+BINNED_ROWS = 64
+# every n-th pixel of the binned mosaic is used to estimate the sky level
+SKY_STEP = 7
+
+
+def bin_image(hdu, binning, median=False):
+    """Bin an image in blocks of 'binning' x 'binning' pixels, incomplete
+    blocks at the upper and right edge are dropped.
+
+    Arguments:
+        hdu [HDU]:
+            header and data unit of the image
+        binning [int]:
+            binning factor
+        median [bool]:
+            use the block median instead of the mean to reject outliers
+    Returns:
+        binned [numpy.ndarray]:
+            binned image (float32)
+    """
+    ny, nx = hdu.shape
+    by, bx = ny // binning, nx // binning
+    data = hdu.data()
+    binned = np.empty((by, bx), dtype=np.float32)
+    for start in range(0, by, BINNED_ROWS):
+        stop = min(start + BINNED_ROWS, by)
+        rows = physical(
+            data[start * binning:stop * binning, :bx * binning], hdu.header)
+        blocks = rows.reshape(stop - start, binning, bx, binning)
+        if median:
+            blocks = blocks.transpose(0, 2, 1, 3).reshape(
+                stop - start, bx, binning * binning)
+            binned[start:stop] = np.median(blocks, axis=2)
+        else:
+            binned[start:stop] = blocks.mean(axis=(1, 3))
+    return binned
+
+
+def mosaic_layout(instrument, shapes, binning):
+    """Position of the binned chips in the mosaic. The chips are placed by
+    their reference pixels (REFPIXX/Y), which point to the same position on
+    the sky. Chips without reference pixels are placed in a row.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        shapes [dict]:
+            unbinned image shape by chip number
+        binning [int]:
+            binning factor
+    Returns:
+        offsets [dict]:
+            lower left corner (y, x) of each binned chip by chip number
+        shape [tuple]:
+            shape of the binned mosaic
+    """
+    chips = sorted(shapes)
+    if any(instrument.REFPIXX[c - 1] or instrument.REFPIXY[c - 1]
+           for c in chips):
+        corners = {
+            c: (-instrument.REFPIXY[c - 1], -instrument.REFPIXX[c - 1])
+            for c in chips}
+    else:
+        corners = {}
+        x = 0
+        for c in chips:
+            corners[c] = (0, x)
+            x += shapes[c][1]
+    y0 = min(y for y, x in corners.values())
+    x0 = min(x for y, x in corners.values())
+    offsets = {
+        c: ((y - y0) // binning, (x - x0) // binning)
+        for c, (y, x) in corners.items()}
+    shape = (
+        max(offsets[c][0] + shapes[c][0] // binning for c in chips),
+        max(offsets[c][1] + shapes[c][1] // binning for c in chips))
+    return offsets, shape
+
+
+def stretch(image, minlevel, maxlevel):
+    """Convert an image to 8 bit with the limits 'minlevel' and 'maxlevel'
+    relative to the sky level, which is estimated from a subsample. Pixels
+    without data are black.
+
+    Returns:
+        pixels [numpy.ndarray]:
+            8 bit image, the first row is the top row
+    """
+    sample = image[::SKY_STEP, ::SKY_STEP]
+    sample = sample[np.isfinite(sample)]
+    sky = estimate_mode(sample) if len(sample) > 0 else 0.0
+    low, high = sky + minlevel, sky + maxlevel
+    scaled = (image - low) * (255.0 / max(high - low, 1e-6))
+    np.nan_to_num(scaled, copy=False, nan=0.0)
+    return np.clip(scaled, 0, 255).astype(np.uint8)[::-1]
+
+
+def write_tiff(path, pixels):
+    """Write an 8 bit grayscale image as uncompressed TIFF."""
+    height, width = pixels.shape
+    data = np.ascontiguousarray(pixels).tobytes()
+    ifd_offset = 8 + len(data) + len(data) % 2
+    entries = (  # tag, field type (3: short, 4: long), value
+        (256, 4, width), (257, 4, height), (258, 3, 8), (259, 3, 1),
+        (262, 3, 1), (273, 4, 8), (277, 3, 1), (278, 4, height),
+        (279, 4, len(data)))
+    with open(path, "wb") as f:
+        f.write(b"II*\x00" + struct.pack("<I", ifd_offset))
+        f.write(data + bytes(len(data) % 2))
+        f.write(struct.pack("<H", len(entries)))
+        for tag, fieldtype, value in entries:
+            if fieldtype == 3:
+                f.write(struct.pack("<HHIHH", tag, fieldtype, 1, value, 0))
+            else:
+                f.write(struct.pack("<HHII", tag, fieldtype, 1, value))
+        f.write(struct.pack("<I", 0))
+
+
+def write_png(path, pixels):
+    """Write an 8 bit grayscale image as PNG."""
+    height, width = pixels.shape
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels  # filter type 0 for each row
+
+    def chunk(name, content):
+        return struct.pack(">I", len(content)) + name + content + \
+            struct.pack(">I", zlib.crc32(name + content) & 0xffffffff)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(
+            ">IIBBBBB", width, height, 8, 0, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def create_preview(instrument, chipfiles, outdir, binning=4, minlevel=-100,
+                   maxlevel=500, median=False, fitsdir=None):
+    """Create the binned preview of an exposure: BINNED_TIFF/[name]binned.tif
+    and .png, where [name] is the name of the first chip image.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposure
+        chipfiles [dict]:
+            paths of the chip images by chip number
+        outdir [string]:
+            folder of the previews
+        binning [int]:
+            binning factor
+        minlevel [float]:
+            black level relative to the sky level
+        maxlevel [float]:
+            white level relative to the sky level
+        median [bool]:
+            bin with the block median to reject outliers
+        fitsdir [string]:
+            folder of the binned FITS mosaic, not written if None
+    """
+    hdus = {chip: read_hdus(path)[0] for chip, path in chipfiles.items()}
+    offsets, shape = mosaic_layout(
+        instrument, {chip: hdu.shape for chip, hdu in hdus.items()},
+        binning)
+    mosaic = np.full(shape, np.nan, dtype=np.float32)
+    for chip, hdu in hdus.items():
+        binned = bin_image(hdu, binning, median)
+        y, x = offsets[chip]
+        mosaic[y:y + binned.shape[0], x:x + binned.shape[1]] = binned
+    name = os.path.splitext(
+        os.path.basename(chipfiles[min(chipfiles)]))[0] + "binned"
+    if fitsdir is not None:
+        create_image(
+            os.path.join(fitsdir, name + ".fits"), [], shape).data(
+                mode="r+")[:] = mosaic
+    pixels = stretch(mosaic, minlevel, maxlevel)
+    write_png(os.path.join(outdir, name + ".png"), pixels)
+    write_tiff(os.path.join(outdir, name + ".tif"), pixels)
+
+
+def preview_folder(instrument, files, binning=4, minlevel=-100,
+                   maxlevel=500, median=False, nthreads=1):
+    """Create the binned previews of all exposures in parallel (see
+    create_preview) in the subfolder 'BINNED_TIFF' of their folder, binned
+    FITS mosaics of multi-chip cameras are written to 'BINNED_FITS'.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        files [list of strings]:
+            paths of the chip images
+        binning [int]:
+            binning factor
+        minlevel [float]:
+            black level relative to the sky level
+        maxlevel [float]:
+            white level relative to the sky level
+        median [bool]:
+            bin with the block median to reject outliers
+        nthreads [int]:
+            number of exposures processed in parallel
+    Returns:
+        errors [list of strings]:
+            error messages of exposures without preview
+    """
+    exposures = {}
+    for path in files:
+        match = CHIP_IMAGE.match(os.path.basename(path))
+        if match is not None:
+            key = (os.path.dirname(path), match.group(1), match.group(3))
+            exposures.setdefault(key, {})[int(match.group(2))] = path
+    for folder in set(key[0] for key in exposures):
+        os.makedirs(os.path.join(folder, "BINNED_TIFF"), exist_ok=True)
+        if instrument.NCHIPS > 1:
+            os.makedirs(os.path.join(folder, "BINNED_FITS"), exist_ok=True)
+
+    def preview(key):
+        folder = key[0]
+        try:
+            create_preview(
+                instrument, exposures[key],
+                os.path.join(folder, "BINNED_TIFF"),
+                binning, minlevel, maxlevel, median,
+                os.path.join(folder, "BINNED_FITS")
+                if instrument.NCHIPS > 1 else None)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            return "%s: %s" % (key[1], e)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as pool:
+        results = list(pool.map(preview, sorted(exposures)))
+    return [error for error in results if error is not None]
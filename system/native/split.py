@@ -0,0 +1,334 @@
+"""
+Defines the native FITS splitter, which copies the chip data of raw (multi-
+extension) FITS files verbatim to single chip images and rewrites the
+headers to THELI conventions using the instrument definition. Like the
+THELI splitting scripts, the chips keep their overscan and are cut by the
+calibration (see chips.read_rows). Crosstalk corrections are applied while
+the chips are copied, such that the raw files are read only once
+"""
+
+import os
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from .fitsio import (BLOCK, STRUCTURE_KEYS, card_key, copy_data,
+                     format_card, header_bytes, read_hdus)
+from .chips import physical
+from .xtalk import correct_crosstalk, corrected_cards
+
+
+# raw header keywords that are searched (in this order) for the values of the
+# THELI keywords, the chip header takes precedence over the primary header
+RAW_KEYS = {
+    "RA": ("RA", "OBJCTRA", "RA-D", "CRVAL1"),
+    "DEC": ("DEC", "OBJCTDEC", "DEC-D", "CRVAL2"),
+    "OBJECT": ("OBJECT", "TARGET"),
+    "EXPTIME": ("EXPTIME", "EXPOSURE", "EXPTIM", "ITIME"),
+    "AIRMASS": ("AIRMASS", "SECZ"),
+    "FILTER": ("FILTER", "FILTER1", "FILTNAM", "INSFLNAM"),
+    "DATE-OBS": ("DATE-OBS", "DATE_OBS", "DATE"),
+    "MJD-OBS": ("MJD-OBS", "MJD_OBS", "MJD")}
+# THELI keywords without dummy value, exposures that lack them in the raw
+# header are left to the splitting script
+REQUIRED_KEYS = ("RA", "DEC", "EXPTIME", "DATE-OBS")
+# dummy values of the other keywords, if not found in the raw header
+DEFAULTS = {"OBJECT": "UNKNOWN", "AIRMASS": 1.0, "FILTER": "UNKNOWN"}
+# keywords written by the splitter and (conflicting) world coordinate
+# keywords, the original cards are not copied
+THELI_KEYS = (
+    "CTYPE1", "CTYPE2", "CUNIT1", "CUNIT2", "CRVAL1", "CRVAL2", "CRPIX1",
+    "CRPIX2", "CD1_1", "CD1_2", "CD2_1", "CD2_2", "CDELT1", "CDELT2",
+    "CROTA1", "CROTA2", "PC1_1", "PC1_2", "PC2_1", "PC2_2", "EQUINOX",
+    "EPOCH", "RADECSYS", "RADESYS", "OBJECT", "EXPTIME", "AIRMASS", "GAIN",
+    "FILTER", "DATE-OBS", "MJD-OBS", "GABODSID", "IMAGEID", "ORIGFILE",
+    "INHERIT")
+# keywords that describe the data of the primary unit only
+PRIMARY_DATA_KEYS = ("BZERO", "BSCALE", "BLANK", "BUNIT")
+MJD_EPOCH = datetime(1858, 11, 17)
+# GABODSID counts the nights since 31.12.1998 (MJD 51178)
+GABODS_EPOCH = 51178
+
+
+def _sexagesimal(value, hours=False):
+    """Convert a coordinate given as number or as sexagesimal string
+    ('hh:mm:ss.s' or 'dd mm ss.s') to degrees."""
+    if not isinstance(value, str):
+        return float(value)
+    parts = value.replace(":", " ").split()
+    if len(parts) == 1:
+        return float(parts[0])
+    sign = -1.0 if parts[0].startswith("-") else 1.0
+    degrees = 0.0
+    for i, part in enumerate(parts[:3]):
+        degrees += abs(float(part)) / 60.0**i
+    return sign * degrees * (15.0 if hours else 1.0)
+
+
+def _mjd(dateobs):
+    """Convert the observation date 'YYYY-MM-DD[Thh:mm:ss[.sss]]' to the
+    modified Julian date."""
+    dateobs = dateobs.strip()
+    for pattern in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            date = datetime.strptime(dateobs, pattern)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError("invalid observation date: " + dateobs)
+    return (date - MJD_EPOCH).total_seconds() / 86400.0
+
+
+def _has_raw_key(headers, key):
+    """Test if any raw keyword of THELI keyword 'key' is in the raw
+    headers."""
+    return any(
+        rawkey in header for header in headers for rawkey in RAW_KEYS[key])
+
+
+def _raw_value(headers, key):
+    """Look up the value of THELI keyword 'key' in the raw headers.
+
+    Raises:
+        KeyError:
+            if a required keyword (see REQUIRED_KEYS) is not found
+    """
+    for header in headers:
+        for rawkey in RAW_KEYS[key]:
+            if rawkey in header:
+                return header[rawkey]
+    if key == "MJD-OBS":
+        return _mjd(_raw_value(headers, "DATE-OBS"))
+    if key not in DEFAULTS:
+        raise KeyError("raw keyword for %s not found" % key)
+    return DEFAULTS[key]
+
+
+def chip_units(hdus):
+    """Select the image units of the chips: the extensions of multi-
+    extension files or the primary unit of single chip files."""
+    if len(hdus) > 1:
+        return [hdu for hdu in hdus[1:] if hdu.is_image]
+    return [hdu for hdu in hdus if hdu.is_image]
+
+
+def check_exposure(instrument, hdus):
+    """Check if the chips of an exposure can be copied verbatim, i.e. the
+    raw file has one 2-dim image per chip of the instrument, and if the raw
+    headers provide the required keywords (see REQUIRED_KEYS).
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposure
+        hdus [list of HDU]:
+            header and data units of the raw file
+    Returns:
+        reason [string]:
+            why the exposure cannot be split, None if it can
+    """
+    chips = chip_units(hdus)
+    if len(chips) != instrument.NCHIPS:
+        return "found %d chips, expected %d" % (
+            len(chips), instrument.NCHIPS)
+    for i, hdu in enumerate(chips):
+        if len(hdu.shape) != 2:
+            return "chip %d is not a 2-dim image" % (i + 1)
+        missing = [
+            key for key in REQUIRED_KEYS
+            if not _has_raw_key((hdu.header, hdus[0].header), key)]
+        if len(missing) > 0:
+            return "chip %d: no raw keyword for %s" % (
+                i + 1, ", ".join(missing))
+    return None
+
+
+def check_split(instrument, rawfiles):
+    """Check if all raw files can be split by copying the chip data (see
+    check_exposure).
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        rawfiles [list of strings]:
+            paths of the raw files
+    Returns:
+        reason [string]:
+            why the files cannot be split, None if they can
+    """
+    for rawfile in rawfiles:
+        try:
+            reason = check_exposure(instrument, read_hdus(rawfile))
+        except (OSError, ValueError, KeyError) as e:
+            reason = str(e)
+        if reason is not None:
+            return "%s: %s" % (os.path.basename(rawfile), reason)
+    return None
+
+
+def chip_header(instrument, hdus, chip, filename):
+    """Create the THELI header of a chip: the world coordinate system from
+    the instrument definition and the pointing, the THELI keywords and the
+    remaining cards of the primary and chip header.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposure
+        hdus [list of HDU]:
+            header and data units of the raw file
+        chip [int]:
+            chip number, starting from 1
+        filename [string]:
+            name of the raw file
+    Returns:
+        cards [list of strings]:
+            header cards without 'END'
+    """
+    primary = hdus[0]
+    hdu = chip_units(hdus)[chip - 1]
+    headers = (hdu.header, primary.header)
+    mjd = float(_raw_value(headers, "MJD-OBS"))
+    cards = [
+        format_card("SIMPLE", True),
+        format_card("BITPIX", hdu.header["BITPIX"]),
+        format_card("NAXIS", 2),
+        format_card("NAXIS1", hdu.header["NAXIS1"]),
+        format_card("NAXIS2", hdu.header["NAXIS2"]),
+        format_card("CTYPE1", "RA---TAN"),
+        format_card("CTYPE2", "DEC--TAN"),
+        format_card("CRVAL1", _sexagesimal(
+            _raw_value(headers, "RA"), hours=True)),
+        format_card("CRVAL2", _sexagesimal(_raw_value(headers, "DEC"))),
+        format_card("CRPIX1", float(instrument.REFPIXX[chip - 1])),
+        format_card("CRPIX2", float(instrument.REFPIXY[chip - 1])),
+        format_card("CD1_1", float(instrument.PIXSCX)),
+        format_card("CD1_2", 0.0),
+        format_card("CD2_1", 0.0),
+        format_card("CD2_2", float(instrument.PIXSCY)),
+        format_card("EQUINOX", 2000.0),
+        format_card("RADECSYS", "FK5"),
+        format_card("OBJECT", str(_raw_value(headers, "OBJECT"))),
+        format_card("EXPTIME", float(_raw_value(headers, "EXPTIME"))),
+        format_card("AIRMASS", float(_raw_value(headers, "AIRMASS"))),
+        format_card("GAIN", float(instrument.GAIN)),
+        format_card("FILTER", str(_raw_value(headers, "FILTER"))),
+        format_card("DATE-OBS", str(_raw_value(headers, "DATE-OBS"))),
+        format_card("MJD-OBS", mjd),
+        format_card("GABODSID", int(mjd - 0.5) - GABODS_EPOCH),
+        format_card("IMAGEID", chip),
+        format_card("ORIGFILE", filename)]
+    # remaining cards, the chip header takes precedence
+    valuecards = {}
+    commentcards = []
+    for unit in (primary, hdu) if hdu is not primary else (hdu,):
+        for card in unit.cards:
+            key = card_key(card)
+            if key in STRUCTURE_KEYS or key in THELI_KEYS:
+                continue
+            if unit is primary and hdu is not primary and \
+                    key in PRIMARY_DATA_KEYS:
+                continue
+            if card[8:10] == "= ":
+                valuecards[key] = card
+            else:
+                commentcards.append(card)
+    cards.extend(valuecards.values())
+    cards.extend(commentcards)
+    cards.append(format_card(
+        "HISTORY", comment=" mefsplit: chip %d of %s" % (chip, filename)))
+    return cards
+
+
+def _write_corrected(dst, hdu, cards, xtalk):
+    """Write a chip with crosstalk correction (see xtalk.correct_crosstalk)
+    as 32 bit float image to the file descriptor 'dst'."""
+    data = correct_crosstalk(physical(hdu.data(), hdu.header), xtalk)
+    cards = [
+        format_card("BITPIX", -32) if card_key(card) == "BITPIX" else card
+        for card in corrected_cards(cards, xtalk)]
+    os.write(dst, header_bytes(cards))
+    os.write(dst, data.astype(">f4").tobytes())
+    os.write(dst, bytes(-data.nbytes % BLOCK))
+
+
+def split_exposure(instrument, rawfile, outdir=None, xtalk=None):
+    """Split a raw file into single chip images [base]_[chip].fits. The chip
+    data is copied verbatim (see fitsio.copy_data), unless a crosstalk
+    correction is applied, which converts the chips to 32 bit float.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposure
+        rawfile [string]:
+            path of the raw file
+        outdir [string]:
+            output folder, by default the folder of the raw file
+        xtalk [list of tuples]:
+            crosstalk correction steps (see xtalk.check_step), None or an
+            empty list to copy the data verbatim
+    Returns:
+        outfiles [list of strings]:
+            paths of the chip images
+    """
+    hdus = read_hdus(rawfile)
+    reason = check_exposure(instrument, hdus)
+    if reason is not None:
+        raise ValueError(reason)
+    if outdir is None:
+        outdir = os.path.dirname(os.path.abspath(rawfile))
+    filename = os.path.basename(rawfile)
+    base = os.path.splitext(filename)[0]
+    outfiles = []
+    src = os.open(rawfile, os.O_RDONLY)
+    try:
+        for chip, hdu in enumerate(chip_units(hdus), 1):
+            outfile = os.path.join(outdir, "%s_%d.fits" % (base, chip))
+            dst = os.open(
+                outfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                cards = chip_header(instrument, hdus, chip, filename)
+                if xtalk:
+                    _write_corrected(dst, hdu, cards, xtalk)
+                else:
+                    os.write(dst, header_bytes(cards))
+                    copy_data(src, dst, hdu.data_offset, hdu.data_size)
+                    os.write(dst, bytes(hdu.padded_size - hdu.data_size))
+            finally:
+                os.close(dst)
+            outfiles.append(outfile)
+    finally:
+        os.close(src)
+    return outfiles
+
+
+def split_exposures(instrument, rawfiles, nthreads=1, xtalk=None):
+    """Split raw files in parallel (see split_exposure) and move them to the
+    subfolder 'ORIGINALS' of their folder afterwards, like the THELI
+    splitting scripts.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        rawfiles [list of strings]:
+            paths of the raw files
+        nthreads [int]:
+            number of files processed in parallel
+        xtalk [list of tuples]:
+            crosstalk correction steps (see xtalk.check_step)
+    Returns:
+        errors [list of strings]:
+            error messages of files that could not be split
+    """
+    def split(rawfile):
+        try:
+            split_exposure(instrument, rawfile, xtalk=xtalk)
+        except (OSError, ValueError, KeyError) as e:
+            return "%s: %s" % (os.path.basename(rawfile), e)
+        originals = os.path.join(os.path.dirname(rawfile), "ORIGINALS")
+        os.makedirs(originals, exist_ok=True)
+        os.rename(rawfile, os.path.join(
+            originals, os.path.basename(rawfile)))
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as pool:
+        results = list(pool.map(split, rawfiles))
+    return [error for error in results if error is not None]
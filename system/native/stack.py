@@ -0,0 +1,127 @@
+"""
+Defines the native stacking engine for master bias and dark frames, which
+combines memory mapped chip images in row chunks, such that the memory usage
+does not depend on the number of exposures
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .fitsio import np, create_image, format_card, read_hdus
+from .chips import (chip_geometry, chunk_rows, group_chips, output_shape,
+                    read_rows)
+
+
+def combine(stack, nlow=0, nhigh=0):
+    """Combine a stack of images pixel by pixel: reject the 'nlow' lowest
+    and 'nhigh' highest values and average the remaining ones. If less than
+    one value remains, the median is used.
+
+    Arguments:
+        stack [numpy.ndarray]:
+            image stack with shape (nimages, ny, nx)
+        nlow [int]:
+            number of low values rejected per pixel
+        nhigh [int]:
+            number of high values rejected per pixel
+    Returns:
+        combined [numpy.ndarray]:
+            combined image (float32)
+    """
+    nimages = len(stack)
+    if nimages - nlow - nhigh < 1:
+        return np.median(stack, axis=0).astype(np.float32)
+    if nlow == 0 and nhigh == 0:
+        return stack.mean(axis=0, dtype=np.float64).astype(np.float32)
+    stack.sort(axis=0)
+    return stack[nlow:nimages - nhigh].mean(
+        axis=0, dtype=np.float64).astype(np.float32)
+
+
+def stack_chip(files, outfile, geometry, nlow=0, nhigh=0,
+               max_bytes=256 * 1024**2):
+    """Combine the images of one chip (see combine) reading at most
+    'max_bytes' of pixel data at a time and write the master frame.
+
+    Arguments:
+        files [list of strings]:
+            paths of the split chip images
+        outfile [string]:
+            path of the master frame
+        geometry [dict]:
+            chip geometry (see chips.chip_geometry)
+        nlow [int]:
+            number of low values rejected per pixel
+        nhigh [int]:
+            number of high values rejected per pixel
+        max_bytes [int]:
+            memory limit of the image stack
+    """
+    hdus = [read_hdus(path)[0] for path in files]
+    shape = output_shape(hdus[0], geometry)
+    for hdu in hdus[1:]:
+        if output_shape(hdu, geometry) != shape:
+            raise ValueError("image size differs: " + hdu.path)
+    cards = [
+        card for card in hdus[0].cards
+        if card[:8].strip() not in ("BZERO", "BSCALE", "BLANK")]
+    cards.append(format_card(
+        "HISTORY", comment=" theli.py: combined %d images, rejected %d "
+        "low and %d high values" % (len(files), nlow, nhigh)))
+    tmpfile = outfile + ".tmp"
+    master = create_image(tmpfile, cards, shape)
+    output = master.data(mode="r+")
+    step = chunk_rows(shape, len(hdus), max_bytes)
+    stack = np.empty((len(hdus), step, shape[1]), dtype=np.float32)
+    for start in range(0, shape[0], step):
+        stop = min(start + step, shape[0])
+        for i, hdu in enumerate(hdus):
+            stack[i, :stop - start] = read_rows(hdu, geometry, start, stop)
+        output[start:stop] = combine(stack[:, :stop - start], nlow, nhigh)
+    output.flush()
+    del output
+    os.replace(tmpfile, outfile)
+
+
+def stack_folder(instrument, folder, files, nlow=0, nhigh=0, nthreads=1,
+                 max_bytes=256 * 1024**2):
+    """Create the master frames [folder]_[chip].fits of all chips in
+    parallel.
+
+    Arguments:
+        instrument [Instrument]:
+            instrument of the exposures
+        folder [string]:
+            path of the data folder
+        files [list of strings]:
+            paths of the split chip images
+        nlow [int]:
+            number of low values rejected per pixel
+        nhigh [int]:
+            number of high values rejected per pixel
+        nthreads [int]:
+            number of chips processed in parallel
+        max_bytes [int]:
+            memory limit of all image stacks
+    Returns:
+        errors [list of strings]:
+            error messages of chips that could not be combined
+    """
+    chips = group_chips(files)
+    name = os.path.basename(os.path.normpath(folder))
+    nthreads = max(1, min(nthreads, len(chips)))
+
+    def stack(chip):
+        try:
+            stack_chip(
+                sorted(chips[chip]),
+                os.path.join(folder, "%s_%d.fits" % (name, chip)),
+                chip_geometry(instrument, chip), nlow, nhigh,
+                max_bytes // nthreads)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            return "chip %d: %s" % (chip, e)
+        return None
+
+    with ThreadPoolExecutor(max_workers=nthreads) as pool:
+        results = list(pool.map(stack, sorted(chips)))
+    return [error for error in results if error is not None]
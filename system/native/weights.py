@@ -0,0 +1,343 @@
+"""
+Defines the native weight map engine: global weights of each chip from the
+normalised flat and the dark (or bias), and weights of each image from the
+global weight, pixel value thresholds and DS9 region masks
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from .fitsio import np, create_image, read_hdus
+from .chips import CHIP_IMAGE, chunk_rows, group_chips, physical
+
+
+# DS9 region in image coordinates: shape(parameters), '-' marks exclusions
+REGION = re.compile(
+    r"^\s*([+-]?)\s*(circle|ellipse|box|polygon)\s*\(([^)]*)\)")
+
+
+def _read_rows(hdu, start, stop):
+    return physical(hdu.data()[start:stop], hdu.header)
+
+
+def _threshold(values, low=None, high=None):
+    """Mask of the values outside [low, high], limits that are None are not
+    applied."""
+    bad = ~np.isfinite(values)
+    if low is not None:
+        bad |= values < low
+    if high is not None:
+        bad |= values > high
+    return bad
+
+
+def _write_maps(weightfile, flagfile, shape, rows_function, max_bytes):
+    """Write a weight map (float32) and its flag map (16 bit, 1 for pixels
+    with zero weight) in row chunks, 'rows_function(start, stop)' returns
+    the weight of the rows."""
+    tmpfiles = (weightfile + ".tmp", flagfile + ".tmp")
+    weight = create_image(tmpfiles[0], [], shape).data(mode="r+")
+    flag = create_image(tmpfiles[1], [], shape, bitpix=16).data(mode="r+")
+    step = chunk_rows(shape, 4, max_bytes)
+    for start in range(0, shape[0], step):
+        stop = min(start + step, shape[0])
+        rows = rows_function(start, stop)
+        weight[start:stop] = rows
+        flag[start:stop] = rows == 0.0
+    weight.flush()
+    flag.flush()
+    del weight, flag
+    os.replace(tmpfiles[0], weightfile)
+    os.replace(tmpfiles[1], flagfile)
+
+
+def global_weight(weightdir, chip, shape, flatfile=None, flatmin=None,
+                  flatmax=None, darkfile=None, darkmin=None, darkmax=None,
+                  max_bytes=64 * 1024**2):
+    """Create the global weight globalweight_[chip].fits and flag map
+    globalflag_[chip].fits of a chip: the normalised flat (or 1 for uniform
+    weights), set to zero where the flat or the dark are outside the given
+    limits.
+
+    Arguments:
+        weightdir [string]:
+            output folder
+        chip [int]:
+            chip number, starting from 1
+        shape [tuple]:
+            image shape of the chip
+        flatfile [string]:
+            path of the normalised flat, None for uniform weights
+        flatmin, flatmax [float]:
+            valid range of the flat
+        darkfile [string]:
+            path of the master dark or bias, None to skip the dark limits
+        darkmin, darkmax [float]:
+            valid range of the dark
+        max_bytes [int]:
+            memory limit of a row chunk
+    Returns:
+        error [string]:
+            error message, None on success
+    """
+    try:
+        flat = None if flatfile is None else read_hdus(flatfile)[0]
+        dark = None if darkfile is None else read_hdus(darkfile)[0]
+        for master in (flat, dark):
+            if master is not None and master.shape != tuple(shape):
+                raise ValueError("master frame size differs")
+
+        def rows_function(start, stop):
+            if flat is None:
+                rows = np.ones((stop - start, shape[1]), dtype=np.float32)
+            else:
+                rows = _read_rows(flat, start, stop)
+                rows[_threshold(rows, flatmin, flatmax)] = 0.0
+            if dark is not None:
+                rows[_threshold(
+                    _read_rows(dark, start, stop), darkmin, darkmax)] = 0.0
+            return rows
+
+        _write_maps(
+            os.path.join(weightdir, "globalweight_%d.fits" % chip),
+            os.path.join(weightdir, "globalflag_%d.fits" % chip),
+            tuple(shape), rows_function, max_bytes)
+    except (OSError, ValueError, KeyError) as e:
+        return "chip %d: %s" % (chip, e)
+    return None
+
+
+def read_regions(regfile):
+    """Read the circles, ellipses, boxes and polygons in image coordinates
+    from a DS9 region file.
+
+    Returns:
+        regions [list of tuples]:
+            shape name and parameters, shapes prefixed with '-' (exclude)
+            are ignored
+    """
+    regions = []
+    with open(regfile) as f:
+        for line in f:
+            if line.lstrip().startswith("#"):
+                continue
+            for entry in line.split(";"):
+                match = REGION.match(entry)
+                if match is None or match.group(1) == "-":
+                    continue
+                values = [
+                    float(v.strip().rstrip("\"'d")) for v in
+                    match.group(3).split(",") if v.strip() != ""]
+                regions.append((match.group(2), values))
+    return regions
+
+
+def _inside_polygon(x, y, vx, vy):
+    """Even-odd rule for the pixel coordinates 'x', 'y' and the polygon
+    vertices 'vx', 'vy'."""
+    inside = np.zeros(np.broadcast(x, y).shape, dtype=bool)
+    for i in range(len(vx)):
+        x1, y1 = vx[i - 1], vy[i - 1]
+        x2, y2 = vx[i], vy[i]
+        if y1 == y2:
+            continue
+        crosses = (y1 > y) != (y2 > y)
+        xcross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (x < xcross)
+    return inside
+
+
+def region_mask(regions, shape):
+    """Rasterise DS9 regions (see read_regions) on an image with 'shape'.
+    Pixel centres have the coordinates 1, 2, ... like in DS9.
+
+    Returns:
+        mask [numpy.ndarray]:
+            True for pixels inside any region
+    """
+    ny, nx = shape
+    mask = np.zeros(shape, dtype=bool)
+    for name, p in regions:
+        if name == "circle" and len(p) >= 3:
+            vx = [p[0] - p[2], p[0] + p[2]]
+            vy = [p[1] - p[2], p[1] + p[2]]
+        elif name in ("ellipse", "box") and len(p) >= 4:
+            r = np.hypot(p[2], p[3])
+            vx, vy = [p[0] - r, p[0] + r], [p[1] - r, p[1] + r]
+        elif name == "polygon" and len(p) >= 6:
+            vx, vy = p[0::2], p[1::2]
+        else:
+            continue
+        # bounding box in array indices
+        x0, x1 = max(0, int(min(vx)) - 1), min(nx, int(max(vx)) + 1)
+        y0, y1 = max(0, int(min(vy)) - 1), min(ny, int(max(vy)) + 1)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        y, x = np.mgrid[y0 + 1:y1 + 1, x0 + 1:x1 + 1].astype(np.float64)
+        if name == "circle":
+            inside = (x - p[0])**2 + (y - p[1])**2 <= p[2]**2
+        elif name == "polygon":
+            inside = _inside_polygon(x, y, vx, vy)
+        else:
+            angle = np.radians(p[4]) if len(p) > 4 else 0.0
+            dx = (x - p[0]) * np.cos(angle) + (y - p[1]) * np.sin(angle)
+            dy = (y - p[1]) * np.cos(angle) - (x - p[0]) * np.sin(angle)
+            if name == "ellipse":
+                inside = (dx / p[2])**2 + (dy / p[3])**2 <= 1.0
+            else:
+                inside = (abs(dx) <= p[2] / 2.0) & (abs(dy) <= p[3] / 2.0)
+        mask[y0:y1, x0:x1] |= inside
+    return mask
+
+
+def image_weight(path, weightdir, chip, low=None, high=None, regfile=None,
+                 max_bytes=64 * 1024**2):
+    """Create the weight map [name].weight.fits and flag map [name].flag.fits
+    of an image: the global weight of its chip, set to zero where the image
+    is outside [low, high] and inside the regions of the DS9 region file.
+
+    Arguments:
+        path [string]:
+            path of the image
+        weightdir [string]:
+            folder with the global weights and output folder
+        chip [int]:
+            chip number, starting from 1
+        low, high [float]:
+            valid range of the pixel values, limits that are None are not
+            applied
+        regfile [string]:
+            path of a DS9 region file in image coordinates or None
+        max_bytes [int]:
+            memory limit of a row chunk
+    Returns:
+        error [string]:
+            error message, None on success
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        image = read_hdus(path)[0]
+        globalweight = read_hdus(
+            os.path.join(weightdir, "globalweight_%d.fits" % chip))[0]
+        if globalweight.shape != image.shape:
+            raise ValueError("global weight size differs")
+        mask = None
+        if regfile is not None:
+            mask = region_mask(read_regions(regfile), image.shape)
+
+        def rows_function(start, stop):
+            rows = _read_rows(globalweight, start, stop)
+            if low is not None or high is not None:
+                rows[_threshold(
+                    _read_rows(image, start, stop), low, high)] = 0.0
+            if mask is not None:
+                rows[mask[start:stop]] = 0.0
+            return rows
+
+        _write_maps(
+            os.path.join(weightdir, name + ".weight.fits"),
+            os.path.join(weightdir, name + ".flag.fits"),
+            image.shape, rows_function, max_bytes)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        return "%s: %s" % (os.path.basename(path), e)
+    return None
+
+
+def region_file(regdir, path):
+    """DS9 region file of an image in 'regdir': [name].reg or, for masks
+    created at an earlier processing stage, [base]_[chip].reg."""
+    if regdir is None:
+        return None
+    match = CHIP_IMAGE.match(os.path.basename(path))
+    for name in (os.path.splitext(os.path.basename(path))[0],
+                 "%s_%s" % (match.group(1), match.group(2))):
+        regfile = os.path.join(regdir, name + ".reg")
+        if os.path.exists(regfile):
+            return regfile
+    return None
+
+
+def global_weights(files, weightdir, normdir=None, darkdir=None,
+                   flatmin=None, flatmax=None, darkmin=None, darkmax=None,
+                   nprocs=1, max_bytes=256 * 1024**2):
+    """Create the global weights of all chips in parallel worker processes
+    (see global_weight).
+
+    Arguments:
+        files [list of strings]:
+            paths of images, which define the chips and their size
+        weightdir [string]:
+            output folder
+        normdir [string]:
+            folder of the normalised flats [name]_[chip].fits, None for
+            uniform weights
+        darkdir [string]:
+            folder of the master frames [name]_[chip].fits, None to skip
+            the dark limits
+        flatmin, flatmax, darkmin, darkmax [float]:
+            valid ranges of the flat and dark, limits that are None are not
+            applied
+        nprocs [int]:
+            number of worker processes
+        max_bytes [int]:
+            memory limit of the row chunks of all workers
+    Returns:
+        errors [list of strings]:
+            error messages of chips without global weight
+    """
+    chips = group_chips(files)
+    nprocs = max(1, min(nprocs, len(chips)))
+    os.makedirs(weightdir, exist_ok=True)
+
+    def master(folder, chip):
+        if folder is None:
+            return None
+        name = os.path.basename(os.path.normpath(folder))
+        return os.path.join(folder, "%s_%d.fits" % (name, chip))
+
+    with ProcessPoolExecutor(max_workers=nprocs) as pool:
+        futures = [
+            pool.submit(
+                global_weight, weightdir, chip,
+                read_hdus(min(chips[chip]))[0].shape,
+                master(normdir, chip), flatmin, flatmax,
+                master(darkdir, chip), darkmin, darkmax, max_bytes // nprocs)
+            for chip in sorted(chips)]
+        results = [future.result() for future in futures]
+    return [error for error in results if error is not None]
+
+
+def image_weights(files, weightdir, regdir=None, low=None, high=None,
+                  nprocs=1, max_bytes=256 * 1024**2):
+    """Create the weights of all images in parallel worker processes (see
+    image_weight).
+
+    Arguments:
+        files [list of strings]:
+            paths of the images
+        weightdir [string]:
+            folder with the global weights and output folder
+        regdir [string]:
+            folder with DS9 region files (see region_file) or None
+        low, high [float]:
+            valid range of the pixel values, limits that are None are not
+            applied
+        nprocs [int]:
+            number of worker processes
+        max_bytes [int]:
+            memory limit of the row chunks of all workers
+    Returns:
+        errors [list of strings]:
+            error messages of images without weight
+    """
+    chips = group_chips(files)
+    nprocs = max(1, min(nprocs, len(files)))
+    with ProcessPoolExecutor(max_workers=nprocs) as pool:
+        futures = [
+            pool.submit(
+                image_weight, path, weightdir, chip, low, high,
+                region_file(regdir, path), max_bytes // nprocs)
+            for chip in sorted(chips) for path in sorted(chips[chip])]
+        results = [future.result() for future in futures]
+    return [error for error in results if error is not None]
@@ -0,0 +1,228 @@
+"""
+Defines the native crosstalk correction of chips that are read out through
+several amplifiers: bright sources in one readout section leave a scaled
+footprint at the same position in the other sections (normal mode), along
+the same row or column (row mode) or a common pattern in many readout
+stripes (multi mode)
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .fitsio import np, card_key, create_image, format_card, read_hdus
+from .chips import physical
+
+
+# readout sections (ny, nx) of the normal mode by GUI button ID: quadrants,
+# two stacked stripes ('row') and two stripes side by side ('col')
+NORMAL_PATTERNS = {0: (2, 2), 1: (2, 1), 2: (1, 2)}
+# readout sections and direction of the footprint of the row mode by GUI
+# button ID, e.g. '2x2-col' has quadrants and footprints along columns
+ROW_PATTERNS = {
+    0: ((2, 2), "row"), 3: ((2, 2), "col"), 1: ((1, 2), "col"),
+    5: ((2, 1), "col"), 2: ((1, 1), "col"), 4: ((1, 1), "row")}
+# direction of the readout stripes of the multi mode by GUI button ID
+MULTI_PATTERNS = {0: "row", 1: "col"}
+
+
+def check_step(step):
+    """Check a correction step (mode, button ID, value) as it is read from
+    the parameters, the value is the amplitude of the normal and row mode
+    and the number of readout stripes of the multi mode.
+
+    Raises:
+        ValueError:
+            if the mode, button ID or value is invalid
+    """
+    mode, buttonid, value = step
+    patterns = {
+        "normal": NORMAL_PATTERNS, "row": ROW_PATTERNS,
+        "multi": MULTI_PATTERNS}
+    if mode not in patterns:
+        raise ValueError("unknown mode '%s'" % mode)
+    if buttonid < 0:
+        raise ValueError("pattern not selected")
+    if buttonid not in patterns[mode]:
+        raise ValueError("unknown pattern %d" % buttonid)
+    if mode == "multi" and value < 2:
+        raise ValueError("at least two readout stripes required")
+    if mode != "multi" and not np.isfinite(value):
+        raise ValueError("invalid amplitude")
+
+
+def _sections(data, grid):
+    """View of 'data' as readout sections with shape (gy, sy, gx, sx) for a
+    grid of (gy, gx) sections."""
+    gy, gx = grid
+    ny, nx = data.shape
+    if ny % gy != 0 or nx % gx != 0:
+        raise ValueError(
+            "chip size %dx%d cannot be divided into %dx%d sections" % (
+                nx, ny, gx, gy))
+    return data.reshape(gy, ny // gy, gx, nx // gx)
+
+
+def correct_normal(data, grid, amplitude):
+    """Subtract the footprint of the other readout sections, which is the
+    pixel at the same position in each section scaled by 'amplitude'.
+
+    Arguments:
+        data [numpy.ndarray]:
+            chip image
+        grid [tuple]:
+            number of readout sections (gy, gx)
+        amplitude [float]:
+            crosstalk amplitude
+    Returns:
+        corrected [numpy.ndarray]:
+            corrected chip image
+    """
+    blocks = _sections(data, grid)
+    total = blocks.sum(axis=(0, 2), keepdims=True, dtype=np.float64)
+    corrected = blocks - amplitude * (total - blocks)
+    return corrected.reshape(data.shape).astype(np.float32)
+
+
+def correct_row(data, grid, direction, amplitude):
+    """Subtract the footprint of the other readout sections, which is the
+    mean of the same row (or column) in each section scaled by 'amplitude'.
+    A chip with a single section leaves the footprint in its own rows.
+
+    Arguments:
+        data [numpy.ndarray]:
+            chip image
+        grid [tuple]:
+            number of readout sections (gy, gx)
+        direction [string]:
+            'row' or 'col', direction of the footprint
+        amplitude [float]:
+            crosstalk amplitude
+    Returns:
+        corrected [numpy.ndarray]:
+            corrected chip image
+    """
+    blocks = _sections(data, grid)
+    means = blocks.mean(
+        axis=3 if direction == "row" else 1, keepdims=True, dtype=np.float64)
+    if grid == (1, 1):
+        footprint = means
+    else:
+        footprint = means.sum(axis=(0, 2), keepdims=True) - means
+    corrected = blocks - amplitude * footprint
+    return corrected.reshape(data.shape).astype(np.float32)
+
+
+def correct_multi(data, nsections, direction):
+    """Subtract the pattern that is common to all readout stripes: the
+    median of the stripes, pixel by pixel, with its own median subtracted
+    such that the sky level is preserved.
+
+    Arguments:
+        data [numpy.ndarray]:
+            chip image
+        nsections [int]:
+            number of readout stripes
+        direction [string]:
+            'row' for stacked stripes or 'col' for stripes side by side
+    Returns:
+        corrected [numpy.ndarray]:
+            corrected chip image
+    """
+    grid = (nsections, 1) if direction == "row" else (1, nsections)
+    blocks = _sections(data, grid)
+    pattern = np.median(blocks, axis=(0, 2), keepdims=True)
+    pattern -= np.median(pattern)
+    corrected = blocks - pattern
+    return corrected.reshape(data.shape).astype(np.float32)
+
+
+def correct_crosstalk(data, steps):
+    """Apply crosstalk correction steps (see check_step) to a chip image in
+    the order normal, row and multi mode.
+
+    Arguments:
+        data [numpy.ndarray]:
+            chip image
+        steps [list of tuples]:
+            mode, button ID and value of each correction step
+    Returns:
+        corrected [numpy.ndarray]:
+            corrected chip image (float32)
+    """
+    order = ("normal", "row", "multi")
+    corrected = data
+    for mode, buttonid, value in sorted(
+            steps, key=lambda step: order.index(step[0])):
+        if mode == "normal":
+            corrected = correct_normal(
+                corrected, NORMAL_PATTERNS[buttonid], value)
+        elif mode == "row":
+            grid, direction = ROW_PATTERNS[buttonid]
+            corrected = correct_row(corrected, grid, direction, value)
+        else:
+            corrected = correct_multi(
+                corrected, int(value), MULTI_PATTERNS[buttonid])
+    return corrected.astype(np.float32, copy=False)
+
+
+def corrected_cards(cards, steps):
+    """Header cards of a corrected chip image: the scaling keywords are
+    removed and the correction is recorded."""
+    cards = [card for card in cards
+             if card_key(card) not in ("BZERO", "BSCALE", "BLANK")]
+    cards.append(format_card("HISTORY", comment=(
+        " theli.py: crosstalk correction (%s)" %
+        ", ".join(mode for mode, buttonid, value in steps))))
+    return cards
+
+
+def correct_file(path, steps):
+    """Apply the crosstalk correction to a split chip image in place, the
+    image is converted to 32 bit float.
+
+    Arguments:
+        path [string]:
+            path of the chip image
+        steps [list of tuples]:
+            mode, button ID and value of each correction step
+    Returns:
+        error [string]:
+            error message, None on success
+    """
+    tmpfile = path + ".tmp"
+    try:
+        hdu = read_hdus(path)[0]
+        corrected = correct_crosstalk(
+            physical(hdu.data(), hdu.header), steps)
+        data = create_image(
+            tmpfile, corrected_cards(hdu.cards, steps),
+            corrected.shape).data(mode="r+")
+        data[:] = corrected
+        data.flush()
+        del data
+        os.replace(tmpfile, path)
+    except (OSError, ValueError, KeyError) as e:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        return "%s: %s" % (os.path.basename(path), e)
+    return None
+
+
+def correct_files(files, steps, nthreads=1):
+    """Apply the crosstalk correction to split chip images in parallel (see
+    correct_file).
+
+    Arguments:
+        files [list of strings]:
+            paths of the chip images
+        steps [list of tuples]:
+            mode, button ID and value of each correction step
+        nthreads [int]:
+            number of images processed in parallel
+    Returns:
+        errors [list of strings]:
+            error messages of images that could not be corrected
+    """
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as pool:
+        results = list(pool.map(lambda path: correct_file(path, steps), files))
+    return [error for error in results if error is not None]
@@ -17,6 +17,9 @@ class Parameters(object):
         preparse [dict]:
             parameter dict (key: variable name, value: value) to initialize
             configureation files.
+        write [bool]:
+            write the configuration files to disk, otherwise they are only
+            kept in memory (e.g. for the dry-run planner)
     """
 
     param_sets_default = {
@@ -217,10 +220,11 @@ class Parameters(object):
                   "param_set2.ini": [],
                   "param_set3.ini": []}
 
-    def __init__(self, preparse={}):
+    def __init__(self, preparse={}, write=True):
         super(Parameters, self).__init__()
         if type(preparse) is not dict:
             raise ValueError("preparse must be of type 'dict'")
+        self.write = write
         self.reset()  # use default (minimal) configuration file
         if len(preparse) > 0:
             self.set(preparse)
@@ -260,7 +264,11 @@ class Parameters(object):
         """Restore default THELI-parameter files from default version in HOME
         folder"""
         # copy back default configuration file and write it to disk
-        self.param_sets = copy(self.param_sets_default)
+        self.param_sets = {
+            fname: copy(lines)
+            for fname, lines in self.param_sets_default.items()}
+        if not self.write:
+            return
         for n in (1, 2, 3):
             fname = "param_set%d.ini" % n
             with open(os.path.join(DIRS["PIPEHOME"], fname), 'w') as f:
@@ -287,12 +295,16 @@ class Parameters(object):
             None
         """
         # test if the system is locked already
-        check_system_lock()  # if yes exit to not change the parameter settings
+        if self.write:
+            # if yes exit to not change the parameter settings
+            check_system_lock()
         if replace == {}:  # nothing to do
             return
         for fname, fcontent in self.param_sets.items():
             # apply changes and write to disk
             fcontent, replace = self._modify_parameter_file(fcontent, replace)
+            if not self.write:
+                continue
             with open(os.path.join(DIRS["PIPEHOME"], fname), 'w') as f:
                 for line in fcontent:
                     f.write(line)
@@ -0,0 +1,519 @@
+"""
+Defines the dry-run planner that predicts which steps of a job list will be
+executed, based on a single scan of the data folders
+"""
+
+import os
+import json
+from fnmatch import fnmatch
+
+from .base import format_duration
+from .folder import ProgressChecks, check_requirements
+from .history import RunHistory
+from .scripts import BACKEND_STAGES
+from .tuning import TuningProfile
+
+
+FOLDER_KEYS = ("biasdir", "darkdir", "flatdir", "flatoffdir",
+               "sciencedir", "skydir", "stddir")
+
+
+class FolderSnapshot(ProgressChecks):
+    """Snapshot of the reduction progress of a data folder, taken from a
+    single scan of the folder. Provides the same checks as 'Folder' (see
+    ProgressChecks) and can be modified to simulate the outcome of the
+    reduction steps.
+
+    Arguments:
+        folder [Folder]:
+            monitored data folder
+    """
+
+    def __init__(self, folder):
+        super(FolderSnapshot, self).__init__()
+        self.path = folder.path
+        self.entries = set(os.listdir(folder.abs))
+        # count the exposures per file tag, like 'Folder.fits_count'
+        self.exposures = {}
+        for tag in folder.tags():
+            self.exposures[tag] = folder.fits_count(tag, ignore_sub=False)
+        self.master = folder.contains_master()
+        self.normflat = folder.search_flatnorm()
+        self.preview = folder.contains_preview()
+        self.refcat = folder.contains_refcatfiles()
+        self.catfiles = folder.contains_catfiles()
+        self.astrometry = folder.contains_astrometry()
+        self.coadds = folder.contains_coadds()
+        self.weights, self.weights_current = folder.check_weight()
+        try:
+            self.originals = len(os.listdir(
+                os.path.join(folder.abs, "ORIGINALS")))
+        except OSError:
+            self.originals = 0
+
+    def contains(self, entry):
+        """Test if folder contains file or folder 'entry'."""
+        return any(fnmatch(e, entry) for e in self.entries)
+
+    def contains_tag(self, tag):
+        """Test if folder contains an image with file tag 'tag'."""
+        return any(fnmatch(t, tag) for t in self.exposures)
+
+    # values of the 'Folder.contains_*' checks at the time of the scan
+
+    def contains_master(self):
+        return self.master
+
+    def search_flatnorm(self):
+        return self.normflat
+
+    def contains_preview(self):
+        return self.preview
+
+    def contains_refcatfiles(self):
+        return self.refcat
+
+    def contains_catfiles(self):
+        return self.catfiles
+
+    def contains_astrometry(self):
+        return self.astrometry
+
+    def contains_coadds(self):
+        return self.coadds
+
+    def tags(self, ignore_sub=True):
+        """Return all file tags, by default excluding sky subtracted
+        images."""
+        return set(t for t in self.exposures
+                   if not (ignore_sub and t.endswith("sub")))
+
+    def fits_count(self, tag='*', ignore_sub=True):
+        """Return the number of exposures with a file tag matching the
+        'tag' pattern."""
+        return sum(
+            count for t, count in self.exposures.items()
+            if fnmatch(t, tag) and not (ignore_sub and t.endswith("sub")))
+
+    def check_weight(self):
+        """Test if weight maps exist and are up to date."""
+        return self.weights, self.weights_current
+
+    def advance(self, tag, newtag, archive=True):
+        """Simulate a reduction step that creates images with tag 'newtag'
+        from images with 'tag' and moves the input to [tag]_IMAGES."""
+        count = self.exposures.pop(tag, 0)
+        self.exposures[newtag] = count
+        if archive:
+            self.entries.add(("SPLIT" if tag == "" else tag) + "_IMAGES")
+
+
+class Planner(object):
+    """Evaluates the verification logic of the Reduction jobs on snapshots of
+    the data folders without executing any script. Each job is reported as
+    run, skipped or failed together with the scripts it calls (or the
+    selected python backends, see scripts.BACKEND_STAGES), the number of
+    exposures and chips processed and an estimated runtime. Jobs following a
+    failing job are reported as blocked.
+
+    Arguments:
+        reduction [Reduction]:
+            reduction project to plan
+    """
+
+    def __init__(self, reduction):
+        super(Planner, self).__init__()
+        self.reduction = reduction
+        self.params = reduction.params
+        self.nchips = reduction.nchips
+        self.redo = reduction.redo
+        self.folders = {}
+        for key in FOLDER_KEYS:
+            folder = getattr(reduction, key)
+            if folder is not None:
+                self.folders[key] = FolderSnapshot(folder)
+        self.history = RunHistory()
+        self.profile = TuningProfile()
+        self.steps = []
+        self._failed = False
+
+    def estimate(self, script, exposures):
+        """Estimate the runtime of a script in seconds from the run history,
+        or the throughput measured by the NPARA tuning, None if unknown."""
+        seconds = self.history.predict(
+            script, self.reduction.instrument.NAME, exposures)
+        if seconds is not None:
+            return seconds
+        best = self.profile.best(script)
+        if best is None or exposures == 0:
+            return None
+        throughput = self.profile.stages[script]["throughput"][str(best)]
+        return exposures / throughput
+
+    def _backend_scripts(self, scripts):
+        """Replace the scripts of the stages that are not processed by the
+        THELI scripts by the selected backend (see scripts.BACKEND_STAGES),
+        shadow runs use both."""
+        names = []
+        for script in scripts:
+            stage = None
+            for name, methods in BACKEND_STAGES.items():
+                if any(script.startswith(m) for m in methods):
+                    stage = name
+            backend = self.reduction.backends.get(stage, "shell")
+            if backend in ("shell", "shadow"):
+                names.append(script)
+            if backend == "shadow":
+                backend = "python %s (shadow)" % stage
+            elif backend != "shell":
+                backend = "%s %s" % (backend, stage)
+            if backend != "shell" and backend not in names:
+                names.append(backend)
+        return names
+
+    def _step(self, job, folder, action, reason="", scripts=(), exposures=0):
+        seconds = None
+        scripts = self._backend_scripts(scripts)
+        if action == "run":
+            # the run time of the python backends is not recorded
+            estimates = [self.estimate(s, exposures) for s in scripts
+                         if s.endswith(".sh")]
+            known = [e for e in estimates if e is not None]
+            seconds = sum(known) if len(known) > 0 else None
+        self.steps.append({
+            "job": job, "folder": folder, "action": action,
+            "reason": reason, "scripts": scripts,
+            "exposures": exposures, "chips": exposures * self.nchips,
+            "seconds": seconds})
+        if action == "fail":
+            self._failed = True
+
+    def _require(self, job, requirements):
+        """Report a failure if the data folders required by a job are
+        missing or lack their master frame (see folder.check_requirements).
+        Returns True if the requirements are met."""
+        reason = check_requirements(self.folders, requirements)
+        if reason is not None:
+            self._step(job, "", "fail", reason)
+            return False
+        return True
+
+    def _verify(self, job, snap, verification):
+        """Report the outcome of the verification of a job (see
+        folder.ProgressChecks), unless the job processes the folder.
+
+        Returns:
+            reason [string]:
+                warning to report with the run, None if the folder is not
+                processed
+        """
+        action, reason = verification
+        if action == "run":
+            return reason
+        self._step(job, snap.path, "fail" if action == "fail" else "skip",
+                   reason)
+        return None
+
+    def _queue(self, keys):
+        """Iterate over the snapshots of the specified folders 'keys' until
+        a step fails."""
+        for key in keys:
+            if self._failed:
+                return
+            if key in self.folders:
+                yield key, self.folders[key]
+
+    def _reduced_keys(self, standard=True):
+        keys = ["sciencedir"]
+        if self.reduction.reduce_skydir:
+            keys.append("skydir")
+        if standard:
+            keys.append("stddir")
+        return keys
+
+    def plan(self, jobs):
+        """Plan a list of jobs.
+
+        Arguments:
+            jobs [list]:
+                tuples of job name, Reduction method name and a dictionary
+                of its arguments
+        Returns:
+            steps [list]:
+                list of dictionaries describing each planned step
+        """
+        for name, func, args in jobs:
+            if self._failed:
+                self._step(name, "", "blocked", "previous job fails")
+            elif hasattr(self, "_" + func):
+                getattr(self, "_" + func)(name, args)
+            else:
+                self._step(name, "", "unknown", "job cannot be planned")
+        return self.steps
+
+    def _split_FITS_correct_header(self, job, args):
+        for key, snap in self._queue(FOLDER_KEYS):
+            if self.redo and "ORIGINALS" in snap.entries:
+                snap.entries = set(["ORIGINALS"])
+                snap.exposures = {"none": snap.originals}
+            reason = self._verify(job, snap, snap.verify_split())
+            if reason is None:
+                continue
+            self._step(job, snap.path, "run", reason, [
+                "process_split_%s.sh" % self.reduction.instrument.NAME],
+                snap.fits_count("none"))
+            snap.advance("none", "", archive=False)
+            snap.entries.add("ORIGINALS")
+        # like 'split_FITS_correct_header', redo only applies to this job
+        self.redo = False
+
+    def _process_master(self, job, key, name, args, normflat=False):
+        snap = self.folders[key]
+        if self.redo:
+            snap.master = False
+        reason = self._verify(
+            job, snap, snap.verify_master(name, self.redo, normflat))
+        if reason is None:
+            return False
+        scripts = ["process_%s_para.sh" % name]
+        if len(args) > 0 and None not in args.values():
+            scripts.insert(0, "check_files_para.sh")
+        self._step(job, snap.path, "run", reason, scripts, snap.fits_count())
+        snap.master = True
+        return True
+
+    def _process_biases(self, job, args):
+        if self._require(job, [("biasdir", False)]):
+            self._process_master(job, "biasdir", "bias", args)
+
+    def _process_darks(self, job, args):
+        if self._require(job, [("darkdir", False)]):
+            self._process_master(job, "darkdir", "dark", args)
+
+    def _process_flats(self, job, args):
+        if not self._require(job, self.reduction.flat_requirements()):
+            return
+        # like 'process_flats', the master flat counts only if normalised,
+        # unless there are flat (off) frames
+        normflat = "flatoffdir" not in self.folders
+        updated = False
+        for key, snap in self._queue(("flatdir", "flatoffdir")):
+            updated |= self._process_master(
+                job, key, "flat", args if key == "flatdir" else {},
+                normflat=normflat and key == "flatdir")
+        if updated and not self._failed:
+            scripts = ["create_flat_ratio.sh", "create_norm_para.sh"]
+            if "flatoffdir" in self.folders:
+                scripts.insert(0, "subtract_flat_flatoff_para.sh")
+            flat = self.folders["flatdir"]
+            self._step(job, flat.path, "run", "normalising flat", scripts,
+                       exposures=1)
+            flat.normflat = True
+
+    def _calibrate_data(self, job, args):
+        if not self._require(job, self.reduction.calibration_requirements(
+                bool(args.get("use_dark")))):
+            return
+        for key, snap in self._queue(("sciencedir", "skydir", "stddir")):
+            if self.redo and snap.contains("SPLIT_IMAGES"):
+                snap.exposures = {"": snap.fits_count()}
+            reason = self._verify(job, snap, snap.verify_calibration())
+            if reason is None:
+                continue
+            scripts = ["process_science_para.sh"]
+            if key == "sciencedir" and args.get("cal_data_mode_min") \
+                    is not None and args.get("cal_data_mode_max") is not None:
+                scripts.insert(0, "check_files_para.sh")
+            self._step(job, snap.path, "run", reason, scripts,
+                       snap.fits_count())
+            snap.advance("", "OFC")
+
+    def _advance_stage(self, job, snap, flag, scripts, verification):
+        """Report the jobs that append 'flag' to the file tag of the current
+        progress stage and simulate their output."""
+        reason = self._verify(job, snap, verification)
+        if reason is None:
+            return
+        tag = snap.tags().pop()
+        self._step(job, snap.path, "run", reason, scripts, snap.fits_count())
+        snap.advance(tag, tag + flag)
+
+    def _background_model_correction(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        min_count = 0 if "skydir" in self.folders else 3
+        for key, snap in self._queue(("sciencedir", "stddir")):
+            scripts = ["process_background_para.sh"]
+            if key == "sciencedir" and \
+                    self.params.get("V_BACK_MAGLIMIT") != "":
+                scripts.insert(0, "id_bright_objects.sh")
+            self._advance_stage(job, snap, "B", scripts, snap.verify_step(
+                "B", "OFC", self.redo, min_count=min_count))
+
+    def _debloom_images(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        for key, snap in self._queue(self._reduced_keys()):
+            self._advance_stage(
+                job, snap, "D", ["create_debloomedimages_para.sh"],
+                snap.verify_step("D", "OFC(BHC)", self.redo))
+
+    def _create_binned_preview(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        for key, snap in self._queue(self._reduced_keys()):
+            reason = self._verify(job, snap, snap.verify_preview(self.redo))
+            if reason is None:
+                continue
+            scripts = ["create_tiff.sh"]
+            if self.nchips > 1:
+                scripts.insert(0, "make_album.sh")
+            self._step(job, snap.path, "run", reason,
+                       scripts * len(snap.tags()), snap.fits_count())
+            snap.preview = True
+
+    def _create_global_weights(self, job, args):
+        if not self._require(
+                job, self.reduction.global_weight_requirements()):
+            return
+        self._step(job, self.folders["sciencedir"].path, "run",
+                   scripts=["create_global_weights_para.sh"], exposures=1)
+
+    def _create_weights(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        for key, snap in self._queue(self._reduced_keys()):
+            reason = self._verify(job, snap, snap.verify_weights(self.redo))
+            if reason is None:
+                continue
+            self._step(job, snap.path, "run", reason, [
+                "transform_ds9_reg.sh", "create_weights_para.sh"] * len(
+                snap.tags()), snap.fits_count())
+            snap.weights, snap.weights_current = True, True
+
+    def _get_reference_catalog(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        snap = self.folders["sciencedir"]
+        reason = self._verify(job, snap, snap.verify_refcat(self.redo))
+        if reason is None:
+            return
+        if args.get("ref_cat") == "Image":
+            if args.get("ref_image") is None:
+                self._step(job, snap.path, "fail",
+                           "reference image path not specified")
+                return
+            scripts = ["create_astrorefcat_fromIMAGE.sh"]
+        else:
+            scripts = ["create_astrorefcat_fromWEB.sh"]
+        self._step(job, snap.path, "run", reason, scripts)
+        snap.refcat = True
+
+    def _create_source_cat(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        for key, snap in self._queue(self._reduced_keys(standard=False)):
+            reason = self._verify(job, snap, snap.verify_catalogs(self.redo))
+            if reason is None:
+                continue
+            scripts = ["create_astromcats_para.sh"]
+            if self.nchips > 1:
+                scripts.append("create_scampcats.sh")
+            self._step(job, snap.path, "run", reason, scripts,
+                       snap.fits_count())
+            snap.catfiles = True
+
+    def _astro_and_photometry(self, job, args):
+        methods = {
+            "scamp": ["create_scamp.sh"],
+            "astrometry.net": [
+                "create_astrometrynet.sh", "create_astrometrynet_photom.sh"],
+            "shift (float)": ["create_zeroorderastrom.sh"],
+            "shift (int)": ["create_zeroorderastrom.sh"],
+            "xcoor": ["create_xcorrastrom.sh"],
+            "header": ["create_headerastrom.sh"]}
+        method = args.get("astrometry_method", "scamp")
+        if method not in methods:
+            self._step(job, "", "fail", "method '%s' not registered" % method)
+            return
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        for key, snap in self._queue(self._reduced_keys(standard=False)):
+            reason = self._verify(
+                job, snap, snap.verify_astrometry(self.redo))
+            if reason is None:
+                continue
+            scripts = methods[method] + [
+                "create_stats_table.sh", "create_absphotom_coadd.sh"]
+            self._step(job, snap.path, "run", reason, scripts,
+                       snap.fits_count())
+            snap.astrometry = True
+            snap.entries.add("headers")
+
+    def _sky_subtraction(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        if args.get("sky_model_const"):
+            scripts = ["create_skysubconst_clean.sh",
+                       "create_skysubconst_para.sh"]
+        else:
+            scripts = ["create_skysub_para.sh"]
+        for key, snap in self._queue(self._reduced_keys(standard=False)):
+            reason = self._verify(job, snap, snap.verify_step(
+                ".sub", "OFC(BHCP)", self.redo, archive=False))
+            if reason is None:
+                continue
+            self._step(job, snap.path, "run", reason, scripts,
+                       snap.fits_count())
+            for tag in snap.tags():
+                snap.exposures[tag + ".sub"] = snap.exposures[tag]
+
+    def _coaddition(self, job, args):
+        if not self._require(job, [("sciencedir", False)]):
+            return
+        scripts = ["prepare_coadd_swarp.sh", "resample_coadd_swarp_para.sh",
+                   "perform_coadd_swarp.sh", "update_coadd_header.sh"]
+        if self.params.get("V_COADD_SMOOTHEDGE") != "":
+            scripts.insert(0, "create_smoothedge_para.sh")
+        if self.params.get("V_COADD_FILTERTHRESHOLD") != "":
+            scripts.insert(-2, "resample_filtercosmics.sh")
+        for key, snap in self._queue(self._reduced_keys(standard=False)):
+            reason = self._verify(job, snap, snap.verify_coadd(self.redo))
+            if reason is None:
+                continue
+            self._step(job, snap.path, "run", reason, scripts,
+                       snap.fits_count())
+            snap.coadds = True
+
+    def report(self):
+        """Format the planned steps as a table."""
+        lines = ["%-28s %-12s %-8s %6s %6s %9s  %s" % (
+            "JOB", "FOLDER", "ACTION", "EXP", "CHIPS", "EST. TIME",
+            "SCRIPTS / REASON")]
+        total, unknown = 0.0, False
+        for step in self.steps:
+            if step["seconds"] is not None:
+                total += step["seconds"]
+                duration = format_duration(step["seconds"])
+            elif step["action"] == "run":
+                unknown = True
+                duration = "unknown"
+            else:
+                duration = ""
+            details = ", ".join(step["scripts"])
+            if step["reason"] != "":
+                details = (details + " - " if details else "") + \
+                    step["reason"]
+            lines.append("%-28s %-12s %-8s %6s %6s %9s  %s" % (
+                step["job"][:28], step["folder"][:12], step["action"],
+                step["exposures"] if step["action"] == "run" else "",
+                step["chips"] if step["action"] == "run" else "",
+                duration, details))
+        lines.append("estimated total runtime: %s%s" % (
+            format_duration(total), " (incomplete)" if unknown else ""))
+        return "\n".join(lines)
+
+    def export(self, path):
+        """Write the planned steps as JSON file to 'path'."""
+        with open(path, "w") as f:
+            json.dump(self.steps, f, indent=1)
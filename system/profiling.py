@@ -0,0 +1,115 @@
+"""
+Defines the profiler of the wrapper code, which measures the CPU time spent
+in the python process (e.g. folder scans, header reads, log scanning) and
+ignores the time spent waiting for the THELI scripts
+"""
+
+import os
+import signal
+import cProfile
+import pstats
+from time import thread_time
+
+
+class StackSampler(object):
+    """Samples the python call stack of the main thread, whenever the process
+    consumed 'interval' seconds of CPU time (ITIMER_PROF). Time blocked on
+    child processes is therefore not sampled, CPU time of other threads
+    (e.g. the memory governor) is attributed to the main thread. The samples
+    are counted per collapsed stack ('outer;...;inner'), the input format of
+    flamegraph.pl.
+
+    Arguments:
+        interval [float]:
+            CPU time in seconds between two samples
+    """
+
+    def __init__(self, interval=0.005):
+        super(StackSampler, self).__init__()
+        self.interval = interval
+        self.counts = {}
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s:%d)" % (
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno))
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def write(self, path):
+        """Write the collapsed stacks with their sample counts to 'path'."""
+        with open(path, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write("%s %d\n" % (stack, count))
+
+
+class JobProfiler(object):
+    """Profiles the wrapper code of each job separately with cProfile, using
+    the CPU time of the main thread as timer. For each job a '.pstats' file
+    and a '.collapsed' file with sampled call stacks are written to the
+    output folder.
+
+    Arguments:
+        outdir [string]:
+            folder to write the profiles to
+    """
+
+    def __init__(self, outdir):
+        super(JobProfiler, self).__init__()
+        self.outdir = os.path.abspath(outdir)
+        os.makedirs(self.outdir, exist_ok=True)
+        self.files = []
+
+    def run(self, name, func, *args, **kwargs):
+        """Call 'func' with the arguments and profile it as job 'name'.
+        Profiles are written even if the job exits."""
+        base = os.path.join(
+            self.outdir, "%02d_%s" % (len(self.files) + 1, name))
+        profile = cProfile.Profile(thread_time)
+        sampler = StackSampler()
+        sampler.start()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            sampler.stop()
+            profile.dump_stats(base + ".pstats")
+            sampler.write(base + ".collapsed")
+            self.files.append(base + ".pstats")
+
+    def summary(self, limit=15):
+        """Format the functions with the highest CPU time (excluding
+        subcalls) of all profiled jobs as table."""
+        if len(self.files) == 0:
+            return ""
+        stats = pstats.Stats(*self.files)
+        total = sum(v[2] for v in stats.stats.values())
+        hotspots = sorted(
+            stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        lines = ["wrapper CPU time: %.2f s, profiles in: %s" % (
+            total, self.outdir)]
+        lines.append("%10s %10s %9s  %s" % (
+            "TOTTIME", "CUMTIME", "CALLS", "FUNCTION"))
+        for (filename, line, func), (cc, nc, tt, ct, callers) in \
+                hotspots[:limit]:
+            if filename == "~":  # built-in function
+                location = func
+            else:
+                location = "%s (%s:%d)" % (
+                    func, os.path.basename(filename), line)
+            lines.append("%10.3f %10.3f %9d  %s" % (tt, ct, nc, location))
+        return "\n".join(lines)
@@ -0,0 +1,107 @@
+"""
+Defines the live progress display of the running THELI scripts
+"""
+
+import re
+import sys
+import shutil
+from time import time
+
+from .base import format_duration
+from .governor import count_exposures
+from .scripts import CallMonitor
+
+
+# matches image names in the script output: [base]_[chip][tag][.*].fits
+IMAGE_NAME = re.compile(
+    r"([\w.+-]+)_(\d+)(?:OFC[A-Z]*)?(?:\.sub)?(?:\.\w+)*?\.fits")
+# scripts that create one master frame per chip, named [folder]_[chip].fits
+# after the last folder in the argument list
+PER_CHIP_SCRIPTS = (
+    "process_bias_para.sh", "process_dark_para.sh", "process_flat_para.sh",
+    "create_norm_para.sh")
+# minimum time in seconds between two updates of the progress line
+UPDATE_INTERVAL = 1.0
+
+
+class ProgressMonitor(CallMonitor):
+    """Shows a progress line with the number of processed chips, the
+    throughput and the remaining time of the running script. Processed chips
+    are identified by image names appearing in the script output, the total
+    is taken from the number of exposures in the data folder.
+
+    Arguments:
+        nchips [int]:
+            number of chips of the instrument
+        stream [file]:
+            output stream, by default stdout, the display is disabled if the
+            stream is not a terminal
+    """
+
+    def __init__(self, nchips, stream=None):
+        super(ProgressMonitor, self).__init__()
+        self.nchips = nchips
+        self.stream = sys.stdout if stream is None else stream
+        try:
+            self.enabled = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self.enabled = False
+        self._reset()
+
+    def _reset(self):
+        self._seen = set()
+        self._total = 0
+        self._start = None
+        self._last_update = 0.0
+        self._recogniser = IMAGE_NAME
+        self._shown = False
+
+    def call_prepare(self, script, arglist):
+        self._reset()
+        if not self.enabled:
+            return
+        if script in PER_CHIP_SCRIPTS and arglist:
+            self._recogniser = re.compile(
+                re.escape(arglist[-1]) + r"\w*_(\d+)\.fits")
+            self._total = self.nchips
+        else:
+            self._total = count_exposures(arglist) * self.nchips
+
+    def call_started(self, script, arglist, process):
+        self._start = time()
+        self._last_update = self._start  # first update after the interval
+
+    def call_output(self, script, line):
+        if not self.enabled or ".fits" not in line:
+            return
+        for match in self._recogniser.finditer(line):
+            self._seen.add(match.groups())
+        now = time()
+        if now - self._last_update >= UPDATE_INTERVAL:
+            self._last_update = now
+            self.display(now)
+
+    def display(self, now):
+        """Overwrite the progress line with the current state."""
+        done = len(self._seen)
+        if done == 0 or self._start is None:
+            return
+        rate = done / max(now - self._start, 1e-3)
+        if self._total > 0:
+            done = min(done, self._total)
+            remaining = (self._total - done) / rate
+            line = "  %d/%d chips, %.2f chips/s, ETA %s" % (
+                done, self._total, rate, format_duration(remaining))
+        else:
+            line = "  %d chips, %.2f chips/s" % (done, rate)
+        width = shutil.get_terminal_size((80, 24))[0] - 1
+        self.stream.write("\r" + line[:width].ljust(width))
+        self.stream.flush()
+        self._shown = True
+
+    def call_finished(self, script, arglist, process, return_code):
+        if self._shown:
+            width = shutil.get_terminal_size((80, 24))[0] - 1
+            self.stream.write("\r" + " " * width + "\r")
+            self.stream.flush()
+        self._reset()
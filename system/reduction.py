@@ -4,14 +4,34 @@ Defines the Reduction class that manages the data reduction process
 
 import os
 import shutil
-from time import sleep
+from copy import copy
+from time import time, sleep, localtime, strftime
 
 from .base import *
 from .instruments import Instrument
-from .folder import Folder
+from .folder import Folder, check_requirements
 from .parameters import Parameters
-from .scripts import Scripts
+from .scripts import (Scripts, BACKEND_STAGES, add_call_monitor,
+                      backend_choices, remove_call_monitor, stage_backend)
 from .version import __version__
+from .watcher import FolderWatcher, classify_exposure, count_extensions
+from .astrometry import AstrometryCache
+from .governor import MemoryGovernor
+from .tuning import NparaTuner, TuningProfile
+from .history import HistoryRecorder, RunHistory
+from .progress import ProgressMonitor
+from .events import EventStream, EventMonitor
+from .resources import available_cpus, physical_memory
+from .shadow import ATOL, RTOL, ShadowMonitor, ShadowRun
+
+
+# reduction stages with an alternative python implementation, the modules of
+# system.native are imported by the methods that use them, since importing
+# numpy delays the start of the wrapper
+NATIVE_STAGES = tuple(BACKEND_STAGES)
+# subfolder of the science and standard folder, in which the watch mode
+# splits and calibrates new exposures before merging them
+WATCH_STAGING = "STAGING"
 
 
 class Reduction(object):
@@ -28,14 +48,45 @@ class Reduction(object):
 
     obsfilter = '(null)'
 
+    _stage = None  # message of the current display_header
+    _stage_start = None
+    _stage_open = False  # stage_finish of the current stage not yet emitted
+    _shadow = None  # shadow run waiting for the comparison with the scripts
+
     def __init__(
             self, instrument, maindir, title="auto",
             biasdir=None, darkdir=None, flatdir=None, flatoffdir=None,
             sciencedir=None, skydir=None, stddir=None,
             reduce_skydir=False, ncpus=None, verbosity="normal",
-            logdisplay="none", check_filters=True, redo=False, parseparams={}):
+            logdisplay="none", check_filters=True, redo=False, parseparams={},
+            require_data=True, memory_limit=None, events=None,
+            backends={}, check_fraction=0.05, shadow_chips=(1,),
+            shadow_tolerance=(RTOL, ATOL), plan=False):
         super(Reduction, self).__init__()
+        # a project set up for the dry-run planner (see system.planner) must
+        # not modify the parameter files, the temp folder or the data folders
+        self.plan = plan
+        # machine readable events, optionally written to a JSON lines file
+        self.events = EventStream(os.path.abspath(maindir))
+        if events is not None and not plan:
+            self.events.add_file(events)
         self.redo = redo
+        # implementation of each reduction stage: 'shell' (THELI scripts),
+        # 'python' (see system.native) or 'shadow' (see run_shadow)
+        self.backends = {stage: "shell" for stage in NATIVE_STAGES}
+        for stage, selection in backends.items():
+            if stage not in NATIVE_STAGES or \
+                    selection not in backend_choices(stage):
+                self.display_error(
+                    "invalid backend '%s' for stage '%s'" % (selection, stage))
+                sys.exit(1)
+            self.backends[stage] = selection
+        # chips processed by shadow runs and the tolerance (rtol, atol) of
+        # the pixel values
+        self.shadow_chips = tuple(shadow_chips)
+        self.shadow_tolerance = shadow_tolerance
+        # fraction of rows read by the python brightness level check
+        self.check_fraction = check_fraction
         # set the main folder
         self.maindir = os.path.abspath(maindir)
         if not os.path.isdir(maindir):
@@ -63,13 +114,17 @@ class Reduction(object):
                 sys.exit(1)
             # test folder presence
             abspath = os.path.join(self.maindir, input_folder)
+            if not require_data and not plan and \
+                    not os.path.exists(abspath):
+                # data folders are filled later, e.g. by 'watch_folder'
+                os.mkdir(abspath)
             if not os.path.exists(abspath):
                 print(self)
                 self.display_error(
                     "%s: not found: %s" % (name, abspath))
                 sys.exit(1)
             # test folder contains files
-            if len(tuple(
+            if require_data and len(tuple(
                     f for f in os.listdir(abspath)
                     if os.path.isfile(os.path.join(abspath, f)))) == 0:
                 print(self)
@@ -99,8 +154,8 @@ class Reduction(object):
         # specify number of threads to use and adjust maximum parallel frames
         self.set_cpus(ncpus)
         self.get_npara_max()
-        # update the parameters file
-        self.params = Parameters(parseparams)  # parse any default parameters
+        # update the parameters file, parse any default parameters
+        self.params = Parameters(parseparams, write=not plan)
         pixscale = self.instrument.PIXSCALE
         crossid_rad = get_crossid_radius(pixscale)
         main_params = {'PROJECTNAME': self.title,
@@ -109,13 +164,13 @@ class Reduction(object):
                        'V_COADD_PIXSCALE': str(pixscale),
                        'V_SCAMP_CROSSIDRADIUS': str(crossid_rad)}
         self.params.set(main_params)
-        # empty temp folder
-        remove_temp_files()
         # determine verbosity level
         self.verbosity = 1
         if verbosity in ("quiet", "normal", "full"):
             verb_modes = {"quiet": 0, "normal": 1, "full": 2}
             self.verbosity = verb_modes[verbosity]
+        if not plan:
+            self._setup_scripts(memory_limit)
         if self.verbosity > 0:
             self.display_message(self)
         # check if the sky folder should be fully reduced
@@ -133,6 +188,33 @@ class Reduction(object):
                 "unsupported text file display '%s'" % logdisplay)
             sys.exit(1)
         self.logdisplay = logdisplay
+        self.events.emit(
+            "run_start", instrument=self.instrument.NAME, title=self.title,
+            folders={
+                key: getattr(self, key).path for key in folders
+                if getattr(self, key) is not None},
+            ncpus=self.ncpus, nframes=self.nframes)
+
+    def _setup_scripts(self, memory_limit):
+        """Prepare the execution of the THELI scripts: register the call
+        monitors and empty the temp folder."""
+        # adapt NPARA and NFRAMES to the memory usage before each script
+        add_call_monitor(MemoryGovernor(
+            self.params, self.ncpus, self.nchips,
+            self.instrument.chip_bytes(), limit=memory_limit))
+        # limit NPARA to the tuned optimum of this host (see --tune-npara)
+        add_call_monitor(NparaTuner(self.params, TuningProfile()))
+        # record the script durations and predict the duration of each step
+        add_call_monitor(HistoryRecorder(
+            self, RunHistory(), self.display_prediction))
+        # empty temp folder
+        remove_temp_files()
+        # live progress of the scripts, the full log is printed otherwise
+        if self.verbosity == 1:
+            add_call_monitor(ProgressMonitor(self.nchips))
+        else:
+            remove_call_monitor(ProgressMonitor)
+        add_call_monitor(EventMonitor(self.events, self.nchips))
 
     def __str__(self):
         # print most important project parameters
@@ -152,7 +234,7 @@ class Reduction(object):
                 "Session info:", __version__, pad=PAD)
             if hasattr(self, "nframes") and hasattr(self, "ncpus"):
                 string += ", {:}/{:} CPU(s), {:} FRAMES".format(
-                    self.ncpus, os.cpu_count(), self.nframes)
+                    self.ncpus, available_cpus(), self.nframes)
             string += "\n"
         if hasattr(self, "instrument"):
             string += "{:{pad}}{:}\n".format(
@@ -184,18 +266,25 @@ class Reduction(object):
         return string
 
     def set_cpus(self, cpus):
+        # respects CPU affinity and container quotas
         if cpus is None:
-            self.ncpus = os.cpu_count()
+            self.ncpus = available_cpus()
         elif type(cpus) is int:
-            self.ncpus = max(1, min(os.cpu_count(), cpus))
+            self.ncpus = max(1, min(available_cpus(), cpus))
         else:
             self.ncpus = 1
 
     def get_npara_max(self):
-        imsize = self.instrument.SIZEX * self.instrument.SIZEY * 4
-        RAM = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        # the largest chip limits the number of frames in memory
+        imsize = self.instrument.chip_bytes()
+        RAM = physical_memory()  # respects container memory limits
         self.nframes = int(0.4 * RAM / imsize / self.ncpus)
 
+    def _relpath(self, folder):
+        """Path of the data 'folder' relative to the main folder, as used by
+        the THELI scripts."""
+        return os.path.relpath(folder.abs, self.maindir)
+
     def update_env(self, **kwargs):
         for key in kwargs:
             self.theli_env[key] = kwargs[key]
@@ -229,6 +318,11 @@ class Reduction(object):
                          'V_COADD_FILTER': filterstring})
 
     def display_header(self, message):
+        self.finish_stage()
+        self._stage = message
+        self._stage_start = time()
+        self._stage_open = True
+        self.events.emit("stage_start", stage=message)
         if self.verbosity > 0:
             print(ascii_styled("> " + message, "bb-"))
 
@@ -236,11 +330,30 @@ class Reduction(object):
         if self.verbosity > 0:
             print(message)
 
+    def finish_stage(self):
+        """Emit the stage_finish event of the current stage, once."""
+        if self._stage_open:
+            self._stage_open = False
+            self.events.emit(
+                "stage_finish", stage=self._stage,
+                seconds=time() - self._stage_start)
+
     def display_separator(self):
+        self.finish_shadow()
+        self.finish_stage()
         if self.verbosity > 0:
             print()
 
+    def display_prediction(self, stage, seconds):
+        if self.verbosity > 0 and seconds is not None:
+            print(ascii_styled("expected:", "-c-"), "%s (ETA %s)" % (
+                format_duration(seconds),
+                strftime("%H:%M:%S", localtime(time() + seconds))))
+
     def display_success(self, message, prefix="SKIPPED:"):
+        self.events.emit(
+            "stage_skip" if prefix == "SKIPPED:" else "stage_success",
+            stage=self._stage, message=message)
         if self.verbosity > 0:
             if prefix is not None:
                 print(ascii_styled(prefix, "-g-"), message)
@@ -248,10 +361,14 @@ class Reduction(object):
                 print(message)
 
     def display_warning(self, message):
+        self.events.emit("warning", stage=self._stage, message=message)
         if self.verbosity > 0:
             print(ascii_styled("WARNING:", "-y-"), message)
 
     def display_error(self, message, critical=True):
+        self.events.emit(
+            "stage_fail", stage=self._stage, message=message,
+            critical=critical)
         if critical:
             print()
             stylestr = "br-"
@@ -261,6 +378,166 @@ class Reduction(object):
         if critical:
             print()
 
+    def check_native_errors(self, errors):
+        """Display the errors of a python backend and exit, if there are
+        any."""
+        for error in errors[:-1]:
+            self.display_error(error, critical=False)
+        if len(errors) > 0:
+            self.display_error(errors[-1])
+            sys.exit(1)
+
+    def check_folders(self, message, requirements):
+        """Display an error under the header 'message' and exit, if the data
+        folders required by a job are not specified or lack their master
+        frame (see folder.check_requirements)."""
+        reason = check_requirements(
+            {key: getattr(self, key) for key, master in requirements},
+            requirements)
+        if reason is not None:
+            self.display_header(message)
+            self.display_error(reason)
+            sys.exit(1)
+
+    def check_verification(self, message, verification):
+        """Display the outcome of the verification of a job (see
+        folder.ProgressChecks) under the header 'message' and exit, if the
+        reduction cannot continue.
+
+        Returns:
+            run [bool]:
+                whether the job has to process the folder
+        """
+        action, reason = verification
+        if action == "run" and reason == "":
+            return True
+        self.display_header(message)
+        if action == "run":
+            self.display_warning(reason)
+            return True
+        if action == "skip":
+            self.display_success(reason)
+        elif action == "warn":
+            self.display_warning(reason)
+        elif action == "error":
+            self.display_error(reason, critical=False)
+        else:
+            self.display_error(reason)
+            sys.exit(1)
+        return False
+
+    def flat_requirements(self):
+        """Data folders required by 'process_flats' (see check_folders)."""
+        requirements = [("flatdir", False)]
+        if self.params.get("V_DO_BIAS") == "Y":
+            requirements.append(("biasdir", True))
+        return requirements
+
+    def calibration_requirements(self, usedark=False):
+        """Data folders required by 'calibrate_data' (see check_folders)."""
+        requirements = [("sciencedir", False)]
+        if self.params.get("V_DO_FLAT") == "Y":
+            requirements.append(("flatdir", True))
+        if self.params.get("V_DO_BIAS") == "Y":
+            requirements.append(("darkdir" if usedark else "biasdir", True))
+        return requirements
+
+    def global_weight_requirements(self):
+        """Data folders required by 'create_global_weights' (see
+        check_folders)."""
+        requirements = [("sciencedir", False)]
+        if self.params.get("V_GLOBW_UNIFORMWEIGHT") == "FALSE":
+            requirements.append(("flatdir", True))
+        return requirements
+
+    def run_shadow(self, stage, method, args, chipwise=True, folders=None):
+        """Run the python implementation 'method' of 'stage' with arguments
+        'args' on a copy of the data of the chips in 'shadow_chips' (all
+        chips, if not 'chipwise') before the scripts process the original
+        data. The data folders are hard linked, unless the stage modifies
+        its input in place, then only the 'folders' it reads and writes
+        (relative to the main folder) are copied. The outputs and run times
+        are compared when the stage finished (see finish_shadow)."""
+        from .native import fitsio
+        self.finish_shadow()
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "shadow mode requires numpy, comparison skipped")
+            return
+        chips = None
+        if chipwise:
+            chips = [c for c in self.shadow_chips if 1 <= c <= self.nchips]
+        run = ShadowRun(
+            self.maindir, stage, chips, link=folders is None, folders=folders)
+        # copy of the reduction that works on the copied data folders
+        shadow = copy(self)
+        shadow.maindir = run.path
+        for attr in ("biasdir", "darkdir", "flatdir", "flatoffdir",
+                     "sciencedir", "skydir", "stddir"):
+            folder = getattr(self, attr)
+            if folder is not None:
+                setattr(shadow, attr, Folder(
+                    os.path.join(run.path, self._relpath(folder)),
+                    folder.nchips))
+        shadow.backends = dict(self.backends)
+        shadow.backends[stage] = "python"
+        shadow.verbosity = 0
+        shadow.events = EventStream()
+        args = [
+            Folder(os.path.join(run.path, self._relpath(arg)), arg.nchips)
+            if isinstance(arg, Folder) else arg for arg in args]
+        try:
+            use_script = run.run(method, shadow, *args)
+        except SystemExit:  # errors are displayed by check_native_errors
+            use_script = None
+        if use_script is not False:
+            self.display_warning(
+                "shadow run of the python %s backend %s, comparison "
+                "skipped" % (
+                    stage, "failed" if use_script is None
+                    else "not applicable"))
+            run.cleanup()
+            return
+        self._shadow = run
+        add_call_monitor(run.monitor)
+
+    def finish_shadow(self):
+        """Compare the outputs of a pending shadow run with those of the
+        scripts and display the run times of both."""
+        run = self._shadow
+        if run is None:
+            return
+        self._shadow = None
+        remove_call_monitor(ShadowMonitor)
+        try:
+            if run.monitor.ncalls == 0:
+                self.display_warning(
+                    "scripts of stage '%s' did not run, shadow comparison "
+                    "skipped" % run.stage)
+                return
+            differences = run.compare(*self.shadow_tolerance)
+            nchips = self.nchips if run.chips is None else len(run.chips)
+            self.events.emit(
+                "shadow_compare", stage=run.stage, outputs=len(run.outputs),
+                differences=len(differences), chips=nchips,
+                python_seconds=run.seconds,
+                script_seconds=run.monitor.seconds,
+                script_chips=self.nchips)
+            self.display_message(
+                "shadow comparison (%s): %d of %d outputs match" % (
+                    run.stage, len(run.outputs) - len(differences),
+                    len(run.outputs)))
+            for relpath, difference in differences:
+                self.display_warning("%s: %s" % (relpath, difference))
+            for name, seconds, n in (
+                    ("scripts", run.monitor.seconds, self.nchips),
+                    ("python", run.seconds, nchips)):
+                self.display_message(
+                    "    %-8s %8.1f s for %2d chip(s) (%.2f s per chip)" % (
+                        name, seconds, n, seconds / max(1, n)))
+        finally:
+            run.cleanup()
+
     def check_return_code(self, code):
         code, warnings = code
         for warning in warnings:
@@ -322,10 +599,6 @@ class Reduction(object):
 
     def split_FITS_correct_header(self, params={}):
         self.params.set(params)
-        correct_xtalk = (
-            self.params.get("V_PRE_XTALK_NOR_CHECKED") != '0' or
-            self.params.get("V_PRE_XTALK_ROW_CHECKED") != '0' or
-            self.params.get("V_PRE_XTALK_MULTI_CHECKED") != '0')
         foldervars = ['biasdir', 'darkdir', 'flatdir', 'flatoffdir',
                       'sciencedir', 'skydir', 'stddir']
         IDs = [' (bias)', ' (dark)', ' (flat)', ' (flat off)',
@@ -338,42 +611,88 @@ class Reduction(object):
                 continue
             if self.redo:
                 folder.restore()
-            filetags = folder.tags(ignore_sub=True)
-            found_original_files = folder.contains_tag('none')
-            found_split_files = folder.contains_tag('')
-            found_split_dir = folder.contains("SPLIT_IMAGES")
-            found_masterframe = folder.contains_master()
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if found_masterframe:
-                self.display_header(job_message)
-                self.display_success("master %s found" % ID[2:-1])
+            if not self.check_verification(
+                    job_message, folder.verify_split()):
                 continue
-            if found_split_files or found_split_dir:
-                self.display_header(job_message)
-                self.display_success("split images found")
-                continue
-            if not found_original_files:
-                self.display_header(job_message)
-                self.display_error("no original images found")
-                sys.exit(1)
             # run jobs
             # split images
             self.display_header(job_message)
+            self._split_folder(folder.path)
+        self.display_separator()
+        self.redo = False
+
+    def _crosstalk_steps(self):
+        """Crosstalk correction steps selected by the V_PRE_XTALK parameters
+        (see native.xtalk.check_step)."""
+        steps = []
+        for mode, key, valuekey, cast in (
+                ("normal", "NOR", "AMPLITUDE", float),
+                ("row", "ROW", "AMPLITUDE", float),
+                ("multi", "MULTI", "NSECTION", int)):
+            if self.params.get("V_PRE_XTALK_%s_CHECKED" % key) in ("", "0"):
+                continue
+            from .native import fitsio
+            from .native.xtalk import check_step
+            if not fitsio.__numpy_success__:
+                self.display_error("crosstalk correction requires numpy")
+                sys.exit(1)
+            try:
+                step = (
+                    mode,
+                    int(self.params.get("V_PRE_XTALK_%s_BUTTONID" % key)),
+                    cast(self.params.get(
+                        "V_PRE_XTALK_%s_%s" % (key, valuekey))))
+                check_step(step)
+            except ValueError as e:
+                self.display_error(
+                    "invalid %s crosstalk correction: %s" % (mode, e))
+                sys.exit(1)
+            steps.append(step)
+        return steps
+
+    def _split_folder(self, folderpath):
+        """Split the raw images in the data folder 'folderpath' (relative to
+        the main folder), correct their headers and, if selected, the
+        crosstalk. The python splitter applies the crosstalk correction while
+        splitting. Only if the splitting script has to be used, the chips are
+        corrected in a second pass."""
+        xtalk = self._crosstalk_steps()
+        folder = Folder(os.path.join(self.maindir, folderpath), self.nchips)
+        if self._split_exposures(folder, xtalk):
             code = Scripts.process_split(
-                self.instrument.NAME, self.maindir, folder.path,
+                self.instrument.NAME, self.maindir, folderpath,
                 env=self.theli_env, verb=self.verbosity)
             self.check_return_code(code)
-            if correct_xtalk:
-                # optional: cross talk correction
+            if xtalk:
+                from .native.xtalk import correct_files
                 self.display_header("Correcting for crosstalk")
-                raise NotImplementedError(
-                    "Cross talk correction not implented yet")
-        self.display_separator()
-        self.redo = False
+                self.check_native_errors(correct_files(
+                    natural_sort(folder.fits("")), xtalk,
+                    nthreads=self.ncpus))
+
+    @stage_backend("split", chipwise=False)
+    def _split_exposures(self, folder, xtalk=None):
+        """Split the raw images in 'folder' with the python splitter and
+        apply the crosstalk correction steps 'xtalk' (None or an empty list
+        for no correction).
+
+        Returns:
+            use_script [bool]:
+                whether the splitting script has to be used instead, if the
+                raw files do not match the instrument definition
+        """
+        from .native.split import check_split, split_exposures
+        rawfiles = natural_sort(folder.fits("none"))
+        reason = check_split(self.instrument, rawfiles)
+        if reason is not None:
+            self.display_warning(
+                "python splitter not applicable, using "
+                "process_split_%s.sh (%s)" % (self.instrument.NAME, reason))
+            return True
+        self.check_native_errors(split_exposures(
+            self.instrument, rawfiles, nthreads=self.ncpus, xtalk=xtalk))
+        return False
 
     def create_links(self, chip, target, params={}):
         self.params.set(params)
@@ -406,124 +725,291 @@ class Reduction(object):
             self.check_return_code(code)
         self.display_separator()
 
+    def watch_folder(self, rawdir, timeout=None, interval=2.0, params={}):
+        """Reduce raw frames incrementally as they arrive in 'rawdir'. New
+        files are classified by their header, copied to the matching data
+        folder, split and, if they are science frames, calibrated with the
+        latest master frames. Master frames are recomputed, if new bias, dark
+        or flat frames arrived. Stops after 'timeout' seconds without new
+        files or on keyboard interrupt.
+        """
+        self.params.set(params)
+        job_message = "Watching for raw data"
+        rawdir = os.path.abspath(rawdir)
+        if not os.path.isdir(rawdir):
+            self.display_header(job_message)
+            self.display_error("raw data folder invalid: %s" % rawdir)
+            sys.exit(1)
+        if self.sciencedir is None:
+            self.display_header(job_message)
+            self.display_error("science folder not specified")
+            sys.exit(1)
+        # map exposure types to data folders
+        type_folders = {
+            "bias": self.biasdir, "dark": self.darkdir, "flat": self.flatdir,
+            "standard": self.stddir, "science": self.sciencedir}
+        sortkey = self.params.get("V_SORT_FITSKEY")
+        keyvalues = {
+            "bias": self.params.get("V_SORT_BIAS"),
+            "dark": self.params.get("V_SORT_DARK"),
+            "flat": self.params.get("V_SORT_DOMEFLAT"),
+            "standard": self.params.get("V_SORT_STD")}
+        skyflat = self.params.get("V_SORT_SKYFLAT")
+        watcher = FolderWatcher(rawdir, interval=interval)
+        mode = "inotify" if watcher.uses_inotify else "polling"
+        self.display_header("%s (%s): %s" % (job_message, mode, rawdir))
+        stale_masters = set()  # frame types with new exposures
+        waiting_science = False  # science frames waiting for master frames
+        last_arrival = time()
+        try:
+            while True:
+                newfiles = watcher.wait()
+                if len(newfiles) == 0:
+                    if waiting_science and len(stale_masters) > 0:
+                        waiting_science = self._update_watched_science(
+                            stale_masters, usedark=self.darkdir is not None)
+                    if timeout is not None and time() - last_arrival > timeout:
+                        break
+                    continue
+                last_arrival = time()
+                for rawfile in newfiles:
+                    frametype = classify_exposure(rawfile, sortkey, keyvalues)
+                    if frametype == "science" and skyflat != "":
+                        if classify_exposure(
+                                rawfile, sortkey, {"flat": skyflat}) == "flat":
+                            frametype = "flat"
+                    folder = type_folders[frametype]
+                    fname = os.path.basename(rawfile)
+                    if folder is None:
+                        self.display_warning(
+                            "no %s folder specified, ignoring: %s" %
+                            (frametype, fname))
+                        continue
+                    if count_extensions(rawfile) not in (1, self.nchips):
+                        self.display_warning(
+                            "chip count does not match %s, ignoring: %s" %
+                            (self.instrument.NAME, fname))
+                        continue
+                    # ingest and split new exposure, science frames are
+                    # staged such that only new frames are calibrated
+                    self.display_header(
+                        "Splitting FITS, correcting headers (%s): %s" %
+                        (frametype, fname))
+                    if frametype in ("science", "standard"):
+                        folder = self._staging_folder(folder)
+                    target = os.path.join(folder.abs, fname)
+                    try:
+                        os.link(rawfile, target)
+                    except OSError:
+                        shutil.copy2(rawfile, target)
+                    self._split_folder(self._relpath(folder))
+                    if frametype in ("bias", "dark", "flat"):
+                        stale_masters.add(frametype)
+                    else:
+                        waiting_science = True
+                if waiting_science:
+                    waiting_science = self._update_watched_science(
+                        stale_masters, usedark=self.darkdir is not None)
+        except KeyboardInterrupt:
+            self.display_message("stopped watching %s" % rawdir)
+        finally:
+            watcher.close()
+        self.display_separator()
+
+    def _staging_folder(self, folder):
+        """Subfolder WATCH_STAGING of a data folder, created if needed."""
+        path = os.path.join(folder.abs, WATCH_STAGING)
+        os.makedirs(path, exist_ok=True)
+        return Folder(path, self.nchips)
+
+    def _update_watched_science(self, stale_masters, usedark=False):
+        """Recompute outdated master frames, calibrate the staged science
+        and standard frames and merge them with their data folder. Returns
+        True, if the calibration has to wait for more calibration frames."""
+        apply_bias = self.params.get("V_DO_BIAS") == "Y"
+        apply_flat = self.params.get("V_DO_FLAT") == "Y"
+        biasdarkdir = self.darkdir if usedark else self.biasdir
+        calibdirs = [
+            folder for folder in (self.biasdir, self.darkdir, self.flatdir)
+            if folder is not None]
+        # the splitting and master scripts change the folders behind the
+        # back of the cached FITS index
+        for folder in calibdirs:
+            folder.refresh()
+        # master bias and dark
+        for frametype, folder, script in (
+                ("bias", self.biasdir, Scripts.process_bias_para),
+                ("dark", self.darkdir, Scripts.process_dark_para)):
+            if frametype not in stale_masters or folder is None:
+                continue
+            if folder.fits_count('') < 3:
+                continue  # need at least 3 exposures
+            self.display_header("Updating master %s" % frametype)
+            folder.delete_master()
+            code = script(
+                self.maindir, folder.path,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
+            stale_masters.remove(frametype)
+        # master flat, requires the master bias
+        if "flat" in stale_masters and self.flatdir is not None and \
+                self.flatdir.fits_count('') >= 3 and \
+                not (apply_bias and "bias" in stale_masters):
+            self.display_header("Updating master flat")
+            self.flatdir.delete_master()
+            use_bias = apply_bias and self.biasdir is not None
+            code = Scripts.process_flat_para(
+                self.maindir, self.biasdir.path if use_bias else "nobiasdir",
+                self.flatdir.path, env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
+            code = Scripts.create_flat_ratio(
+                self.maindir, self.flatdir.path,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
+            code = Scripts.create_norm_para(
+                self.maindir, self.flatdir.path,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
+            stale_masters.remove("flat")
+        # the calibration must wait for the masters to become available
+        for folder in calibdirs:
+            folder.refresh()
+        if apply_bias and (
+                biasdarkdir is None or not biasdarkdir.contains_master()):
+            return True
+        if apply_flat and (
+                self.flatdir is None or not self.flatdir.contains_master()):
+            return True
+        for folder in (self.sciencedir, self.stddir):
+            if folder is None or not folder.contains(WATCH_STAGING):
+                continue
+            staging = self._staging_folder(folder)
+            if staging.contains_tag(''):
+                self.display_header("Calibrating data (%s)" % folder.path)
+                self._calibrate_folder(
+                    staging, biasdarkdir if apply_bias else None,
+                    self.flatdir if apply_flat else None)
+            folder.merge_content(WATCH_STAGING)
+            folder.refresh()
+        return False
+
     # ################## Calibration ##################
 
     def process_biases(self, minmode=None, maxmode=None, params={}):
         self.params.set(params)
         job_message = "Processsing BIASes"
         # folder verification
-        if self.biasdir is None:
-            self.display_header(job_message)
-            self.display_error("bias folder not specified")
-            sys.exit(1)
+        self.check_folders(job_message, [("biasdir", False)])
         if self.redo:
             self.biasdir.delete_master()
-        filetags = self.biasdir.tags(ignore_sub=True)
-        found_split_files = self.biasdir.contains_tag('')
-        found_masterbias = self.biasdir.contains_master()
-        split_count = self.biasdir.fits_count()
         # data verification
-        if len(filetags) > 1:
-            self.display_header(job_message)
-            self.display_error("found multiple progress stages")
-            sys.exit(1)
-        if not self.redo and found_masterbias:
-            self.display_header(job_message)
-            self.display_success("master bias found")
+        if not self.check_verification(
+                job_message, self.biasdir.verify_master("bias", self.redo)):
             self.display_separator()
             return
-        if not found_split_files:
-            self.display_header(job_message)
-            self.display_error("no split images found")
-            sys.exit(1)
-        if split_count < 3:
-            self.display_header(job_message)
-            self.display_warning(
-                "need at least 3 exposures - skipping redo")
-            sys.exit(1)
         # run jobs
         if minmode is not None and maxmode is not None:
             # optional: brightness level check
-            self.display_header("Checking brightness levels")
-            code = Scripts.check_files_para(
-                self.maindir, self.biasdir.path, "empty", minmode, maxmode,
-                env=self.theli_env, verb=self.verbosity)
-            self.check_return_code(code)
+            self._check_brightness(self.biasdir, minmode, maxmode)
         # compute master bias
         self.display_header(job_message)
-        code = Scripts.process_bias_para(
-            self.maindir, self.biasdir.path,
-            env=self.theli_env, verb=self.verbosity)
-        self.check_return_code(code)
+        if self._stack_masters(
+                self.biasdir, "V_CAL_BIASNLOW", "V_CAL_BIASNHIGH"):
+            code = Scripts.process_bias_para(
+                self.maindir, self.biasdir.path,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
         self.display_separator()
 
     def process_darks(self, minmode=None, maxmode=None, params={}):
         self.params.set(params)
         job_message = "Processsing DARKs"
         # folder verification
-        if self.darkdir is None:
-            self.display_header(job_message)
-            self.display_error("dark folder not specified")
-            sys.exit(1)
+        self.check_folders(job_message, [("darkdir", False)])
         if self.redo:
             self.darkdir.delete_master()
-        filetags = self.darkdir.tags(ignore_sub=True)
-        found_split_files = self.darkdir.contains_tag('')
-        found_masterdark = self.darkdir.contains_master()
-        split_count = self.biasdir.fits_count()
         # data verification
-        if len(filetags) > 1:
-            self.display_header(job_message)
-            self.display_error("found multiple progress stages")
-            sys.exit(1)
-        if not self.redo and found_masterdark:
-            self.display_header(job_message)
-            self.display_success("master dark found")
+        if not self.check_verification(
+                job_message, self.darkdir.verify_master("dark", self.redo)):
             self.display_separator()
             return
-        if not found_split_files:
-            self.display_header(job_message)
-            self.display_error("no split images found")
-            sys.exit(1)
-        if split_count < 3:
-            self.display_header(job_message)
-            self.display_warning(
-                "need at least 3 exposures - skipping redo")
-            sys.exit(1)
         # run jobs
         if minmode is not None and maxmode is not None:
             # optional: brightness level check
-            self.display_header("Checking brightness levels")
-            code = Scripts.check_files_para(
-                self.maindir, self.biasdir.path, "empty", minmode, maxmode,
-                env=self.theli_env, verb=self.verbosity)
-            self.check_return_code(code)
+            self._check_brightness(self.darkdir, minmode, maxmode)
         # compute master dark
         self.display_header(job_message)
-        code = Scripts.process_dark_para(
-            self.maindir, self.darkdir.path,
-            env=self.theli_env, verb=self.verbosity)
-        self.check_return_code(code)
+        if self._stack_masters(
+                self.darkdir, "V_CAL_DARKNLOW", "V_CAL_DARKNHIGH"):
+            code = Scripts.process_dark_para(
+                self.maindir, self.darkdir.path,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
         self.display_separator()
 
+    def _check_brightness(self, folder, minmode, maxmode):
+        """Move exposures in 'folder' with a mode of any chip outside
+        [minmode, maxmode] to the subfolder 'BADMODE'."""
+        self.display_header("Checking brightness levels")
+        if self._check_modes(folder, minmode, maxmode):
+            code = Scripts.check_files_para(
+                self.maindir, folder.path, "empty", minmode, maxmode,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
+
+    @stage_backend("check", chipwise=False)
+    def _check_modes(self, folder, minmode, maxmode):
+        """Check the brightness levels in 'folder' with the python backend
+        on a subsample of the rows.
+
+        Returns:
+            use_script [bool]:
+                whether the checking script has to be used instead
+        """
+        from .native import fitsio
+        from .native.check import check_folder
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python brightness check requires numpy, using THELI script")
+            return True
+        rejected, errors = check_folder(
+            self.instrument, folder.fits(""), float(minmode),
+            float(maxmode), fraction=self.check_fraction,
+            nthreads=self.ncpus)
+        for base in rejected:
+            self.display_warning(
+                "%s: mode out of range, moved to BADMODE" % base)
+        self.check_native_errors(errors)
+        return False
+
+    @stage_backend("stack")
+    def _stack_masters(self, folder, nlowkey, nhighkey):
+        """Combine the split images in 'folder' to master frames with the
+        python stacking backend, rejecting the number of low and high values
+        given by the THELI parameters 'nlowkey' and 'nhighkey'.
+
+        Returns:
+            use_script [bool]:
+                whether the stacking script has to be used instead
+        """
+        from .native import fitsio
+        from .native.stack import stack_folder
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python stacking requires numpy, using THELI script")
+            return True
+        self.check_native_errors(stack_folder(
+            self.instrument, folder.abs, folder.fits(""),
+            nlow=int(self.params.get(nlowkey) or 0),
+            nhigh=int(self.params.get(nhighkey) or 0),
+            nthreads=self.ncpus, max_bytes=int(0.4 * physical_memory())))
+        return False
+
     def process_flats(self, minmode=None, maxmode=None, params={}):
         self.params.set(params)
         # folder verification
         job_message = "Processsing FLATs"
-        if self.flatdir is None:
-            self.display_header(job_message)
-            self.display_error("flat folder not specified")
-            sys.exit(1)
-        apply_bias = self.params.get("V_DO_BIAS") == "Y"
-        if apply_bias:
-            if self.biasdir is None:
-                self.display_header(job_message)
-                self.display_error("bias folder not specified")
-                sys.exit(1)
-            if not self.biasdir.contains_master():
-                self.display_header(job_message)
-                self.display_error("master bias not found")
-                sys.exit(1)
+        self.check_folders(job_message, self.flat_requirements())
         # queue data folders (optinal: have flatoff-dir)
         self.check_filters()
         folders = [self.flatdir]
@@ -535,42 +1021,17 @@ class Reduction(object):
         if len(IDs) > 1:
             IDs[0] = " (science)"
         for folder, ID in zip(folders, IDs):
-            filetags = folder.tags(ignore_sub=True)
             if self.redo:
                 folder.delete_master()
-            found_split_files = folder.contains_tag('')
-            found_masterflat = folder.contains_master()
-            # check flat norm explicitly
-            if ID == "":
-                found_normflat = folder.search_flatnorm()
-                found_masterflat = found_masterflat & found_normflat
-            split_count = self.biasdir.fits_count()
-            # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and found_masterflat:
-                self.display_header(job_message + ID)
-                self.display_success("master flat found")
+            # data verification, check flat norm explicitly
+            if not self.check_verification(
+                    job_message + ID, folder.verify_master(
+                        "flat", self.redo, normflat=(ID == ""))):
                 continue
-            if not found_split_files:
-                self.display_header(job_message + ID)
-                self.display_error("no split images found")
-                sys.exit(1)
-            if split_count < 3:
-                self.display_header(job_message + ID)
-                self.display_warning(
-                    "need at least 3 exposures - skipping redo")
-                sys.exit(1)
             # run jobs
             if ID == "" and (minmode is not None and maxmode is not None):
                 # optional: brightness level check (flat only)
-                self.display_header("Checking brightness levels")
-                code = Scripts.check_files_para(
-                    self.maindir, self.biasdir.path, "empty", minmode, maxmode,
-                    env=self.theli_env, verb=self.verbosity)
-                self.check_return_code(code)
+                self._check_brightness(folder, minmode, maxmode)
             # compute master flats (optional with flatoff)
             self.display_header(job_message + ID)
             code = Scripts.process_flat_para(
@@ -606,32 +1067,11 @@ class Reduction(object):
         self.params.set(params)
         # folder verification
         job_message = "Calibrating data"
-        if self.sciencedir is None:
-            self.display_header(job_message)
-            self.display_error("science folder not specified")
-            sys.exit(1)
+        self.check_folders(
+            job_message, self.calibration_requirements(usedark))
         apply_flat = self.params.get("V_DO_FLAT") == "Y"
-        if apply_flat:
-            if self.flatdir is None:
-                self.display_header(job_message)
-                self.display_error("flat folder not specified")
-                sys.exit(1)
-            if not self.flatdir.contains_master():
-                self.display_header(job_message)
-                self.display_error("master flat not found")
-                sys.exit(1)
         biasdarkdir = self.darkdir if usedark else self.biasdir
-        ID_biasdark = "dark" if usedark else "bias"
         apply_biasdark = self.params.get("V_DO_BIAS") == "Y"
-        if apply_biasdark:
-            if biasdarkdir is None:
-                self.display_header(job_message)
-                self.display_error("%s folder not specified" % ID_biasdark)
-                sys.exit(1)
-            if not biasdarkdir.contains_master():
-                self.display_header(job_message)
-                self.display_error("master %s not found" % ID_biasdark)
-                sys.exit(1)
         # queue data folders (optinal: have flatoff-dir)
         self.check_filters()
         folders = [self.sciencedir]
@@ -648,41 +1088,63 @@ class Reduction(object):
             if self.redo:
                 folder.delete("*FC*")
                 folder.lift_content("SPLIT_IMAGES")
-            filetags = folder.tags(ignore_sub=True)
-            found_split_files = folder.contains_tag('')
-            found_OFC_folder = folder.contains("OFC_IMAGES")
-            found_OFC_files = folder.contains_tag('OFC')
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if found_OFC_files or found_OFC_folder:
-                self.display_header(job_message + ID)
-                self.display_success("OFC images found")
+            if not self.check_verification(
+                    job_message + ID, folder.verify_calibration()):
                 continue
-            if not found_split_files:
-                self.display_header(job_message + ID)
-                self.display_error("no split images found")
-                sys.exit(1)
             # run jobs
             if self.redo:
                 folder.move_tag("OF*", "OFC_IMAGES", ignore_sub=True)
                 folder.lift_content("SPLIT_IMAGES")
             if ID == "" and (minmode is not None and maxmode is not None):
                 # optional: brightness level check (science only)
-                self.display_header("Checking brightness levels" + ID)
-                code = Scripts.check_files_para(
-                    self.maindir, folder.path, "empty", minmode, maxmode,
-                    env=self.theli_env, verb=self.verbosity)
-                self.check_return_code(code)
+                self._check_brightness(folder, minmode, maxmode)
             # calibrate data
             self.display_header(job_message + ID)
+            self._calibrate_folder(
+                folder, biasdarkdir if apply_biasdark else None,
+                self.flatdir if apply_flat else None)
+        self.display_separator()
+
+    def _calibrate_folder(self, folder, biasdarkdir, flatdir):
+        """Calibrate the split images in 'folder' with the master frames in
+        'biasdarkdir' and 'flatdir', the bias/dark subtraction or flat
+        division is skipped if the folder is None. The calibration script
+        reads V_DO_BIAS and V_DO_FLAT itself and gets a placeholder for a
+        skipped step (like 'noskydir' of the background script)."""
+        if self._calibrate_science(folder, biasdarkdir, flatdir):
             code = Scripts.process_science_para(
-                self.maindir, biasdarkdir.path, self.flatdir.path, folder.path,
-                env=self.theli_env, verb=self.verbosity)
+                self.maindir,
+                "nobiasdir" if biasdarkdir is None
+                else self._relpath(biasdarkdir),
+                "noflatdir" if flatdir is None else self._relpath(flatdir),
+                self._relpath(folder), env=self.theli_env,
+                verb=self.verbosity)
             self.check_return_code(code)
-        self.display_separator()
+
+    @stage_backend("calibrate")
+    def _calibrate_science(self, folder, biasdarkdir, flatdir):
+        """Calibrate the split images in 'folder' with the python
+        calibration backend, subtracting the master frames in 'biasdarkdir'
+        and dividing by the master flats of 'flatdir' (skipped if None),
+        which share the normalisation of all chips.
+
+        Returns:
+            use_script [bool]:
+                whether the calibration script has to be used instead
+        """
+        from .native import fitsio
+        from .native.calibrate import calibrate_folder
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python calibration requires numpy, using THELI script")
+            return True
+        self.check_native_errors(calibrate_folder(
+            self.instrument, folder.fits(""),
+            biasdir=None if biasdarkdir is None else biasdarkdir.abs,
+            flatdir=None if flatdir is None else flatdir.abs,
+            nprocs=self.ncpus, max_bytes=int(0.4 * physical_memory())))
+        return False
 
     # ################## Background ##################
 
@@ -779,40 +1241,14 @@ class Reduction(object):
                     folder.delete("BACKGROUND")
                     folder.delete("MASK_IMAGES")
                     folder.lift_content("OFC_IMAGES")
-                filetags = seq.tags(ignore_sub=True)
-                found_input_files = any(
-                    seq.contains_tag(t) for t in THELI_TAGS["OFCB"])
-                found_output_folder = any(
-                    seq.contains(t + "B_IMAGES") for t in THELI_TAGS["OFCB"])
-                found_output_files = any(
-                    seq.contains_tag(t + "B") for t in THELI_TAGS["OFCB"])
-                input_count = seq.fits_count()
                 # data verification
-                if len(filetags) > 1:
-                    self.display_header(job_message + ID)
-                    self.display_error("found multiple progress stages")
-                    sys.exit(1)
-                if not self.redo and (
-                        found_output_files or found_output_folder):
-                    self.display_header(job_message + ID)
-                    self.display_success("OFCB images found")
-                    continue
-                if self.redo and (found_output_files or found_output_folder) \
-                        and not found_input_files:
-                    self.display_header(job_message + ID)
-                    self.display_warning("no OFC images found - skipping redo")
-                    continue
-                if not found_input_files:
-                    self.display_header(job_message + ID)
-                    self.display_error("no OFC images found")
-                    sys.exit(1)
-                if input_count < 3 and not apply_skydir:
-                    self.display_header(job_message + ID)
-                    self.display_error(
-                        "need at least 3 exposures", critical=False)
+                if not self.check_verification(
+                        job_message + ID, seq.verify_step(
+                            "B", "OFC", self.redo,
+                            min_count=0 if apply_skydir else 3)):
                     continue
                 # run jobs
-                tag = filetags.pop()
+                tag = seq.tags(ignore_sub=True).pop()
                 if self.redo:
                     seq.move_tag(tag, tag + "_IMAGES", ignore_sub=True)
                     for foldertag in THELI_TAGS["OFCB"]:
@@ -834,6 +1270,9 @@ class Reduction(object):
                         self.return_code_check(code)
                     # create background model
                     self.display_header(job_message + ID)
+                    if not self._model_background(
+                            seq, tag, apply_skydir and ID == ""):
+                        continue
                     skydir = (
                         self.skydir.path
                         if apply_skydir and ID == ""
@@ -858,6 +1297,53 @@ class Reduction(object):
                     folder.unfreeze()
         self.display_separator()
 
+    @stage_backend("background")
+    def _model_background(self, folder, tag, use_skydir):
+        """Create and apply the background models of the images in 'folder'
+        with tag 'tag' with the python background backend, the models are
+        created from the images in the sky folder, if 'use_skydir'.
+
+        Returns:
+            use_script [bool]:
+                whether the background script has to be used instead
+        """
+        from .native import fitsio
+        from .native.background import background_folder
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python background models require numpy, using THELI script")
+            return True
+        windowsize = self.params.get("V_BACK_WINDOWSIZE")
+        applymode = self.params.get("V_BACK_APPLYMODE")
+        if windowsize not in ("", "0") or applymode not in ("0", "1"):
+            self.display_warning(
+                "python background models support static models that are "
+                "subtracted or divided, using THELI script")
+            return True
+
+        def number(key, cast, default):
+            value = self.params.get(key)
+            return default if value == "" else cast(value)
+
+        expand = self.params.get("V_BACK_MASKEXPAND")
+        self.check_native_errors(background_folder(
+            folder.fits(tag),
+            modelfiles=self.skydir.fits(tag) if use_skydir else None,
+            nlow1=number("V_BACK_NLOW1", int, 0),
+            nhigh1=number("V_BACK_NHIGH1", int, 0),
+            nlow2=number("V_BACK_NLOW2", int, 0),
+            nhigh2=number("V_BACK_NHIGH2", int, 1),
+            median=self.params.get("V_BACK_COMBINEMETHOD") in (
+                "Median", "0"),
+            twopass=self.params.get("V_BACK_TWOPASS") == "Y",
+            threshold=number("V_BACK_DETECTTHRESH", float, 1.3),
+            minarea=number("V_BACK_DETECTMINAREA", int, 5),
+            expand=2 if expand == "" else int(round(2 * float(expand))),
+            smooth=self.params.get("V_BACK_SEXFILTER") == "Y",
+            applymode=int(applymode), nthreads=self.ncpus,
+            max_bytes=int(0.4 * physical_memory())))
+        return False
+
     def merge_sequence(self, params={}):
         self.params.set(params)
         job_message = "Collecting images"
@@ -935,34 +1421,13 @@ class Reduction(object):
                     if folder.contains("%s_IMAGES" % tag):
                         folder.lift_content("%s_IMAGES" % tag)
                         break
-            filetags = folder.tags(ignore_sub=True)
-            found_input_files = any(
-                folder.contains_tag(t) for t in THELI_TAGS["OFCH"])
-            found_output_folder = any(
-                folder.contains(t + "H_IMAGES") for t in THELI_TAGS["OFCH"])
-            found_output_files = any(
-                folder.contains_tag(t + "H") for t in THELI_TAGS["OFCH"])
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and (found_output_files or found_output_folder):
-                self.display_header(job_message + ID)
-                self.display_success("OFC(B)H images found")
+            if not self.check_verification(
+                    job_message + ID,
+                    folder.verify_step("H", "OFC(B)", self.redo)):
                 continue
-            if self.redo and (found_output_files or found_output_folder) and \
-                    not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_warning(
-                    "no OFC(B) images found - skipping redo")
-                continue
-            if not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_error("no OFC(B) images found")
-                sys.exit(1)
             # run jobs
-            tag = filetags.pop()
+            tag = folder.tags(ignore_sub=True).pop()
             if redo:
                 folder.move_tag(tag, tag + "_IMAGES", ignore_sub=True)
                 for foldertag in THELI_TAGS["OFCH"]:
@@ -1012,34 +1477,13 @@ class Reduction(object):
                     if folder.contains("%s_IMAGES" % tag):
                         folder.lift_content("%s_IMAGES" % tag)
                         break
-            filetags = folder.tags(ignore_sub=True)
-            found_input_files = any(
-                folder.contains_tag(t) for t in THELI_TAGS["OFCC"])
-            found_output_folder = any(
-                folder.contains(t + "C_IMAGES") for t in THELI_TAGS["OFCC"])
-            found_output_files = any(
-                folder.contains_tag(t + "C") for t in THELI_TAGS["OFCC"])
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and (found_output_files or found_output_folder):
-                self.display_header(job_message + ID)
-                self.display_success("OFC(BH)C images found")
+            if not self.check_verification(
+                    job_message + ID,
+                    folder.verify_step("C", "OFC(BH)", self.redo)):
                 continue
-            if self.redo and (found_output_files or found_output_folder) and \
-                    not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_warning(
-                    "no OFC(BH) images found - skipping redo")
-                continue
-            if not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_error("no OFC(BH) images found")
-                sys.exit(1)
             # run jobs
-            tag = filetags.pop()
+            tag = folder.tags(ignore_sub=True).pop()
             if self.redo:
                 folder.move_tag(tag, tag + "_IMAGES", ignore_sub=True)
                 for foldertag in THELI_TAGS["OFCC"]:
@@ -1095,34 +1539,13 @@ class Reduction(object):
                     if folder.contains("%s_IMAGES" % tag):
                         folder.lift_content("%s_IMAGES" % tag)
                         break
-            filetags = folder.tags(ignore_sub=True)
-            found_input_files = any(
-                folder.contains_tag(t) for t in THELI_TAGS["OFCD"])
-            found_output_folder = any(
-                folder.contains(t + "D_IMAGES") for t in THELI_TAGS["OFCD"])
-            found_output_files = any(
-                folder.contains_tag(t + "D") for t in THELI_TAGS["OFCD"])
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and (found_output_files or found_output_folder):
-                self.display_header(job_message + ID)
-                self.display_success("OFC(BHC)D images found")
+            if not self.check_verification(
+                    job_message + ID,
+                    folder.verify_step("D", "OFC(BHC)", self.redo)):
                 continue
-            if self.redo and (found_output_files or found_output_folder) and \
-                    not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_warning(
-                    "no OFC(BHC) images found - skipping redo")
-                continue
-            if not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_error("no OFC(BHC) images found")
-                sys.exit(1)
             # run jobs
-            tag = filetags.pop()
+            tag = folder.tags(ignore_sub=True).pop()
             if self.redo:
                 folder.move_tag(tag, tag + "_IMAGES", ignore_sub=True)
                 for foldertag in THELI_TAGS["OFCD"]:
@@ -1164,17 +1587,11 @@ class Reduction(object):
         if len(IDs) > 1:
             IDs[0] = " (science)"
         for folder, ID in zip(folders, IDs):
-            filetags = folder.tags(ignore_sub=True)
-            found_output_files = folder.contains_preview()
             # data verification
-            if len(filetags) < 1:
-                self.display_header(job_message + ID)
-                self.display_error("no images found")
-                sys.exit(1)
-            if not self.redo and found_output_files:
-                self.display_header(job_message + ID)
-                self.display_success("preview images found")
+            if not self.check_verification(
+                    job_message + ID, folder.verify_preview(self.redo)):
                 continue
+            filetags = folder.tags(ignore_sub=True)
             for tag in filetags:
                 # run jobs
                 if self.redo:
@@ -1183,6 +1600,9 @@ class Reduction(object):
                 tagID = " [%s]" % tag if len(filetags) > 1 else ""
                 try:
                     folder.freeze()
+                    if not self._create_previews(
+                            folder, tag, job_message + ID + tagID):
+                        continue
                     if self.nchips > 1:
                         # from multichip cameras: create fits preview
                         self.display_header(
@@ -1203,25 +1623,38 @@ class Reduction(object):
                     folder.unfreeze()
         self.display_separator()
 
+    @stage_backend("preview", chipwise=False)
+    def _create_previews(self, folder, tag, message):
+        """Create the binned previews of the images in 'folder' with tag
+        'tag' with the python preview backend.
+
+        Returns:
+            use_script [bool]:
+                whether the preview scripts have to be used instead
+        """
+        from .native import fitsio
+        from .native.preview import preview_folder
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python previews require numpy, using THELI scripts")
+            return True
+        self.display_header(message)
+        self.check_native_errors(preview_folder(
+            self.instrument, folder.fits(tag),
+            binning=int(self.params.get("V_WEIGHTBINSIZE") or 4),
+            minlevel=float(self.params.get("V_WEIGHTBINMIN") or -100),
+            maxlevel=float(self.params.get("V_WEIGHTBINMAX") or 500),
+            median=self.params.get("V_WEIGHT_BINOUTLIER") == "TRUE",
+            nthreads=self.ncpus))
+        return False
+
     def create_global_weights(self, params={}):
         self.params.set(params)
         # folder verification
         job_message = "Creating global WEIGHTs"
-        if self.sciencedir is None:
-            self.display_header(job_message)
-            self.display_error("science folder not specified")
-            sys.exit(1)
+        self.check_folders(job_message, self.global_weight_requirements())
         use_flat = self.params.get("V_GLOBW_UNIFORMWEIGHT") == "FALSE"
         self.check_filters()
-        if use_flat:
-            if self.flatdir is None:
-                self.display_header(job_message)
-                self.display_error("flat folder not specified")
-                sys.exit(1)
-            if not self.flatdir.contains_master():
-                self.display_header(job_message)
-                self.display_error("master flat not found")
-                sys.exit(1)
         # BUG: this is not intended: if many science folders have a shared
         # WEIGHTS folder, the global weight will always be reused, if the
         # reduction steps are not done all at once
@@ -1234,13 +1667,81 @@ class Reduction(object):
             return
         # run jobs
         self.display_header(job_message)
-        flatnormdir = str(self.flatdir.path) + "_norm"
-        code = Scripts.create_global_weights_para(
-            self.maindir, flatnormdir, self.sciencedir.path,
-            env=self.theli_env, verb=self.verbosity)
-        self.check_return_code(code)
+        if self._create_global_weights(use_flat):
+            flatnormdir = str(self.flatdir.path) + "_norm"
+            code = Scripts.create_global_weights_para(
+                self.maindir, flatnormdir, self.sciencedir.path,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
         self.display_separator()
 
+    def _threshold_params(self, lowkey, highkey):
+        """Read the optional limits 'lowkey' and 'highkey' (None if
+        empty)."""
+        limits = []
+        for key in (lowkey, highkey):
+            value = self.params.get(key)
+            limits.append(None if value in ("", None) else float(value))
+        return limits
+
+    def _unsupported_weight_params(self, keys):
+        """Return the parameters of 'keys' that enable a masking step of the
+        THELI weighting scripts that the python weight backend does not
+        implement."""
+        active = []
+        for key in keys:
+            value = self.params.get(key)
+            if key == "V_MASKBLOOMSPIKE":
+                if value == "1":
+                    active.append(key)
+            elif value != "":
+                active.append(key)
+        return active
+
+    @stage_backend("weights")
+    def _create_global_weights(self, use_flat):
+        """Create the global weights with the python weight backend from
+        the normalised flat (or uniform weights) and the master dark (or
+        bias, if no dark folder is specified).
+
+        Returns:
+            use_script [bool]:
+                whether the weighting script has to be used instead
+        """
+        from .native import fitsio
+        from .native.weights import global_weights
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python weights require numpy, using THELI script")
+            return True
+        unsupported = self._unsupported_weight_params((
+            "V_DEFECT_KERNELSIZE", "V_DEFECT_ROWTOL", "V_DEFECT_COLTOL",
+            "V_DEFECT_CLUSTOL", "V_DEFECT_KERNELSIZE_SF",
+            "V_DEFECT_ROWTOL_SF", "V_DEFECT_COLTOL_SF",
+            "V_DEFECT_CLUSTOL_SF"))
+        if len(unsupported) > 0:
+            self.display_warning(
+                "python weights do not detect defects (%s), using THELI "
+                "script" % ", ".join(unsupported))
+            return True
+        flatmin, flatmax = self._threshold_params(
+            "V_GLOBWFLATMIN", "V_GLOBWFLATMAX")
+        darkmin, darkmax = self._threshold_params(
+            "V_GLOBWDARKMIN", "V_GLOBWDARKMAX")
+        darkdir = None
+        if darkmin is not None or darkmax is not None:
+            darkdir = self.darkdir if self.darkdir is not None \
+                else self.biasdir
+        self.check_native_errors(global_weights(
+            self.sciencedir.fits(ignore_sub=True),
+            os.path.join(self.maindir, "WEIGHTS"),
+            normdir=self.flatdir.abs + "_norm" if use_flat else None,
+            darkdir=None if darkdir is None else darkdir.abs,
+            flatmin=flatmin, flatmax=flatmax, darkmin=darkmin,
+            darkmax=darkmax, nprocs=self.ncpus,
+            max_bytes=int(0.4 * physical_memory())))
+        return False
+
     def create_weights(self, params={}):
         self.params.set(params)
         job_message = "Creating WEIGHTs"
@@ -1261,16 +1762,17 @@ class Reduction(object):
         if len(IDs) > 1:
             IDs[0] = " (science)"
         for folder, ID in zip(folders, IDs):
-            filetags = folder.tags(ignore_sub=True)
-            found_output_files, timestamps_fine = folder.check_weight()
             # data verification
-            if not self.redo and found_output_files and timestamps_fine:
-                self.display_header(job_message)
-                self.display_success("weight maps found")
+            if not self.check_verification(
+                    job_message + ID, folder.verify_weights(self.redo)):
                 continue
+            filetags = folder.tags(ignore_sub=True)
             # run jobs
             for tag in filetags:
                 tagID = " [%s]" % tag if len(filetags) > 1 else ""
+                if not self._create_weights(
+                        folder, tag, job_message + ID + tagID):
+                    continue
                 self.display_header("Transforming DS9 masks" + ID + tagID)
                 code = Scripts.transform_ds9_reg(
                     self.maindir, self.sciencedir.path,
@@ -1283,6 +1785,40 @@ class Reduction(object):
                 self.check_return_code(code)
         self.display_separator()
 
+    @stage_backend("weights")
+    def _create_weights(self, folder, tag, message):
+        """Create the weights of the images in 'folder' with tag 'tag' with
+        the python weight backend, applying the pixel value thresholds and
+        the DS9 region masks in the subfolder 'reg'.
+
+        Returns:
+            use_script [bool]:
+                whether the weighting scripts have to be used instead
+        """
+        from .native import fitsio
+        from .native.weights import image_weights
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python weights require numpy, using THELI scripts")
+            return True
+        unsupported = self._unsupported_weight_params((
+            "V_COSMICSTHRESHOLD", "V_MASKBLOOMSPIKE"))
+        if len(unsupported) > 0:
+            self.display_warning(
+                "python weights do not mask cosmics or blooming spikes "
+                "(%s), using THELI scripts" % ", ".join(unsupported))
+            return True
+        self.display_header(message)
+        low, high = self._threshold_params(
+            "V_WEIGHTLOWTHRESHOLD", "V_WEIGHTHIGHTHRESHOLD")
+        regdir = os.path.join(folder.abs, "reg")
+        self.check_native_errors(image_weights(
+            folder.fits(tag), os.path.join(self.maindir, "WEIGHTS"),
+            regdir=regdir if os.path.isdir(regdir) else None,
+            low=low, high=high, nprocs=self.ncpus,
+            max_bytes=int(0.4 * physical_memory())))
+        return False
+
     def distribute_target_sets(self, minoverlap, params={}):
         self.params.set(params)
         job_message = "Separating different target fields"
@@ -1333,18 +1869,11 @@ class Reduction(object):
             self.display_error("science folder not specified")
             sys.exit(1)
         # data verification
-        filetags = self.sciencedir.tags(ignore_sub=True)
-        found_refcat = self.sciencedir.contains_refcatfiles()
-        if len(filetags) > 1:
-            self.display_header(job_message)
-            self.display_error("found multiple progress stages")
-            sys.exit(1)
-        if not self.redo and found_refcat:
-            self.display_header(job_message)
-            self.display_success("reference catalogue found")
+        if not self.check_verification(
+                job_message, self.sciencedir.verify_refcat(self.redo)):
             self.display_separator()
             return
-        tag = filetags.pop()
+        tag = self.sciencedir.tags(ignore_sub=True).pop()
         # create a reference time spam of if old version of catalogue exists
         refcatpath = os.path.join(
             self.sciencedir.abs, "cat", "ds9cat", "theli_mystd.reg")
@@ -1589,17 +2118,11 @@ class Reduction(object):
         if len(IDs) > 1:
             IDs[0] = " (science)"
         for folder, ID in zip(folders, IDs):
-            filetags = folder.tags(ignore_sub=True)
-            found_cat = folder.contains_catfiles()
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and found_cat:
-                self.display_header(job_message + ID)
-                self.display_success("image catalogues found")
+            if not self.check_verification(
+                    job_message + ID, folder.verify_catalogs(self.redo)):
                 continue
+            filetags = folder.tags(ignore_sub=True)
             # run jobs
             for tag in filetags:
                 tagID = " [%s]" % tag if len(filetags) > 1 else ""
@@ -1677,17 +2200,11 @@ class Reduction(object):
         if len(IDs) > 1:
             IDs[0] = " (science)"
         for folder, ID in zip(folders, IDs):
-            filetags = folder.tags(ignore_sub=True)
-            found_headers = folder.contains_astrometry()
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and found_headers:
-                self.display_header(job_message + ID)
-                self.display_success("astrometric headers found")
+            if not self.check_verification(
+                    job_message + ID, folder.verify_astrometry(self.redo)):
                 continue
+            filetags = folder.tags(ignore_sub=True)
             # run jobs
             for tag in filetags:
                 tagID = " [%s]" % tag if len(filetags) > 1 else ""
@@ -1747,8 +2264,181 @@ class Reduction(object):
                     raise
                 finally:
                     folder.unfreeze()
+            # make the solutions available for 'reduce_single'
+            self._cache_astrometry(folder)
         self.display_separator()
 
+    def _cache_astrometry(self, folder):
+        """Store the astrometric solution of each exposure in 'folder' in the
+        astrometry cache of the instrument."""
+        headerdir = os.path.join(folder.abs, "headers")
+        if not os.path.isdir(headerdir):
+            return
+        # collect header files per exposure
+        exposures = {}
+        for head in os.listdir(headerdir):
+            if not head.endswith(".head"):
+                continue
+            base, chip = os.path.splitext(head)[0].rsplit("_", 1)
+            if chip.isdigit():
+                exposures.setdefault(base, {})[int(chip)] = os.path.join(
+                    headerdir, head)
+        # the first chip of each exposure defines the pointing
+        firstchips = {}
+        for fitsfile in folder.fits(ignore_sub=True):
+            base, tag = os.path.basename(fitsfile).rsplit("_", 1)
+            if ''.join([i for i in tag if i.isdigit()]) == "1":
+                firstchips[base] = fitsfile
+        cache = AstrometryCache(
+            self.instrument.NAME,
+            radius=float(self.params.get("V_SCAMP_MAXOFFSET")))
+        for base, headers in exposures.items():
+            if base not in firstchips:
+                continue
+            try:
+                ra, dec, filterkey = get_FITS_header_values(
+                    firstchips[base], ["CRVAL1", "CRVAL2", "FILTER"])
+            except KeyError:
+                continue
+            cache.store(float(ra), float(dec), str(filterkey), headers)
+        cache.save()
+
+    def reduce_single(self, rawfile, usedark=False, params={}):
+        """Fast reduction of a single science exposure for transient follow-
+        up. Reuses the existing master bias/dark and flat, the global weights
+        and a cached astrometric solution of the same pointing (see
+        '_cache_astrometry'), if available. The exposure is reduced in its own
+        subfolder '[science]_[exposure]' of the main folder, the other data
+        folders are never scanned.
+
+        Arguments:
+            rawfile [string]:
+                path to the raw exposure
+            usedark [bool]:
+                use the master dark instead of the master bias
+        Returns:
+            folder [Folder]:
+                folder containing the reduced exposure
+        """
+        self.params.set(params)
+        job_message = "Reducing single exposure"
+        rawfile = os.path.abspath(rawfile)
+        if not os.path.isfile(rawfile):
+            self.display_header(job_message)
+            self.display_error("raw exposure not found: %s" % rawfile)
+            sys.exit(1)
+        if self.sciencedir is None:
+            self.display_header(job_message)
+            self.display_error("science folder not specified")
+            sys.exit(1)
+        start = time()
+        # check calibration data by their expected file names only
+        biasdarkdir = self.darkdir if usedark else self.biasdir
+        ID_biasdark = "dark" if usedark else "bias"
+        chips = range(1, self.nchips + 1)
+        required = [os.path.join(
+            self.maindir, "WEIGHTS", "globalweight_%d.fits" % chip)
+            for chip in chips]
+        if self.params.get("V_DO_BIAS") == "Y":
+            if biasdarkdir is None:
+                self.display_header(job_message)
+                self.display_error("%s folder not specified" % ID_biasdark)
+                sys.exit(1)
+            required.extend(os.path.join(
+                biasdarkdir.abs, "%s_%d.fits" % (biasdarkdir.path, chip))
+                for chip in chips)
+        if self.params.get("V_DO_FLAT") == "Y":
+            if self.flatdir is None:
+                self.display_header(job_message)
+                self.display_error("flat folder not specified")
+                sys.exit(1)
+            required.extend(os.path.join(
+                self.flatdir.abs, "%s_%d.fits" % (self.flatdir.path, chip))
+                for chip in chips)
+        for path in required:
+            if not os.path.exists(path):
+                self.display_header(job_message)
+                self.display_error("calibration file not found: %s" % path)
+                sys.exit(1)
+        # set up a folder containing only this exposure
+        rawbase = os.path.splitext(os.path.basename(rawfile))[0]
+        singlepath = "%s_%s" % (self.sciencedir.path, rawbase)
+        singledir = os.path.join(self.maindir, singlepath)
+        check_system_lock()
+        if os.path.exists(singledir):
+            shutil.rmtree(singledir)
+        os.mkdir(singledir)
+        try:
+            os.link(rawfile, os.path.join(
+                singledir, os.path.basename(rawfile)))
+        except OSError:
+            shutil.copy2(rawfile, singledir)
+        # the reference catalogue of the science folder covers the pointing
+        refcat = os.path.join(self.sciencedir.abs, "cat")
+        if os.path.isdir(refcat):
+            shutil.copytree(
+                refcat, os.path.join(singledir, "cat"),
+                ignore=lambda d, files: [
+                    f for f in files if not f.startswith("theli_mystd") and
+                    not os.path.isdir(os.path.join(d, f))])
+        # run jobs
+        self.display_header("%s: %s" % (job_message, rawbase))
+        self._split_folder(singlepath)
+        self.display_header("Calibrating data (single)")
+        self._calibrate_folder(
+            Folder(singledir, self.nchips),
+            biasdarkdir if self.params.get("V_DO_BIAS") == "Y" else None,
+            self.flatdir if self.params.get("V_DO_FLAT") == "Y" else None)
+        tag = "OFC"
+        self.display_header("Creating WEIGHTs (single)")
+        code = Scripts.create_weights_para(
+            self.maindir, singlepath, tag,
+            env=self.theli_env, verb=self.verbosity)
+        self.check_return_code(code)
+        # the split script may rename the exposure
+        firstchip = [f for f in os.listdir(singledir)
+                     if f.endswith("_1%s.fits" % tag)][0]
+        base = firstchip.rsplit("_", 1)[0]
+        ra, dec, filterkey = get_FITS_header_values(
+            os.path.join(singledir, firstchip), ["CRVAL1", "CRVAL2", "FILTER"])
+        ra, dec, filterkey = float(ra), float(dec), str(filterkey)
+        cache = AstrometryCache(
+            self.instrument.NAME,
+            radius=float(self.params.get("V_SCAMP_MAXOFFSET")))
+        entry = cache.lookup(ra, dec, filterkey)
+        self.display_header("Calculating astrometric solution (single)")
+        if entry is not None:
+            cache.restore(
+                entry, ra, dec, base, os.path.join(singledir, "headers"))
+            self.display_success("cached solution", prefix="REUSED:")
+        else:
+            if not os.path.exists(os.path.join(
+                    singledir, "cat", "ds9cat", "theli_mystd.reg")):
+                code = Scripts.create_astrorefcat_fromWEB(
+                    self.maindir, singlepath, tag,
+                    env=self.theli_env, verb=self.verbosity)
+                self.check_return_code(code)
+            code = Scripts.create_astromcats_para(
+                self.maindir, singlepath, tag,
+                env=self.theli_env, verb=self.verbosity)
+            self.check_return_code(code)
+            if self.nchips > 1:
+                code = Scripts.create_scampcats(
+                    self.maindir, singlepath, tag,
+                    env=self.theli_env, verb=self.verbosity)
+                self.check_return_code(code)
+            code = Scripts.create_scamp(
+                self.maindir, singlepath, tag, False,
+                env=self.theli_env, verb=self.verbosity,
+                ignoreerr=["Segmentation fault"],
+                ignoremsg=["ignored segmentation fault in scamp"])
+            self.check_return_code(code)
+            self._cache_astrometry(Folder(singledir, self.nchips))
+        self.display_message(
+            "reduced %s in %.1f s" % (base, time() - start))
+        self.display_separator()
+        return Folder(singledir, self.nchips)
+
     def astrometry_update_header(self, params={}):
         """
         see: void theliForm::update_zeroheader
@@ -1790,29 +2480,12 @@ class Reduction(object):
         if len(IDs) > 1:
             IDs[0] = " (science)"
         for folder, ID in zip(folders, IDs):
-            filetags = folder.tags(ignore_sub=True)
-            found_input_files = any(
-                folder.contains_tag(t) for t in THELI_TAGS["OFC.sub"])
-            found_output_files = any(
-                folder.contains_tag(t + ".sub") for t in THELI_TAGS["OFC.sub"])
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and found_output_files:
-                self.display_header(job_message + ID)
-                self.display_success("OFC(BHCP).sub images found")
+            if not self.check_verification(
+                    job_message + ID, folder.verify_step(
+                        ".sub", "OFC(BHCP)", self.redo, archive=False)):
                 continue
-            if self.redo and found_output_files and not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_warning(
-                    "no OFC(BHCP) images found - skipping redo")
-                continue
-            if not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_error("no OFC(BHCP) images found")
-                sys.exit(1)
+            filetags = folder.tags(ignore_sub=True)
             # run jobs
             for tag in filetags:
                 tagID = " [%s]" % tag if len(filetags) > 1 else ""
@@ -1866,49 +2539,10 @@ class Reduction(object):
             IDs[0] = " (science)"
         for folder, ID in zip(folders, IDs):
             filetags = folder.tags(ignore_sub=True)
-            found_input_files = any(
-                folder.contains_tag(t) for t in THELI_TAGS["OFC.sub"])
-            found_weights, timestamps_fine = folder.check_weight()
-            found_headers = folder.contains("headers")
-            found_output_files = folder.contains_coadds()
             # data verification
-            if len(filetags) > 1:
-                self.display_header(job_message + ID)
-                self.display_error("found multiple progress stages")
-                sys.exit(1)
-            if not self.redo and found_output_files:
-                self.display_header(job_message + ID)
-                self.display_success("coadd images found")
+            if not self.check_verification(
+                    job_message + ID, folder.verify_coadd(self.redo)):
                 continue
-            if self.redo and found_output_files and not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_warning(
-                    "no OFC(BHCP) images found - skipping redo")
-                continue
-            if self.redo and found_output_files and not found_weights:
-                self.display_header(job_message + ID)
-                self.display_warning("no weight maps found - skipping redo")
-                continue
-            if self.redo and found_output_files and not found_headers:
-                self.display_header(job_message + ID)
-                self.display_warning(
-                    "no astrometric header files found - skipping redo")
-                continue
-            if not found_input_files:
-                self.display_header(job_message + ID)
-                self.display_error("no OFC(BHCP) images found")
-                sys.exit(1)
-            if not found_weights:
-                self.display_header(job_message + ID)
-                self.display_error("no weight maps found")
-                sys.exit(1)
-            if not found_headers:
-                self.display_header(job_message + ID)
-                self.display_error("no astrometric header files found")
-                self.exit(1)
-            if not timestamps_fine:
-                self.display_header(job_message + ID)
-                self.display_warning("weight maps possibly outdated")
             # run jobs
             tag = filetags.pop()
             # read out current filter -> if not set manually
@@ -1957,10 +2591,11 @@ class Reduction(object):
                 if do_cosmics_filtering:
                     # filter outliers
                     self.display_header("Coaddition: rejecting outliers" + ID)
-                    code = Scripts.resample_filtercosmics(
-                        self.maindir, self.sciencedir.path,
-                        env=self.theli_env, verb=self.verbosity)
-                    self.check_return_code(code)
+                    if self._filter_outliers(folder):
+                        code = Scripts.resample_filtercosmics(
+                            self.maindir, self.sciencedir.path,
+                            env=self.theli_env, verb=self.verbosity)
+                        self.check_return_code(code)
                 # coaddition
                 self.display_header("Coaddition: coadding images" + ID)
                 code = Scripts.perform_coadd_swarp(
@@ -1979,6 +2614,44 @@ class Reduction(object):
                 folder.unfreeze()
         self.display_separator()
 
+    def _coadd_folder(self, folder):
+        """Coaddition folder of the data folder 'folder', relative to the
+        main folder."""
+        ident = self.params.get("V_COADD_IDENT")
+        if ident == "(null)":
+            ident = "null"
+        return os.path.join(self._relpath(folder), "coadd_" + ident)
+
+    @stage_backend("outliers", chipwise=False,
+                   inplace=lambda self, folder: [self._coadd_folder(folder)])
+    def _filter_outliers(self, folder):
+        """Reject outliers of the resampled images in the coaddition folder
+        of 'folder' with the python outlier backend by setting their weight
+        to zero.
+
+        Returns:
+            use_script [bool]:
+                whether the filtering script has to be used instead
+        """
+        from .native import fitsio
+        from .native.outliers import filter_outliers
+        if not fitsio.__numpy_success__:
+            self.display_warning(
+                "python outlier rejection requires numpy, using THELI "
+                "scripts")
+            return True
+        clustersize = self.params.get("V_COADD_FILTERCLUSTERSIZE")
+        borderwidth = self.params.get("V_COADD_FILTERBORDERWIDTH")
+        nrejected, errors = filter_outliers(
+            os.path.join(self.maindir, self._coadd_folder(folder)),
+            float(self.params.get("V_COADD_FILTERTHRESHOLD")),
+            clustersize=int(clustersize) if clustersize != "" else 1,
+            borderwidth=int(borderwidth) if borderwidth != "" else 0,
+            nprocs=self.ncpus, max_bytes=int(0.4 * physical_memory()))
+        self.display_message("rejected %d pixels" % nrejected)
+        self.check_native_errors(errors)
+        return False
+
     def resolve_links(self, params={}):
         # if (command.find("resolvelinks.sh") != -1)
         # reply.append("Resolving link structure ...");
@@ -0,0 +1,179 @@
+"""
+Defines functions to query the system resources available to the reduction
+"""
+
+import os
+from math import ceil
+
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def _cgroup_paths():
+    """Parse /proc/self/cgroup into a dictionary that maps the controller
+    names to the cgroup of this process, the unified (v2) hierarchy is
+    stored with the key ''."""
+    paths = {}
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                _, controllers, path = line.rstrip("\n").split(":", 2)
+                for controller in controllers.split(","):
+                    paths[controller] = path
+    except (OSError, ValueError):
+        pass
+    return paths
+
+
+def _read_cgroup(controller, name):
+    """Read a cgroup control file, first of the unified (v2) hierarchy, then
+    of the controller's v1 hierarchy.
+
+    Arguments:
+        controller [string]:
+            v1 controller name (e.g. 'memory')
+        name [tuple]:
+            file names in the v2 and v1 hierarchy, None if not present
+    Returns:
+        content [string]:
+            content of the file, None if it does not exist
+    """
+    paths = _cgroup_paths()
+    candidates = []
+    if name[0] is not None and "" in paths:
+        candidates.append(os.path.join(
+            CGROUP_ROOT, paths[""].lstrip("/"), name[0]))
+        candidates.append(os.path.join(CGROUP_ROOT, name[0]))
+    if name[1] is not None and controller in paths:
+        candidates.append(os.path.join(
+            CGROUP_ROOT, controller, paths[controller].lstrip("/"), name[1]))
+        # inside containers the cgroup path is often not mounted
+        candidates.append(os.path.join(CGROUP_ROOT, controller, name[1]))
+    for candidate in candidates:
+        try:
+            with open(candidate) as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def available_cpus():
+    """Return the number of CPUs this process may use, respecting the CPU
+    affinity mask (e.g. set by Slurm or taskset) and cgroup CPU quotas of
+    containers."""
+    try:
+        ncpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        ncpus = os.cpu_count() or 1
+    quota, period = None, None
+    content = _read_cgroup("cpu", ("cpu.max", None))
+    if content is not None:  # v2: "$MAX $PERIOD", $MAX may be "max"
+        values = content.split()
+        if values[0] != "max":
+            quota, period = int(values[0]), int(values[1])
+    else:  # v1: quota is -1 if unlimited
+        content = _read_cgroup("cpu", (None, "cpu.cfs_quota_us"))
+        if content is not None and int(content) > 0:
+            period = _read_cgroup("cpu", (None, "cpu.cfs_period_us"))
+            if period is not None:
+                quota, period = int(content), int(period)
+    if quota is not None and period:
+        ncpus = min(ncpus, int(ceil(quota / period)))
+    return max(1, ncpus)
+
+
+def memory_limit():
+    """Return the cgroup memory limit in bytes, None if there is none."""
+    content = _read_cgroup(
+        "memory", ("memory.max", "memory.limit_in_bytes"))
+    if content is None or content == "max":
+        return None
+    limit = int(content)
+    # v1 reports an unlimited group as a huge, page aligned number
+    if limit >= os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'):
+        return None
+    return limit
+
+
+def _read_meminfo():
+    """Parse /proc/meminfo into a dictionary with values in bytes."""
+    meminfo = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                value = value.split()
+                meminfo[key] = int(value[0]) * (
+                    1024 if len(value) > 1 else 1)
+    except (OSError, ValueError):
+        pass
+    return meminfo
+
+
+def physical_memory():
+    """Return the physical memory of the machine in bytes, limited by the
+    cgroup memory limit."""
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limit = memory_limit()
+    if limit is not None:
+        memory = min(memory, limit)
+    return memory
+
+
+def free_memory():
+    """Return the memory in bytes that is currently available for new
+    processes without swapping (MemAvailable), limited by the unused part of
+    the cgroup memory limit. Falls back to the physical memory if it cannot
+    be determined."""
+    meminfo = _read_meminfo()
+    try:
+        memory = meminfo["MemAvailable"]
+    except KeyError:
+        memory = physical_memory()
+    limit = memory_limit()
+    if limit is not None:
+        usage = _read_cgroup(
+            "memory", ("memory.current", "memory.usage_in_bytes"))
+        usage = 0 if usage is None else int(usage)
+        memory = min(memory, max(0, limit - usage))
+    return memory
+
+
+def process_tree_rss(pid):
+    """Sum the resident set size of process 'pid' and all its descendants.
+
+    Arguments:
+        pid [int]:
+            process ID of the root process
+    Returns:
+        rss [int]:
+            resident memory in bytes, 0 if not supported by the system
+    """
+    pagesize = os.sysconf('SC_PAGE_SIZE')
+    try:
+        procs = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return 0
+    # build the parent -> children map of all processes
+    children = {}
+    for proc in procs:
+        try:
+            with open("/proc/%s/stat" % proc) as f:
+                # the command name may contain spaces and is enclosed by ()
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(proc))
+    # sum the resident pages of the tree
+    rss = 0
+    queue = [pid]
+    while len(queue) > 0:
+        proc = queue.pop()
+        queue.extend(children.get(proc, []))
+        try:
+            with open("/proc/%d/statm" % proc) as f:
+                rss += int(f.read().split()[1]) * pagesize
+        except (OSError, IndexError, ValueError):
+            continue
+    return rss
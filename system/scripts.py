@@ -7,6 +7,7 @@ import os
 import sys
 import subprocess
 from inspect import stack
+from functools import wraps
 
 from .base import DIRS, LOCKFILE, LOGFILE, check_system_lock
 
@@ -83,6 +84,175 @@ ERR_EXCEPT = [
     "CDSCLIENT_EXEC keyword unknown"]
 
 
+# objects that observe the script calls (instances of CallMonitor)
+CALL_MONITORS = []
+
+
+class CallMonitor(object):
+    """Base class for objects that are notified about the script calls of
+    'checked_call'. Register instances with 'add_call_monitor'. The methods
+    receive the script name and its argument list and must not raise
+    exceptions."""
+
+    def call_prepare(self, script, arglist):
+        """Called before the system lock is created and the script starts
+        (e.g. to update THELI parameters)."""
+        pass
+
+    def call_started(self, script, arglist, process):
+        """Called after the script process 'process' started."""
+        pass
+
+    def call_output(self, script, line):
+        """Called with each line of the script output while it runs. Must
+        return quickly, since it blocks the log capture."""
+        pass
+
+    def call_finished(self, script, arglist, process, return_code):
+        """Called after the script finished and its log was scanned,
+        'return_code' is None if the call was interrupted. The monitors are
+        called in reverse order of registration, such that parameters
+        changed in 'call_prepare' are restored in reverse order."""
+        pass
+
+
+def add_call_monitor(monitor):
+    """Register a CallMonitor instance, replacing any registered monitor of
+    the same class."""
+    remove_call_monitor(type(monitor))
+    CALL_MONITORS.append(monitor)
+
+
+def remove_call_monitor(monitor_class):
+    """Unregister all monitors of class 'monitor_class'."""
+    CALL_MONITORS[:] = [
+        m for m in CALL_MONITORS if type(m) is not monitor_class]
+
+
+# reduction stages with alternative implementations and the Scripts methods
+# they replace
+BACKEND_STAGES = {
+    "split": ("process_split",),
+    "check": ("check_files_para",),
+    "stack": ("process_bias_para", "process_dark_para"),
+    "calibrate": ("process_science_para",),
+    "background": ("process_background_para",),
+    "preview": ("make_album", "create_tiff"),
+    "weights": (
+        "create_global_weights_para", "transform_ds9_reg",
+        "create_weights_para"),
+    "outliers": ("resample_filtercosmics",)}
+
+# names of the alternative implementations of each stage ('shell' are the
+# THELI scripts)
+BACKENDS = {stage: [] for stage in BACKEND_STAGES}
+
+
+def register_backend(stage, name):
+    """Register the alternative implementation 'name' of a reduction stage
+    (see BACKEND_STAGES)."""
+    if stage not in BACKEND_STAGES:
+        raise KeyError("unknown reduction stage: %s" % stage)
+    if name in ("shell", "shadow"):
+        raise ValueError("reserved backend name: %s" % name)
+    if name not in BACKENDS[stage]:
+        BACKENDS[stage].append(name)
+
+
+def backend_choices(stage):
+    """Valid selections of the implementation of a reduction stage: 'shell',
+    the registered implementations and 'shadow', which runs the scripts and
+    compares their outputs with the python implementation."""
+    choices = ["shell"] + BACKENDS[stage]
+    if "python" in BACKENDS[stage]:
+        choices.append("shadow")
+    return tuple(choices)
+
+
+def stage_backend(stage, name="python", chipwise=True, inplace=None):
+    """Decorator that registers a method of the reduction class as the
+    implementation 'name' of a reduction stage. The method takes the
+    arguments of the stage and returns whether the scripts have to be used
+    instead. Calls are dispatched by the selection in the 'backends'
+    attribute of the reduction:
+        'shell': the method is skipped and the scripts are used
+        'shadow': the method runs on a copy of a subset of the chips (see
+                  the 'run_shadow' method of the reduction) and the scripts
+                  are used
+        'name': the method is called
+
+    Arguments:
+        stage [string]:
+            reduction stage (see BACKEND_STAGES)
+        name [string]:
+            name of the implementation
+        chipwise [bool]:
+            whether the chips are processed independently, otherwise shadow
+            runs use all chips
+        inplace [function]:
+            for methods that modify their input files: function of the
+            reduction and the method arguments that returns the folders
+            (relative to the main folder) the method reads and writes. Only
+            these are copied for shadow runs, the other stages link all
+            folders.
+    """
+    register_backend(stage, name)
+
+    def decorator(method):
+        @wraps(method)
+        def dispatch(self, *args):
+            selection = self.backends[stage]
+            if selection == name:
+                return method(self, *args)
+            if selection == "shadow" and name == "python":
+                self.run_shadow(
+                    stage, method, args, chipwise,
+                    None if inplace is None else inplace(self, *args))
+            return True
+
+        return dispatch
+
+    return decorator
+
+
+def scan_log(lines, ignoreerr=[], ignoremsg=[]):
+    """Scan the lines of a script log for error messages.
+
+    Arguments:
+        lines [list of strings]:
+            lines of the log
+        ignoreerr [list of strings]:
+            error keywords to ignore in log
+        ignoremsg [list of strings]:
+            message to display, if an error is ignored in log
+    Returns:
+        return_code [2-dim tuple]:
+            line number and line text in which error occured, if no error
+            occured, return (0, "")
+        warnings [list of 2-dim tuple]:
+            for each ignored error it contains a tuple with line and message
+            to disply for an ignored error
+    """
+    return_code = (0, "")
+    warnings = []
+    for i, line in enumerate(lines, 1):
+        # check if line contains error message
+        got_error = any(err in line for err in ERR_KEYS)
+        is_false_detection = any(err in line for err in ERR_EXCEPT)
+        # check if the error should explicitly be ignored
+        if got_error and not is_false_detection:
+            # error is valid
+            if not any(ignore in line for ignore in ignoreerr):
+                return_code = (i, line)
+                break
+            # error will be handled as warning
+            else:
+                for i, ignore in enumerate(ignoreerr, 1):
+                    msg = ignoremsg[i - 1] if len(ignoremsg) >= i else ""
+                    warnings.append([ignore, msg])
+    return return_code, warnings
+
+
 def checked_call(script, arglist=None, parallel=False, **kwargs):
     """Set up shell environment, call GUI script, capture log and scan it for
     possible errors.
@@ -126,40 +296,41 @@ def checked_call(script, arglist=None, parallel=False, **kwargs):
         cmdstr = [os.path.join(".", script)]
     if arglist is not None:
         cmdstr.extend(arglist)
+    for monitor in CALL_MONITORS:
+        monitor.call_prepare(script, arglist)
     # test if any other instance is running
     check_system_lock()
     # create a lock file, prohibiting the system to run a parallel task
     os.system("touch %s 2>&1" % LOCKFILE)
+    call = None
+    return_code = None
     try:
         # execute command and get log
         call = subprocess.Popen(
             cmdstr, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
             shell=False, cwd=scriptdir, env=env)
+        for monitor in CALL_MONITORS:
+            monitor.call_started(script, arglist, call)
+        # monitors that process the output line by line
+        readers = [
+            m for m in CALL_MONITORS
+            if type(m).call_output is not CallMonitor.call_output]
         # highest verbosity level, dump all logs to stdout and log files
         if verbosity > 1:
             sys.stdout.write("\n")
-            # read bytewise from pipe, buffer till newline, flush to stdout
-            stdout = []
-            line = b""
-            while call.poll() is None:
-                out = call.stdout.read(1)
-                line += out
-                if out == b'\n':  # if newline, flush line to stdout
-                    strline = line.decode("utf-8")
-                    sys.stdout.write(strline)
-                    sys.stdout.flush()
-                    stdout.append(strline.rstrip())
-                    line = b""
-            # capture remaining buffer
-            if out != b'\n':
-                line += b'\n'
-                strline = line.decode("utf-8")
+        # read the pipe line by line, optionally flush lines to stdout
+        stdout = []
+        for rawline in call.stdout:
+            strline = rawline.decode("utf-8", errors="replace")
+            if verbosity > 1:
                 sys.stdout.write(strline)
                 sys.stdout.flush()
-                stdout.append(strline.rstrip())
-        else:  # capture log only
-            stdout = call.communicate()[0].decode("utf-8").splitlines()
-            stdout.append("")
+            strline = strline.rstrip("\r\n")
+            stdout.append(strline)
+            for monitor in readers:
+                monitor.call_output(script, strline)
+        call.wait()
+        stdout.append("")
     except Exception as e:
         try:
             call.kill()
@@ -168,23 +339,7 @@ def checked_call(script, arglist=None, parallel=False, **kwargs):
         raise e
     else:
         # scan log for errors
-        return_code = (0, "")
-        warnings = []
-        for i, line in enumerate(stdout, 1):
-            # check if line contains error message
-            got_error = any(err in line for err in ERR_KEYS)
-            is_false_detection = any(err in line for err in ERR_EXCEPT)
-            # check if the error should explicitly be ignored
-            if got_error and not is_false_detection:
-                # error is valid
-                if not any(ignore in line for ignore in ignoreerr):
-                    return_code = (i, line)
-                    break
-                # error will be handled as warning
-                else:
-                    for i, ignore in enumerate(ignoreerr, 1):
-                        msg = ignoremsg[i - 1] if len(ignoremsg) >= i else ""
-                        warnings.append([ignore, msg])
+        return_code, warnings = scan_log(stdout, ignoreerr, ignoremsg)
         # write out log
         caller = stack()[1][3]
         logfile = os.path.join(
@@ -204,6 +359,8 @@ def checked_call(script, arglist=None, parallel=False, **kwargs):
     finally:
         # remove lock file
         os.system("rm %s 2>&1" % LOCKFILE)
+        for monitor in reversed(CALL_MONITORS):
+            monitor.call_finished(script, arglist, call, return_code)
 
 
 class Scripts(object):
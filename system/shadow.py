@@ -0,0 +1,256 @@
+"""
+Defines the shadow mode of the reduction backends: the python implementation
+of a stage runs on a copy of a subset of the chips, while the THELI scripts
+process the original data. The outputs of both are compared pixel by pixel
+and their run times are reported side by side
+"""
+
+import os
+import re
+import shutil
+from time import time
+
+from .base import FITS_EXTENSIONS
+from .scripts import BACKEND_STAGES, CallMonitor
+
+
+# folder in the main folder with the copy of the data
+SHADOW_FOLDER = ".shadow"
+# subfolders that archive earlier processing stages or contain outputs, they
+# are not copied
+SKIPPED_FOLDERS = (
+    "ORIGINALS", "BADMODE", "BINNED_TIFF", "BINNED_FITS", "BACKGROUND",
+    "NOSKYCORR", "headers", "cat")
+# chip number of split images, master frames and weights (but not of raw
+# files): [name]_[chip][tag](.[type]).fits
+CHIP_FILE = re.compile(r"_([1-9]\d*)[A-Z]*(?:\.[a-z]+)*\.fits$")
+# default tolerance of the pixel values: |python - script| <= ATOL +
+# RTOL * |script|
+RTOL = 1e-4
+ATOL = 1e-3
+
+
+def _skipped(dirname):
+    return dirname.startswith(".") or dirname in SKIPPED_FOLDERS or \
+        dirname.endswith("_IMAGES")
+
+
+def mirror_tree(maindir, shadowdir, chips=None, link=True, folders=None):
+    """Mirror the folders in 'maindir' to 'shadowdir', skipping hidden and
+    archive folders (see SKIPPED_FOLDERS).
+
+    Arguments:
+        maindir [string]:
+            main folder of the reduction
+        shadowdir [string]:
+            target folder
+        chips [list of int]:
+            chips that are copied, all chips if None
+        link [bool]:
+            create hard links where possible instead of copies, the mirrored
+            files must not be modified in place
+        folders [list of strings]:
+            folders (relative to 'maindir') whose files are mirrored,
+            including their subfolders, all if None. The other folders are
+            created empty.
+    Returns:
+        mirrored [dict]:
+            modification time of the mirrored files by relative path
+    """
+    if folders is not None:
+        folders = [os.path.normpath(folder) for folder in folders]
+    mirrored = {}
+    for root, dirs, files in os.walk(maindir):
+        dirs[:] = sorted(d for d in dirs if not _skipped(d))
+        relroot = os.path.relpath(root, maindir)
+        os.makedirs(os.path.join(shadowdir, relroot), exist_ok=True)
+        if folders is not None and not any(
+                relroot == folder or relroot.startswith(folder + os.sep)
+                for folder in folders):
+            continue
+        for fname in files:
+            match = CHIP_FILE.search(fname)
+            if chips is not None and match is not None and \
+                    int(match.group(1)) not in chips:
+                continue
+            relpath = os.path.normpath(os.path.join(relroot, fname))
+            source = os.path.join(maindir, relpath)
+            target = os.path.join(shadowdir, relpath)
+            try:
+                if not link:
+                    raise OSError("copy requested")
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+            mirrored[relpath] = os.stat(target).st_mtime
+    return mirrored
+
+
+def find_outputs(shadowdir, mirrored):
+    """Files in 'shadowdir' that are not in 'mirrored' (see mirror_tree) or
+    have been modified.
+
+    Returns:
+        outputs [list of strings]:
+            paths relative to 'shadowdir'
+    """
+    outputs = []
+    for root, dirs, files in os.walk(shadowdir):
+        for fname in files:
+            relpath = os.path.relpath(os.path.join(root, fname), shadowdir)
+            if fname.endswith(".tmp"):
+                continue
+            mtime = os.stat(os.path.join(shadowdir, relpath)).st_mtime
+            if mirrored.get(relpath) != mtime:
+                outputs.append(relpath)
+    return sorted(outputs)
+
+
+def compare_images(path, reference, rtol=RTOL, atol=ATOL,
+                   max_bytes=64 * 1024**2):
+    """Compare the pixel values of the images in two FITS files row chunk
+    by row chunk. Pixels that are NaN in both images are equal.
+
+    Arguments:
+        path [string]:
+            path of the tested FITS file
+        reference [string]:
+            path of the reference FITS file
+        rtol, atol [float]:
+            pixels differ if |value - reference| > atol + rtol * |reference|
+        max_bytes [int]:
+            memory limit of a row chunk
+    Returns:
+        npixels [int]:
+            number of compared pixels
+        ndiffer [int]:
+            number of pixels that differ
+        maxdiff [float]:
+            maximum absolute difference
+    """
+    # numpy is imported with the comparison only, see Reduction.run_shadow
+    from .native.fitsio import np, read_hdus
+    from .native.chips import chunk_rows, physical
+    hdus = [hdu for hdu in read_hdus(path) if hdu.is_image]
+    references = [hdu for hdu in read_hdus(reference) if hdu.is_image]
+    if [hdu.shape for hdu in hdus] != [hdu.shape for hdu in references]:
+        raise ValueError("image dimensions differ")
+    npixels, ndiffer, maxdiff = 0, 0, 0.0
+    for hdu, ref in zip(hdus, references):
+        shape = (int(np.prod(hdu.shape[:-1])), hdu.shape[-1])
+        data = hdu.data().reshape(shape)
+        refdata = ref.data().reshape(shape)
+        step = chunk_rows(shape, 4, max_bytes)
+        for start in range(0, shape[0], step):
+            values = physical(data[start:start + step], hdu.header)
+            expected = physical(refdata[start:start + step], ref.header)
+            diff = abs(values - expected)
+            with np.errstate(invalid="ignore"):
+                differ = ~(diff <= atol + rtol * abs(expected))
+            differ &= ~(np.isnan(values) & np.isnan(expected))
+            npixels += values.size
+            ndiffer += int(differ.sum())
+            finite = diff[np.isfinite(diff)]
+            if len(finite) > 0:
+                maxdiff = max(maxdiff, float(finite.max()))
+    return npixels, ndiffer, maxdiff
+
+
+class ShadowMonitor(CallMonitor):
+    """Measures the run time of the scripts of a reduction stage (see
+    BACKEND_STAGES).
+
+    Arguments:
+        stage [string]:
+            reduction stage
+    """
+
+    def __init__(self, stage):
+        super(ShadowMonitor, self).__init__()
+        self.scripts = BACKEND_STAGES[stage]
+        self.seconds = 0.0  # total run time of the scripts
+        self.ncalls = 0
+        self._start = None
+
+    def call_started(self, script, arglist, process):
+        if script.startswith(self.scripts):
+            self._start = time()
+
+    def call_finished(self, script, arglist, process, return_code):
+        if self._start is not None:
+            self.seconds += time() - self._start
+            self.ncalls += 1
+            self._start = None
+
+
+class ShadowRun(object):
+    """Copy of the data of a subset of the chips in the main folder, in which
+    the python implementation of a reduction stage runs (see mirror_tree).
+
+    Arguments:
+        maindir [string]:
+            main folder of the reduction
+        stage [string]:
+            reduction stage
+        chips [list of int]:
+            chips that are copied, all chips if None
+        link [bool]:
+            create hard links where possible instead of copies
+        folders [list of strings]:
+            folders (relative to 'maindir') whose files are copied, all if
+            None
+    """
+
+    def __init__(self, maindir, stage, chips=None, link=True, folders=None):
+        super(ShadowRun, self).__init__()
+        self.maindir = maindir
+        self.stage = stage
+        self.chips = chips
+        self.path = os.path.join(maindir, SHADOW_FOLDER)
+        if os.path.exists(self.path):  # left over from a failed stage
+            shutil.rmtree(self.path)
+        self._mirrored = mirror_tree(
+            maindir, self.path, chips, link, folders)
+        self.monitor = ShadowMonitor(stage)
+        self.seconds = None  # run time of the python implementation
+        self.outputs = []
+
+    def run(self, function, *args):
+        """Call 'function' with 'args', measure its run time and collect the
+        files it created or modified."""
+        start = time()
+        try:
+            return function(*args)
+        finally:
+            self.seconds = time() - start
+            self.outputs = find_outputs(self.path, self._mirrored)
+
+    def compare(self, rtol=RTOL, atol=ATOL):
+        """Compare the outputs with the files of the same name in the main
+        folder, only the existence of files other than FITS is checked.
+
+        Returns:
+            differences [list of tuples]:
+                relative path and description of each difference
+        """
+        differences = []
+        for relpath in self.outputs:
+            reference = os.path.join(self.maindir, relpath)
+            if not os.path.exists(reference):
+                differences.append((relpath, "not created by the scripts"))
+                continue
+            if not relpath.endswith(FITS_EXTENSIONS):
+                continue
+            try:
+                npixels, ndiffer, maxdiff = compare_images(
+                    os.path.join(self.path, relpath), reference, rtol, atol)
+            except (OSError, ValueError, KeyError) as e:
+                differences.append((relpath, str(e)))
+                continue
+            if ndiffer > 0:
+                differences.append((relpath, "%d of %d pixels differ by up "
+                                    "to %g" % (ndiffer, npixels, maxdiff)))
+        return differences
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,271 @@
+"""
+Defines the per-host tuning profile of the number of parallel processes
+(NPARA) of the THELI scripts
+"""
+
+import os
+import re
+import json
+import shutil
+import socket
+from time import time
+
+from .base import DIRS, FITS_EXTENSIONS, natural_sort
+from .governor import count_exposures
+from .scripts import CallMonitor, add_call_monitor, remove_call_monitor
+
+
+# matches the chip number and tag of split images: [base]_[chip][tag].fits
+CHIP_SUFFIX = re.compile(r"_\d+(OFC[A-Z]*(\.sub)?)?\.fits$")
+# accepted throughput loss in favour of fewer parallel processes
+TOLERANCE = 0.05
+
+
+class TuningProfile(object):
+    """Stores the measured throughput (exposures per second) of the parallel
+    scripts for different NPARA values in the THELI home folder. Each host
+    has its own profile, since the optimum depends on the number of CPUs and
+    the storage system.
+
+    Arguments:
+        host [string]:
+            name of the host, by default the name of this machine
+    """
+
+    def __init__(self, host=None):
+        super(TuningProfile, self).__init__()
+        self.host = socket.gethostname() if host is None else host
+        self.path = os.path.join(
+            DIRS["PIPEHOME"], "tuning_%s.json" % self.host)
+        try:
+            with open(self.path) as f:
+                self.stages = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.stages = {}
+
+    def save(self):
+        """Write the profile to disk."""
+        with open(self.path, "w") as f:
+            json.dump(self.stages, f, indent=1, sort_keys=True)
+
+    def record(self, script, npara, throughput):
+        """Store the throughput of a script measured with 'npara' parallel
+        processes and update its optimum NPARA. Changes are written to disk
+        with 'save'."""
+        stage = self.stages.setdefault(
+            script, {"npara": None, "throughput": {}})
+        stage["throughput"][str(npara)] = throughput
+        # use the fewest processes that are within the tolerance of the
+        # highest throughput, disk bound scripts saturate early
+        fastest = max(stage["throughput"].values())
+        stage["npara"] = min(
+            int(n) for n, t in stage["throughput"].items()
+            if t >= (1.0 - TOLERANCE) * fastest)
+
+    def best(self, script):
+        """Return the optimum NPARA of a script, None if it is not tuned."""
+        try:
+            return self.stages[script]["npara"]
+        except KeyError:
+            return None
+
+
+class NparaTuner(CallMonitor):
+    """Limits NPARA of each tuned parallel script to the optimum of the
+    tuning profile and restores it after the script. Must be registered
+    after the memory governor, such that memory limits are respected.
+
+    Arguments:
+        params [Parameters]:
+            parameter manager of the reduction
+        profile [TuningProfile]:
+            tuning profile of this host
+    """
+
+    def __init__(self, params, profile):
+        super(NparaTuner, self).__init__()
+        self.params = params
+        self.profile = profile
+        self._requested = None
+
+    def call_prepare(self, script, arglist):
+        self._requested = None
+        best = self.profile.best(script)
+        if best is None:
+            return
+        self._requested = self.params.get("NPARA")
+        try:
+            current = int(self._requested)
+        except (TypeError, ValueError):
+            current = best
+        self.params.set({"NPARA": str(min(current, best))})
+
+    def call_finished(self, script, arglist, process, return_code):
+        if self._requested is not None:
+            self.params.set({"NPARA": self._requested})
+            self._requested = None
+
+
+class NparaRecorder(CallMonitor):
+    """Forces NPARA of all parallel scripts to a fixed value (within the
+    memory limits), restores it after the script and records the throughput
+    in a tuning profile.
+
+    Arguments:
+        params [Parameters]:
+            parameter manager of the reduction
+        profile [TuningProfile]:
+            tuning profile to record the throughput in
+        npara [int]:
+            number of parallel processes to test
+    """
+
+    def __init__(self, params, profile, npara):
+        super(NparaRecorder, self).__init__()
+        self.params = params
+        self.profile = profile
+        self.npara = npara
+        self._call = None
+        self._requested = None
+
+    def call_prepare(self, script, arglist):
+        self._call = None
+        self._requested = None
+        if not script.endswith("_para.sh"):
+            return
+        self._requested = self.params.get("NPARA")
+        try:
+            npara = min(self.npara, int(self._requested))
+        except (TypeError, ValueError):
+            npara = self.npara
+        self.params.set({"NPARA": str(npara)})
+        self._call = [npara, count_exposures(arglist), None]
+
+    def call_started(self, script, arglist, process):
+        if self._call is not None:
+            self._call[2] = time()
+
+    def call_finished(self, script, arglist, process, return_code):
+        if self._requested is not None:
+            self.params.set({"NPARA": self._requested})
+            self._requested = None
+        if self._call is None or self._call[2] is None:
+            return
+        npara, nexposures, start = self._call
+        self._call = None
+        if return_code != (0, "") or nexposures == 0:
+            return
+        self.profile.record(
+            script, npara, nexposures / max(time() - start, 1e-3))
+
+
+def copy_subset(source, destination, nexposures):
+    """Link (or copy) the FITS files of the first exposures of a data folder
+    to a new folder.
+
+    Arguments:
+        source [string]:
+            data folder
+        destination [string]:
+            folder to create
+        nexposures [int]:
+            number of exposures to copy, all chips of an exposure are copied
+    """
+    os.makedirs(destination)
+    exposures = {}
+    for fits in os.listdir(source):
+        if not fits.endswith(FITS_EXTENSIONS) or \
+                not os.path.isfile(os.path.join(source, fits)):
+            continue
+        base = CHIP_SUFFIX.sub("", fits)
+        exposures.setdefault(base, []).append(fits)
+    for base in natural_sort(exposures.keys())[:nexposures]:
+        for fits in exposures[base]:
+            src = os.path.join(source, fits)
+            dst = os.path.join(destination, fits)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy(src, dst)
+
+
+def tune_npara(instrument, maindir, project_kwargs, jobs, nexposures=4,
+               values=None):
+    """Run jobs on a subset of the data with different NPARA values and store
+    the throughput of each parallel script in the tuning profile of this
+    host.
+
+    Arguments:
+        instrument [string]:
+            valid THELI instrument string (e.g. ACAM@WHT)
+        maindir [string]:
+            main folder of the project
+        project_kwargs [dict]:
+            keyword arguments used to create the Reduction instance
+        jobs [list]:
+            tuples of Reduction method name and argument list
+        nexposures [int]:
+            number of exposures per data folder in the subset
+        values [list of int]:
+            NPARA values to test, by default powers of two up to the number
+            of available CPUs
+    Returns:
+        profile [TuningProfile]:
+            updated tuning profile
+    """
+    from .events import EventMonitor
+    from .history import HistoryRecorder
+    from .reduction import Reduction
+    folder_keys = ("biasdir", "darkdir", "flatdir", "flatoffdir",
+                   "sciencedir", "skydir", "stddir")
+    maindir = os.path.abspath(maindir)
+    tunedir = os.path.join(maindir, ".tune_npara")
+    profile = TuningProfile()
+    # create a project once to get the number of CPUs and chips
+    kwargs = dict(project_kwargs)
+    kwargs["verbosity"] = "quiet"
+    # the tuning runs vary NPARA on purpose, they must not end up in the run
+    # history that predicts the durations of real reductions
+    kwargs["events"] = None
+
+    def unrecorded(project):
+        remove_call_monitor(HistoryRecorder)
+        remove_call_monitor(EventMonitor)
+        return project
+
+    if values is None:
+        project = unrecorded(Reduction(instrument, maindir, **kwargs))
+        limit = max(1, min(project.ncpus, project.nchips))
+        values = sorted(set(
+            [2 ** i for i in range(limit.bit_length())] + [limit]))
+    for npara in values:
+        print("NPARA tuning: running jobs with %d process(es)" % npara)
+        shutil.rmtree(tunedir, ignore_errors=True)
+        os.makedirs(tunedir)
+        for key in folder_keys:
+            if project_kwargs.get(key) is None:
+                continue
+            name = os.path.basename(os.path.normpath(project_kwargs[key]))
+            copy_subset(
+                os.path.join(maindir, name), os.path.join(tunedir, name),
+                nexposures)
+            kwargs[key] = name
+        project = unrecorded(Reduction(instrument, tunedir, **kwargs))
+        # the tuning profile must not influence the measurement
+        remove_call_monitor(NparaTuner)
+        add_call_monitor(NparaRecorder(project.params, profile, npara))
+        try:
+            for func, jobargs in jobs:
+                getattr(project, func)(*jobargs)
+        finally:
+            remove_call_monitor(NparaRecorder)
+        profile.save()
+    shutil.rmtree(tunedir, ignore_errors=True)
+    # summary
+    for script in sorted(profile.stages):
+        throughput = profile.stages[script]["throughput"]
+        print("%-36s NPARA=%-3s %s" % (
+            script, profile.best(script), ", ".join(
+                "%s: %.3g/s" % (n, throughput[n])
+                for n in sorted(throughput, key=int))))
+    return profile
@@ -4,30 +4,51 @@ determine software versions from data program files
 
 import os
 
-from .base import DIRS
-
-
-__version_theli__ = "N/A"
-# read THELI version from README file
-versionfile = os.path.join(DIRS["PIPESOFT"], "README")
-with open(versionfile) as txt:
-    for line in txt:
-        if "version" in line:
-            # select word containing digits
-            for word in line.split():
-                if any(char.isdigit() for char in word):
-                    __version_theli__ = word.strip()
-                    break
-            break
-
-__version_gui__ = "N/A"
-# read GUI script verion from the most recent change log entry
-versionfile = os.path.join(DIRS["PIPESOFT"], "gui", "CHANGELOG")
-with open(versionfile) as txt:
-    for line in txt:
-        # version line starts with vX.XX...
-        if line.startswith("v"):
-            __version_gui__ = line.split()[0].strip("v")
-            break
+from . import base
+
+
+def _read_theli_version(pipesoft):
+    """Read THELI version from README file in the installation 'pipesoft'"""
+    version = "N/A"
+    versionfile = os.path.join(pipesoft, "README")
+    with open(versionfile) as txt:
+        for line in txt:
+            if "version" in line:
+                # select word containing digits
+                for word in line.split():
+                    if any(char.isdigit() for char in word):
+                        version = word.strip()
+                        break
+                break
+    return version
+
+
+def _read_gui_version(pipesoft):
+    """Read GUI script verion from the most recent change log entry in the
+    installation 'pipesoft'"""
+    version = "N/A"
+    versionfile = os.path.join(pipesoft, "gui", "CHANGELOG")
+    with open(versionfile) as txt:
+        for line in txt:
+            # version line starts with vX.XX...
+            if line.startswith("v"):
+                version = line.split()[0].strip("v")
+                break
+    return version
+
+
+# versions of the THELI installation, taken from the environment snapshot on
+# first access
+_THELI_VERSIONS = ("__version_theli__", "__version_gui__")
+
+
+def __getattr__(name):
+    if name in _THELI_VERSIONS:
+        # cache the value
+        globals()[name] = base._get_environment()["versions"][name]
+        return globals()[name]
+    raise AttributeError("module '%s' has no attribute '%s'" % (
+        __name__, name))
+
 
 __version__ = "1.0"
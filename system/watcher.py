@@ -0,0 +1,191 @@
+"""
+Defines the raw data monitor for the incremental (watch folder) reduction
+"""
+
+import os
+import select
+import struct
+from time import sleep
+
+from .base import FITS_EXTENSIONS, natural_sort, get_FITS_header_values
+
+
+# inotify is accessed through the C-library, if not available (e.g. not on
+# Linux) fall back to polling the folder content
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _libc.inotify_init
+    _libc.inotify_add_watch
+    __inotify_success__ = True
+except (OSError, AttributeError):
+    __inotify_success__ = False
+
+IN_CLOSE_WRITE = 0x00000008  # file opened for writing was closed
+IN_MOVED_TO = 0x00000080  # file was moved into watched folder
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+# header values (lower case) that identify the exposure type, if no sorting
+# keys are specified by the user
+FRAME_TYPES = {
+    "bias": ("bias", "zero"),
+    "dark": ("dark",),
+    "flat": ("flat", "domeflat", "skyflat", "twilight"),
+    "standard": ("standard", "std")}
+FRAME_TYPE_KEYS = ("IMAGETYP", "OBSTYPE", "EXPTYPE", "OBJECT")
+
+
+class FolderWatcher(object):
+    """Reports FITS files that were completely written to a folder. Uses
+    inotify on Linux and falls back to polling the folder content, in which
+    case a file is complete, if its size and modification time did not change
+    between two polls. Files present on initialization are reported on the
+    first call of 'wait'.
+
+    Arguments:
+        path [string]:
+            path to the folder that is monitored
+        interval [float]:
+            polling interval in seconds (fallback mode only)
+        use_inotify [bool]:
+            use inotify if available
+    """
+
+    def __init__(self, path, interval=2.0, use_inotify=True):
+        super(FolderWatcher, self).__init__()
+        self.abs = os.path.abspath(path)
+        self.interval = interval
+        self._fd = None
+        self._known = {}  # polling: file -> (size, mtime) at last poll
+        self._reported = set()
+        self._pending = set(  # files that arrived before watching
+            os.path.join(self.abs, f) for f in os.listdir(self.abs)
+            if f.endswith(FITS_EXTENSIONS))
+        if use_inotify and __inotify_success__:
+            fd = _libc.inotify_init()
+            if fd >= 0:
+                wd = _libc.inotify_add_watch(
+                    fd, self.abs.encode(), IN_CLOSE_WRITE | IN_MOVED_TO)
+                if wd >= 0:
+                    self._fd = fd
+                else:
+                    os.close(fd)
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def _read_events(self, timeout):
+        """Read the inotify events for 'timeout' seconds."""
+        ready = select.select([self._fd], [], [], timeout)[0]
+        if len(ready) == 0:
+            return
+        buffer = os.read(self._fd, 65536)
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(
+                buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0").decode()
+            offset += length
+            if name.endswith(FITS_EXTENSIONS):
+                self._pending.add(os.path.join(self.abs, name))
+
+    def _poll(self, timeout):
+        """Scan the folder and register files with stable size as pending."""
+        sleep(timeout)
+        current = {}
+        for f in os.listdir(self.abs):
+            if not f.endswith(FITS_EXTENSIONS):
+                continue
+            path = os.path.join(self.abs, f)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime)
+            if self._known.get(path) == current[path]:
+                self._pending.add(path)
+        self._known = current
+
+    def wait(self, timeout=None):
+        """Wait until new files are complete or 'timeout' seconds passed.
+
+        Arguments:
+            timeout [float]:
+                maximum waiting time in seconds, by default the polling
+                interval
+        Returns:
+            files [list]:
+                natural sorted list of new files, may be empty
+        """
+        timeout = self.interval if timeout is None else timeout
+        if len(self._pending - self._reported) == 0:
+            if self.uses_inotify:
+                self._read_events(timeout)
+            else:
+                self._poll(timeout)
+        new = [f for f in self._pending - self._reported
+               if os.path.exists(f)]
+        self._reported.update(new)
+        self._pending.clear()
+        return natural_sort(new)
+
+    def close(self):
+        """Stop the inotify watch."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def classify_exposure(filename, sortkey="OBJECT", keyvalues={}):
+    """Determine the type of a raw exposure from its FITS header. If the user
+    specified sorting key values (V_SORT_*), these are compared against the
+    value of 'sortkey', otherwise common header keywords are scanned for
+    typical type identifiers.
+
+    Arguments:
+        filename [string]:
+            path to raw FITS file
+        sortkey [string]:
+            FITS keyword that identifies the exposure type
+        keyvalues [dict]:
+            maps exposure types ('bias', 'dark', 'flat', 'standard') to
+            values of 'sortkey'
+    Returns:
+        frametype [string]:
+            one of 'bias', 'dark', 'flat', 'standard', 'science'
+    """
+    keyvalues = {t: v for t, v in keyvalues.items() if v != ""}
+    if len(keyvalues) > 0:
+        try:
+            value = str(get_FITS_header_values(
+                filename, [sortkey], extension=0)[0]).strip()
+        except KeyError:
+            return "science"
+        for frametype, keyvalue in keyvalues.items():
+            if value == keyvalue:
+                return frametype
+        return "science"
+    # scan the typical header keys in order of their reliability
+    for key in FRAME_TYPE_KEYS:
+        try:
+            value = str(get_FITS_header_values(
+                filename, [key], extension=0)[0]).strip().lower()
+        except KeyError:
+            continue
+        for frametype, identifiers in FRAME_TYPES.items():
+            if any(ident in value for ident in identifiers):
+                return frametype
+    return "science"
+
+
+def count_extensions(filename):
+    """Count the image extensions of a raw FITS file from the NEXTEND keyword.
+    Returns 1 for simple FITS files without this keyword."""
+    try:
+        return int(get_FITS_header_values(
+            filename, ["NEXTEND"], extension=0)[0])
+    except (KeyError, ValueError):
+        return 1
@@ -0,0 +1,61 @@
+"""
+Configuration of the tests of the native backends and the wrapper
+
+    python3 -m pytest -q tests
+"""
+
+import pytest
+
+from benchmark.stub_theli import create_home, create_installation
+from system import base, scripts
+from system.reduction import Reduction
+from system.native.fitsio import np, __numpy_success__
+
+from .fitsdata import STUB_INSTRUMENT, STUB_NCHIPS
+
+
+# the native backends require numpy
+if not __numpy_success__:
+    collect_ignore_glob = ["test_*.py"]
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(42)
+
+
+@pytest.fixture(scope="session")
+def theli_home(tmp_path_factory):
+    """Home folder that links a stub THELI installation, such that the
+    wrapper does not depend on the installation of the user. The paths of
+    the environment are resolved again on first use."""
+    root = tmp_path_factory.mktemp("theli")
+    pipesoft = create_installation(str(root), nchips=STUB_NCHIPS)
+    home = str(root / "home")
+    create_home(home, pipesoft)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("HOME", home)
+        mp.setattr(base, "_environment", None)
+        for proxy in (base.DIRS, base.CMDTOOLS, base.CMDSCRIPTS,
+                      base.INSTRUMENTS):
+            mp.setattr(proxy, "_data", None)
+        for proxy in (base.LOCKFILE, base.LOGFILE):
+            mp.setattr(proxy, "_path", None)
+        yield home
+
+
+@pytest.fixture
+def make_reduction(theli_home, tmp_path, monkeypatch):
+    """Factory of Reduction instances of the stub instrument with the main
+    folder 'project' in 'tmp_path'. The call monitors they register are
+    discarded after the test."""
+    monkeypatch.setattr(scripts, "CALL_MONITORS", [])
+    maindir = tmp_path / "project"
+    maindir.mkdir(exist_ok=True)
+
+    def make(**kwargs):
+        kwargs.setdefault("verbosity", "quiet")
+        return Reduction(STUB_INSTRUMENT, str(maindir), **kwargs)
+
+    return make
+
@@ -0,0 +1,107 @@
+"""
+Tiny FITS images for the tests of the native backends, written with the
+benchmark FITS generator, a minimal instrument definition and the raw
+exposures of the stub THELI installation for the tests of the wrapper
+"""
+
+import os
+
+from benchmark.fitsgen import DEFAULT_KEYS, _pad, write_image, write_mef
+from benchmark.stub_theli import FRAME_LEVELS, create_exposures
+from system.native.chips import physical
+from system.native.fitsio import np, create_image, format_card, read_hdus
+
+
+# instrument of the stub THELI installation (see benchmark.stub_theli)
+STUB_INSTRUMENT = "STUB@BENCHMARK"
+STUB_NCHIPS = 2
+
+
+class ChipInstrument(object):
+    """Instrument definition with the attributes of an Instrument (see
+    system.instruments) that the native backends use, all chips share the
+    same geometry.
+
+    Arguments:
+        nchips [int]:
+            number of chips
+        size [tuple]:
+            chip size (ny, nx) after cutting
+        overscan [tuple]:
+            first and last overscan column (starting from 1) or None
+        cut [tuple]:
+            first column and row of the cut region (starting from 1)
+        refpix [tuple]:
+            reference pixel (x, y) of each chip or None
+        stats [tuple]:
+            statistics region (xmin, xmax, ymin, ymax) or None
+    """
+
+    def __init__(self, nchips=2, size=(16, 16), overscan=None, cut=(1, 1),
+                 refpix=None, stats=None):
+        super(ChipInstrument, self).__init__()
+        self.NAME = "TEST@PYTEST"
+        self.NCHIPS = nchips
+        self.TYPE = "OPT"
+        self.PIXSCALE = 0.2
+        self.GAIN = 1.5
+        self.PIXSCX = -5.55556e-05
+        self.PIXSCY = 5.55556e-05
+        self.CHIPSIZEX = [size[1]] * nchips
+        self.CHIPSIZEY = [size[0]] * nchips
+        x1, x2 = overscan if overscan is not None else (0, 0)
+        self.OVSCANX1 = [x1] * nchips
+        self.OVSCANX2 = [x2] * nchips
+        self.CUTX = [cut[0]] * nchips
+        self.CUTY = [cut[1]] * nchips
+        if refpix is None:
+            refpix = [(0, 0)] * nchips
+        self.REFPIXX = [x for x, y in refpix]
+        self.REFPIXY = [y for x, y in refpix]
+        xmin, xmax, ymin, ymax = stats if stats is not None else (0,) * 4
+        self.STATSXMIN = [xmin] * nchips
+        self.STATSXMAX = [xmax] * nchips
+        self.STATSYMIN = [ymin] * nchips
+        self.STATSYMAX = [ymax] * nchips
+
+
+def int_data(data):
+    """Padded big endian 16 bit pixel data of an array for the FITS
+    generator."""
+    return _pad(np.asarray(data).astype(">i2").tobytes(), b"\0")
+
+
+def write_raw(path, data, keys=DEFAULT_KEYS):
+    """Write a 16 bit single extension image."""
+    write_image(str(path), data.shape, keys=keys, data=int_data(data))
+    return str(path)
+
+
+def write_raw_mef(path, data, nchips, keys=DEFAULT_KEYS):
+    """Write a 16 bit multi-extension exposure, all chips share 'data'."""
+    write_mef(str(path), data.shape, nchips, keys=keys, data=int_data(data))
+    return str(path)
+
+
+def write_float(path, data, keys=()):
+    """Write a 32 bit float image with additional (key, value) cards."""
+    cards = [format_card(key, value) for key, value in keys]
+    create_image(str(path), cards, data.shape).data(mode="r+")[:] = data
+    return str(path)
+
+
+def read_image(path):
+    """Pixel values (float32) and header of the first image of a file."""
+    hdu = read_hdus(str(path))[0]
+    return physical(hdu.data(), hdu.header), hdu.header
+
+
+def write_exposures(folder, prefix, nexposures):
+    """Write raw exposures of the stub instrument with the level of the
+    frame type 'prefix' (e.g. 'bias') and return their paths."""
+    create_exposures(
+        str(folder), prefix, nexposures, STUB_NCHIPS,
+        level=FRAME_LEVELS.get(prefix, 1000.0))
+    return sorted(
+        os.path.join(str(folder), f) for f in os.listdir(str(folder))
+        if f.startswith(prefix))
@@ -0,0 +1,98 @@
+"""
+Tests of the python background model backend (system.native.background)
+"""
+
+import os
+
+import pytest
+
+from system.native.background import (DIVIDE, SAMPLE_STEP, SUBTRACT,
+                                      background_folder, masked_combine)
+from system.native.check import estimate_mode
+
+from .fitsdata import np, read_image, write_float
+
+
+def reference_combine(stack, nlow, nhigh, function):
+    """Combine the valid values of each pixel one by one."""
+    combined = np.full(stack.shape[1:], np.nan)
+    for index in np.ndindex(*stack.shape[1:]):
+        values = np.sort(stack[(slice(None),) + index])
+        values = values[np.isfinite(values)]
+        if len(values) - nlow - nhigh >= 1:
+            values = values[nlow:len(values) - nhigh]
+        if len(values) > 0:
+            combined[index] = function(values)
+    return combined
+
+
+def test_masked_combine_matches_reference(rng):
+    stack = rng.normal(1.0, 0.1, size=(6, 5, 7)).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.3] = np.nan
+    stack[:, 0, 0] = np.nan  # no valid value
+    for median, function in ((True, np.median), (False, np.mean)):
+        for nlow, nhigh in ((0, 0), (1, 2), (3, 3)):
+            np.testing.assert_allclose(
+                masked_combine(stack.copy(), nlow, nhigh, median),
+                reference_combine(stack, nlow, nhigh, function), rtol=1e-5)
+
+
+@pytest.mark.parametrize("applymode", [SUBTRACT, DIVIDE])
+def test_background_folder_matches_reference(tmp_path, rng, applymode):
+    folder = tmp_path / "SCIENCE"
+    folder.mkdir()
+    # a common background pattern scaled to different sky levels
+    pattern = 1.0 + 0.1 * np.sin(np.arange(24) / 4.0)[np.newaxis]
+    images = {}
+    files = []
+    for i, level in enumerate((800.0, 1000.0, 1200.0, 900.0)):
+        for chip in (1, 2):
+            data = level * pattern + rng.normal(0.0, 5.0, size=(20, 24))
+            images[i, chip] = data.astype(np.float32)
+            files.append(write_float(
+                folder / ("exp%d_%dOFC.fits" % (i, chip)), images[i, chip]))
+    # room for a single row of the stack of each thread
+    errors = background_folder(
+        files, nlow2=0, nhigh2=0, twopass=False, applymode=applymode,
+        nthreads=2, max_bytes=2 * 3 * 4 * 4 * 24)
+    assert errors == []
+    for chip in (1, 2):
+        modes = {
+            i: estimate_mode(images[i, chip][::SAMPLE_STEP].ravel())
+            for i in range(4)}
+        model = np.median(
+            [images[i, chip] / modes[i] for i in range(4)], axis=0)
+        written, header = read_image(
+            folder / "BACKGROUND" / ("SCIENCE_%d.fits" % chip))
+        np.testing.assert_allclose(written, model, rtol=1e-5)
+        for i in range(4):
+            if applymode == SUBTRACT:
+                expected = images[i, chip] - modes[i] * (model - 1.0)
+            else:
+                expected = images[i, chip] / model
+            corrected, header = read_image(
+                folder / ("exp%d_%dOFCB.fits" % (i, chip)))
+            np.testing.assert_allclose(
+                corrected, expected, rtol=1e-5, atol=1e-3)
+    assert sorted(os.listdir(folder / "OFC_IMAGES")) == sorted(
+        os.path.basename(f) for f in files)
+
+
+def test_two_pass_masks_objects(tmp_path, rng):
+    folder = tmp_path / "SCIENCE"
+    folder.mkdir()
+    files = []
+    for i in range(4):
+        data = rng.normal(1000.0, 5.0, size=(30, 30)).astype(np.float32)
+        # a source at a different position in each image
+        data[5 + 5 * i:9 + 5 * i, 10:14] += 500.0
+        files.append(write_float(folder / ("exp%d_1OFC.fits" % i), data))
+    errors = background_folder(
+        files, nlow1=0, nhigh1=0, nlow2=0, nhigh2=0, median=False)
+    assert errors == []
+    mask, header = read_image(
+        folder / "MASK_IMAGES" / "exp0_1OFC_mask.fits")
+    assert mask[5:9, 10:14].all()
+    # the mean model is not biased by the masked sources
+    model, header = read_image(folder / "BACKGROUND" / "SCIENCE_1.fits")
+    assert abs(model - 1.0).max() < 0.02
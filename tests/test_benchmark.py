@@ -0,0 +1,133 @@
+"""
+Tests of the synthetic data and the stub THELI installation of the end to
+end benchmark and of the microbenchmarks (benchmark.fitsgen,
+benchmark.stub_theli, benchmark.e2e, benchmark.micro)
+"""
+
+import argparse
+import os
+
+import pytest
+
+from benchmark import e2e, micro
+from benchmark.fitsgen import (BLOCK, CARD, card_values, format_card,
+                               read_cards, write_mef)
+from benchmark.stub_theli import FRAME_LEVELS, create_exposures
+from system import scripts
+from system.base import DIRS
+from system.native.fitsio import read_hdus
+
+
+@pytest.mark.parametrize("key,value,formatted", [
+    ("SIMPLE", True, "SIMPLE  =                    T"),
+    ("NAXIS", 2, "NAXIS   =                    2"),
+    ("EXPTIME", 60.0, "EXPTIME =                 60.0"),
+    ("GAIN", 1e-05, "GAIN    =                1E-05"),
+    ("OBJECT", "o'clock", "OBJECT  = 'o''clock'"),
+    ("FILTER", "r", "FILTER  = 'r       '"),
+    ("END", None, "END")])
+def test_format_card(key, value, formatted):
+    card = format_card(key, value)
+    assert len(card) == CARD
+    assert card.rstrip() == formatted
+
+
+def test_mef_round_trip(tmp_path):
+    path = str(tmp_path / "exp.fits")
+    write_mef(path, (5, 7), 3, keys=[("OBJECT", "NGC 253")], seed=1)
+    assert os.path.getsize(path) % BLOCK == 0
+    headers = read_cards(path)
+    assert len(headers) == 4
+    assert card_values(headers[0])["OBJECT"] == "NGC 253"
+    assert [card_values(h)["EXTNAME"] for h in headers[1:]] == [
+        "CHIP1", "CHIP2", "CHIP3"]
+    # the native FITS reader parses the generated files
+    hdus = read_hdus(path)
+    assert [hdu.shape for hdu in hdus] == [(), (5, 7), (5, 7), (5, 7)]
+    data = hdus[2].data()
+    assert abs(data.mean() - 1000.0) < 10.0
+    assert (hdus[1].data() == data).all()
+
+
+@pytest.mark.parametrize("frametype", sorted(FRAME_LEVELS))
+def test_exposure_levels(tmp_path, frametype):
+    create_exposures(str(tmp_path), frametype, 2, 2,
+                     level=FRAME_LEVELS[frametype])
+    paths = [str(tmp_path / ("%s%05d.fits" % (frametype, n)))
+             for n in (1, 2)]
+    assert sorted(os.listdir(str(tmp_path))) == [
+        os.path.basename(p) for p in paths]
+    header = card_values(read_cards(paths[1])[0])
+    assert header["OBJECT"] == frametype.upper()
+    assert float(header["CRVAL1"]) == pytest.approx(150.102)
+    data = read_hdus(paths[0])[1].data()
+    assert abs(data.mean() - FRAME_LEVELS[frametype]) < 10.0
+
+
+def test_analyse_splits_jobs():
+    events = [
+        {"event": "script_finish", "time": 101.0, "seconds": 0.5},
+        {"event": "job_start", "time": 102.0, "job": "bias"},
+        {"event": "script_finish", "time": 104.0, "seconds": 1.5},
+        {"event": "script_finish", "time": 105.0, "seconds": 1.0},
+        {"event": "job_finish", "time": 106.0, "job": "bias"},
+        {"event": "job_start", "time": 107.0, "job": "flat"},
+        {"event": "job_finish", "time": 108.0, "job": "flat"}]
+    rows = e2e.analyse(100.0, 10.0, events)
+    assert [(r["job"], r["wall"], r["scripts"], r["calls"], r["overhead"])
+            for r in rows] == [
+        ("setup", 2.0, 0.5, 1, 1.5), ("bias", 4.0, 2.5, 2, 1.5),
+        ("flat", 1.0, 0.0, 0, 1.0), ("other", 3.0, 0.0, 0, 3.0)]
+    lines = e2e.report(100, 25, rows).splitlines()
+    assert lines[0] == "100 files (25 exposures)"
+    assert lines[-1].split() == [
+        "TOTAL", "10.00", "3.00", "3", "7.00", "70.000"]
+
+
+def test_microbenchmarks_run(theli_home, tmp_path, monkeypatch):
+    monkeypatch.setattr(scripts, "CALL_MONITORS", [])
+    args = argparse.Namespace(files=40, log=None, log_size=0.01)
+    ctx = micro.Context(str(tmp_path), args, DIRS["SCRIPTS"])
+    assert len(ctx.names()) == 40
+    for name, setup, number in micro.BENCHMARKS:
+        stmt = setup(ctx)
+        if stmt is None:  # requires an optional FITS library
+            assert name.endswith(".pyfits")
+            continue
+        best, med, number = micro.measure(stmt, 1, 2)
+        assert 0.0 < best <= med and number == 1
+
+
+def result(commit, seconds, files=10000):
+    return dict(commit=commit, dirty=False, config=dict(files=files),
+                results={name: dict(min=t) for name, t in seconds.items()})
+
+
+def test_find_baseline():
+    history = [result("aaa1", {}), result("bbb2", {}),
+               result("bbb2", {}, files=100), result("ccc3", {})]
+    current = result("ccc3", {})
+    assert micro.find_baseline(history, current, "") is history[1]
+    assert micro.find_baseline(history, current, "aaa") is history[0]
+    assert micro.find_baseline(history, current, "ddd") is None
+    assert micro.find_baseline(
+        history, result("ccc3", {}, files=100), "") is history[2]
+
+
+def test_compare_reports_regressions(capsys):
+    baseline = result("aaa1", {"fast": 1e-3, "slow": 1e-3, "same": 2.0})
+    current = result("bbb2", {"fast": 5e-4, "slow": 1.2e-3, "same": 2.1,
+                              "new": 1e-9})
+    assert micro.compare(baseline, current, 0.1) == ["slow"]
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1] == "compared with aaa1"
+    assert len(lines) == 6
+    assert lines[4].split() == ["slow", "1.000", "ms", "1.200", "ms",
+                                "1.20", "REGRESSION"]
+
+
+@pytest.mark.parametrize("seconds,formatted", [
+    (2.5, "2.500 s"), (0.0123, "12.300 ms"), (4.2e-6, "4.200 us"),
+    (3e-8, "30.0 ns")])
+def test_format_time(seconds, formatted):
+    assert micro.format_time(seconds) == formatted
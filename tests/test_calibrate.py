@@ -0,0 +1,78 @@
+"""
+Tests of the python calibration backend (system.native.calibrate)
+"""
+
+import os
+
+from system.native.calibrate import calibrate_folder
+from system.native.check import estimate_mode
+
+from .fitsdata import ChipInstrument, np, read_image, write_float, write_raw
+
+
+def test_calibrate_folder_matches_reference(tmp_path, rng):
+    # chips of 12x20 pixels with overscan columns 17-20, cut to 8x12
+    instrument = ChipInstrument(
+        nchips=2, size=(8, 12), overscan=(17, 20), cut=(3, 2))
+    science = tmp_path / "SCIENCE"
+    (tmp_path / "BIAS").mkdir()
+    (tmp_path / "FLAT").mkdir()
+    science.mkdir()
+    raw = {}
+    bias = {}
+    flat = {}
+    files = []
+    for chip in (1, 2):
+        bias[chip] = rng.normal(5.0, 1.0, size=(8, 12)).astype(np.float32)
+        # the second chip has a higher gain
+        flat[chip] = rng.uniform(
+            0.8, 1.2, size=(8, 12)).astype(np.float32) * 1000.0 * chip
+        flat[chip][0, 0] = 0.0  # no valid flat value
+        write_float(tmp_path / "BIAS" / ("BIAS_%d.fits" % chip), bias[chip])
+        write_float(tmp_path / "FLAT" / ("FLAT_%d.fits" % chip), flat[chip])
+        for name in ("exp1", "exp2"):
+            raw[name, chip] = rng.integers(1000, 2000, size=(12, 20))
+            files.append(write_raw(
+                science / ("%s_%d.fits" % (name, chip)), raw[name, chip],
+                keys=[("CRPIX1", 100.0), ("CRPIX2", 50.0)]))
+    errors = calibrate_folder(
+        instrument, files, biasdir=str(tmp_path / "BIAS"),
+        flatdir=str(tmp_path / "FLAT"), nprocs=2)
+    assert errors == []
+    # all chips are normalised by the same value
+    scale = np.median([estimate_mode(flat[chip].ravel()) for chip in (1, 2)])
+    for (name, chip), data in raw.items():
+        overscan = np.median(data[:, 16:20], axis=1)[:, np.newaxis]
+        expected = (data - overscan)[1:9, 2:14] - bias[chip]
+        with np.errstate(divide="ignore"):
+            expected = np.where(
+                flat[chip] > 0.0, expected * scale / flat[chip], 0.0)
+        calibrated, header = read_image(
+            science / ("%s_%dOFC.fits" % (name, chip)))
+        np.testing.assert_allclose(calibrated, expected, rtol=1e-5)
+        # the reference pixel follows the cut
+        assert header["CRPIX1"] == 98.0
+        assert header["CRPIX2"] == 49.0
+    assert sorted(os.listdir(science / "SPLIT_IMAGES")) == sorted(
+        os.path.basename(f) for f in files)
+
+
+def test_calibrate_folder_reports_missing_master(tmp_path, rng):
+    files = [write_raw(
+        tmp_path / "exp_1.fits", rng.integers(0, 100, size=(8, 8)))]
+    errors = calibrate_folder(
+        ChipInstrument(nchips=1, size=(8, 8)), files,
+        biasdir=str(tmp_path / "BIAS"))
+    assert len(errors) == 1 and errors[0].startswith("chip 1: master bias")
+    assert os.path.exists(files[0])
+
+
+def test_calibrate_folder_reports_missing_flat(tmp_path, rng):
+    (tmp_path / "FLAT").mkdir()
+    files = [write_raw(
+        tmp_path / "exp_1.fits", rng.integers(0, 100, size=(8, 8)))]
+    errors = calibrate_folder(
+        ChipInstrument(nchips=1, size=(8, 8)), files,
+        flatdir=str(tmp_path / "FLAT"))
+    assert errors == ["master flat: no master flat found"]
+    assert os.path.exists(files[0])
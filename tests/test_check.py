@@ -0,0 +1,58 @@
+"""
+Tests of the python brightness level check (system.native.check)
+"""
+
+import os
+
+from system.native.check import (check_folder, chip_mode, estimate_mode,
+                                 stats_region)
+
+from .fitsdata import ChipInstrument, np, write_raw
+
+
+def test_estimate_mode_of_skewed_sample(rng):
+    # sky with faint sources: the mode is close to the sky level, unlike
+    # the mean
+    values = np.concatenate([
+        rng.normal(1000.0, 10.0, 20000), 1000.0 + rng.exponential(50, 2000)])
+    assert abs(estimate_mode(values) - 1000.0) < 3.0
+    assert values.mean() > 1004.0
+
+
+def test_stats_region_is_clipped():
+    instrument = ChipInstrument(nchips=1, stats=(5, 100, 0, 8))
+    assert stats_region(instrument, 1, (20, 30)) == (0, 8, 4, 30)
+    # full image without region
+    assert stats_region(ChipInstrument(nchips=1), 1, (20, 30)) == \
+        (0, 20, 0, 30)
+
+
+def test_chip_mode_subsample_matches_full_region(tmp_path, rng):
+    data = rng.normal(1000.0, 20.0, size=(400, 200)).astype(np.int16)
+    path = write_raw(tmp_path / "exp_1.fits", data)
+    region = (0, 400, 0, 200)
+    full, error = chip_mode(path, region, 1.0)
+    assert error == 0.0
+    assert full == estimate_mode(data.ravel())
+    mode, error = chip_mode(path, region, 0.05)
+    assert error > 0.0
+    assert abs(mode - full) < 3.0
+
+
+def test_check_folder_matches_reference(tmp_path, rng):
+    levels = {"low": 500.0, "sky": 1000.0, "high": 5000.0, "edge": 1990.0}
+    files = []
+    expected = set()
+    for name, level in levels.items():
+        for chip in (1, 2):
+            data = rng.normal(level, 20.0, size=(400, 200)).astype(np.int16)
+            files.append(write_raw(tmp_path / ("%s_%d.fits" % (name, chip)),
+                                   data))
+            if not 800.0 <= estimate_mode(data.ravel()) <= 2000.0:
+                expected.add(name)
+    rejected, errors = check_folder(
+        ChipInstrument(nchips=2), files, 800.0, 2000.0, nthreads=2)
+    assert errors == []
+    assert rejected == sorted(expected) == ["high", "low"]
+    assert sorted(os.listdir(tmp_path / "BADMODE")) == [
+        "high_1.fits", "high_2.fits", "low_1.fits", "low_2.fits"]
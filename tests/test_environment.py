@@ -0,0 +1,151 @@
+"""
+Tests of the lazily loaded THELI environment (system.base)
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmark.stub_theli import create_home, create_installation
+from system import base
+from system.base import LazyDict, LazyList, LazyPath
+
+from .fitsdata import STUB_INSTRUMENT
+
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Loader(object):
+    """Returns 'value' and counts the calls."""
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_lazy_dict():
+    loader = Loader({"HOME": "/home/user"})
+    lazy = LazyDict(loader)
+    assert loader.calls == 0
+    assert lazy["HOME"] == "/home/user"
+    lazy["PIPEHOME"] = "/home/user/.theli"
+    del lazy["HOME"]
+    assert dict(lazy) == {"PIPEHOME": "/home/user/.theli"}
+    assert len(lazy) == 1 and "PIPEHOME" in lazy
+    assert repr(lazy) == repr(loader.value)
+    assert loader.calls == 1
+
+
+def test_lazy_list():
+    loader = Loader(["ACAM@WHT", "WFI@MPGESO"])
+    lazy = LazyList(loader)
+    assert loader.calls == 0
+    assert "ACAM@WHT" in lazy and "GMOS@GEMINI" not in lazy
+    assert lazy[-1] == "WFI@MPGESO"
+    assert list(lazy) == loader.value and len(lazy) == 2
+    assert loader.calls == 1
+
+
+def test_lazy_path(tmp_path):
+    loader = Loader(str(tmp_path / "theli.lock"))
+    lazy = LazyPath(loader)
+    assert loader.calls == 0
+    assert not os.path.exists(lazy)
+    with open(lazy, "w"):
+        pass
+    assert os.path.exists(lazy)
+    assert os.path.join(lazy, "") == loader.value + os.sep
+    assert "%s" % lazy == loader.value and str(lazy) == loader.value
+    assert lazy == loader.value and lazy == LazyPath(Loader(loader.value))
+    assert {lazy: 1}[loader.value] == 1
+    assert loader.calls == 1
+
+
+def test_startup_without_installation(tmp_path):
+    # neither importing the wrapper nor the help require the THELI setup,
+    # which would ask for the installation on the standard input
+    env = dict(os.environ, HOME=str(tmp_path))
+    for command in (
+            ["-c", "import system.reduction, system.planner, "
+                   "commandline.parser"],
+            [os.path.join(REPOSITORY, "theli.py"), "--help"]):
+        process = subprocess.run(
+            [sys.executable] + command, cwd=REPOSITORY, env=env,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, timeout=60)
+        assert process.returncode == 0, process.stderr.decode()
+    assert "usage:" in process.stdout.decode()
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.fixture
+def installation(tmp_path, monkeypatch):
+    """Stub THELI installation with its own home folder, the builds of the
+    environment snapshot are counted."""
+    pipesoft = create_installation(str(tmp_path), nchips=1)
+    home = str(tmp_path / "home")
+    create_home(home, pipesoft)
+    monkeypatch.setenv("HOME", home)
+    builds = []
+    build = base._build_environment
+
+    def counted():
+        builds.append(1)
+        return build()
+
+    monkeypatch.setattr(base, "_build_environment", counted)
+    return pipesoft, builds
+
+
+def test_snapshot_is_reused(installation):
+    pipesoft, builds = installation
+    environment = base._load_environment()
+    assert len(builds) == 1
+    assert environment["DIRS"]["PIPESOFT"] == pipesoft
+    assert environment["DIRS"]["SCRIPTS"] == os.path.join(
+        pipesoft, "gui", "scripts")
+    assert environment["INSTRUMENTS"] == [STUB_INSTRUMENT]
+    assert environment["versions"] == {
+        "__version_theli__": "0.0.0", "__version_gui__": "0.0.0"}
+    assert environment["LOGFILE"] == os.path.join(
+        environment["DIRS"]["PIPEHOME"], "theli_last.log")
+    assert os.path.exists(base._environment_file())
+    assert base._load_environment() == environment
+    assert len(builds) == 1
+
+
+def test_snapshot_rebuilt_on_changes(installation):
+    pipesoft, builds = installation
+    base._load_environment()
+    # a new instrument changes the modification time of the script folder
+    scriptdir = os.path.join(pipesoft, "gui", "scripts")
+    os.utime(scriptdir, (0, 0))
+    environment = base._load_environment()
+    assert len(builds) == 2
+    with open(os.path.join(pipesoft, "README"), "w") as f:
+        f.write("THELI stub installation, version 0.0.1\n")
+    os.utime(os.path.join(pipesoft, "README"), (1, 1))
+    environment = base._load_environment()
+    assert len(builds) == 3
+    assert environment["versions"]["__version_theli__"] == "0.0.1"
+    # outdated and corrupt snapshots
+    environment["version"] = base.ENVIRONMENT_VERSION - 1
+    with open(base._environment_file(), "w") as f:
+        json.dump(environment, f)
+    base._load_environment()
+    assert len(builds) == 4
+    for content in ("{", "[]", "{}"):
+        with open(base._environment_file(), "w") as f:
+            f.write(content)
+        base._load_environment()
+    assert len(builds) == 7
+    base._load_environment()
+    assert len(builds) == 7
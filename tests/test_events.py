@@ -0,0 +1,90 @@
+"""
+Tests of the machine readable event stream of the reduction (system.events)
+"""
+
+import json
+
+import pytest
+
+from system.events import EventMonitor, EventStream
+
+from .fitsdata import write_exposures
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_stream_distributes_events(tmp_path):
+    stream = EventStream("project")
+    assert not stream.enabled
+    stream.emit("discarded")
+    received = []
+    stream.add_callback(received.append)
+    path = str(tmp_path / "events.jsonl")
+    stream.add_file(path)
+    # several streams can share a file
+    other = EventStream("other")
+    other.add_file(path)
+    assert stream.enabled
+    stream.emit("run_start", ncpus=4)
+    other.emit("warning", message="text")
+    stream.close()
+    other.close()
+    stream.emit("stage_start", stage="header")
+    events = read_events(path)
+    assert [(e["event"], e["source"]) for e in events] == [
+        ("run_start", "project"), ("warning", "other")]
+    assert events[0]["ncpus"] == 4
+    assert events[0]["time"] <= events[1]["time"]
+    # the callback keeps receiving after the files are closed
+    assert [e["event"] for e in received] == ["run_start", "stage_start"]
+
+
+@pytest.mark.usefixtures("theli_home")
+def test_monitor_reports_script_calls(tmp_path):
+    (tmp_path / "BIAS").mkdir()
+    for name in ("bias1_1.fits", "bias1_2.fits", "bias2_1.fits"):
+        (tmp_path / "BIAS" / name).write_bytes(b"")
+    stream = EventStream()
+    received = []
+    stream.add_callback(received.append)
+    monitor = EventMonitor(stream, 4)
+    arglist = [str(tmp_path), "BIAS"]
+    monitor.call_prepare("process_bias_para.sh", arglist)
+    monitor.call_started("process_bias_para.sh", arglist, None)
+    monitor.call_finished("process_bias_para.sh", arglist, None, (12, "x"))
+    monitor.call_prepare("process_bias_para.sh", arglist)
+    monitor.call_started("process_bias_para.sh", arglist, None)
+    monitor.call_finished("process_bias_para.sh", arglist, None, None)
+    start, finish, _, interrupted = received
+    assert (start["event"], start["folder"], start["exposures"],
+            start["chips"]) == ("script_start", "BIAS", 2, 8)
+    assert (finish["event"], finish["success"], finish["interrupted"],
+            finish["log_line"]) == ("script_finish", False, False, 12)
+    assert finish["seconds"] >= 0.0
+    assert (interrupted["interrupted"], interrupted["log_line"]) == (
+        True, None)
+
+
+def test_reduction_events(tmp_path, make_reduction):
+    path = str(tmp_path / "events.jsonl")
+    write_exposures(tmp_path / "project" / "BIAS", "bias", 3)
+    reduction = make_reduction(biasdir="BIAS", events=path)
+    reduction.split_FITS_correct_header()
+    reduction.process_biases()
+    reduction.process_biases()
+    reduction.events.close()
+    events = read_events(path)
+    assert events[0]["event"] == "run_start"
+    assert events[0]["folders"] == {"biasdir": "BIAS"}
+    names = [e["event"] for e in events]
+    assert "script_start" in names and "script_finish" in names
+    assert all(e["success"] for e in events if e["event"] == "script_finish")
+    # the second call finds the master bias
+    assert names[-2:] == ["stage_skip", "stage_finish"]
+    # every stage is finished exactly once before the next one starts
+    stages = [e["event"] for e in events
+              if e["event"] in ("stage_start", "stage_finish")]
+    assert stages == ["stage_start", "stage_finish"] * (len(stages) // 2)
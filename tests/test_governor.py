@@ -0,0 +1,88 @@
+"""
+Tests of the memory governor of NPARA and NFRAMES (system.governor)
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from system import governor
+from system.base import DIRS
+from system.governor import DEFAULT_FACTOR, MemoryGovernor, count_exposures
+from system.parameters import Parameters
+
+
+FRAMESIZE = 1000
+
+
+@pytest.fixture
+def make_governor(theli_home, tmp_path, monkeypatch):
+    """Factory of governors with a memory limit in units of the memory of
+    one frame, the profile is written to 'tmp_path'."""
+    monkeypatch.setitem(DIRS, "PIPEHOME", str(tmp_path))
+    monkeypatch.setattr(governor, "free_memory", lambda: 10**12)
+
+    def make(units, ncpus=4, nchips=4, params=None):
+        return MemoryGovernor(
+            Parameters({} if params is None else params, write=False),
+            ncpus, nchips, FRAMESIZE, limit=units * DEFAULT_FACTOR * FRAMESIZE,
+            sampling=0.01)
+
+    return make
+
+
+@pytest.mark.parametrize("units,max_npara,max_nframes,expected", [
+    (100, None, None, (4, 10)),  # all exposures in memory
+    (12, None, None, (4, 3)),
+    (8, None, None, (2, 4)),  # fewer processes with at least 3 frames
+    (2, None, None, (1, 2)),
+    (100, 3, 5, (3, 5)),  # requested values are never exceeded
+    (0, None, None, (1, 1))])
+def test_plan_stacking_scripts(make_governor, units, max_npara, max_nframes,
+                               expected):
+    assert make_governor(units).plan(
+        "process_bias_para.sh", 10, max_npara, max_nframes) == expected
+
+
+def test_plan_other_scripts(make_governor):
+    assert make_governor(100).plan("create_weights_para.sh", 10) == (4, 25)
+    assert make_governor(2).plan("create_weights_para.sh", 10) == (2, 1)
+    # single chip cameras distribute the exposures
+    assert make_governor(100, ncpus=8, nchips=1).plan(
+        "create_weights_para.sh", 3) == (3, 33)
+    # learned memory consumption per frame
+    memory = make_governor(12)
+    memory.factors["create_weights_para.sh"] = 2 * DEFAULT_FACTOR
+    assert memory.plan("create_weights_para.sh", 10) == (4, 1)
+
+
+def test_count_exposures(tmp_path):
+    for name in ("a_1.fits", "a_2.fits", "b_1OFCB.fits", "b_1OFCB.sub.fits",
+                 "c_10.fits", "BIAS_1.fit"):
+        (tmp_path / name).write_bytes(b"")
+    assert count_exposures([str(tmp_path.parent), tmp_path.name]) == 3
+    assert count_exposures([str(tmp_path), "missing"]) == 0
+    assert count_exposures([]) == 0
+
+
+def test_restores_parameters_and_learns(make_governor, tmp_path):
+    memory = make_governor(12, params={"NPARA": "2", "NFRAMES": ""})
+    arglist = [str(tmp_path), "."]
+    memory.call_prepare("process_bias_para.sh", arglist)
+    assert memory.params.get("NPARA") == "2"
+    assert memory.params.get("NFRAMES") == "1"
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import time; time.sleep(0.2)"])
+    memory.call_started("process_bias_para.sh", arglist, process)
+    process.wait()
+    memory.call_finished("process_bias_para.sh", arglist, process, 0)
+    assert memory.params.get("NPARA") == "2"
+    assert memory.params.get("NFRAMES") == ""
+    # the python process needs far more than the tiny frames
+    factor = memory.factors["process_bias_para.sh"]
+    assert factor > DEFAULT_FACTOR
+    with open(os.path.join(str(tmp_path), "memory_profile.json")) as f:
+        assert json.load(f) == {"process_bias_para.sh": factor}
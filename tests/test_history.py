@@ -0,0 +1,91 @@
+"""
+Tests of the run history database of the script durations (system.history)
+"""
+
+import pytest
+
+from system.base import DIRS
+from system.history import RunHistory
+
+from .fitsdata import write_exposures
+
+
+@pytest.fixture
+def history(tmp_path):
+    """Run history with two runs of 'ACAM@WHT' on 'host1' and one run of
+    'WFI@MPGESO' on 'host2'."""
+    history = RunHistory(str(tmp_path / "history.sqlite"))
+    runs = [history.start_run(inst, "", "", 4)
+            for inst in ("ACAM@WHT", "ACAM@WHT", "WFI@MPGESO")]
+    history.db.execute("UPDATE runs SET host = ?, started = id",
+                       ("host1",))
+    history.db.execute("UPDATE runs SET host = ? WHERE id = ?",
+                       ("host2", runs[2]))
+    for run, exposures, seconds in ((runs[0], 4, 8.0), (runs[0], 40, 40.0),
+                                    (runs[1], 5, 20.0), (runs[2], 4, 1.0)):
+        history.add_stage(run, "process_bias_para.sh", "BIAS", exposures,
+                          2 * exposures, 4, 0.0, seconds, True)
+    # failed calls are ignored
+    history.add_stage(runs[1], "process_bias_para.sh", "BIAS", 4, 8, 4,
+                      0.0, 1000.0, False)
+    step = history.add_step(runs[0], "Processing biases", 4, 8, 0.0, 1.0,
+                            False)
+    history.update_step(step, 9.0, True)
+    yield history
+    history.close()
+
+
+def test_predict_scales_similar_runs(history):
+    # only the calls with 4 and 5 exposures are similar, scaled to 8
+    # exposures they take 16 and 32 seconds
+    assert history.predict("process_bias_para.sh", "ACAM@WHT", 8) == 32.0
+    assert history.predict("process_bias_para.sh", "ACAM@WHT", 4) == 16.0
+    # no similar call, the median of all scaled calls
+    assert history.predict("process_bias_para.sh", "ACAM@WHT", 1000) == \
+        2000.0
+    # unknown exposure count
+    assert history.predict("process_bias_para.sh", "ACAM@WHT", 0) == 20.0
+    assert history.predict("process_bias_para.sh", "WFI@MPGESO", 4) == 1.0
+    assert history.predict("process_bias_para.sh", "GMOS@GEMINI", 4) is None
+    assert history.predict("process_flat_para.sh", "ACAM@WHT", 4) is None
+
+
+def test_predict_step(history):
+    assert history.predict_step("Processing biases", "ACAM@WHT", 8) == 18.0
+    assert history.predict_step("Processing flats", "ACAM@WHT", 8) is None
+
+
+def test_summary_and_runs(history):
+    summary = history.summary()
+    assert [row[:4] for row in summary] == [
+        ("ACAM@WHT", "process_bias_para.sh", 3, 98),
+        ("WFI@MPGESO", "process_bias_para.sh", 1, 8)]
+    assert summary[0][4] == pytest.approx(68.0 / 3600.0)
+    assert summary[0][5] == pytest.approx(68.0 / 98)
+    assert history.summary(host="host2") == [summary[1]]
+    assert history.summary(instrument="ACAM@WHT", since=2) == [
+        ("ACAM@WHT", "process_bias_para.sh", 1, 10, 20.0 / 3600.0, 2.0)]
+    runs = history.runs()
+    assert [(r[0], r[2], r[3], r[6]) for r in runs] == [
+        (1, "host1", "ACAM@WHT", 2), (2, "host1", "ACAM@WHT", 2),
+        (3, "host2", "WFI@MPGESO", 1)]
+    assert runs[1][7] == 1020.0
+    assert history.runs(host="host3") == []
+
+
+def test_reduction_records_calls(tmp_path, make_reduction, monkeypatch):
+    monkeypatch.setitem(DIRS, "PIPEHOME", str(tmp_path))
+    write_exposures(tmp_path / "project" / "BIAS", "bias", 3)
+    reduction = make_reduction(biasdir="BIAS")
+    reduction.split_FITS_correct_header()
+    reduction.process_biases()
+    history = RunHistory()
+    scripts = [row[1] for row in history.summary()]
+    assert "process_bias_para.sh" in scripts
+    assert history.predict(
+        "process_bias_para.sh", reduction.instrument.NAME, 3) is not None
+    steps = history.db.execute(
+        "SELECT exposures, success FROM steps").fetchall()
+    assert len(steps) >= 2
+    assert all(success == 1 for exposures, success in steps)
+    history.close()
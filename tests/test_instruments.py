@@ -0,0 +1,146 @@
+"""
+Tests of the instrument database (system.instruments)
+"""
+
+import json
+import os
+
+import pytest
+
+from system import instruments
+from system.base import DIRS
+from system.instruments import (DATABASE_VERSION, Instrument,
+                                instrument_database, parse_instrument_file)
+
+from .fitsdata import STUB_INSTRUMENT, STUB_NCHIPS
+
+
+MOSAIC_INI = """# mosaic camera
+INSTRUMENT=MOSAIC@TEST
+export NCHIPS=3  # three chips
+. progs.ini
+PIXSCALE=0.25
+GAIN=
+PIXSCX=-6.9e-05
+SIZEX=([1]=2048 [2]=2048 [3]=1024)
+SIZEY=([1]=4096 [2]=4096 [3]=4096 [4]=4096)
+OVSCANX1=([1]=10 [3]=12)
+CUTX=5
+REFPIXX=([1]=-10.5 [2]=2100.0 [3]=invalid)
+if [ "${USE_X}" = 1 ]; then
+  STATSXMIN=([1]=100)
+fi
+TYPE=NIR
+"""
+
+
+def write_ini(folder, name, content):
+    os.makedirs(str(folder), exist_ok=True)
+    path = os.path.join(str(folder), name + ".ini")
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def test_parse_instrument_file(tmp_path):
+    data = parse_instrument_file(
+        write_ini(tmp_path, "MOSAIC@TEST", MOSAIC_INI))
+    assert (data["NCHIPS"], data["TYPE"], data["PIXSCALE"]) == (
+        3, "NIR", 0.25)
+    # empty values keep the defaults
+    assert (data["GAIN"], data["PIXSCX"], data["PIXSCY"]) == (
+        1.0, -6.9e-05, 0.0)
+    assert data["SIZEX"] == [2048, 2048, 1024]
+    # chips beyond NCHIPS are ignored, missing chips are 0
+    assert data["SIZEY"] == [4096, 4096, 4096]
+    assert data["OVSCANX1"] == [10, 0, 12]
+    # scalar values apply to all chips
+    assert data["CUTX"] == [5, 5, 5]
+    # invalid values of optional variables are ignored
+    assert data["REFPIXX"] == [0, 0, 0]
+    assert data["STATSXMIN"] == [100, 0, 0]
+    assert data["CUTY"] == [0, 0, 0]
+
+
+@pytest.mark.parametrize("line", [
+    "NCHIPS=two", "PIXSCALE=0.2arcsec", "SIZEX=([1]=large)"])
+def test_parse_invalid_required_keys(tmp_path, line):
+    path = write_ini(tmp_path, "BROKEN@TEST", MOSAIC_INI + line + "\n")
+    with pytest.raises(ValueError):
+        parse_instrument_file(path)
+
+
+@pytest.fixture
+def folders(theli_home, tmp_path, monkeypatch):
+    """Empty instrument folders in 'tmp_path', the database is written to
+    'tmp_path' as well."""
+    monkeypatch.setitem(DIRS, "PIPEHOME", str(tmp_path))
+    monkeypatch.setitem(DIRS, "SCRIPTS", str(tmp_path / "scripts"))
+    monkeypatch.setattr(instruments, "_database", None)
+    return [tmp_path / "instruments_user",
+            tmp_path / "scripts" / "instruments_commercial",
+            tmp_path / "scripts" / "instruments_professional"]
+
+
+def test_database_precedence(folders):
+    user, commercial, professional = folders
+    write_ini(user, "MOSAIC@TEST", MOSAIC_INI.replace("0.25", "0.3"))
+    write_ini(professional, "MOSAIC@TEST", MOSAIC_INI)
+    write_ini(commercial, "BROKEN@TEST", "NCHIPS=two\n")
+    (commercial / "README").write_text("NCHIPS=1\n")
+    database = instrument_database()
+    assert sorted(database) == ["BROKEN@TEST", "MOSAIC@TEST"]
+    assert database["BROKEN@TEST"] is None
+    assert database["MOSAIC@TEST"]["PIXSCALE"] == 0.25
+    # the parsed data is cached in memory
+    assert instrument_database() is database
+
+
+def test_database_rebuilt_on_changes(folders, tmp_path, monkeypatch):
+    user, commercial, professional = folders
+    path = write_ini(professional, "MOSAIC@TEST", MOSAIC_INI)
+    instrument_database()
+    dbfile = str(tmp_path / "instruments.json")
+    with open(dbfile) as f:
+        stored = json.load(f)
+    assert stored["version"] == DATABASE_VERSION
+    assert stored["instruments"]["MOSAIC@TEST"]["NCHIPS"] == 3
+    builds = []
+    build = instruments._build_database
+
+    def counted(folders):
+        builds.append(1)
+        return build(folders)
+
+    monkeypatch.setattr(instruments, "_build_database", counted)
+    monkeypatch.setattr(instruments, "_database", None)
+    assert instrument_database()["MOSAIC@TEST"]["SIZEX"] == [
+        2048, 2048, 1024]
+    assert builds == []
+    # a modified instrument file
+    write_ini(professional, "MOSAIC@TEST", MOSAIC_INI.replace(
+        "NCHIPS=3", "NCHIPS=2"))
+    os.utime(path, (0, 0))
+    monkeypatch.setattr(instruments, "_database", None)
+    assert instrument_database()["MOSAIC@TEST"]["NCHIPS"] == 2
+    assert len(builds) == 1
+    # a new user folder
+    write_ini(user, "OTHER@TEST", MOSAIC_INI)
+    monkeypatch.setattr(instruments, "_database", None)
+    assert sorted(instrument_database()) == ["MOSAIC@TEST", "OTHER@TEST"]
+    assert len(builds) == 2
+
+
+@pytest.mark.usefixtures("theli_home")
+def test_instrument():
+    instrument = Instrument(STUB_INSTRUMENT)
+    assert instrument.NCHIPS == STUB_NCHIPS
+    assert (instrument.TYPE, instrument.PIXSCALE) == ("OPT", 0.2)
+    assert instrument.CHIPSIZEX == [2048] * STUB_NCHIPS
+    assert (instrument.SIZEX, instrument.SIZEY) == (2048, 4096)
+    assert instrument.chip_bytes() == instrument.chip_bytes(1) == \
+        2048 * 4096 * 4
+    assert "%d chip(s) of size 2048 x 4096" % STUB_NCHIPS in str(instrument)
+    with pytest.raises(ValueError):
+        instrument.set("MISSING@TEST")
+    assert instrument.NAME == "" and instrument.chip_bytes() == 0
@@ -0,0 +1,75 @@
+"""
+Tests of the python outlier rejection backend (system.native.outliers)
+"""
+
+import pytest
+
+from system.native.outliers import (MIN_TILE_SIZE, filter_outliers,
+                                    tile_layout)
+
+from .fitsdata import np, read_image, write_float
+
+
+# position (y, x) of the resampled images on the coaddition grid
+OFFSETS = ((0, 0), (3, 5), (6, 2), (1, 9), (4, 4))
+# cosmic ray in the third image in image coordinates
+COSMIC = (2, 20, 17)
+
+
+def write_coadd(folder, rng, shape=(40, 40)):
+    for n, (y, x) in enumerate(OFFSETS):
+        data = rng.normal(100.0, 3.0, size=shape).astype(np.float32)
+        if n == COSMIC[0]:
+            data[COSMIC[1:]] += 500.0
+        keys = [("COMIN1", x + 1), ("COMIN2", y + 1)]
+        write_float(folder / ("img%d.resamp.fits" % n), data, keys)
+        write_float(folder / ("img%d.resamp.weight.fits" % n),
+                    np.ones(shape, dtype=np.float32), keys)
+
+
+def rejected(folder):
+    """Pixels with zero weight by image."""
+    pixels = {}
+    for n in range(len(OFFSETS)):
+        weight, header = read_image(folder / ("img%d.resamp.weight.fits" % n))
+        y, x = np.nonzero(weight == 0.0)
+        if len(y) > 0:
+            pixels[n] = sorted(zip(y.tolist(), x.tolist()))
+    return pixels
+
+
+@pytest.mark.parametrize("tilesize,nprocs,max_bytes", [
+    (512, 1, None), (8, 2, None), (512, 2, 300000)])
+def test_filter_outliers_rejects_cosmic(tmp_path, rng, tilesize, nprocs,
+                                        max_bytes):
+    write_coadd(tmp_path, rng)
+    nrejected, errors = filter_outliers(
+        str(tmp_path), 8.0, nprocs=nprocs, tilesize=tilesize,
+        max_bytes=max_bytes)
+    assert errors == []
+    assert nrejected == 1
+    assert rejected(tmp_path) == {COSMIC[0]: [COSMIC[1:]]}
+
+
+def test_filter_outliers_masks_border(tmp_path, rng):
+    write_coadd(tmp_path, rng)
+    nrejected, errors = filter_outliers(
+        str(tmp_path), 8.0, borderwidth=1, tilesize=8)
+    assert errors == []
+    y, x = COSMIC[1:]
+    expected = [(y + dy, x + dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+    assert nrejected == 9
+    assert rejected(tmp_path) == {COSMIC[0]: expected}
+
+
+def test_tile_layout_shrinks_tiles_then_workers():
+    def tile_bytes(size):
+        # 8 copies of a stack of 10 tiles with a margin of 1 pixel
+        return 8 * 4 * 10 * (size + 2)**2
+
+    assert tile_layout(10, 4, None, 1) == (512, 4)
+    assert tile_layout(10, 4, 4 * tile_bytes(512), 1) == (512, 4)
+    assert tile_layout(10, 4, 4 * tile_bytes(256), 1) == (256, 4)
+    assert tile_layout(10, 4, 2 * tile_bytes(MIN_TILE_SIZE), 1) == \
+        (MIN_TILE_SIZE, 2)
+    assert tile_layout(10, 4, 1, 1) == (MIN_TILE_SIZE, 1)
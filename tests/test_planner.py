@@ -0,0 +1,146 @@
+"""
+Tests of the job verification shared by the reduction and the dry-run
+planner (system.folder, system.planner)
+"""
+
+import pytest
+
+from system.base import DIRS
+from system.folder import Folder, check_requirements
+from system.history import RunHistory
+from system.planner import FolderSnapshot, Planner
+
+from .fitsdata import STUB_INSTRUMENT, write_exposures
+
+
+def touch(folder, names):
+    for name in names:
+        (folder / name).write_bytes(b"")
+
+
+def verifications(folder, redo):
+    return [
+        folder.verify_split(), folder.verify_master("bias", redo),
+        folder.verify_master("flat", redo, normflat=True),
+        folder.verify_calibration(),
+        folder.verify_step("B", "OFC", redo, min_count=3),
+        folder.verify_step("D", "OFC(BHC)", redo),
+        folder.verify_step(".sub", "OFC(BHCP)", redo, archive=False),
+        folder.verify_preview(redo), folder.verify_weights(redo),
+        folder.verify_refcat(redo), folder.verify_catalogs(redo),
+        folder.verify_astrometry(redo), folder.verify_coadd(redo)]
+
+
+@pytest.mark.parametrize("names", [
+    ["exp1.fits", "exp2.fits"],
+    ["exp%d_%d.fits" % (i, c) for i in range(3) for c in (1, 2)],
+    ["exp%d_%dOFC.fits" % (i, c) for i in range(2) for c in (1, 2)],
+    ["exp1_1OFCB.fits", "exp1_1OFCB.sub.fits", "OFC_IMAGES"],
+    ["exp1_1OFC.fits", "exp1_1OFCB.fits"],
+    ["BIAS_1.fits", "exp1_1.fits"]])
+@pytest.mark.parametrize("redo", [False, True])
+def test_snapshot_verification_matches_folder(tmp_path, names, redo):
+    for name in names:
+        if name.endswith("_IMAGES"):
+            (tmp_path / name).mkdir()
+    touch(tmp_path, [n for n in names if not n.endswith("_IMAGES")])
+    folder = Folder(str(tmp_path), nchips=2)
+    assert verifications(FolderSnapshot(folder), redo) == \
+        verifications(folder, redo)
+
+
+def test_snapshot_simulates_progress(tmp_path):
+    touch(tmp_path, ["exp%d_%dOFC.fits" % (i, c)
+                     for i in range(3) for c in (1, 2)])
+    snap = FolderSnapshot(Folder(str(tmp_path), nchips=2))
+    assert snap.fits_count() == 3
+    assert snap.verify_step("B", "OFC", False) == ("run", "")
+    snap.advance("OFC", "OFCB")
+    assert snap.verify_step("B", "OFC", False) == (
+        "skip", "OFCB images found")
+    assert snap.verify_step("B", "OFC", True) == (
+        "warn", "no OFC images found - skipping redo")
+
+
+def test_check_requirements(tmp_path):
+    touch(tmp_path, ["exp1_1.fits"])
+    folder = Folder(str(tmp_path), nchips=2)
+    assert check_requirements({}, [("biasdir", False)]) == \
+        "bias folder not specified"
+    assert check_requirements(
+        {"biasdir": folder}, [("biasdir", False)]) is None
+    assert check_requirements(
+        {"biasdir": folder}, [("biasdir", True)]) == "master bias not found"
+    touch(tmp_path, ["BIAS_1.fits"])
+    assert check_requirements(
+        {"biasdir": FolderSnapshot(folder)}, [("biasdir", True)]) is None
+
+
+@pytest.fixture
+def planned(tmp_path, make_reduction, monkeypatch):
+    """Factory of the plan of bias, flat and science exposures of the stub
+    instrument, with empty run history and tuning profile."""
+    monkeypatch.setitem(DIRS, "PIPEHOME", str(tmp_path))
+    maindir = tmp_path / "project"
+    write_exposures(maindir / "BIAS", "bias", 3)
+    write_exposures(maindir / "FLAT", "flat", 3)
+    write_exposures(maindir / "SCIENCE", "science", 2)
+
+    def plan(jobs, **kwargs):
+        planner = Planner(make_reduction(
+            biasdir="BIAS", flatdir="FLAT", sciencedir="SCIENCE", plan=True,
+            **kwargs))
+        planner.plan(jobs)
+        return planner
+
+    return plan
+
+
+JOBS = [("split", "split_FITS_correct_header", {}),
+        ("bias", "process_biases", {}),
+        ("flat", "process_flats", {}),
+        ("calibrate", "calibrate_data", {"use_dark": False})]
+
+
+def test_plan_raw_data(planned):
+    planner = planned(JOBS)
+    assert [(s["job"], s["folder"], s["action"], s["exposures"])
+            for s in planner.steps] == [
+        ("split", "BIAS", "run", 3), ("split", "FLAT", "run", 3),
+        ("split", "SCIENCE", "run", 2), ("bias", "BIAS", "run", 3),
+        ("flat", "FLAT", "run", 3), ("flat", "FLAT", "run", 1),
+        ("calibrate", "SCIENCE", "run", 2)]
+    assert planner.steps[-1]["scripts"] == ["process_science_para.sh"]
+    assert planner.steps[-1]["chips"] == 2 * planner.nchips
+    report = planner.report()
+    assert report.splitlines()[-1] == \
+        "estimated total runtime: 00:00:00 (incomplete)"
+
+
+def test_plan_blocks_after_failure(planned):
+    planner = planned([JOBS[0], ("darks", "process_darks", {}),
+                       JOBS[1], ("unknown", "reduce_everything", {})])
+    assert [(s["job"], s["action"]) for s in planner.steps] == [
+        ("split", "run"), ("split", "run"), ("split", "run"),
+        ("darks", "fail"), ("bias", "blocked"), ("unknown", "blocked")]
+    assert planner.steps[3]["reason"] == "dark folder not specified"
+
+
+@pytest.mark.parametrize("backend,scripts", [
+    ("shell", ["process_science_para.sh"]),
+    ("python", ["python calibrate"]),
+    ("shadow", ["process_science_para.sh", "python calibrate (shadow)"])])
+def test_plan_backends(planned, backend, scripts):
+    planner = planned(JOBS, backends={"calibrate": backend})
+    assert planner.steps[-1]["scripts"] == scripts
+
+
+def test_plan_estimates_from_history(planned, tmp_path):
+    history = RunHistory()
+    run = history.start_run(STUB_INSTRUMENT, "", "", 1)
+    history.add_stage(run, "process_science_para.sh", "SCIENCE", 4, 8, 1,
+                      0.0, 20.0, True)
+    history.close()
+    planner = planned(JOBS)
+    assert planner.steps[-1]["seconds"] == pytest.approx(10.0)
+    assert planner.steps[0]["seconds"] is None
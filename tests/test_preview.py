@@ -0,0 +1,49 @@
+"""
+Tests of the python preview backend (system.native.preview)
+"""
+
+import os
+import struct
+
+from system.native.fitsio import read_hdus
+from system.native.preview import bin_image, preview_folder
+
+from .fitsdata import ChipInstrument, np, read_image, write_raw
+
+
+def reference_bin(data, binning, function):
+    by, bx = data.shape[0] // binning, data.shape[1] // binning
+    blocks = data[:by * binning, :bx * binning].reshape(
+        by, binning, bx, binning).astype(np.float64)
+    return function(blocks, axis=(1, 3))
+
+
+def test_bin_image_matches_reference(tmp_path, rng):
+    data = rng.integers(0, 3000, size=(150, 70))
+    hdu = read_hdus(write_raw(tmp_path / "exp_1.fits", data))[0]
+    # incomplete blocks at the upper and right edge are dropped
+    np.testing.assert_allclose(
+        bin_image(hdu, 2), reference_bin(data, 2, np.mean), rtol=1e-6)
+    np.testing.assert_allclose(
+        bin_image(hdu, 3, median=True), reference_bin(data, 3, np.median),
+        rtol=1e-6)
+
+
+def test_preview_folder_writes_mosaic(tmp_path, rng):
+    # chips without reference pixels are placed in a row
+    chips = {
+        chip: rng.normal(1000.0, 10.0, size=(16, 24)).astype(np.int16)
+        for chip in (1, 2)}
+    files = [write_raw(tmp_path / ("exp_%d.fits" % chip), data)
+             for chip, data in chips.items()]
+    assert preview_folder(ChipInstrument(nchips=2), files, binning=4) == []
+    mosaic, header = read_image(
+        tmp_path / "BINNED_FITS" / "exp_1binned.fits")
+    expected = np.hstack([
+        reference_bin(chips[chip], 4, np.mean) for chip in (1, 2)])
+    np.testing.assert_allclose(mosaic, expected, rtol=1e-6)
+    with open(tmp_path / "BINNED_TIFF" / "exp_1binned.png", "rb") as f:
+        png = f.read(24)
+    assert png[:8] == b"\x89PNG\r\n\x1a\n"
+    assert struct.unpack(">II", png[16:24]) == (12, 4)
+    assert os.path.exists(tmp_path / "BINNED_TIFF" / "exp_1binned.tif")
@@ -0,0 +1,62 @@
+"""
+Tests of the profiler of the wrapper code (system.profiling)
+"""
+
+import os
+import signal
+import subprocess
+import sys
+from time import thread_time
+
+import pytest
+
+from system.profiling import JobProfiler, StackSampler
+
+
+def busy(seconds):
+    """Spend CPU time in the python process."""
+    start = thread_time()
+    while thread_time() - start < seconds:
+        sum(range(1000))
+    return "done"
+
+
+def test_sampler_records_collapsed_stacks(tmp_path):
+    previous = signal.getsignal(signal.SIGPROF)
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    try:
+        busy(0.1)
+    finally:
+        sampler.stop()
+    assert signal.getsignal(signal.SIGPROF) == previous
+    assert len(sampler.counts) > 0
+    assert any("busy (test_profiling.py:" in stack
+               for stack in sampler.counts)
+    path = str(tmp_path / "stacks.collapsed")
+    sampler.write(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == len(sampler.counts)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert sampler.counts[stack] == int(count)
+
+
+def test_profiler_ignores_child_processes(tmp_path):
+    profiler = JobProfiler(str(tmp_path / "profile"))
+    assert profiler.summary() == ""
+    assert profiler.run("busy", busy, 0.1) == "done"
+    profiler.run("wait", subprocess.call,
+                 [sys.executable, "-c", "import time; time.sleep(0.5)"])
+    with pytest.raises(SystemExit):
+        profiler.run("exit", sys.exit, 1)
+    # profiles are written even if the job exits
+    assert sorted(os.listdir(str(tmp_path / "profile"))) == [
+        "01_busy.collapsed", "01_busy.pstats", "02_wait.collapsed",
+        "02_wait.pstats", "03_exit.collapsed", "03_exit.pstats"]
+    summary = profiler.summary(limit=3)
+    lines = summary.splitlines()
+    assert len(lines) == 5
+    # waiting for the child process costs (almost) no CPU time
+    total = float(lines[0].split()[3].rstrip(","))
+    assert 0.1 <= total < 0.4
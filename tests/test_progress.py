@@ -0,0 +1,89 @@
+"""
+Tests of the live progress display of the THELI scripts (system.progress)
+"""
+
+import io
+
+import pytest
+
+from system import progress
+from system.progress import IMAGE_NAME, ProgressMonitor
+
+
+class Terminal(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the time of the progress display by a settable clock."""
+    now = [100.0]
+    monkeypatch.setattr(progress, "time", lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize("line,matches", [
+    ("processing exp1_1.fits", [("exp1", "1")]),
+    ("exp1_2OFC.fits -> exp1_2OFCB.fits", [("exp1", "2"), ("exp1", "2")]),
+    ("/data/SCIENCE/WFI.2003-01-01_10OFCBHC.sub.fits done",
+     [("WFI.2003-01-01", "10")]),
+    ("wrote exp1_3.weight.fits", [("exp1", "3")]),
+    ("no image here", []),
+    ("file.fits", [])])
+def test_image_names(line, matches):
+    assert [m.groups() for m in IMAGE_NAME.finditer(line)] == matches
+
+
+def test_disabled_without_terminal():
+    stream = io.StringIO()
+    monitor = ProgressMonitor(4, stream)
+    assert not monitor.enabled
+    monitor.call_prepare("process_science_para.sh", [])
+    monitor.call_started("process_science_para.sh", [], None)
+    monitor.call_output("process_science_para.sh", "exp1_1.fits")
+    monitor.call_finished("process_science_para.sh", [], None, 0)
+    assert stream.getvalue() == ""
+
+
+def test_counts_processed_chips(tmp_path, clock):
+    for i in (1, 2):
+        for chip in (1, 2):
+            (tmp_path / ("exp%d_%d.fits" % (i, chip))).write_bytes(b"")
+    arglist = [str(tmp_path.parent), tmp_path.name]
+    stream = Terminal()
+    monitor = ProgressMonitor(2, stream)
+    monitor.call_prepare("process_science_para.sh", arglist)
+    assert monitor._total == 4
+    monitor.call_started("process_science_para.sh", arglist, None)
+    # updates are limited by the update interval
+    monitor.call_output("process_science_para.sh", "exp1_1.fits")
+    assert stream.getvalue() == ""
+    clock[0] += 2.0
+    monitor.call_output("process_science_para.sh", "exp1_1OFC.fits")
+    # duplicate chips are counted once
+    assert stream.getvalue().split()[:3] == ["1/4", "chips,", "0.50"]
+    assert stream.getvalue().rstrip().endswith("ETA 00:00:06")
+    clock[0] += 2.0
+    monitor.call_output("process_science_para.sh", "exp1_2.fits exp2_1.fits")
+    assert stream.getvalue().split("\r")[-1].split()[0] == "3/4"
+    monitor.call_finished("process_science_para.sh", arglist, None, 0)
+    assert stream.getvalue().endswith("\r")
+    assert monitor._seen == set()
+
+
+def test_master_frames_per_chip(tmp_path, clock):
+    stream = Terminal()
+    monitor = ProgressMonitor(4, stream)
+    arglist = [str(tmp_path), "BIAS"]
+    monitor.call_prepare("process_bias_para.sh", arglist)
+    assert monitor._total == 4
+    monitor.call_started("process_bias_para.sh", arglist, None)
+    # the input exposures are not counted, only the master frames
+    monitor.call_output("process_bias_para.sh", "reading bias1_1.fits")
+    monitor.call_output("process_bias_para.sh", "writing BIAS_1.fits")
+    monitor.call_output("process_bias_para.sh", "writing BIAS_2.fits")
+    clock[0] += 2.0
+    monitor.display(clock[0])
+    assert stream.getvalue().split()[0] == "2/4"
@@ -0,0 +1,81 @@
+"""
+Tests of the detection of the system resources (system.resources)
+"""
+
+import os
+
+import pytest
+
+from system import resources
+
+
+GiB = 1024**3
+
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    """Factory of a cgroup hierarchy in 'tmp_path' with control files by
+    path relative to the hierarchy root, as seen by a process in the
+    cgroups 'paths' (see resources._cgroup_paths)."""
+    monkeypatch.setattr(resources, "CGROUP_ROOT", str(tmp_path))
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(8)))
+
+    def create(paths, files):
+        monkeypatch.setattr(resources, "_cgroup_paths", lambda: paths)
+        for name, content in files.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content + "\n")
+
+    return create
+
+
+V2 = {"": "/user.slice/job"}
+V1 = {"cpu": "/docker/abc", "cpuacct": "/docker/abc", "memory": "/docker/abc"}
+
+
+@pytest.mark.parametrize("paths,files,ncpus", [
+    ({}, {}, 8),
+    (V2, {"user.slice/job/cpu.max": "250000 100000"}, 3),
+    (V2, {"user.slice/job/cpu.max": "max 100000"}, 8),
+    # the cgroup of the process is not mounted inside containers
+    (V2, {"cpu.max": "100000 100000"}, 1),
+    (V1, {"cpu/docker/abc/cpu.cfs_quota_us": "300000",
+          "cpu/docker/abc/cpu.cfs_period_us": "100000"}, 3),
+    (V1, {"cpu/cpu.cfs_quota_us": "200000",
+          "cpu/cpu.cfs_period_us": "100000"}, 2),
+    (V1, {"cpu/docker/abc/cpu.cfs_quota_us": "-1",
+          "cpu/docker/abc/cpu.cfs_period_us": "100000"}, 8),
+    (V1, {"cpu/docker/abc/cpu.cfs_quota_us": "300000"}, 8)])
+def test_available_cpus(cgroup, paths, files, ncpus):
+    cgroup(paths, files)
+    assert resources.available_cpus() == ncpus
+
+
+@pytest.mark.parametrize("paths,files,limit", [
+    ({}, {}, None),
+    (V2, {"user.slice/job/memory.max": "max"}, None),
+    (V2, {"user.slice/job/memory.max": str(GiB)}, GiB),
+    (V1, {"memory/docker/abc/memory.limit_in_bytes": str(2 * GiB)}, 2 * GiB),
+    # v1 reports unlimited groups as a huge number
+    (V1, {"memory/docker/abc/memory.limit_in_bytes": str(2**63 - 4096)},
+     None)])
+def test_memory_limit(cgroup, paths, files, limit):
+    cgroup(paths, files)
+    assert resources.memory_limit() == limit
+
+
+def test_free_memory_respects_limit(cgroup, monkeypatch):
+    monkeypatch.setattr(
+        resources, "_read_meminfo", lambda: {"MemAvailable": 8 * GiB})
+    cgroup(V2, {"user.slice/job/memory.max": str(GiB),
+                "user.slice/job/memory.current": str(GiB // 4)})
+    assert resources.free_memory() == GiB - GiB // 4
+    assert resources.physical_memory() <= GiB
+    cgroup({}, {})
+    assert resources.free_memory() == 8 * GiB
+
+
+def test_process_tree_rss():
+    assert resources.process_tree_rss(os.getpid()) > 0
+    assert resources.process_tree_rss(-1) == 0
@@ -0,0 +1,71 @@
+"""
+Tests of the shadow mode of the reduction backends (system.shadow)
+"""
+
+import os
+
+from system.shadow import compare_images, find_outputs, mirror_tree
+
+from .fitsdata import np, write_float, write_raw
+
+
+def test_mirror_tree_selects_chips(tmp_path, rng):
+    maindir = tmp_path / "main"
+    for folder in ("SCIENCE", "SCIENCE/ORIGINALS", "SCIENCE/SPLIT_IMAGES"):
+        (maindir / folder).mkdir(parents=True)
+    data = rng.integers(0, 100, size=(4, 4))
+    for name in ("exp_1.fits", "exp_2.fits", "exp_1OFC.fits",
+                 "ORIGINALS/exp.fits", "SPLIT_IMAGES/exp_1.fits"):
+        write_raw(maindir / "SCIENCE" / name, data)
+    shadowdir = tmp_path / "shadow"
+    mirrored = mirror_tree(str(maindir), str(shadowdir), chips=[1])
+    assert sorted(mirrored) == [
+        os.path.join("SCIENCE", "exp_1.fits"),
+        os.path.join("SCIENCE", "exp_1OFC.fits")]
+    assert find_outputs(str(shadowdir), mirrored) == []
+    # new and modified files are outputs
+    write_raw(shadowdir / "SCIENCE" / "new_1.fits", data)
+    path = shadowdir / "SCIENCE" / "exp_1.fits"
+    os.utime(path, (0, 0))
+    assert find_outputs(str(shadowdir), mirrored) == [
+        os.path.join("SCIENCE", "exp_1.fits"),
+        os.path.join("SCIENCE", "new_1.fits")]
+
+
+def test_compare_images_counts_differences(tmp_path, rng):
+    data = rng.normal(1000.0, 10.0, size=(12, 10)).astype(np.float32)
+    data[0, 0] = np.nan
+    reference = write_float(tmp_path / "reference.fits", data)
+    # same values in a different data type
+    rounded = np.round(np.nan_to_num(data))
+    assert compare_images(
+        write_raw(tmp_path / "int.fits", rounded), write_float(
+            tmp_path / "rounded.fits", rounded)) == (120, 0, 0.0)
+    changed = data.copy()
+    changed[5, 5] += 1.0
+    changed[6, 6] += 1e-4
+    npixels, ndiffer, maxdiff = compare_images(
+        write_float(tmp_path / "changed.fits", changed), reference,
+        max_bytes=4 * 4 * 10)
+    assert (npixels, ndiffer) == (120, 1)
+    assert abs(maxdiff - 1.0) < 1e-3
+
+
+def test_mirror_tree_copies_selected_folders(tmp_path, rng):
+    # in-place stages get copies of the folders they read and write only
+    maindir = tmp_path / "main"
+    coadd = maindir / "SCIENCE" / "coadd_null"
+    coadd.mkdir(parents=True)
+    data = rng.integers(0, 100, size=(4, 4))
+    write_raw(maindir / "SCIENCE" / "exp_1OFC.fits", data)
+    source = write_raw(coadd / "exp_1OFC.resamp.weight.fits", data)
+    shadowdir = tmp_path / "shadow"
+    mirrored = mirror_tree(
+        str(maindir), str(shadowdir), link=False,
+        folders=[os.path.join("SCIENCE", "coadd_null")])
+    assert list(mirrored) == [
+        os.path.join("SCIENCE", "coadd_null", "exp_1OFC.resamp.weight.fits")]
+    # the other data folders exist, but are empty
+    assert os.listdir(shadowdir / "SCIENCE") == ["coadd_null"]
+    copy = shadowdir / "SCIENCE" / "coadd_null" / "exp_1OFC.resamp.weight.fits"
+    assert os.stat(copy).st_ino != os.stat(source).st_ino
@@ -0,0 +1,103 @@
+"""
+Tests of the fast single exposure reduction (Reduction.reduce_single) and
+its astrometry cache (system.astrometry)
+"""
+
+import os
+import shutil
+
+import pytest
+
+from system.astrometry import AstrometryCache
+from system.base import DIRS
+
+from .fitsdata import STUB_NCHIPS, write_exposures
+
+
+def write_header(path, ra, dec):
+    with open(path, "w") as head:
+        head.write("CRVAL1  = %20.10f / RA\n" % ra)
+        head.write("CRVAL2  = %20.10f / DEC\n" % dec)
+        head.write("CRPIX1  = %20.10f\n" % 1.0)
+    return str(path)
+
+
+def read_header(path):
+    values = {}
+    with open(path) as head:
+        for line in head:
+            values[line[:8].strip()] = float(line[9:].split("/")[0])
+    return values
+
+
+@pytest.mark.usefixtures("theli_home")
+def test_astrometry_cache_matches_pointing(tmp_path):
+    headers = {
+        chip: write_header(tmp_path / ("old_%d.head" % chip), 150.0, 2.0)
+        for chip in (1, 2)}
+    cache = AstrometryCache("CACHE@PYTEST", radius=2.0)
+    cache.store(150.0, 2.0, "r_G0326", headers)
+    # a second solution of the same pointing replaces the first
+    cache.store(150.0, 2.0, "r_G0326", headers)
+    cache.save()
+    cache = AstrometryCache("CACHE@PYTEST", radius=2.0)
+    assert cache.lookup(150.0, 2.0 + 3.0 / 60.0, "r_G0326") is None
+    assert cache.lookup(150.0, 2.0, "g_G0325") is None
+    entry = cache.lookup(150.01, 2.01, "r_G0326")
+    assert entry["chips"] == [1, 2]
+    cache.restore(entry, 150.01, 2.01, "new", str(tmp_path / "headers"))
+    assert sorted(os.listdir(tmp_path / "headers")) == [
+        "new_1.head", "new_2.head"]
+    values = read_header(tmp_path / "headers" / "new_2.head")
+    assert values["CRVAL1"] == pytest.approx(150.01)
+    assert values["CRVAL2"] == pytest.approx(2.01)
+    assert values["CRPIX1"] == 1.0
+
+
+@pytest.fixture
+def calibrated(tmp_path, make_reduction):
+    """Project with master bias, master flat and global weights of the stub
+    instrument, a science folder with a single exposure and an empty
+    astrometry cache."""
+    shutil.rmtree(os.path.join(DIRS["PIPEHOME"], "astrometry_cache"),
+                  ignore_errors=True)
+    maindir = tmp_path / "project"
+    write_exposures(maindir / "BIAS", "bias", 3)
+    write_exposures(maindir / "FLAT", "flat", 3)
+    write_exposures(maindir / "SCIENCE", "science", 1)
+    reduction = make_reduction(
+        biasdir="BIAS", flatdir="FLAT", sciencedir="SCIENCE")
+    reduction.split_FITS_correct_header()
+    reduction.process_biases()
+    reduction.process_flats()
+    reduction.create_global_weights()
+    return reduction
+
+
+def test_reduce_single_requires_calibration(tmp_path, calibrated, capsys):
+    rawfile, = write_exposures(tmp_path / "raw", "single", 1)
+    os.remove(os.path.join(calibrated.maindir, "FLAT", "FLAT_2.fits"))
+    capsys.readouterr()
+    with pytest.raises(SystemExit):
+        calibrated.reduce_single(rawfile)
+    assert "FLAT_2.fits" in capsys.readouterr().out
+    # the check only applies to enabled calibration steps
+    folder = calibrated.reduce_single(rawfile, params={"V_DO_FLAT": "N"})
+    assert folder.path == "SCIENCE_single00001"
+    assert folder.fits_count("OFC") == 1
+
+
+def test_reduce_single_reuses_astrometry(tmp_path, calibrated):
+    first, second = write_exposures(tmp_path / "raw", "single", 2)
+    for rawfile in (first, second):
+        folder = calibrated.reduce_single(rawfile)
+        assert folder.tags() == {"OFC"}
+        base = os.path.splitext(os.path.basename(rawfile))[0]
+        headerdir = os.path.join(folder.abs, "headers")
+        assert sorted(os.listdir(headerdir)) == [
+            "%s_%d.head" % (base, chip)
+            for chip in range(1, STUB_NCHIPS + 1)]
+        with open(os.path.join(headerdir, base + "_1.head")) as head:
+            shifted = "shifted by cache" in head.read()
+        # the second exposure is within the matching radius of the first
+        assert shifted == (rawfile == second)
@@ -0,0 +1,80 @@
+"""
+Tests of the python splitter (system.native.split)
+"""
+
+import os
+
+from benchmark.fitsgen import DEFAULT_KEYS
+from system.native.fitsio import read_hdus
+from system.native.split import check_split, split_exposure, split_exposures
+
+from .fitsdata import ChipInstrument, np, read_image, write_raw_mef
+
+
+def test_split_exposure_copies_chips_verbatim(tmp_path, rng):
+    data = rng.integers(-100, 3000, size=(12, 20))
+    rawfile = write_raw_mef(tmp_path / "exposure.fits", data, nchips=2)
+    instrument = ChipInstrument(nchips=2, refpix=[(10, 6), (-10, 6)])
+    outfiles = split_exposure(instrument, rawfile)
+    assert [os.path.basename(f) for f in outfiles] == [
+        "exposure_1.fits", "exposure_2.fits"]
+    for chip, outfile in enumerate(outfiles, 1):
+        hdu = read_hdus(outfile)[0]
+        assert hdu.header["BITPIX"] == 16
+        np.testing.assert_array_equal(hdu.data(), data)
+        assert hdu.header["IMAGEID"] == chip
+        assert hdu.header["CRPIX1"] == instrument.REFPIXX[chip - 1]
+        assert hdu.header["FILTER"] == "r_G0326"
+        assert hdu.header["EXPTIME"] == 60.0
+        assert hdu.header["ORIGFILE"] == "exposure.fits"
+
+
+def test_split_exposure_keeps_overscan(tmp_path, rng):
+    # the overscan is removed by the calibration, like with the scripts
+    data = rng.integers(0, 1000, size=(12, 20))
+    rawfile = write_raw_mef(tmp_path / "exposure.fits", data, nchips=1)
+    instrument = ChipInstrument(
+        nchips=1, size=(12, 16), overscan=(17, 20), cut=(1, 1))
+    chipdata, header = read_image(split_exposure(instrument, rawfile)[0])
+    np.testing.assert_array_equal(chipdata, data)
+
+
+def test_split_exposures_moves_originals(tmp_path, rng):
+    data = rng.integers(0, 1000, size=(8, 8))
+    rawfiles = [
+        write_raw_mef(tmp_path / ("exposure%d.fits" % i), data, nchips=2)
+        for i in range(3)]
+    instrument = ChipInstrument(nchips=2)
+    assert check_split(instrument, rawfiles) is None
+    assert split_exposures(instrument, rawfiles, nthreads=2) == []
+    assert sorted(os.listdir(tmp_path / "ORIGINALS")) == [
+        "exposure0.fits", "exposure1.fits", "exposure2.fits"]
+    assert len([f for f in os.listdir(tmp_path) if f.endswith(".fits")]) \
+        == 6
+
+
+def test_check_split_rejects_chip_count(tmp_path, rng):
+    data = rng.integers(0, 1000, size=(8, 8))
+    rawfile = write_raw_mef(tmp_path / "exposure.fits", data, nchips=2)
+    reason = check_split(ChipInstrument(nchips=4), [rawfile])
+    assert reason == "exposure.fits: found 2 chips, expected 4"
+
+
+def test_check_split_requires_pointing_and_date(tmp_path, rng):
+    # exposures without pointing, exposure time or date are left to the
+    # splitting script instead of getting dummy values
+    data = rng.integers(0, 1000, size=(8, 8))
+    keys = [(key, value) for key, value in DEFAULT_KEYS
+            if key not in ("CRVAL2", "DATE-OBS")]
+    rawfile = write_raw_mef(tmp_path / "exposure.fits", data, 2, keys=keys)
+    reason = check_split(ChipInstrument(nchips=2), [rawfile])
+    assert reason == "exposure.fits: chip 1: no raw keyword for DEC, DATE-OBS"
+    # the object, airmass and filter are optional
+    keys = [(key, value) for key, value in DEFAULT_KEYS
+            if key not in ("OBJECT", "AIRMASS", "FILTER")]
+    rawfile = write_raw_mef(tmp_path / "optional.fits", data, 1, keys=keys)
+    instrument = ChipInstrument(nchips=1, size=(8, 8))
+    assert check_split(instrument, [rawfile]) is None
+    chipdata, header = read_image(split_exposure(instrument, rawfile)[0])
+    assert (header["OBJECT"], header["AIRMASS"], header["FILTER"]) == (
+        "UNKNOWN", 1.0, "UNKNOWN")
@@ -0,0 +1,64 @@
+"""
+Tests of the python stacking backend (system.native.stack)
+"""
+
+import os
+
+from system.native.stack import combine, stack_chip, stack_folder
+from system.native.chips import chip_geometry
+
+from .fitsdata import ChipInstrument, np, read_image, write_raw
+
+
+def reference_combine(stack, nlow, nhigh):
+    """Mean of the values left after rejecting the extreme values."""
+    ordered = np.sort(stack.astype(np.float64), axis=0)
+    return ordered[nlow:len(stack) - nhigh].mean(axis=0)
+
+
+def test_combine_rejects_extreme_values(rng):
+    stack = rng.normal(300.0, 5.0, size=(7, 4, 5)).astype(np.float32)
+    np.testing.assert_allclose(
+        combine(stack.copy(), 2, 1), reference_combine(stack, 2, 1),
+        rtol=1e-6)
+
+
+def test_combine_falls_back_to_median(rng):
+    stack = rng.normal(300.0, 5.0, size=(3, 4, 5)).astype(np.float32)
+    np.testing.assert_allclose(
+        combine(stack.copy(), 2, 1), np.median(stack, axis=0), rtol=1e-6)
+
+
+def test_stack_folder_matches_reference(tmp_path, rng):
+    folder = tmp_path / "BIAS"
+    folder.mkdir()
+    frames = rng.integers(250, 350, size=(5, 10, 12))
+    files = [
+        write_raw(folder / ("bias%d_%d.fits" % (i, chip)), frames[i] + chip)
+        for i in range(len(frames)) for chip in (1, 2)]
+    errors = stack_folder(
+        ChipInstrument(nchips=2, size=(10, 12)), str(folder), files,
+        nlow=1, nhigh=1, nthreads=2)
+    assert errors == []
+    for chip in (1, 2):
+        master, header = read_image(folder / ("BIAS_%d.fits" % chip))
+        np.testing.assert_allclose(
+            master, reference_combine(frames + chip, 1, 1), rtol=1e-6)
+
+
+def test_stack_chip_chunks_rows(tmp_path, rng):
+    # overscan correction and cutting are applied per row chunk
+    frames = rng.integers(250, 350, size=(4, 10, 16))
+    files = [write_raw(tmp_path / ("dark%d_1.fits" % i), frame)
+             for i, frame in enumerate(frames)]
+    instrument = ChipInstrument(
+        nchips=1, size=(8, 10), overscan=(13, 16), cut=(2, 2))
+    outfile = str(tmp_path / "master.fits")
+    # room for a single row of all images
+    stack_chip(files, outfile, chip_geometry(instrument, 1),
+               max_bytes=4 * 10 * len(files))
+    overscan = np.median(frames[:, :, 12:16], axis=2)
+    expected = frames[:, 1:9, 1:11] - overscan[:, 1:9, np.newaxis]
+    master, header = read_image(outfile)
+    np.testing.assert_allclose(master, expected.mean(axis=0), rtol=1e-6)
+    assert not os.path.exists(outfile + ".tmp")
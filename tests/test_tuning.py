@@ -0,0 +1,96 @@
+"""
+Tests of the per-host tuning profile of NPARA (system.tuning)
+"""
+
+import os
+
+import pytest
+
+from system.base import DIRS
+from system.parameters import Parameters
+from system.tuning import (NparaRecorder, NparaTuner, TuningProfile,
+                           copy_subset)
+
+
+@pytest.fixture
+def profile(theli_home, tmp_path, monkeypatch):
+    """Empty tuning profile of a test host, written to 'tmp_path'."""
+    monkeypatch.setitem(DIRS, "PIPEHOME", str(tmp_path))
+    return TuningProfile("pytest")
+
+
+def test_profile_prefers_fewer_processes(profile, tmp_path):
+    assert profile.best("process_bias_para.sh") is None
+    profile.record("process_bias_para.sh", 1, 1.0)
+    assert profile.best("process_bias_para.sh") == 1
+    profile.record("process_bias_para.sh", 4, 3.0)
+    assert profile.best("process_bias_para.sh") == 4
+    # within the tolerance of the fastest run
+    profile.record("process_bias_para.sh", 2, 2.9)
+    assert profile.best("process_bias_para.sh") == 2
+    profile.save()
+    assert os.path.exists(str(tmp_path / "tuning_pytest.json"))
+    restored = TuningProfile("pytest")
+    assert restored.stages == profile.stages
+    assert restored.best("process_bias_para.sh") == 2
+    assert TuningProfile("other").stages == {}
+
+
+def test_profile_ignores_corrupt_file(profile, tmp_path):
+    (tmp_path / "tuning_pytest.json").write_text("{")
+    assert TuningProfile("pytest").stages == {}
+
+
+@pytest.mark.parametrize("requested,expected", [
+    ("8", "2"), ("1", "1"), ("", "2")])
+def test_tuner_limits_and_restores(profile, requested, expected):
+    profile.record("process_bias_para.sh", 2, 1.0)
+    params = Parameters({"NPARA": requested}, write=False)
+    tuner = NparaTuner(params, profile)
+    tuner.call_prepare("process_bias_para.sh", [])
+    assert params.get("NPARA") == expected
+    tuner.call_finished("process_bias_para.sh", [], None, 0)
+    assert params.get("NPARA") == requested
+    # scripts without profile are left alone
+    tuner.call_prepare("create_weights_para.sh", [])
+    assert params.get("NPARA") == requested
+    tuner.call_finished("create_weights_para.sh", [], None, 0)
+    assert params.get("NPARA") == requested
+
+
+def test_recorder_measures_throughput(profile, tmp_path):
+    data = tmp_path / "BIAS"
+    data.mkdir()
+    for name in ("a_1.fits", "a_2.fits", "b_1.fits", "b_2.fits"):
+        (data / name).write_bytes(b"")
+    arglist = [str(tmp_path), "BIAS"]
+    params = Parameters({"NPARA": "8"}, write=False)
+    recorder = NparaRecorder(params, profile, 4)
+    recorder.call_prepare("process_bias_para.sh", arglist)
+    assert params.get("NPARA") == "4"
+    recorder.call_started("process_bias_para.sh", arglist, None)
+    recorder.call_finished("process_bias_para.sh", arglist, None, (0, ""))
+    assert params.get("NPARA") == "8"
+    assert list(profile.stages["process_bias_para.sh"]["throughput"]) == [
+        "4"]
+    # failed runs and serial scripts are not recorded
+    recorder.call_prepare("create_weights_para.sh", arglist)
+    recorder.call_started("create_weights_para.sh", arglist, None)
+    recorder.call_finished("create_weights_para.sh", arglist, None, (1, ""))
+    recorder.call_prepare("process_science.sh", arglist)
+    assert params.get("NPARA") == "8"
+    assert list(profile.stages) == ["process_bias_para.sh"]
+
+
+def test_copy_subset(tmp_path):
+    source = tmp_path / "SCIENCE"
+    source.mkdir()
+    for i in (1, 2, 10):
+        for chip in (1, 2):
+            (source / ("sci%d_%dOFCB.fits" % (i, chip))).write_bytes(b"")
+    (source / "sci3_1OFCB.sub.fits").write_bytes(b"")
+    (source / "ORIGINALS").mkdir()
+    copy_subset(str(source), str(tmp_path / "SUBSET"), 2)
+    assert sorted(os.listdir(str(tmp_path / "SUBSET"))) == [
+        "sci1_1OFCB.fits", "sci1_2OFCB.fits",
+        "sci2_1OFCB.fits", "sci2_2OFCB.fits"]
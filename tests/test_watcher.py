@@ -0,0 +1,107 @@
+"""
+Tests of the watch folder reduction (system.watcher, Reduction.watch_folder)
+"""
+
+import os
+
+import pytest
+
+from system.reduction import WATCH_STAGING
+from system.watcher import (FolderWatcher, __inotify_success__,
+                            classify_exposure, count_extensions)
+
+from .fitsdata import STUB_NCHIPS, np, write_exposures, write_raw
+
+
+def test_polling_reports_complete_files(tmp_path):
+    (tmp_path / "old.fits").write_bytes(b"old")
+    (tmp_path / "notes.txt").write_bytes(b"")
+    watcher = FolderWatcher(str(tmp_path), interval=0.0, use_inotify=False)
+    assert not watcher.uses_inotify
+    # files present before watching are reported first
+    assert watcher.wait() == [str(tmp_path / "old.fits")]
+    (tmp_path / "new.fits").write_bytes(b"new")
+    # complete once the size did not change between two polls
+    assert watcher.wait() == []
+    assert watcher.wait() == [str(tmp_path / "new.fits")]
+    assert watcher.wait() == []
+
+
+@pytest.mark.skipif(not __inotify_success__, reason="inotify not available")
+def test_inotify_reports_closed_files(tmp_path):
+    watcher = FolderWatcher(str(tmp_path))
+    try:
+        if not watcher.uses_inotify:
+            pytest.skip("inotify watch not permitted")
+        with open(tmp_path / "new.fits", "wb") as f:
+            f.write(b"new")
+        assert watcher.wait(timeout=5.0) == [str(tmp_path / "new.fits")]
+        assert watcher.wait(timeout=0.0) == []
+    finally:
+        watcher.close()
+
+
+@pytest.mark.usefixtures("theli_home")
+@pytest.mark.parametrize("keys,keyvalues,frametype", [
+    ([("IMAGETYP", "zero")], {}, "bias"),
+    ([("OBSTYPE", "DOMEFLAT")], {}, "flat"),
+    ([("IMAGETYP", "object"), ("OBJECT", "dark 60s")], {}, "dark"),
+    ([("OBJECT", "NGC 253")], {}, "science"),
+    ([("OBJECT", "SA 113")], {"standard": "SA 113", "bias": ""}, "standard"),
+    ([("OBJECT", "bias")], {"standard": "SA 113"}, "science")])
+def test_classify_exposure(tmp_path, keys, keyvalues, frametype):
+    path = write_raw(
+        tmp_path / "raw.fits", np.zeros((2, 2)), keys=keys)
+    assert classify_exposure(path, "OBJECT", keyvalues) == frametype
+
+
+@pytest.mark.usefixtures("theli_home")
+def test_count_extensions(tmp_path):
+    exposure, = write_exposures(tmp_path, "science", 1)
+    assert count_extensions(exposure) == STUB_NCHIPS
+    assert count_extensions(
+        write_raw(tmp_path / "single.fits", np.zeros((2, 2)))) == 1
+
+
+def test_watch_folder_calibrates_new_science(tmp_path, make_reduction):
+    rawdir = tmp_path / "raw"
+    write_exposures(rawdir, "bias", 3)
+    write_exposures(rawdir, "flat", 3)
+    write_exposures(rawdir, "science", 2)
+    reduction = make_reduction(
+        biasdir="BIAS", flatdir="FLAT", sciencedir="SCIENCE",
+        require_data=False)
+    reduction.watch_folder(str(rawdir), timeout=0.2, interval=0.05)
+    assert reduction.biasdir.contains_master()
+    assert reduction.flatdir.contains_master()
+    science = reduction.sciencedir
+    science.refresh()
+    assert not science.contains(WATCH_STAGING)
+    assert science.tags() == {"OFC"}
+    assert science.fits_count("OFC") == 2
+
+
+def test_watched_science_waits_for_masters(tmp_path, make_reduction):
+    rawdir = tmp_path / "raw"
+    write_exposures(rawdir, "bias", 2)
+    write_exposures(rawdir, "science", 1)
+    reduction = make_reduction(
+        biasdir="BIAS", flatdir="FLAT", sciencedir="SCIENCE",
+        require_data=False)
+    reduction.watch_folder(str(rawdir), timeout=0.2, interval=0.05)
+    # two bias exposures do not make a master bias
+    assert not reduction.biasdir.contains_master()
+    staging = os.path.join(reduction.sciencedir.abs, WATCH_STAGING)
+    assert sorted(os.listdir(staging)) == [
+        "ORIGINALS", "science00001_1.fits", "science00001_2.fits"]
+    # a third exposure completes the master bias, the staged frames are
+    # calibrated without flat field
+    write_exposures(reduction.biasdir.abs, "late", 1)
+    reduction._split_folder(reduction.biasdir.path)
+    reduction.params.set({"V_DO_FLAT": "N"})
+    assert not reduction._update_watched_science({"bias"})
+    assert reduction.biasdir.contains_master()
+    science = reduction.sciencedir
+    science.refresh()
+    assert not science.contains(WATCH_STAGING)
+    assert science.fits_count("OFC") == 1
@@ -0,0 +1,78 @@
+"""
+Tests of the python weight backend (system.native.weights)
+"""
+
+from system.native.weights import (global_weights, image_weights,
+                                   read_regions, region_mask)
+
+from .fitsdata import np, read_image, write_float
+
+
+def test_global_weights_match_reference(tmp_path, rng):
+    for folder in ("FLAT_norm", "BIAS", "SCIENCE", "WEIGHTS"):
+        (tmp_path / folder).mkdir()
+    flats = {}
+    darks = {}
+    files = []
+    for chip in (1, 2):
+        flats[chip] = rng.uniform(0.3, 1.7, size=(10, 12)).astype(np.float32)
+        darks[chip] = rng.normal(0.0, 5.0, size=(10, 12)).astype(np.float32)
+        write_float(tmp_path / "FLAT_norm" / ("FLAT_norm_%d.fits" % chip),
+                    flats[chip])
+        write_float(tmp_path / "BIAS" / ("BIAS_%d.fits" % chip), darks[chip])
+        files.append(write_float(
+            tmp_path / "SCIENCE" / ("exp_%dOFC.fits" % chip),
+            np.zeros((10, 12), dtype=np.float32)))
+    errors = global_weights(
+        files, str(tmp_path / "WEIGHTS"), str(tmp_path / "FLAT_norm"),
+        str(tmp_path / "BIAS"), flatmin=0.5, flatmax=1.5, darkmin=-8.0,
+        darkmax=8.0, nprocs=2)
+    assert errors == []
+    for chip in (1, 2):
+        bad = (flats[chip] < 0.5) | (flats[chip] > 1.5) | \
+            (darks[chip] < -8.0) | (darks[chip] > 8.0)
+        expected = np.where(bad, 0.0, flats[chip])
+        weight, header = read_image(
+            tmp_path / "WEIGHTS" / ("globalweight_%d.fits" % chip))
+        flag, header = read_image(
+            tmp_path / "WEIGHTS" / ("globalflag_%d.fits" % chip))
+        np.testing.assert_array_equal(weight, expected)
+        np.testing.assert_array_equal(flag, expected == 0.0)
+
+
+def test_image_weights_match_reference(tmp_path, rng):
+    weightdir = tmp_path / "WEIGHTS"
+    regdir = tmp_path / "reg"
+    weightdir.mkdir()
+    regdir.mkdir()
+    globalweight = rng.uniform(0.5, 1.5, size=(20, 30)).astype(np.float32)
+    write_float(weightdir / "globalweight_1.fits", globalweight)
+    image = rng.normal(100.0, 30.0, size=(20, 30)).astype(np.float32)
+    path = write_float(tmp_path / "exp_1OFC.fits", image)
+    # regions of the split image are used for later stages
+    with open(regdir / "exp_1.reg", "w") as f:
+        f.write("# Region file format: DS9\nimage\n"
+                "circle(10,8,3)\n-box(20,10,4,4,0)\n")
+    errors = image_weights(
+        [path], str(weightdir), str(regdir), low=50.0, high=150.0)
+    assert errors == []
+    y, x = np.mgrid[1:21, 1:31]
+    inside = (x - 10)**2 + (y - 8)**2 <= 9
+    bad = (image < 50.0) | (image > 150.0) | inside
+    weight, header = read_image(weightdir / "exp_1OFC.weight.fits")
+    flag, header = read_image(weightdir / "exp_1OFC.flag.fits")
+    np.testing.assert_array_equal(weight, np.where(bad, 0.0, globalweight))
+    np.testing.assert_array_equal(flag, bad)
+
+
+def test_region_mask_of_box_and_polygon(tmp_path):
+    regfile = tmp_path / "regions.reg"
+    with open(regfile, "w") as f:
+        f.write("box(5,5,4,2,0); polygon(9.5,0.5,14.5,0.5,14.5,4.5)\n")
+    mask = region_mask(read_regions(str(regfile)), (8, 16))
+    y, x = np.mgrid[1:9, 1:17]
+    box = (abs(x - 5) <= 2) & (abs(y - 5) <= 1)
+    # triangle below the line from (9.5, 0.5) to (14.5, 4.5), no pixel
+    # centre is on an edge
+    triangle = (x > 9.5 + (y - 0.5) * 1.25) & (x < 14.5)
+    np.testing.assert_array_equal(mask, box | triangle)
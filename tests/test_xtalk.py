@@ -0,0 +1,135 @@
+"""
+Tests of the python crosstalk correction (system.native.xtalk)
+"""
+
+import pytest
+
+from system.native.split import split_exposure
+from system.native.xtalk import check_step, correct_crosstalk, correct_files
+
+from .fitsdata import ChipInstrument, np, read_image, write_raw_mef
+
+
+def reference_normal(data, grid, amplitude):
+    """Subtract the scaled pixels at the same position in the other readout
+    sections, one pixel at a time."""
+    ny, nx = data.shape[0] // grid[0], data.shape[1] // grid[1]
+    corrected = np.empty(data.shape)
+    for y in range(data.shape[0]):
+        for x in range(data.shape[1]):
+            others = [
+                data[y % ny + qy * ny, x % nx + qx * nx]
+                for qy in range(grid[0]) for qx in range(grid[1])
+                if (qy, qx) != (y // ny, x // nx)]
+            corrected[y, x] = data[y, x] - amplitude * sum(others)
+    return corrected
+
+
+def reference_row(data, grid, direction, amplitude):
+    """Subtract the scaled mean of the same row (or column) of the other
+    readout sections, or of the own section if there is only one."""
+    ny, nx = data.shape[0] // grid[0], data.shape[1] // grid[1]
+    sections = {
+        (qy, qx): data[qy * ny:(qy + 1) * ny, qx * nx:(qx + 1) * nx]
+        for qy in range(grid[0]) for qx in range(grid[1])}
+    corrected = np.empty(data.shape)
+    for y in range(data.shape[0]):
+        for x in range(data.shape[1]):
+            own = (y // ny, x // nx)
+            others = [own] if len(sections) == 1 else [
+                key for key in sections if key != own]
+            footprint = 0.0
+            for key in others:
+                if direction == "row":
+                    footprint += sections[key][y % ny].mean()
+                else:
+                    footprint += sections[key][:, x % nx].mean()
+            corrected[y, x] = data[y, x] - amplitude * footprint
+    return corrected
+
+
+def reference_multi(data, nsections, direction):
+    """Subtract the median of the readout stripes, pixel by pixel, without
+    changing the sky level."""
+    if direction == "col":
+        return reference_multi(data.T, nsections, "row").T
+    stripes = np.split(data.astype(np.float64), nsections, axis=0)
+    pattern = np.median(stripes, axis=0)
+    pattern -= np.median(pattern)
+    return np.concatenate([stripe - pattern for stripe in stripes])
+
+
+@pytest.mark.parametrize("buttonid,grid", [(0, (2, 2)), (1, (2, 1)),
+                                           (2, (1, 2))])
+def test_correct_normal_matches_reference(rng, buttonid, grid):
+    data = rng.integers(0, 5000, size=(8, 12)).astype(np.float32)
+    np.testing.assert_allclose(
+        correct_crosstalk(data, [("normal", buttonid, -0.002)]),
+        reference_normal(data, grid, -0.002), rtol=1e-6)
+
+
+@pytest.mark.parametrize("buttonid,grid,direction", [
+    (0, (2, 2), "row"), (3, (2, 2), "col"), (1, (1, 2), "col"),
+    (5, (2, 1), "col"), (2, (1, 1), "col"), (4, (1, 1), "row")])
+def test_correct_row_matches_reference(rng, buttonid, grid, direction):
+    data = rng.integers(0, 5000, size=(8, 12)).astype(np.float32)
+    np.testing.assert_allclose(
+        correct_crosstalk(data, [("row", buttonid, 0.001)]),
+        reference_row(data, grid, direction, 0.001), rtol=1e-5)
+
+
+@pytest.mark.parametrize("buttonid,direction", [(0, "row"), (1, "col")])
+def test_correct_multi_matches_reference(rng, buttonid, direction):
+    data = rng.normal(1000.0, 10.0, size=(12, 12)).astype(np.float32)
+    np.testing.assert_allclose(
+        correct_crosstalk(data, [("multi", buttonid, 4)]),
+        reference_multi(data, 4, direction), rtol=1e-5)
+
+
+def test_steps_are_applied_in_mode_order(rng):
+    data = rng.normal(1000.0, 10.0, size=(8, 8)).astype(np.float32)
+    expected = reference_multi(reference_row(reference_normal(
+        data, (2, 2), 0.01), (2, 2), "row", 0.001), 2, "col")
+    np.testing.assert_allclose(
+        correct_crosstalk(data, [
+            ("multi", 1, 2), ("row", 0, 0.001), ("normal", 0, 0.01)]),
+        expected, rtol=1e-5)
+
+
+def test_check_step_rejects_invalid_steps():
+    with pytest.raises(ValueError, match="unknown mode"):
+        check_step(("diagonal", 0, 0.01))
+    with pytest.raises(ValueError, match="not selected"):
+        check_step(("normal", -1, 0.01))
+    with pytest.raises(ValueError, match="unknown pattern"):
+        check_step(("row", 6, 0.01))
+    with pytest.raises(ValueError, match="two readout stripes"):
+        check_step(("multi", 0, 1))
+    with pytest.raises(ValueError, match="invalid amplitude"):
+        check_step(("normal", 0, float("nan")))
+    check_step(("normal", 0, 0.01))
+    check_step(("multi", 1, 4))
+
+
+@pytest.mark.parametrize("steps,reference", [
+    ([("normal", 0, 0.01)],
+     lambda data: reference_normal(data, (2, 2), 0.01)),
+    ([("row", 3, 0.001)],
+     lambda data: reference_row(data, (2, 2), "col", 0.001)),
+    ([("multi", 0, 2)], lambda data: reference_multi(data, 2, "row"))])
+def test_split_and_second_pass_agree(tmp_path, rng, steps, reference):
+    # the correction fused into the splitter and the pass over the chips
+    # split by a script give the same result
+    data = rng.integers(0, 5000, size=(8, 12))
+    instrument = ChipInstrument(nchips=2, size=(8, 12))
+    fused = split_exposure(
+        instrument, write_raw_mef(tmp_path / "fused.fits", data, 2),
+        xtalk=steps)
+    verbatim = split_exposure(
+        instrument, write_raw_mef(tmp_path / "verbatim.fits", data, 2))
+    assert correct_files(verbatim, steps, nthreads=2) == []
+    expected = reference(data)
+    for path in fused + verbatim:
+        corrected, header = read_image(path)
+        assert header["BITPIX"] == -32
+        np.testing.assert_allclose(corrected, expected, rtol=1e-5)
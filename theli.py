@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
+import os
+
 from system.base import ascii_styled
 from system.reduction import Reduction
+from system.tuning import tune_npara
+from system.planner import Planner
+from system.profiling import JobProfiler
 from commandline.parser import Parser, read_theli_parameter_file
 
 
@@ -13,7 +18,7 @@ def main():
     # create a file with current parameters
     if args.config_save is not None:
         read_theli_parameter_file(args)
-    elif args.jobs == "":
+    elif args.jobs == "" and args.watch is None and args.single is None:
         print(
             ascii_styled("\nERROR: ", "br-") +
             "No jobs specified, there is nothing to do.")
@@ -25,19 +30,71 @@ def main():
         print("       Use --help for more information\n")
     # run the reduction pipeline
     else:
-        project = Reduction(
-            args.inst, args.main, title=args.title,
+        project_kwargs = dict(
+            title=args.title,
             biasdir=args.bias, darkdir=args.dark, flatdir=args.flat,
             flatoffdir=args.flatoff, sciencedir=args.science, skydir=args.sky,
             stddir=args.standard, reduce_skydir=args.reduce_sky,
             ncpus=args.threads, verbosity=args.verbosity,
             parseparams=theli_args, logdisplay=args.log_display,
-            check_filters=args.disable_filter_check, redo=args.redo)
-        for job in joblist:
-            # read parameters for Reduction - classmethods
-            jobargs = [getattr(args, param) for param in job["para"]]
-            # execute job
-            getattr(project, job["func"])(*jobargs)
+            check_filters=args.disable_filter_check, redo=args.redo,
+            events=args.events, backends=dict(args.backend),
+            check_fraction=args.check_fraction,
+            shadow_chips=args.shadow_chips,
+            shadow_tolerance=tuple(args.shadow_tolerance),
+            plan=args.plan is not None,
+            memory_limit=None if args.memory_limit is None
+            else int(args.memory_limit * 1024**3))
+        if args.tune_npara is not None:
+            jobs = [
+                (job["func"], [getattr(args, param) for param in job["para"]])
+                for job in joblist]
+            tune_npara(
+                args.inst, args.main, project_kwargs, jobs,
+                nexposures=args.tune_npara)
+            return
+        profiler = None
+        if args.profile is not None:
+            profiler = JobProfiler(
+                args.profile or os.path.join(args.main, "profile"))
+            project = profiler.run(
+                "setup", Reduction, args.inst, args.main,
+                require_data=args.watch is None, **project_kwargs)
+        else:
+            project = Reduction(
+                args.inst, args.main, require_data=args.watch is None,
+                **project_kwargs)
+        if args.plan is not None:
+            planner = Planner(project)
+            planner.plan([
+                (job["name"], job["func"],
+                 {param: getattr(args, param) for param in job["para"]})
+                for job in joblist])
+            print(planner.report())
+            if args.plan != "":
+                planner.export(args.plan)
+            return
+        try:
+            if args.watch is not None:
+                project.watch_folder(args.watch, args.watch_timeout)
+            if args.single is not None:
+                project.reduce_single(args.single, args.use_dark)
+            for job in joblist:
+                # read parameters for Reduction - classmethods
+                jobargs = [getattr(args, param) for param in job["para"]]
+                # execute job
+                project.events.emit("job_start", job=job["func"])
+                if profiler is not None:
+                    profiler.run(
+                        job["func"], getattr(project, job["func"]), *jobargs)
+                else:
+                    getattr(project, job["func"])(*jobargs)
+                project.events.emit("job_finish", job=job["func"])
+            project.events.emit("run_finish")
+        finally:
+            if profiler is not None:
+                print(profiler.summary())
+            project.events.close()
 
 
 if __name__ == '__main__':